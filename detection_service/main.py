@@ -5,12 +5,19 @@ from collections import defaultdict
 from scansynclib.logging import logger
 import pika
 from scansynclib.rabbitmq import RabbitMQClient
+from scansynclib import tracing
 from scansynclib.config import config
 import json
 
 SCAN_DIR = config.get("smb.path")
 RABBITQUEUE = "metadata_queue"
 DUPLICATE_DETECTION_WINDOW = 5
+# Seconds between two deletions of old traces, see scansynclib.cleanup.
+TRACE_CLEANUP_INTERVAL = 24 * 60 * 60
+# Queues in front of the slow stages; their depth drives the backpressure.
+BACKPRESSURE_QUEUES = [RABBITQUEUE, "ocr_queue", "upload_queue"]
+# Redis set of the pending files, so a restart doesn't take files held back by backpressure for processed ones.
+PENDING_KEY = "scansync:detection:pending"
 logger.info("Starting detection service...")
 
 
@@ -48,7 +55,7 @@ def get_all_files(directory):
                 continue
 
             if file.endswith('_OCR.pdf'):
-                # Ignore OCR files
+                # Ignore OCR files older releases wrote next to the scans
                 continue
             all_files.add(os.path.join(root, file))
     return all_files
@@ -60,6 +67,66 @@ def ensure_scan_directory_exists(directory):
         exit(1)
 
 
+def backpressure_controller(client, settings_source=None):
+    """Return the controller that holds detection back while the downstream queues are deep.
+
+    ``settings_source`` returns the backpressure settings, by default the current ones.
+    """
+    from scansynclib.backpressure import BackpressureController
+
+    if settings_source is None:
+        from scansynclib.settings import settings
+
+        def settings_source():
+            return settings.backpressure
+    return BackpressureController(client, BACKPRESSURE_QUEUES, settings_source)
+
+
+def split_for_backpressure(grouped_files, state, batch_size):
+    """Split grouped files into the groups to publish now and the groups to hold back.
+
+    While the pipeline is paused nothing is released, while it is throttled
+    only ``batch_size`` groups are released per scan.
+    """
+    from scansynclib.backpressure import BackpressureState
+
+    if state == BackpressureState.PAUSED:
+        return {}, dict(grouped_files)
+    if state == BackpressureState.THROTTLED:
+        items = list(grouped_files.items())
+        return dict(items[:batch_size]), dict(items[batch_size:])
+    return dict(grouped_files), {}
+
+
+def save_pending(file_paths, redis_client=None) -> bool:
+    """Remember the files that weren't published yet across restarts."""
+    try:
+        if redis_client is None:
+            from scansynclib.redis_client import get_redis
+            redis_client = get_redis()
+        pipe = redis_client.pipeline()
+        pipe.delete(PENDING_KEY)
+        if file_paths:
+            pipe.sadd(PENDING_KEY, *file_paths)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to remember {len(file_paths)} pending files: {e}")
+        return False
+
+
+def load_pending(redis_client=None) -> set:
+    """Return the files that weren't published before a restart and still exist."""
+    try:
+        if redis_client is None:
+            from scansynclib.redis_client import get_redis
+            redis_client = get_redis()
+        return {path for path in redis_client.smembers(PENDING_KEY) if os.path.exists(path)}
+    except Exception as e:
+        logger.warning(f"Failed to read the pending files: {e}")
+        return set()
+
+
 def publish_new_files(channel, queue_name, grouped_files):
     """Veröffentlicht gruppierte Dateien, wobei identische Dateien zusammen gesendet werden"""
     for file_hash, file_paths in grouped_files.items():
@@ -78,7 +145,8 @@ def publish_new_files(channel, queue_name, grouped_files):
             exchange="",
             routing_key=queue_name,
             body=message,
-            properties=pika.BasicProperties(delivery_mode=2)  # Make message persistent
+            # Make message persistent and start the trace of the document
+            properties=pika.BasicProperties(delivery_mode=2, headers=tracing.inject_headers())
         )
 
         if len(file_paths) > 1:
@@ -90,7 +158,9 @@ def publish_new_files(channel, queue_name, grouped_files):
 def main():
     # Imported lazily so that importing this module (e.g. in tests) does not
     # trigger the database initialisation performed by scansynclib.sqlite_wrapper.
-    from scansynclib.cleanup import cleanup_dangling_documents
+    from scansynclib.cleanup import cleanup_dangling_documents, cleanup_old_traces
+    from scansynclib.backpressure import BackpressureState
+    from scansynclib.settings import settings
 
     ensure_scan_directory_exists(SCAN_DIR)
     cleanup_dangling_documents()
@@ -99,14 +169,24 @@ def main():
         logger.warning("RabbitMQ is not available. Retrying detection startup in 5 seconds...")
         time.sleep(5)
     client.declare_queue(RABBITQUEUE)
+    backpressure = backpressure_controller(client)
 
     logger.info(f"Scanning {SCAN_DIR} for new files...")
-    known_files = get_all_files(SCAN_DIR)
+    # Files pending before a restart, e.g. held back by backpressure, aren't known yet and are processed like new ones.
+    saved_pending = load_pending()
+    if saved_pending:
+        logger.info(f"Resuming {len(saved_pending)} files that were pending before the restart")
+    known_files = get_all_files(SCAN_DIR) - saved_pending
     pending_files = []
     last_file_time = None
+    last_trace_cleanup = None
 
     while True:
         try:
+            if last_trace_cleanup is None or time.time() - last_trace_cleanup >= TRACE_CLEANUP_INTERVAL:
+                last_trace_cleanup = time.time()
+                cleanup_old_traces()
+
             # Keep the single connection alive and reconnect if it was dropped.
             if not client.is_open():
                 logger.warning("RabbitMQ connection lost. Reconnecting...")
@@ -120,7 +200,7 @@ def main():
                 client.process_events(1)
 
             current_files = get_all_files(SCAN_DIR)
-            new_files = current_files - known_files
+            new_files = current_files - known_files - set(pending_files)
 
             if new_files:
                 pending_files.extend(new_files)
@@ -129,14 +209,26 @@ def main():
 
             # Prüfen, ob genug Zeit vergangen ist, um pending_files zu verarbeiten
             if pending_files and last_file_time and (time.time() - last_file_time >= DUPLICATE_DETECTION_WINDOW):
-                logger.info(f"Processing {len(pending_files)} pending files after {DUPLICATE_DETECTION_WINDOW}s wait...")
-                grouped_files = group_files_by_content(pending_files)
-                if client.is_open():
-                    publish_new_files(client.channel, RABBITQUEUE, grouped_files)
-                    pending_files = []  # Pending-Liste leeren
-                    last_file_time = None
-
-            known_files = current_files
+                state = backpressure.state()
+                if state == BackpressureState.PAUSED:
+                    logger.debug(f"Holding back {len(pending_files)} pending files, {backpressure.depth} documents are queued downstream.")
+                else:
+                    logger.info(f"Processing {len(pending_files)} pending files after {DUPLICATE_DETECTION_WINDOW}s wait...")
+                    grouped_files = group_files_by_content(pending_files)
+                    release, hold = split_for_backpressure(grouped_files, state, settings.backpressure.throttle_batch_size)
+                    if hold:
+                        logger.info(f"Backpressure {state.value}: publishing {len(release)} and holding back {len(hold)} documents.")
+                    if client.is_open():
+                        publish_new_files(client.channel, RABBITQUEUE, release)
+                        # Pending-Liste auf zurückgehaltene Dateien reduzieren
+                        pending_files = [path for paths in hold.values() for path in paths]
+                        if not pending_files:
+                            last_file_time = None
+
+            # Pending files only become known once they are published.
+            known_files = current_files - set(pending_files)
+            if set(pending_files) != saved_pending and save_pending(pending_files):
+                saved_pending = set(pending_files)
 
         except Exception as e:
             logger.error(f"Failed scanning {SCAN_DIR}: {e}")
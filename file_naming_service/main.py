@@ -1,10 +1,14 @@
 import os
 import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 from scansynclib.ProcessItem import ProcessItem, ProcessStatus, FileNamingStatus
 from scansynclib.logging import logger
 from scansynclib.helpers import consume, forward_to_rabbitmq
+from scansynclib.rabbitmq import ack_threadsafe
+from scansynclib import batch_naming, remote_rename, tracing
 import pika.exceptions
 from scansynclib.openai_helper import generate_filename_openai
 from scansynclib.ollama_helper import generate_filename_ollama
@@ -15,6 +19,21 @@ from scansynclib.settings import settings
 
 RABBITQUEUE = "file_naming_queue"
 
+# Names documents concurrently, most of a naming request is waiting for the LLM.
+executor = None
+workers = 1
+
+# Prefetch applied to the consumer's channel, see set_prefetch.
+prefetch = {"channel": None, "count": None}
+
+# Seconds a started batch waits for more deliveries before it is named anyway.
+BATCH_WAIT = 2
+
+# Deliveries collected for the next batch while the naming queue is deep, see scansynclib.batch_naming.
+pending = []
+pending_lock = threading.Lock()
+pending_timer = None
+
 
 def get_latest_file_naming_status(item: ProcessItem):
     status_name = execute_query(
@@ -30,7 +49,7 @@ def get_latest_file_naming_status(item: ProcessItem):
     return item.file_naming_status
 
 
-def callback(ch, method, properties, body):
+def callback(ch, method, properties, body, batch: batch_naming.Batch = None):
     item = None
     try:
         item: ProcessItem = pickle.loads(body)
@@ -43,8 +62,12 @@ def callback(ch, method, properties, body):
         # Create db element
         item.file_naming_db_id = execute_query('INSERT INTO file_naming_jobs (scanneddata_id, file_naming_status) VALUES (?, ?)', (item.db_id, FileNamingStatus.PENDING.name), return_last_id=True)
         logger.debug(f"Added file naming job for {item.filename} to database with id {item.file_naming_db_id}")
+        if batch is not None:
+            batch.join(item)
 
-        if not os.path.exists(item.ocr_file):
+        # Uploaded at the same time, the upload may have removed the OCR file already. The text is kept in the database.
+        rename_after_upload = getattr(item, "rename_after_upload", False)
+        if not rename_after_upload and not os.path.exists(item.ocr_file):
             raise FileNotFoundError(f"OCR file does not exist: {item.ocr_file}")
 
         # test if openai or ollama will be used
@@ -56,23 +79,44 @@ def callback(ch, method, properties, body):
 
         if not openai_enabled and not ollama_enabled:
             logger.error("Neither OpenAI nor Ollama is enabled. Please enable one of them in the settings.")
+        if not rename_after_upload:
+            item.status = ProcessStatus.FILENAME
+            update_scanneddata_database(item, {"file_status": item.status.value})
         item.file_naming_status = FileNamingStatus.PROCESSING
         execute_query('UPDATE file_naming_jobs SET file_naming_status = ? WHERE id = ?', (FileNamingStatus.PROCESSING.name, item.file_naming_db_id))
 
         method_setting = settings.file_naming.method
 
-        if method_setting == FileNamingMethod.OPENAI:
+        new_filename = None
+        if method_setting in (FileNamingMethod.OPENAI, FileNamingMethod.OLLAMA) and settings.file_naming.rules_enabled:
+            new_filename = name_by_rules(item)
+
+        if new_filename:
+            pass
+        elif batch is not None and batch.filename(item):
+            new_filename = batch.filename(item)
+            execute_query(
+                "UPDATE file_naming_jobs SET file_naming_status = ?, method = ?, model = ?, success = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+                (FileNamingStatus.COMPLETED.name, "openai", batch.model, True, item.file_naming_db_id)
+            )
+            learn_filename(item, new_filename)
+        elif method_setting == FileNamingMethod.OPENAI:
             new_filename = generate_filename_openai(item)
+            learn_filename(item, new_filename)
         elif method_setting == FileNamingMethod.OLLAMA:
             new_filename = generate_filename_ollama(item)
+            learn_filename(item, new_filename)
         else:
             logger.info("No file naming method configured. Using default filename.")
             new_filename = item.filename_without_extension
-        if new_filename and os.path.exists(item.ocr_file):
-            os.rename(item.ocr_file, os.path.join(item.local_directory, new_filename + "_OCR.pdf"))
+        if new_filename and rename_after_upload:
+            logger.info(f"Generated filename: {new_filename}")
+            if new_filename != item.filename_without_extension:
+                remote_rename.record_filename(item, new_filename)
+        elif new_filename and os.path.exists(item.ocr_file):
+            # The OCR file keeps its name in the output area, uploads are named after item.filename.
             item.filename_without_extension = new_filename
             item.filename = new_filename + ".pdf"
-            item.ocr_file = os.path.join(item.local_directory, new_filename + "_OCR.pdf")
             logger.info(f"Generated filename: {new_filename}")
 
     except FileNotFoundError:
@@ -93,14 +137,16 @@ def callback(ch, method, properties, body):
     finally:
         ack_ok = True
         try:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            acknowledge(ch, method.delivery_tag)
         except pika.exceptions.AMQPError:
             ack_ok = False
             # The connection was lost before we could acknowledge. The unified
             # consumer will reconnect and the broker will redeliver the message.
             logger.error("Connection lost while acknowledging message. It will be redelivered after reconnect.")
         if ack_ok:
-            if isinstance(item, ProcessItem):
+            if isinstance(item, ProcessItem) and getattr(item, "rename_after_upload", False):
+                logger.debug(f"{item.filename} was forwarded to the upload queue by the OCR service already.")
+            elif isinstance(item, ProcessItem):
                 item_file_naming_db_id = getattr(item, "file_naming_db_id", None)
                 if item_file_naming_db_id:
                     item.file_naming_status = get_latest_file_naming_status(item)
@@ -111,8 +157,185 @@ def callback(ch, method, properties, body):
                 logger.error("Item is None, cannot forward to upload queue.")
 
 
+def named_by_rules(item: ProcessItem) -> bool:
+    """Return whether the rules are confident enough to name ``item``, without recording anything, see :func:`name_by_rules`."""
+    from scansynclib import rule_namer, text_store
+    try:
+        suggestion = rule_namer.suggest(text_store.get_text(item, keep_pages=True), item.local_directory_above)
+    except Exception:
+        return False
+    return suggestion is not None and suggestion.confidence >= settings.file_naming.rules_min_confidence
+
+
+def name_by_rules(item: ProcessItem) -> str | None:
+    """Return the filename the rules derive for ``item`` if they are confident enough, the LLM names it otherwise."""
+    from scansynclib import rule_namer, text_store
+    try:
+        text = text_store.get_text(item, keep_pages=True)
+        suggestion = rule_namer.suggest(text, item.local_directory_above)
+    except Exception:
+        logger.exception(f"Naming rules failed for {item.filename}, asking the LLM.")
+        return None
+    if suggestion is None:
+        return None
+    execute_query("UPDATE file_naming_jobs SET confidence = ? WHERE id = ?", (suggestion.confidence, item.file_naming_db_id))
+    if suggestion.confidence < settings.file_naming.rules_min_confidence:
+        logger.debug(f"Rules are unsure about {item.filename} ({suggestion}), asking the LLM.")
+        return None
+    execute_query(
+        "UPDATE file_naming_jobs SET file_naming_status = ?, method = ?, model = ?, success = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+        (FileNamingStatus.COMPLETED.name, "rules", suggestion.rule, True, item.file_naming_db_id)
+    )
+    logger.info(f"Named {item.filename} by rules without asking the LLM")
+    # Known senders stay known, and senders of the header become known.
+    rule_namer.learn(item.local_directory_above, text, suggestion.filename)
+    return suggestion.filename
+
+
+def learn_filename(item: ProcessItem, filename: str):
+    """Teach the rules the sender of a document the LLM named, also while the rules are disabled."""
+    if not filename or filename == item.filename_without_extension:
+        return
+    from scansynclib import rule_namer, text_store
+    try:
+        rule_namer.learn(item.local_directory_above, text_store.get_text(item, keep_pages=True), filename)
+    except Exception:
+        logger.exception(f"Failed to learn the senders of {item.filename}.")
+
+
+def acknowledge(ch, delivery_tag: int):
+    """Acknowledge a delivery, from the consumer thread or a worker of the executor."""
+    if threading.current_thread() is threading.main_thread():
+        ch.basic_ack(delivery_tag=delivery_tag)
+    else:
+        ack_threadsafe(ch, delivery_tag)
+
+
+def process(ch, method, properties, body, span, batch: batch_naming.Batch = None):
+    """Run :func:`callback` in a worker thread as part of the delivery's trace."""
+    try:
+        with tracing.resume_span(span):
+            callback(ch, method, properties, body, batch)
+    except Exception:
+        logger.exception("File naming worker failed.")
+
+
+def process_batch(ch, deliveries: list):
+    """Name the documents of several deliveries with one request, then finish each delivery on its own."""
+    from scansynclib.openai_helper import OPENAI_MODEL, filename_cache_key, request_filenames_openai
+    batch = None
+    try:
+        items = []
+        for _, _, body, _ in deliveries:
+            item = pickle.loads(body)
+            # Documents the rules name aren't sent, callback names them by rules.
+            if isinstance(item, ProcessItem) and not (settings.file_naming.rules_enabled and named_by_rules(item)):
+                items.append(item)
+        if items:
+            batch = batch_naming.name_batch(
+                items, OPENAI_MODEL, request_filenames_openai,
+                max_tokens=settings.file_naming.excerpt_budget(OPENAI_MODEL), cache_key=filename_cache_key
+            )
+    except Exception:
+        logger.exception("Batch naming failed, naming the documents one by one.")
+    for method, properties, body, span in deliveries:
+        process(ch, method, properties, body, span, batch)
+
+
+def batching() -> bool:
+    """Return whether deliveries are currently collected into batches."""
+    file_naming = settings.file_naming
+    return file_naming.method == FileNamingMethod.OPENAI and file_naming.batch_size > 1 and batch_naming.queue_is_deep(file_naming.batch_queue_threshold)
+
+
+def collect(ch, delivery: tuple):
+    """Add a delivery to the next batch and submit the batch once it is full or waited long enough."""
+    global pending_timer
+    with pending_lock:
+        pending.append(delivery)
+        full = len(pending) >= settings.file_naming.batch_size
+        if not full and pending_timer is None:
+            pending_timer = threading.Timer(BATCH_WAIT, flush, args=(ch,))
+            pending_timer.daemon = True
+            pending_timer.start()
+    if full:
+        flush(ch)
+
+
+def flush(ch):
+    """Submit the collected deliveries as one batch."""
+    global pending_timer
+    with pending_lock:
+        deliveries = pending[:]
+        pending.clear()
+        if pending_timer is not None:
+            pending_timer.cancel()
+            pending_timer = None
+    if deliveries:
+        executor.submit(process_batch, ch, deliveries)
+
+
+def set_prefetch(ch, batched: bool):
+    """Prefetch a batch of documents only while batching, one per worker otherwise.
+
+    Every worker gets one unacknowledged message, no more, so priorities still apply.
+    Batches need their documents prefetched, at the cost of priorities during bulk imports.
+    """
+    count = max(workers, settings.file_naming.batch_size) if batched else workers
+    # consume() applies the prefetch of one per worker to every new channel.
+    current = prefetch["count"] if prefetch["channel"] is ch else workers
+    if count != current:
+        ch.basic_qos(prefetch_count=count)
+        logger.info(f"Prefetching {count} documents")
+    prefetch.update(channel=ch, count=count)
+
+
+def dispatch(ch, method, properties, body):
+    """Hand a delivery to the executor, the consumer thread keeps serving the connection."""
+    span = tracing.detach_span()
+    batched = batching()
+    set_prefetch(ch, batched)
+    if batched:
+        collect(ch, (method, properties, body, span))
+    else:
+        executor.submit(process, ch, method, properties, body, span)
+
+
+def watch_ollama_model():
+    """Load the Ollama model at startup and whenever the naming settings change."""
+    from scansynclib.ollama_helper import warm_up_model
+    from scansynclib.settings import settings_manager
+
+    def current():
+        file_naming = settings.file_naming
+        return (file_naming.method, file_naming.ollama_server_url, file_naming.ollama_server_port, file_naming.ollama_model)
+
+    warmed = [None]
+
+    def warm_up():
+        target = current()
+        if target[0] != FileNamingMethod.OLLAMA or target == warmed[0]:
+            return
+        warmed[0] = target
+
+        def run():
+            if not warm_up_model():
+                # Try again with the next settings change.
+                warmed[0] = None
+        threading.Thread(target=run, name="ollama_warm_up", daemon=True).start()
+
+    warm_up()
+    settings_manager.add_listener(warm_up)
+
+
 def start_consuming_with_reconnect():
-    consume(RABBITQUEUE, callback, heartbeat=120)
+    global executor, workers
+    workers = settings.file_naming.concurrency
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="file_naming")
+    logger.info(f"Naming up to {workers} documents concurrently")
+    watch_ollama_model()
+    # One unacknowledged message per worker, dispatch raises it while batching.
+    consume(RABBITQUEUE, dispatch, prefetch_count=workers, heartbeat=120)
 
 
 if __name__ == "__main__":
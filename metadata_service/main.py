@@ -7,12 +7,22 @@ from PIL import Image
 from pypdf import PdfReader
 from scansynclib.sqlite_wrapper import execute_query, update_scanneddata_database
 from scansynclib.helpers import consume, publish, move_to_failed
+from scansynclib.rabbitmq import get_publisher
+from scansynclib import ocr_fanout, ocr_storage, tracing
+from scansynclib.backpressure import BackpressureController, BackpressureState
 from scansynclib.config import config
+from scansynclib.priority import compute_priority
+from scansynclib.text_layer import strictest_mode
+from scansynclib.settings import settings
 import pymupdf
 import pickle
 
 RABBITQUEUE = "metadata_queue"
 TIMEOUT_PDF_VALIDATION = 300
+# Delay before handling a document while the OCR queue is throttled.
+BACKPRESSURE_THROTTLE_DELAY = 2
+
+backpressure = BackpressureController(get_publisher(), ["ocr_queue"], lambda: settings.backpressure)
 
 
 def on_created(filepaths: list):
@@ -38,7 +48,7 @@ def on_created(filepaths: list):
         logger.info(f"Ignoring hidden file at {filepaths[0]}")
         return
 
-    # Ignore OCR files
+    # Ignore OCR files older releases wrote next to the scans
     if "_OCR.pdf" in filepaths[0]:
         logger.info(f"Ignoring working _OCR file at {filepaths[0]}")
         return
@@ -56,6 +66,8 @@ def on_created(filepaths: list):
     item = ProcessItem(filepaths[0], ItemType.UNKNOWN)
     item.db_id = execute_query('INSERT INTO scanneddata (file_name, local_filepath) VALUES (?, ?)', (item.filename, item.local_directory_above), return_last_id=True)
     logger.debug(f"Added {filepaths[0]} to database with id {item.db_id}")
+    item.ocr_file = ocr_storage.output_path(item.local_directory_above, item.filename_without_extension, item.db_id)
+    tracing.set_document_id(item.db_id)
 
     # Now add additional smb paths to the item
     additional_smbs_str = ""
@@ -85,9 +97,11 @@ def on_created(filepaths: list):
     smb_names = [item.local_directory_above] + item.additional_remote_paths
 
     # Query each SMB name individually to maintain order
+    share_priority = None
+    text_layer_modes = []
     for smb_name in smb_names:
         query = """
-            SELECT onedrive_path, folder_id, drive_id
+            SELECT onedrive_path, folder_id, drive_id, priority, text_layer_mode, ocr_profile
             FROM smb_onedrive
             WHERE smb_name = ?
         """
@@ -102,11 +116,20 @@ def on_created(filepaths: list):
                         remote_drive_id=res.get("drive_id")
                     )
                 )
+                # A document shared to several destinations uses the most urgent share priority
+                res_priority = res.get("priority") or 0
+                share_priority = res_priority if share_priority is None else max(share_priority, res_priority)
+                text_layer_modes.append(res.get("text_layer_mode"))
+                # The OCR profile of the share the document was scanned to wins
+                if item.ocr_profile is None:
+                    item.ocr_profile = res.get("ocr_profile")
             logger.debug(f"Found remote destination for {smb_name}: {res.get('onedrive_path')}")
         else:
             logger.warning(f"Could not find remote destination for {smb_name}")
 
     update_scanneddata_database(item, {'remote_filepath': ",".join([dest.remote_file_path for dest in item.OneDriveDestinations])})
+    # A document shared to several destinations gets the most thorough processing
+    item.text_layer_mode = strictest_mode(text_layer_modes).value
 
     logger.info(f"Waiting for {item.filename} to be a valid PDF or image file")
     for i in range(TIMEOUT_PDF_VALIDATION):
@@ -160,10 +183,21 @@ def on_created(filepaths: list):
             update_scanneddata_database(item, {'pdf_pages': item.pdf_pages})
         except Exception:
             logger.exception(f"Error reading PDF file: {item.local_file_path}")
+    item.priority = compute_priority(item.pdf_pages, share_priority or 0, settings.priority)
     item.status = ProcessStatus.OCR_PENDING
     update_scanneddata_database(item, {"file_status": item.status.value})
-    publish("ocr_queue", pickle.dumps(item))
-    logger.info(f"Added {item.local_file_path} to OCR queue")
+
+    # Split large documents so all OCR replicas can work on them at once
+    chunk_items = []
+    if item.item_type == ItemType.PDF and ocr_fanout.should_fan_out(item.pdf_pages, settings.ocr):
+        try:
+            chunk_items = ocr_fanout.fan_out(item, settings.ocr)
+        except Exception:
+            logger.exception(f"Failed splitting {item.filename} into OCR chunks, processing it as a whole")
+            chunk_items = []
+    for ocr_item in chunk_items or [item]:
+        publish("ocr_queue", pickle.dumps(ocr_item), priority=item.priority)
+    logger.info(f"Added {item.local_file_path} to OCR queue with priority {item.priority}{f' as {len(chunk_items)} chunks' if chunk_items else ''}")
 
 
 def is_image(file_path) -> bool:
@@ -220,6 +254,12 @@ def callback(ch, method, properties, body):
         data = json.loads(body)
         filepaths: list = data["file_paths"]
         logger.info(f"Received item{"s" if len(filepaths) > 1 else ""} for metadata service {filepaths}")
+        # Don't prepare documents that won't be OCR'd for a long time. Waiting
+        # here keeps the message unacked, so with prefetch 1 no further
+        # messages are delivered to this replica until the OCR queue drained.
+        state = backpressure.wait_while_paused(sleep=ch.connection.sleep)
+        if state == BackpressureState.THROTTLED:
+            ch.connection.sleep(BACKPRESSURE_THROTTLE_DELAY)
         on_created(filepaths)
         ch.basic_ack(delivery_tag=method.delivery_tag)
     except Exception:
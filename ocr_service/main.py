@@ -1,16 +1,29 @@
 from scansynclib.logging import logger
-from scansynclib.ProcessItem import ProcessItem, ProcessStatus, OCRStatus
+from scansynclib.ProcessItem import ItemType, ProcessItem, ProcessStatus, OCRStatus
 from scansynclib.sqlite_wrapper import execute_query, update_scanneddata_database
-from scansynclib.helpers import consume, forward_to_rabbitmq, extract_text
+from scansynclib.helpers import consume, forward_to_rabbitmq, extract_text, move_to_failed
 import pickle
 import ocrmypdf
 import os
+import shutil
 from datetime import datetime
 from scansynclib.settings import settings
+from scansynclib import image_normalization, language_detection, metrics, ocr_fanout, ocr_progress, ocr_storage, ocr_watchdog, text_layer, text_store
+from scansynclib.text_layer import TextLayerMode
+from scansynclib.cpu_budget import CpuBudget, cores_for_document
 
 logger.info("Starting OCR service...")
 RABBITQUEUE = "ocr_queue"
 
+# ocrmypdf runs one Tesseract process per job. Without this limit every
+# Tesseract process additionally spawns one OpenMP thread per core.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+cpu_budget = CpuBudget(lambda: settings.ocr)
+
+# ocrmypdf plugin reporting the per-page progress of a run, see scansynclib.ocr_progress.
+PROGRESS_PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_progress_plugin.py")
+
 
 def callback(ch, method, properties, body):
     try:
@@ -26,7 +39,87 @@ def callback(ch, method, properties, body):
         item.ocr_status = OCRStatus.FAILED
 
 
+def run_ocr(input_path: str, output_path: str, pages: int, progress: ocr_progress.OcrProgress = None, document_id: int = None, **options):
+    """Run ocrmypdf with as many jobs as the shared CPU budget grants for ``pages`` pages.
+
+    If ``progress`` is given, the per-page progress of the run is published to the dashboard.
+    With the watchdog enabled, the run happens in a child process that is killed on timeout,
+    memory overuse or cancellation of ``document_id``, raising :class:`~scansynclib.ocr_watchdog.OcrAborted`.
+    """
+    with cpu_budget.reserve(cores_for_document(pages, settings.ocr)) as jobs:
+        logger.debug(f"Running OCR for {input_path} with {jobs} CPU cores")
+        options["jobs"] = jobs
+        if progress is not None:
+            options.update(progress_bar=True, plugins=[PROGRESS_PLUGIN])
+        if not settings.ocr.watchdog_enabled:
+            with ocr_progress.tracking(progress):
+                return ocrmypdf.ocr(input_path, output_path, **options)
+        return ocr_watchdog.run_supervised(
+            ocrmypdf.ocr, (input_path, output_path), options,
+            deadline=ocr_watchdog.deadline_for(pages, settings.ocr),
+            rss_limit=settings.ocr.memory_limit_mb * 2**20,
+            cancelled=lambda: ocr_watchdog.cancel_requested(document_id),
+            progress=progress,
+            workdir=os.path.dirname(output_path),
+        )
+
+
+def ocr_options(item: ProcessItem) -> dict:
+    """Return the ocrmypdf options of the OCR profile selected by the item's share."""
+    profile_name = getattr(item, "ocr_profile", None)
+    if profile_name and profile_name not in settings.ocr.profiles:
+        logger.warning(f"OCR profile '{profile_name}' of {item.filename} doesn't exist, using '{settings.ocr.default_profile}'")
+    return settings.ocr.profile(profile_name).ocrmypdf_options()
+
+
+def select_languages(item: ProcessItem, input_path: str, options: dict) -> dict:
+    """Narrow the profile's Tesseract languages to the language detected for the document."""
+    languages = options.get("language") or []
+    if not settings.ocr.detect_language or len(languages) < 2:
+        return options
+    chosen, detected = language_detection.choose_languages(
+        input_path, getattr(item, "local_directory_above", None), languages, settings.ocr.language_history_size
+    )
+    source = "sample" if detected else "history" if chosen != languages else "fallback"
+    metrics.inc("scansync_ocr_language_detection_total", 1, "Languages selected before OCR", source=source)
+    chunk = getattr(item, "chunk", None)
+    if detected and (chunk is None or chunk.index == 0):
+        item.detected_language = detected
+        update_scanneddata_database(item, {"detected_language": detected})
+    if chosen != languages:
+        logger.info(f"Running OCR of {item.filename} with {'+'.join(chosen)} instead of {'+'.join(languages)}")
+    return options | {"language": chosen}
+
+
+def normalize_input(item: ProcessItem, input_path: str, output_path: str) -> image_normalization.NormalizationResult | None:
+    """Write ``input_path`` with oversized and gray colour page images normalized to ``output_path``.
+
+    Returns:
+        NormalizationResult | None: The savings, ``None`` if the original file should be OCR'd.
+    """
+    if getattr(item, "item_type", None) != ItemType.PDF:
+        return None
+    return image_normalization.normalize_pdf(input_path, output_path, settings.ocr.profile(getattr(item, "ocr_profile", None)))
+
+
+def record_normalization(job_id: int, normalization: image_normalization.NormalizationResult, ocr_seconds: float):
+    """Store the bytes and the estimated seconds image normalization saved an OCR job."""
+    if normalization is None or not job_id:
+        return
+    seconds_saved = normalization.seconds_saved(ocr_seconds)
+    execute_query(
+        "UPDATE ocr_jobs SET normalized_pages = ?, bytes_saved = ?, seconds_saved = ? WHERE id = ?",
+        (normalization.pages, normalization.bytes_saved, round(seconds_saved, 1), job_id)
+    )
+    metrics.inc("scansync_ocr_normalized_pages_total", normalization.pages, "Pages whose images were normalized before OCR")
+    metrics.inc("scansync_ocr_normalization_bytes_saved_total", max(normalization.bytes_saved, 0), "Input bytes saved by image normalization")
+    metrics.inc("scansync_ocr_normalization_seconds_saved_total", max(seconds_saved, 0), "Estimated OCR seconds saved by image normalization")
+
+
 def start_processing(item: ProcessItem):
+    if getattr(item, "chunk", None) is not None:
+        return process_chunk(item)
+
     item.status = ProcessStatus.OCR
     item.ocr_status = OCRStatus.PROCESSING
     item.ocr_db_id = execute_query(
@@ -40,30 +133,55 @@ def start_processing(item: ProcessItem):
     logger.info(f"Processing file with OCR: {item.filename}")
     ocr_error = None
     result = None
+    scratch = None
+    normalization = None
 
     try:
-        result = ocrmypdf.ocr(item.local_file_path, item.ocr_file, output_type='pdfa', skip_text=True, rotate_pages=True, jpg_quality=80, png_quality=80, optimize=2, language=["eng", "deu"], tesseract_timeout=120)
+        # OCR works on local scratch space, only the finished file is published to the output area.
+        scratch = ocr_storage.ScratchDirectory(item.local_file_path)
+        scratch_output = scratch.file("output.pdf")
+        # ocrmypdf writes the recognized text here, so it doesn't have to be parsed from the PDF again
+        sidecar_file = scratch.file("sidecar.txt")
+        if ocr_watchdog.cancel_requested(item.db_id):
+            raise ocr_watchdog.OcrAborted(OCRStatus.CANCELLED, "OCR was cancelled before it started")
+        mode = text_layer.parse_mode(getattr(item, "text_layer_mode", None))
+        existing_text = None
+        if mode != TextLayerMode.OCR and getattr(item, "item_type", None) == ItemType.PDF:
+            existing_text = text_layer.read_text_layer(item.local_file_path)
+
+        if existing_text is not None:
+            logger.info(f"{item.filename} already has a complete text layer, skipping OCR ({mode.value})")
+            result = convert_text_layer_document(item, mode, scratch_output)
+        else:
+            options = select_languages(item, item.local_file_path, ocr_options(item))
+            pages = getattr(item, "pdf_pages", 0)
+            progress = ocr_progress.OcrProgress(item.db_id, pages)
+            normalization = normalize_input(item, item.local_file_path, scratch.file("normalized.pdf"))
+            ocr_input = normalization.output_path if normalization else item.local_file_path
+            ocr_started = datetime.now()
+            result = run_ocr(ocr_input, scratch_output, pages, progress=progress, document_id=item.db_id, sidecar=sidecar_file, **options)
+            if result == 0:
+                record_normalization(item.ocr_db_id, normalization, (datetime.now() - ocr_started).total_seconds())
         logger.debug(f"OCR exited with code {result}")
 
         if result != 0:
             logger.error(f"OCR exited with code {result}")
             item.ocr_status = OCRStatus.FAILED
             ocr_error = f"OCR exited with code {result}"
+        elif not ocr_storage.publish(scratch_output, item.ocr_file):
+            logger.debug(f"OCR of {item.filename} produced no output file")
+            verify_ocr_output(item)
+        elif existing_text is not None:
+            verify_ocr_output(item, existing_text, "text_layer")
         else:
             logger.info(f"OCR processing completed: {item.filename}")
-
-            # Verify that the OCR file actually contains text
-            if os.path.exists(item.ocr_file):
-                extracted_text = (extract_text(item.ocr_file, max_pages=5, max_chars=2048) or "").strip()
-                if extracted_text:
-                    logger.info(f"OCR verification successful: extracted {len(extracted_text)} characters from {item.filename}")
-                    item.ocr_status = OCRStatus.COMPLETED
-                else:
-                    logger.warning(f"OCR verification failed: no text found in OCR output file {item.ocr_file}")
-                    item.ocr_status = OCRStatus.NO_TEXT
-            else:
-                logger.error(f"OCR output file not found: {item.ocr_file}")
-                item.ocr_status = OCRStatus.OUTPUT_ERROR
+            verify_ocr_output(item, text_store.read_sidecar(sidecar_file))
+            if item.ocr_status == OCRStatus.COMPLETED:
+                record_ocr_throughput(getattr(item, "pdf_pages", 0), item.time_ocr_started)
+    except ocr_watchdog.OcrAborted as aborted:
+        logger.error(f"OCR of {item.local_file_path} stopped: {aborted}")
+        item.ocr_status = aborted.status
+        ocr_error = str(aborted)
     except ocrmypdf.UnsupportedImageFormatError:
         logger.error(f"Unsupported image format: {item.local_file_path}")
         item.ocr_status = OCRStatus.UNSUPPORTED
@@ -90,35 +208,222 @@ def start_processing(item: ProcessItem):
         ocr_error = str(ex)
     finally:
         item.time_ocr_finished = datetime.now()
+        metrics.inc("scansync_ocr_documents_total", 1, "Documents processed by OCR", status=item.ocr_status.name)
+        if scratch is not None:
+            scratch.cleanup()
         if result is not None and result != 0:
             item.ocr_status = OCRStatus.FAILED
             if not ocr_error:
                 ocr_error = f"OCR exited with code {result}"
-        if item.ocr_db_id:
-            execute_query(
-                "UPDATE ocr_jobs SET ocr_status = ?, ocr_error = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
-                (item.ocr_status.name, ocr_error, item.ocr_db_id)
-            )
-        item.status = ProcessStatus.SYNC_PENDING
-
-        try:
-            logger.debug("Checking if File Naming is enabled")
-            ollama_enabled = bool(settings.file_naming.ollama_server_url and settings.file_naming.ollama_server_port and settings.file_naming.ollama_model)
-            openai_enabled = bool(settings.file_naming.openai_api_key)
-            if openai_enabled or ollama_enabled:
-                logger.info(f"Forwarding item {item.filename} to File Naming service.")
-                item.status = ProcessStatus.FILENAME_PENDING
-                forward_to_rabbitmq("file_naming_queue", item)
-            else:
-                logger.info(f"Forwarding item {item.filename} to Upload service.")
-                item.status = ProcessStatus.SYNC_PENDING
-                forward_to_rabbitmq("upload_queue", item)
-        except Exception as e:
-            logger.error(f"Failed to forward item {item.filename} to the next service: {e}")
-            item.status = ProcessStatus.FAILED
-        finally:
-            update_scanneddata_database(item, {"file_status": item.status.value, "ocr_status": item.ocr_status.name})
+        return finish_processing(item, ocr_error)
+
+
+def convert_text_layer_document(item: ProcessItem, mode: TextLayerMode, output_path: str) -> int:
+    """Write the OCR file of a document that already has text on every page to ``output_path``.
+
+    Returns:
+        int: The exit code, ``0`` on success.
+    """
+    if mode == TextLayerMode.PASSTHROUGH:
+        shutil.copyfile(item.local_file_path, output_path)
+        result = 0
+    else:
+        # Every page has text, so skip_text makes ocrmypdf only convert to PDF/A.
+        result = ocrmypdf.ocr(item.local_file_path, output_path, output_type='pdfa', skip_text=True, jobs=1)
+    metrics.inc("scansync_ocr_text_layer_documents_total", 1, "Documents with an existing text layer that skipped OCR", mode=mode.value)
+    return result
+
+
+def verify_ocr_output(item: ProcessItem, text: str = None, source: str = "sidecar"):
+    """Set the OCR status depending on whether the OCR file actually contains text.
+
+    The text is taken from the ocrmypdf sidecar (or the existing text layer)
+    if available, otherwise it is extracted from the OCR file. Either way it
+    is stored for later stages.
+    """
+    if os.path.exists(item.ocr_file):
+        if text is None:
+            source = "pdf"
+            text = extract_text(item.ocr_file) or ""
+        extracted_text = text.strip()
+        if extracted_text:
+            logger.info(f"OCR verification successful: extracted {len(extracted_text)} characters from {item.filename}")
+            item.ocr_status = OCRStatus.COMPLETED
+            if not text_store.save_text(item.db_id, text, source):
+                logger.warning(f"Failed to store the OCR text of {item.filename}, later stages will parse the PDF")
+        else:
+            logger.warning(f"OCR verification failed: no text found in OCR output file {item.ocr_file}")
+            item.ocr_status = OCRStatus.NO_TEXT
+    else:
+        logger.error(f"OCR output file not found: {item.ocr_file}")
+        item.ocr_status = OCRStatus.OUTPUT_ERROR
+
+
+def record_ocr_throughput(pages: int, started: datetime):
+    """Count the pages and seconds of a successful OCR run, pages/sec = rate(pages_total) / rate(seconds_total).
+
+    Pages that skipped OCR because of their text layer aren't counted.
+    """
+    metrics.inc("scansync_ocr_pages_total", pages or 1, "Pages processed by OCR")
+    metrics.inc("scansync_ocr_seconds_total", (datetime.now() - started).total_seconds(), "Seconds spent in successful OCR runs")
+
+
+def finish_processing(item: ProcessItem, ocr_error: str = None) -> ProcessItem:
+    """Persist the OCR result and forward the item to file naming or upload.
+
+    Documents whose OCR was stopped by the watchdog or cancelled end here, their scan is
+    moved to the failed directory to be found and retried there, cancelled ones too so
+    they don't wait in the share without a record of what happened to them.
+    """
+    if item.ocr_db_id:
+        execute_query(
+            "UPDATE ocr_jobs SET ocr_status = ?, ocr_error = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+            (item.ocr_status.name, ocr_error, item.ocr_db_id)
+        )
+    ocr_watchdog.clear_cancel(item.db_id)
+    if item.ocr_status in ocr_watchdog.ABORTED_STATUSES:
+        item.status = ProcessStatus.SKIPPED if item.ocr_status == OCRStatus.CANCELLED else ProcessStatus.FAILED
+        logger.info(f"Not forwarding {item.filename}, its OCR stopped with {item.ocr_status.name}")
+        update_scanneddata_database(item, {"file_status": item.status.value, "ocr_status": item.ocr_status.name})
+        move_to_failed(item)
         return item
+    item.status = ProcessStatus.SYNC_PENDING
+
+    try:
+        logger.debug("Checking if File Naming is enabled")
+        ollama_enabled = bool(settings.file_naming.ollama_server_url and settings.file_naming.ollama_server_port and settings.file_naming.ollama_model)
+        openai_enabled = bool(settings.file_naming.openai_api_key)
+        if (openai_enabled or ollama_enabled) and settings.file_naming.rename_after_upload:
+            # Named next to the upload, the uploaded files are renamed afterwards.
+            logger.info(f"Forwarding item {item.filename} to Upload and File Naming service.")
+            item.status = ProcessStatus.SYNC_PENDING
+            item.rename_after_upload = True
+            forward_to_rabbitmq("upload_queue", item)
+            forward_to_rabbitmq("file_naming_queue", item)
+        elif openai_enabled or ollama_enabled:
+            logger.info(f"Forwarding item {item.filename} to File Naming service.")
+            item.status = ProcessStatus.FILENAME_PENDING
+            forward_to_rabbitmq("file_naming_queue", item)
+        else:
+            logger.info(f"Forwarding item {item.filename} to Upload service.")
+            item.status = ProcessStatus.SYNC_PENDING
+            forward_to_rabbitmq("upload_queue", item)
+    except Exception as e:
+        logger.error(f"Failed to forward item {item.filename} to the next service: {e}")
+        item.status = ProcessStatus.FAILED
+    finally:
+        update_scanneddata_database(item, {"file_status": item.status.value, "ocr_status": item.ocr_status.name})
+    return item
+
+
+def process_chunk(item: ProcessItem) -> ProcessItem:
+    """OCR one page range of a split document and merge the document after its last chunk."""
+    chunk = item.chunk
+    item.status = ProcessStatus.OCR
+    item.time_ocr_started = datetime.now()
+    ocr_fanout.mark_parent_processing(chunk.parent_job_id)
+    execute_query(
+        "UPDATE ocr_jobs SET ocr_status = ?, started = DATETIME('now', 'localtime') WHERE id = ?",
+        (OCRStatus.PROCESSING.name, chunk.job_id)
+    )
+    update_scanneddata_database(item, {"file_status": item.status.value})
+
+    logger.info(f"Processing OCR chunk {chunk.index + 1}/{chunk.count} (pages {chunk.page_start}-{chunk.page_end}) of {item.filename}")
+    status, ocr_error = OCRStatus.COMPLETED, None
+    try:
+        if ocr_watchdog.cancel_requested(item.db_id):
+            raise ocr_watchdog.OcrAborted(OCRStatus.CANCELLED, "OCR was cancelled before it started")
+        existing_text = None
+        if text_layer.parse_mode(getattr(item, "text_layer_mode", None)) != TextLayerMode.OCR:
+            existing_text = text_layer.read_text_layer(chunk.input_path)
+        if existing_text is not None:
+            logger.info(f"OCR chunk {chunk.index + 1}/{chunk.count} of {item.filename} already has a complete text layer, skipping OCR")
+            shutil.copyfile(chunk.input_path, chunk.output_path)
+            with open(chunk.sidecar_path, "w", encoding="utf-8") as f:
+                f.write(existing_text)
+            result = 0
+        else:
+            # Chunks are converted to PDF/A once after merging.
+            options = select_languages(item, chunk.input_path, ocr_options(item)) | {"output_type": "pdf"}
+            progress = ocr_progress.OcrProgress(item.db_id, chunk.pages, chunk=chunk)
+            normalization = normalize_input(item, chunk.input_path, ocr_fanout.normalized_path(chunk.directory, chunk.index))
+            ocr_input = normalization.output_path if normalization else chunk.input_path
+            ocr_started = datetime.now()
+            result = run_ocr(ocr_input, chunk.output_path, chunk.pages, progress=progress, document_id=item.db_id, sidecar=chunk.sidecar_path, **options)
+            if result == 0:
+                record_normalization(chunk.job_id, normalization, (datetime.now() - ocr_started).total_seconds())
+        if result != 0:
+            status, ocr_error = OCRStatus.FAILED, f"OCR exited with code {result}"
+        elif not os.path.exists(chunk.output_path):
+            status, ocr_error = OCRStatus.OUTPUT_ERROR, f"OCR output file not found: {chunk.output_path}"
+        elif existing_text is None:
+            # Split documents are counted per chunk, the merge doesn't know which chunks ran OCR.
+            record_ocr_throughput(chunk.pages, item.time_ocr_started)
+    except ocr_watchdog.OcrAborted as aborted:
+        logger.error(f"OCR chunk {chunk.index + 1}/{chunk.count} of {item.filename} stopped: {aborted}")
+        status, ocr_error = aborted.status, str(aborted)
+    except Exception as ex:
+        logger.exception(f"Failed processing OCR chunk {chunk.index + 1}/{chunk.count} of {item.filename}: {ex}")
+        status, ocr_error = OCRStatus.FAILED, str(ex)
+
+    execute_query(
+        "UPDATE ocr_jobs SET ocr_status = ?, ocr_error = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+        (status.name, ocr_error, chunk.job_id)
+    )
+    logger.info(f"OCR chunk {chunk.index + 1}/{chunk.count} of {item.filename} finished with {status.name}")
+
+    if not ocr_fanout.claim_merge(chunk.parent_job_id):
+        return item
+    return merge_document(item)
+
+
+def merge_document(item: ProcessItem) -> ProcessItem:
+    """Assemble the OCR'd chunks of a split document and forward it like a single document."""
+    chunk = item.chunk
+    item.chunk = None
+    item.ocr_db_id = chunk.parent_job_id
+    item.ocr_status = OCRStatus.MERGING
+    ocr_error = None
+    scratch = None
+    logger.info(f"Merging {chunk.count} OCR chunks of {item.filename}")
+
+    try:
+        failed = ocr_fanout.failed_chunks(chunk.parent_job_id)
+        if failed:
+            item.ocr_status = OCRStatus.CANCELLED if ocr_watchdog.cancel_requested(item.db_id) else OCRStatus.FAILED
+            ocr_error = f"{failed} of {chunk.count} OCR chunks failed"
+        else:
+            merged_file = os.path.join(chunk.directory, "merged.pdf")
+            ocr_fanout.merge_chunks(chunk.directory, chunk.count, merged_file)
+            if ocr_options(item)["output_type"] == "pdfa":
+                # All pages carry text already, skip_text turns this run into a PDF/A conversion.
+                scratch = ocr_storage.ScratchDirectory(merged_file)
+                result = run_ocr(merged_file, scratch.file("output.pdf"), getattr(item, "pdf_pages", 0), document_id=item.db_id, output_type='pdfa', skip_text=True)
+                merged_file = scratch.file("output.pdf")
+            else:
+                result = 0
+            if result != 0:
+                item.ocr_status = OCRStatus.FAILED
+                ocr_error = f"OCR exited with code {result}"
+            elif not ocr_storage.publish(merged_file, item.ocr_file):
+                verify_ocr_output(item)
+            else:
+                verify_ocr_output(item, ocr_fanout.merge_sidecars(chunk.directory, chunk.count))
+    except ocr_watchdog.OcrAborted as aborted:
+        logger.error(f"Merging the OCR chunks of {item.filename} stopped: {aborted}")
+        item.ocr_status = aborted.status
+        ocr_error = str(aborted)
+    except Exception as ex:
+        logger.exception(f"Failed merging OCR chunks of {item.filename}: {ex}")
+        item.ocr_status = OCRStatus.FAILED
+        ocr_error = str(ex)
+    finally:
+        item.time_ocr_finished = datetime.now()
+        metrics.inc("scansync_ocr_documents_total", 1, "Documents processed by OCR", status=item.ocr_status.name)
+        ocr_fanout.remove_chunks(chunk.directory)
+        if scratch is not None:
+            scratch.cleanup()
+        return finish_processing(item, ocr_error)
 
 
 def start_consuming_with_reconnect():
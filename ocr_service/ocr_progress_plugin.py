@@ -0,0 +1,28 @@
+"""ocrmypdf plugin forwarding progress bar updates to :mod:`scansynclib.ocr_progress`."""
+
+from ocrmypdf import hookimpl
+
+from scansynclib import ocr_progress
+
+
+class ProgressBar:
+    """Progress bar of an ocrmypdf phase that reports to the active :class:`~scansynclib.ocr_progress.OcrProgress`."""
+    def __init__(self, *, total=None, desc=None, unit=None, disable=False, **kwargs):
+        self.progress = ocr_progress.active()
+        if self.progress is not None:
+            self.progress.start_phase(desc, total, unit)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def update(self, n=1, *, completed=None):
+        if self.progress is not None:
+            self.progress.update(n, completed)
+
+
+@hookimpl
+def get_progressbar_class():
+    return ProgressBar
@@ -2,6 +2,7 @@ from enum import Enum
 import os
 from datetime import datetime
 from scansynclib.logging import logger
+from scansynclib.ocr_storage import output_path
 
 
 class ProcessStatus(Enum):
@@ -72,6 +73,10 @@ class OCRStatus(Enum):
     INPUT_ERROR: The input file could not be read by the OCR engine.
     OUTPUT_ERROR: The OCR engine could not write the output file.
     NO_TEXT: OCR completed but the output file contained no extractable text.
+    MERGING: All chunks of a split document were OCR'd and are being merged.
+    TIMEOUT: OCR was stopped because it exceeded its deadline.
+    MEMORY_LIMIT: OCR was stopped because it exceeded the memory limit.
+    CANCELLED: OCR was cancelled from the dashboard.
     """
     UNKNOWN = "Unknown"
     PENDING = "Waiting for OCR"
@@ -84,6 +89,10 @@ class OCRStatus(Enum):
     INPUT_ERROR = "Error reading input file"
     OUTPUT_ERROR = "Error writing OCR output file"
     NO_TEXT = "No text found in OCR output"
+    MERGING = "Merging OCR chunks"
+    TIMEOUT = "OCR timed out"
+    MEMORY_LIMIT = "OCR exceeded the memory limit"
+    CANCELLED = "OCR cancelled"
 
 
 class FileNamingStatus(Enum):
@@ -121,6 +130,7 @@ class OneDriveDestination:
         self.remote_folder_id = remote_folder_id
         self.remote_drive_id = remote_drive_id
         self.web_url = None  # Will be set after successful upload
+        self.item_id = None  # Graph item id, set after successful upload
 
 
 class ProcessItem:
@@ -162,7 +172,7 @@ class ProcessItem:
         self.time_finished = None
         self.item_type = item_type
         self.ocr_status = OCRStatus.UNKNOWN
-        self.ocr_file = os.path.join(self.local_directory, self.filename_without_extension + "_OCR.pdf")
+        self.ocr_file = output_path(self.local_directory_above, self.filename_without_extension)
         self.db_id = None
         self.preview_image_path = None
         self.web_url = []
@@ -193,6 +203,24 @@ class ProcessItem:
         self.file_naming_status = FileNamingStatus.PENDING
         """The status of the file naming process."""
 
+        self.priority = None
+        """The RabbitMQ message priority of the item, computed by the metadata service."""
+
+        self.ocr_profile = None
+        """Name of the OCR profile selected by the item's share, ``None`` uses the default profile."""
+
+        self.text_layer_mode = None
+        """How the share handles PDFs that already have a text layer, see :class:`~scansynclib.text_layer.TextLayerMode`."""
+
+        self.detected_language = None
+        """Tesseract language detected from a sample of the first page, ``None`` if detection was inconclusive."""
+
+        self.rename_after_upload = False
+        """Whether the item is uploaded with its original name while it is named, see :mod:`~scansynclib.remote_rename`."""
+
+        self.chunk = None
+        """The page range (:class:`~scansynclib.ocr_fanout.OcrChunk`) to OCR if the document was split."""
+
         # PDF Status
         self.pdf_pages = 0
         logger.debug(f"Created ProcessItem: {self.local_file_path}")
@@ -0,0 +1,112 @@
+"""Queue depth based backpressure between the pipeline stages.
+
+Detection and metadata are cheap compared to OCR and uploads. Without any
+feedback they happily push thousands of documents into ``ocr_queue`` during a
+bulk import, creating previews and database rows for documents that won't be
+processed for hours. :class:`BackpressureController` reads the depth of the
+downstream queues and tells the producing stage to keep going, slow down or
+stop until the backlog has drained.
+"""
+
+import time
+from enum import Enum
+
+from scansynclib.logging import logger
+from scansynclib.settings_schema import BackpressureSettings
+
+
+class BackpressureState(Enum):
+    """Publishing state derived from the downstream queue depth."""
+    OPEN = "open"
+    THROTTLED = "throttled"
+    PAUSED = "paused"
+
+
+class BackpressureController:
+    """Derive a :class:`BackpressureState` from downstream queue depths.
+
+    The state uses hysteresis: once paused, the stage only resumes after the
+    backlog drained below ``resume_watermark`` so it doesn't flap around the
+    pause watermark. Queue depths are cached for ``check_interval`` seconds to
+    keep the number of passive declares on the broker low.
+
+    Args:
+        client: A :class:`~scansynclib.rabbitmq.RabbitMQClient` used to read queue depths.
+        queue_names (list[str]): The downstream queues whose depths are summed up.
+        settings_source (Callable): Returns the current :class:`BackpressureSettings`,
+            so changes in the web UI apply without a restart.
+        clock (Callable): Monotonic clock, replaceable in tests.
+    """
+
+    def __init__(self, client, queue_names, settings_source=None, clock=time.monotonic):
+        self._client = client
+        self._queue_names = list(queue_names)
+        self._settings_source = settings_source or BackpressureSettings
+        self._clock = clock
+        self._state = BackpressureState.OPEN
+        self._depth = 0
+        self._last_check = None
+
+    @property
+    def settings(self) -> BackpressureSettings:
+        return self._settings_source()
+
+    @property
+    def depth(self) -> int:
+        """The last measured combined depth of the downstream queues."""
+        return self._depth
+
+    def _measure(self) -> int | None:
+        total = 0
+        for queue_name in self._queue_names:
+            depth = self._client.queue_depth(queue_name)
+            if depth is None:
+                return None
+            total += depth
+        return total
+
+    def state(self, force: bool = False) -> BackpressureState:
+        """Return the current state, re-measuring the queues if the cache expired."""
+        settings = self.settings
+        if not settings.enabled:
+            self._state = BackpressureState.OPEN
+            return self._state
+
+        now = self._clock()
+        if not force and self._last_check is not None and now - self._last_check < settings.check_interval:
+            return self._state
+        self._last_check = now
+
+        depth = self._measure()
+        if depth is None:
+            # Broker unreachable: keep the previous state instead of guessing.
+            return self._state
+        self._depth = depth
+
+        previous = self._state
+        if depth >= settings.pause_watermark:
+            self._state = BackpressureState.PAUSED
+        elif previous == BackpressureState.PAUSED and depth > settings.resume_watermark:
+            self._state = BackpressureState.PAUSED
+        elif depth >= settings.throttle_watermark:
+            self._state = BackpressureState.THROTTLED
+        else:
+            self._state = BackpressureState.OPEN
+
+        if self._state != previous:
+            logger.info(f"Backpressure changed from {previous.value} to {self._state.value} ({depth} messages in {', '.join(self._queue_names)}).")
+        return self._state
+
+    def wait_while_paused(self, sleep=time.sleep) -> BackpressureState:
+        """Block until the stage is no longer paused and return the new state.
+
+        Args:
+            sleep (Callable): Sleep function. Consumers should pass
+                ``connection.sleep`` so pika keeps sending heartbeats.
+        """
+        state = self.state()
+        while state == BackpressureState.PAUSED:
+            logger.debug(f"Backpressure paused, {self._depth} messages waiting downstream.")
+            sleep(self.settings.check_interval)
+            state = self.state()
+        return state
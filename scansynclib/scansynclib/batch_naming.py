@@ -0,0 +1,141 @@
+"""Naming several documents with one LLM request during bulk imports.
+
+A bulk import puts thousands of documents into ``file_naming_queue`` and
+every one of them used to pay the round trip and the instructions of its own
+OpenAI request. Once the queue is deeper than ``batch_queue_threshold``, the
+file naming service collects up to ``batch_size`` deliveries and names them
+with a single request that answers with a JSON list of filenames, see
+:func:`name_batch`.
+
+Documents the rules name confidently aren't collected, and documents whose
+filename is cached aren't sent. The filenames of a batch are cached like
+those of single requests. Documents the answer has no usable filename for, or
+all documents of a batch whose answer can't be parsed, are named one by one
+as usual. Each batch is recorded in ``file_naming_batches`` and its documents
+reference it through ``file_naming_jobs.batch_id``.
+"""
+
+import json
+import re
+import time
+
+from scansynclib.logging import logger
+from scansynclib.helpers import validate_smb_filename
+from scansynclib import metrics
+
+QUEUE = "file_naming_queue"
+
+# Seconds the measured depth of the naming queue is reused.
+DEPTH_CHECK_INTERVAL = 5
+
+_depth = {"value": 0, "measured": None}
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def queue_is_deep(threshold: int, clock=time.monotonic) -> bool:
+    """Return whether ``file_naming_queue`` holds at least ``threshold`` documents."""
+    now = clock()
+    if _depth["measured"] is None or now - _depth["measured"] >= DEPTH_CHECK_INTERVAL:
+        from scansynclib.rabbitmq import queue_depth
+        depth = queue_depth(QUEUE)
+        _depth["measured"] = now
+        if depth is not None:
+            _depth["value"] = depth
+    return _depth["value"] >= threshold
+
+
+def build_prompt(texts: list[str]) -> str:
+    """Return the documents of a batch as one prompt, each under a numbered heading."""
+    return "\n\n".join(f"### Document {number}\n{text}" for number, text in enumerate(texts, start=1))
+
+
+def parse_filenames(answer: str, count: int) -> list[str | None]:
+    """Return the ``count`` filenames of a batch answer, ``None`` for entries without a usable name.
+
+    Raises:
+        ValueError: The answer isn't a JSON list of ``count`` entries.
+    """
+    filenames = json.loads(_FENCE.sub("", answer.strip()))
+    if not isinstance(filenames, list) or len(filenames) != count:
+        raise ValueError(f"Expected a JSON list of {count} filenames")
+    return [validate_smb_filename(name) if isinstance(name, str) and name.strip() else None for name in filenames]
+
+
+class Batch:
+    """Filenames of the documents named together in one request.
+
+    Args:
+        batch_id: ID of the batch in ``file_naming_batches``.
+        model: The model that named the batch.
+        filenames (dict): Filenames by the ``db_id`` of the named documents.
+        documents (set): ``db_id`` of all documents of the batch, defaults to the named ones.
+    """
+    def __init__(self, batch_id: int, model: str, filenames: dict[int, str], documents: set[int] = None):
+        self.batch_id = batch_id
+        self.model = model
+        self.filenames = filenames
+        self.documents = set(filenames) if documents is None else documents
+
+    def join(self, item):
+        """Record that the file naming job of ``item`` belongs to the batch, if it does."""
+        if item.db_id not in self.documents:
+            return
+        from scansynclib.sqlite_wrapper import execute_query
+        execute_query("UPDATE file_naming_jobs SET batch_id = ? WHERE id = ?", (self.batch_id, item.file_naming_db_id))
+
+    def filename(self, item) -> str | None:
+        """Return the filename of ``item``, ``None`` if it has to be named on its own."""
+        return self.filenames.get(item.db_id)
+
+
+def name_batch(items: list, model: str, request, max_tokens: int = None, cache_key=None) -> Batch:
+    """Name ``items`` with a single LLM request.
+
+    Args:
+        items (list[ProcessItem]): The documents to name.
+        model: The model ``request`` sends the prompt to.
+        request (Callable): Sends the excerpts of the documents in one prompt (see :func:`build_prompt`) and returns the answer.
+        max_tokens (int): Token budget of the excerpt of each document, see :func:`~scansynclib.prompt_excerpt.build_excerpt`.
+        cache_key (Callable): Returns the :mod:`~scansynclib.filename_cache` key of an excerpt, ``None`` disables the cache.
+
+    Returns:
+        Batch: The filenames of the documents the answer named.
+    """
+    from scansynclib.sqlite_wrapper import execute_query
+    from scansynclib import filename_cache, prompt_excerpt, text_store
+
+    batch_id = execute_query(
+        "INSERT INTO file_naming_batches (model, size) VALUES (?, ?)",
+        (model, len(items)),
+        return_last_id=True
+    )
+    excerpts = {}
+    for item in items:
+        text = text_store.get_text(item, keep_pages=True)
+        excerpts[item.db_id] = prompt_excerpt.build_excerpt(text, max_tokens) if max_tokens else text
+    keys = {db_id: cache_key(excerpt) for db_id, excerpt in excerpts.items() if excerpt} if cache_key else {}
+    # Documents without text are left to the single requests, which record why they can't be named,
+    # and so are cached documents, the single requests find them in the cache.
+    named = [item for item in items if excerpts[item.db_id] and not (keys and filename_cache.get(keys[item.db_id]))]
+    filenames = {}
+    error = None
+    if named:
+        try:
+            answer = request([excerpts[item.db_id] for item in named])
+            filenames = {item.db_id: name for item, name in zip(named, parse_filenames(answer, len(named))) if name}
+        except Exception as e:
+            logger.warning(f"Batch naming of {len(named)} documents failed, naming them one by one: {e}")
+            error = str(e)
+    if keys:
+        for db_id, filename in filenames.items():
+            filename_cache.put(keys[db_id], filename)
+
+    execute_query(
+        "UPDATE file_naming_batches SET finished = DATETIME('now', 'localtime'), named = ?, error_description = ? WHERE id = ?",
+        (len(filenames), error, batch_id)
+    )
+    metrics.inc("scansync_file_naming_batch_documents_total", len(filenames), "Documents named by batch requests", result="named")
+    metrics.inc("scansync_file_naming_batch_documents_total", len(items) - len(filenames), "Documents named by batch requests", result="fallback")
+    logger.info(f"Batch {batch_id} named {len(filenames)} of {len(items)} documents with one request")
+    return Batch(batch_id, model, filenames, {item.db_id for item in items})
@@ -0,0 +1,135 @@
+"""Circuit breaker for naming backends that are unreachable.
+
+If the Ollama host is switched off, every document used to wait for three
+connection attempts with exponential backoff before it fell back to its
+original name, stalling the whole pipeline behind the file naming stage.
+:class:`CircuitBreaker` counts consecutive connection failures of all
+replicas in Redis. Once ``failure_threshold`` is reached the circuit opens
+and documents skip LLM naming immediately. While open, one replica at a time
+probes the backend in a background thread every ``probe_interval`` seconds
+and closes the circuit as soon as the backend answers again.
+
+Redis layout:
+
+* ``circuit_breaker:<name>`` - hash with the consecutive ``failures`` and,
+  while the circuit is open, the time it was ``opened_at``.
+* ``circuit_breaker:<name>:probe`` - held by the replica probing the backend.
+"""
+
+import threading
+import time
+
+import redis
+
+from scansynclib.logging import logger
+from scansynclib import metrics
+
+KEY = "circuit_breaker:{}"
+
+
+class CircuitOpenError(Exception):
+    """The backend is known to be unreachable, the request wasn't sent."""
+
+
+class CircuitBreaker:
+    """Failure counting circuit of a backend shared through Redis.
+
+    Args:
+        name: Name of the backend, e.g. ``"ollama"``.
+        probe (Callable): Returns whether the backend is reachable again.
+        settings_source (Callable): Returns the current ``(failure_threshold, probe_interval)``.
+        redis_factory (Callable): Returns the Redis client, defaults to the shared one.
+        clock (Callable): Wall clock, replaceable in tests.
+        sleep (Callable): Sleep function of the probe thread.
+    """
+
+    def __init__(self, name: str, probe, settings_source, redis_factory=None, clock=time.time, sleep=time.sleep):
+        self.name = name
+        self.key = KEY.format(name)
+        self.probe_key = self.key + ":probe"
+        self._probe = probe
+        self._settings_source = settings_source
+        self._redis_factory = redis_factory
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def _redis(self):
+        if self._redis_factory is None:
+            from scansynclib.redis_client import get_redis
+            return get_redis()
+        return self._redis_factory()
+
+    def is_open(self) -> bool:
+        """Return whether requests to the backend are currently skipped."""
+        try:
+            return self._redis().hget(self.key, "opened_at") is not None
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker {self.name} unavailable, assuming the backend is reachable: {e}")
+            return False
+
+    def allow(self) -> bool:
+        """Return whether a request may be sent, starting the background probe while the circuit is open."""
+        if not self.is_open():
+            return True
+        self._start_prober()
+        return False
+
+    def record_success(self):
+        """Close the circuit after the backend answered."""
+        try:
+            self._redis().delete(self.key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to reset circuit breaker {self.name}: {e}")
+
+    def record_failure(self):
+        """Count a connection failure and open the circuit once the threshold is reached."""
+        threshold, _ = self._settings_source()
+        try:
+            client = self._redis()
+            failures = client.hincrby(self.key, "failures", 1)
+            if failures >= threshold and client.hsetnx(self.key, "opened_at", self._clock()):
+                logger.warning(f"{self.name} failed {failures} times in a row, skipping its requests until it is reachable again")
+                metrics.inc("scansync_circuit_breaker_transitions_total", 1, "State changes of circuit breakers", backend=self.name, state="open")
+        except redis.RedisError as e:
+            logger.warning(f"Failed to record a failure of {self.name}: {e}")
+
+    def probe_once(self) -> bool:
+        """Probe the backend unless another replica does, and close the circuit if it answers.
+
+        Returns:
+            bool: Whether the circuit was closed.
+        """
+        _, interval = self._settings_source()
+        try:
+            if not self._redis().set(self.probe_key, 1, nx=True, ex=interval):
+                return False
+        except redis.RedisError as e:
+            logger.warning(f"Could not probe {self.name}: {e}")
+            return False
+        try:
+            reachable = self._probe()
+        except Exception as e:
+            logger.debug(f"Probe of {self.name} failed: {e}")
+            reachable = False
+        if not reachable:
+            return False
+        self.record_success()
+        logger.info(f"{self.name} is reachable again, resuming its requests")
+        metrics.inc("scansync_circuit_breaker_transitions_total", 1, "State changes of circuit breakers", backend=self.name, state="closed")
+        return True
+
+    def _start_prober(self):
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name=f"{self.name}_probe", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while self.is_open():
+            _, interval = self._settings_source()
+            self._sleep(interval)
+            if self.probe_once():
+                return
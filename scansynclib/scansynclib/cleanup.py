@@ -1,20 +1,27 @@
 import os
+import time
 from scansynclib.logging import logger
 from scansynclib.config import config
+from scansynclib import ocr_storage, stage_latency, tracing
 from scansynclib.ProcessItem import ProcessStatus, StatusProgressBar
 from scansynclib.sqlite_wrapper import execute_query
 
+# Days the spans and status transitions of documents are kept. The hourly
+# latency rollups keep the durations after the transitions are gone.
+TRACE_RETENTION_DAYS = 30
 
-def _move_leftover_to_failed(file_name: str, local_dir: str):
+
+def _move_leftover_to_failed(file_name: str, local_dir: str, doc_id: int = None):
     """Move a leftover source file into the failed directory and drop its OCR file.
 
     The original (non OCR) scan is moved into the failed directory so it stays
-    recoverable from the web UI, while any leftover ``*_OCR.pdf`` working file is
-    removed. Missing files are tolerated and only logged.
+    recoverable from the web UI, while any leftover ``*_OCR.pdf`` in the OCR
+    output area is removed. Missing files are tolerated and only logged.
 
     Args:
         file_name (str): The base file name of the scan (as stored in the DB).
         local_dir (str): The SMB share sub directory the scan lives in.
+        doc_id (int): The ID of the document, its OCR files carry it.
     """
     if not file_name:
         logger.warning("Cannot move leftover file to failed directory: missing file name.")
@@ -45,9 +52,11 @@ def _move_leftover_to_failed(file_name: str, local_dir: str):
         else:
             logger.debug(f"Leftover file {source_path} not found, nothing to move.")
 
-        # Remove leftover OCR working file if present
-        ocr_file = os.path.join(smb_path, local_dir, os.path.splitext(file_name)[0] + "_OCR.pdf")
-        if os.path.exists(ocr_file):
+        # Remove leftover OCR file if present, files written before OCR files carried the document ID too
+        ocr_files = [ocr_storage.output_path(local_dir, os.path.splitext(file_name)[0])]
+        if doc_id is not None:
+            ocr_files += ocr_storage.document_outputs(local_dir, doc_id)
+        for ocr_file in filter(os.path.exists, ocr_files):
             try:
                 os.remove(ocr_file)
                 logger.info(f"Removed leftover OCR file {ocr_file}")
@@ -85,7 +94,7 @@ def cleanup_dangling_documents():
         file_name = row.get("file_name")
         local_dir = row.get("local_filepath")
         try:
-            _move_leftover_to_failed(file_name, local_dir)
+            _move_leftover_to_failed(file_name, local_dir, doc_id)
         except Exception:
             logger.exception(f"Failed moving leftover file for document id {doc_id} to failed directory.")
 
@@ -97,3 +106,15 @@ def cleanup_dangling_documents():
             logger.info(f"Startup cleanup: marked document id {doc_id} ({file_name}) as failed.")
         except Exception:
             logger.exception(f"Failed marking document id {doc_id} as failed during startup cleanup.")
+
+
+def cleanup_old_traces(now: float = None):
+    """Delete pipeline spans and status transitions older than :data:`TRACE_RETENTION_DAYS`."""
+    before = (time.time() if now is None else now) - TRACE_RETENTION_DAYS * 24 * 3600
+    spans = tracing.prune_spans(before)
+    transitions = stage_latency.prune_transitions(before)
+    if spans is None or transitions is None:
+        logger.error("Trace cleanup: failed deleting old spans or status transitions.")
+        return
+    if spans or transitions:
+        logger.info(f"Trace cleanup: deleted {spans} spans and {transitions} status transitions older than {TRACE_RETENTION_DAYS} days.")
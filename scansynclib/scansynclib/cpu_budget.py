@@ -0,0 +1,229 @@
+"""CPU core budget shared by all OCR replicas.
+
+``ocrmypdf`` runs one Tesseract process per ``jobs`` and, left alone, uses
+every core for each document. With several OCR replicas on one host this
+oversubscribes the CPU as soon as two documents are processed at the same
+time. :class:`CpuBudget` hands out core tokens from a global budget kept in
+Redis, so the sum of ``jobs`` of all replicas never exceeds the budget.
+
+Redis layout:
+
+* ``cpu_budget:leases`` - sorted set of ``<lease id>:<tokens>`` members scored
+  by the time the lease expires. Leases are renewed while a document is
+  processed, so tokens of a crashed replica return to the pool on expiry.
+"""
+
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from scansynclib.logging import logger
+from scansynclib.settings_schema import OcrSettings
+
+LEASES_KEY = "cpu_budget:leases"
+
+# Seconds a lease is valid without being renewed.
+LEASE_TTL = 60
+
+# Seconds between two attempts to acquire tokens while the budget is exhausted.
+POLL_INTERVAL = 1
+
+
+def physical_cores() -> int:
+    """Return the number of physical cores available to this process.
+
+    Hyper-threads don't speed up Tesseract, so sibling threads are counted as
+    one core. Falls back to the logical CPU count if ``/proc/cpuinfo`` can't be
+    read and never exceeds the CPUs the process is allowed to run on.
+    """
+    try:
+        available = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        available = os.cpu_count() or 1
+
+    cores = set()
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            physical_id = core_id = None
+            for line in cpuinfo:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                elif not key and core_id is not None:
+                    cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+    except OSError:
+        pass
+
+    return max(1, min(available, len(cores) or available))
+
+
+def budget_size(ocr_settings: OcrSettings) -> int:
+    """Return the configured core budget, capped at the physical cores."""
+    cores = physical_cores()
+    if ocr_settings.cpu_budget <= 0:
+        return cores
+    return min(ocr_settings.cpu_budget, cores)
+
+
+def cores_for_document(pdf_pages: int, ocr_settings: OcrSettings) -> int:
+    """Return the number of cores a document with ``pdf_pages`` pages asks for.
+
+    One core is requested per ``pages_per_core`` pages, limited by
+    ``max_cores_per_document`` (half of the budget by default) so a single
+    huge document always leaves cores for the other replicas.
+    """
+    budget = budget_size(ocr_settings)
+    limit = ocr_settings.max_cores_per_document or math.ceil(budget / 2)
+    wanted = math.ceil(max(1, pdf_pages or 0) / ocr_settings.pages_per_core)
+    return max(1, min(wanted, limit, budget))
+
+
+class CpuBudget:
+    """Acquire and release core tokens from the budget shared through Redis.
+
+    Args:
+        settings_source (Callable): Returns the current :class:`OcrSettings`,
+            so changes in the web UI apply to the next document.
+        redis_factory (Callable): Returns the Redis client, defaults to the shared one.
+        clock (Callable): Wall clock used for lease expiry, replaceable in tests.
+        sleep (Callable): Sleep function used while waiting for tokens.
+    """
+
+    def __init__(self, settings_source=None, redis_factory=None, clock=time.time, sleep=time.sleep):
+        self._settings_source = settings_source or OcrSettings
+        self._redis_factory = redis_factory
+        self._clock = clock
+        self._sleep = sleep
+
+    @property
+    def settings(self) -> OcrSettings:
+        return self._settings_source()
+
+    def _redis(self):
+        if self._redis_factory is None:
+            from scansynclib.redis_client import get_redis
+            return get_redis()
+        return self._redis_factory()
+
+    @staticmethod
+    def _tokens(member: str) -> int:
+        return int(member.rsplit(":", 1)[1])
+
+    def in_use(self) -> int:
+        """Return the number of tokens held by unexpired leases."""
+        client = self._redis()
+        members = client.zrangebyscore(LEASES_KEY, self._clock(), "+inf")
+        return sum(self._tokens(member) for member in members)
+
+    def try_acquire(self, wanted: int, budget: int) -> tuple[str, int] | None:
+        """Take up to ``wanted`` tokens if at least one is free.
+
+        Returns:
+            tuple[str, int] | None: The lease member and the granted tokens, or
+            ``None`` if the budget is exhausted.
+        """
+        client = self._redis()
+        with client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(LEASES_KEY)
+                    now = self._clock()
+                    members = pipe.zrangebyscore(LEASES_KEY, now, "+inf")
+                    free = budget - sum(self._tokens(member) for member in members)
+                    if free <= 0:
+                        pipe.unwatch()
+                        return None
+                    granted = min(wanted, free)
+                    member = f"{uuid.uuid4().hex}:{granted}"
+                    pipe.multi()
+                    pipe.zremrangebyscore(LEASES_KEY, "-inf", now)
+                    pipe.zadd(LEASES_KEY, {member: now + LEASE_TTL})
+                    pipe.execute()
+                    return member, granted
+                except redis.WatchError:
+                    # Another replica changed the leases in between, retry.
+                    continue
+
+    def renew(self, member: str):
+        """Extend the expiry of a held lease."""
+        self._redis().zadd(LEASES_KEY, {member: self._clock() + LEASE_TTL}, xx=True)
+
+    def release(self, member: str):
+        """Return the tokens of a lease to the budget."""
+        self._redis().zrem(LEASES_KEY, member)
+
+    def acquire(self, wanted: int) -> tuple[str | None, int]:
+        """Block until at least one token is free and take up to ``wanted`` tokens.
+
+        If no token gets free within ``acquire_timeout`` seconds, or Redis is
+        unreachable, the document runs on a single core without a lease so
+        processing never stalls.
+
+        Returns:
+            tuple[str | None, int]: The lease member (``None`` without lease) and the granted tokens.
+        """
+        settings = self.settings
+        budget = budget_size(settings)
+        wanted = max(1, min(wanted, budget))
+        deadline = self._clock() + settings.acquire_timeout
+        waited = False
+        try:
+            while True:
+                lease = self.try_acquire(wanted, budget)
+                if lease is not None:
+                    if waited:
+                        logger.info(f"Acquired {lease[1]} of {wanted} requested CPU cores after waiting for the budget.")
+                    return lease
+                if self._clock() >= deadline:
+                    logger.warning(f"No CPU core became free within {settings.acquire_timeout}s, running OCR on a single core.")
+                    return None, 1
+                if not waited:
+                    logger.info(f"CPU budget of {budget} cores exhausted, waiting for other OCR jobs to finish.")
+                    waited = True
+                self._sleep(POLL_INTERVAL)
+        except redis.RedisError as e:
+            logger.warning(f"CPU budget unavailable, running OCR on a single core: {e}")
+            return None, 1
+
+    @contextmanager
+    def reserve(self, wanted: int):
+        """Hold up to ``wanted`` tokens for the duration of the ``with`` block.
+
+        The lease is renewed in the background until the block exits.
+
+        Yields:
+            int: The number of cores the caller may use.
+        """
+        member, granted = self.acquire(wanted)
+        stop = threading.Event()
+        renewer = None
+        if member is not None:
+            def _renew():
+                while not stop.wait(LEASE_TTL / 3):
+                    try:
+                        self.renew(member)
+                    except redis.RedisError as e:
+                        logger.warning(f"Failed to renew CPU budget lease: {e}")
+
+            renewer = threading.Thread(target=_renew, name="cpu-budget-renew", daemon=True)
+            renewer.start()
+        try:
+            yield granted
+        finally:
+            stop.set()
+            if member is not None:
+                try:
+                    self.release(member)
+                except redis.RedisError as e:
+                    logger.warning(f"Failed to release CPU budget lease, it expires in {LEASE_TTL}s: {e}")
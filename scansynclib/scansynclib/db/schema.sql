@@ -10,7 +10,9 @@ CREATE TABLE IF NOT EXISTS scanneddata (
     additional_smb TEXT,
     web_url TEXT,
     pdf_pages INTEGER DEFAULT 0,
-    status_code INTEGER NOT NULL DEFAULT 0
+    status_code INTEGER NOT NULL DEFAULT 0,
+    latency_rolled_up INTEGER NOT NULL DEFAULT 0,
+    detected_language TEXT
 );
 
 CREATE TABLE IF NOT EXISTS smb_onedrive (
@@ -20,6 +22,9 @@ CREATE TABLE IF NOT EXISTS smb_onedrive (
     drive_id TEXT NOT NULL,
     folder_id TEXT NOT NULL,
     web_url TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    text_layer_mode TEXT NOT NULL DEFAULT 'pdfa',
+    ocr_profile TEXT,
     created DATETIME NOT NULL DEFAULT (DATETIME('now', 'localtime'))
 );
 
@@ -29,7 +34,15 @@ CREATE TABLE IF NOT EXISTS ocr_jobs (
     started DATETIME NOT NULL DEFAULT (DATETIME('now', 'localtime')),
     finished DATETIME,
     ocr_status TEXT NOT NULL,
-    ocr_error TEXT
+    ocr_error TEXT,
+    parent_id INTEGER,
+    chunk_index INTEGER,
+    chunk_count INTEGER,
+    page_start INTEGER,
+    page_end INTEGER,
+    normalized_pages INTEGER,
+    bytes_saved INTEGER,
+    seconds_saved REAL
 );
 
 CREATE TABLE IF NOT EXISTS file_naming_jobs (
@@ -41,6 +54,19 @@ CREATE TABLE IF NOT EXISTS file_naming_jobs (
     model TEXT,
     file_naming_status TEXT NOT NULL,
     success Boolean NOT NULL DEFAULT 0,
+    error_description TEXT,
+    cache_hit Boolean,
+    confidence REAL,
+    batch_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS file_naming_batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started DATETIME NOT NULL DEFAULT (DATETIME('now', 'localtime')),
+    finished DATETIME,
+    model TEXT,
+    size INTEGER NOT NULL,
+    named INTEGER,
     error_description TEXT
 );
 
@@ -52,4 +78,76 @@ CREATE TABLE IF NOT EXISTS sync_jobs (
     sync_status TEXT NOT NULL,
     success Boolean NOT NULL DEFAULT 0,
     error_description TEXT
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS pipeline_spans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trace_id TEXT NOT NULL,
+    span_id TEXT NOT NULL,
+    parent_span_id TEXT,
+    document_id INTEGER,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ok',
+    enqueued_at REAL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    queue_wait_seconds REAL,
+    processing_seconds REAL,
+    created DATETIME NOT NULL DEFAULT (DATETIME('now', 'localtime'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_pipeline_spans_trace_id ON pipeline_spans (trace_id);
+CREATE INDEX IF NOT EXISTS idx_pipeline_spans_document_id ON pipeline_spans (document_id);
+CREATE INDEX IF NOT EXISTS idx_pipeline_spans_stage_started ON pipeline_spans (stage, started_at);
+
+CREATE TABLE IF NOT EXISTS status_transitions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scanneddata_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    status_code INTEGER NOT NULL,
+    at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_status_transitions_scanneddata_id ON status_transitions (scanneddata_id);
+
+CREATE TABLE IF NOT EXISTS stage_latency_hourly (
+    hour TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    smb_name TEXT NOT NULL DEFAULT '',
+    page_bucket TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    sum_seconds REAL NOT NULL DEFAULT 0,
+    histogram TEXT NOT NULL,
+    PRIMARY KEY (hour, stage, smb_name, page_bucket)
+);
+
+CREATE TABLE IF NOT EXISTS document_text (
+    scanneddata_id INTEGER PRIMARY KEY,
+    text BLOB NOT NULL,
+    chars INTEGER NOT NULL,
+    pages INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    created DATETIME NOT NULL DEFAULT (DATETIME('now', 'localtime'))
+);
+
+CREATE TABLE IF NOT EXISTS sender_vocabulary (
+    share TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_seen DATETIME NOT NULL DEFAULT (DATETIME('now', 'localtime')),
+    PRIMARY KEY (share, sender)
+);
+
+CREATE TABLE IF NOT EXISTS sender_vocabulary_documents (
+    share TEXT PRIMARY KEY,
+    documents INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS remote_renames (
+    scanneddata_id INTEGER PRIMARY KEY,
+    filename TEXT,
+    remote_items TEXT,
+    claimed INTEGER NOT NULL DEFAULT 0,
+    finished DATETIME,
+    error_description TEXT
+);
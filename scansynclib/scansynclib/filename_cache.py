@@ -0,0 +1,101 @@
+"""Cache of LLM generated filenames.
+
+Redeliveries, re-scans of the same letter and recurring forms would otherwise
+send the same text to OpenAI or Ollama again and pay the full latency and cost
+of the request. Generated filenames are stored in Redis under a hash of the
+normalized document text, the provider, the model and the prompt, so a
+repeated document is named without asking the LLM again.
+
+Entries expire after ``cache_ttl_days`` and the least recently used entries
+are evicted once the cache holds more than ``cache_max_entries``. The hit or
+miss of every lookup is recorded in ``file_naming_jobs.cache_hit``.
+"""
+
+import hashlib
+import time
+import unicodedata
+
+import redis
+
+from scansynclib.logging import logger
+from scansynclib import metrics
+
+# Bump when the handling of LLM answers changes, so cached names are generated again.
+PROMPT_VERSION = 1
+
+KEY_PREFIX = "filename_cache:"
+# Sorted set of cache keys by their last use, for LRU eviction.
+LRU_KEY = "filename_cache:lru"
+
+
+def _redis():
+    from scansynclib.redis_client import get_redis
+    return get_redis()
+
+
+def _settings():
+    from scansynclib.settings import settings
+    return settings.file_naming
+
+
+def normalize_text(text: str) -> str:
+    """Return ``text`` without the differences of repeated OCR runs of the same document."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(provider: str, model: str, prompt: str, text: str) -> str:
+    """Return the cache key of naming ``text`` with ``model`` of ``provider`` and ``prompt``."""
+    digest = hashlib.sha256()
+    for part in (str(PROMPT_VERSION), provider, model or "", prompt, normalize_text(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return KEY_PREFIX + digest.hexdigest()
+
+
+def get(key: str) -> str | None:
+    """Return the cached filename of ``key`` and mark it as recently used."""
+    if not _settings().cache_enabled:
+        return None
+    try:
+        client = _redis()
+        filename = client.get(key)
+        if filename is None:
+            return None
+        client.zadd(LRU_KEY, {key: time.time()})
+        client.expire(key, _settings().cache_ttl_days * 24 * 60 * 60)
+        return filename
+    except redis.RedisError as e:
+        logger.warning(f"Filename cache lookup failed: {e}")
+        return None
+
+
+def put(key: str, filename: str):
+    """Cache ``filename`` under ``key`` and evict the least recently used entries."""
+    file_naming = _settings()
+    if not file_naming.cache_enabled or not filename:
+        return
+    try:
+        client = _redis()
+        pipe = client.pipeline()
+        pipe.set(key, filename, ex=file_naming.cache_ttl_days * 24 * 60 * 60)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.zcard(LRU_KEY)
+        size = pipe.execute()[-1]
+        if size > file_naming.cache_max_entries:
+            evicted = [member for member, _ in client.zpopmin(LRU_KEY, size - file_naming.cache_max_entries)]
+            if evicted:
+                client.delete(*evicted)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache filename: {e}")
+
+
+def lookup(file_naming_db_id: int, key: str) -> str | None:
+    """Return the cached filename of ``key`` and record the hit or miss for the file naming job."""
+    filename = get(key)
+    if not _settings().cache_enabled:
+        return filename
+    # Imported lazily, sqlite_wrapper initializes the database on import.
+    from scansynclib.sqlite_wrapper import execute_query
+    execute_query("UPDATE file_naming_jobs SET cache_hit = ? WHERE id = ?", (filename is not None, file_naming_db_id))
+    metrics.inc("scansync_file_naming_cache_total", 1, "Filename cache lookups", result="hit" if filename is not None else "miss")
+    return filename
@@ -183,7 +183,7 @@ def validate_smb_filename(filename: str) -> str:
     return filename
 
 
-def extract_text(pdf_path: str, max_pages: int = 10, max_chars: int = 50_000) -> str:
+def extract_text(pdf_path: str, max_pages: int = 10, max_chars: int = 50_000, page_separator: str = "\n") -> str:
     """Extracts text from a PDF file with configurable limits.
 
     To avoid excessive memory usage on large documents, extraction stops after
@@ -194,6 +194,7 @@ def extract_text(pdf_path: str, max_pages: int = 10, max_chars: int = 50_000) ->
         pdf_path (str): The path to the PDF file.
         max_pages (int): Maximum number of pages to read (default 10).
         max_chars (int): Maximum number of characters to return (default 50 000).
+        page_separator (str): Joins the text of the pages, e.g. ``"\\f"`` to keep the page breaks.
 
     Returns:
         str: The extracted text from the PDF, truncated to the limits above.
@@ -216,8 +217,29 @@ def extract_text(pdf_path: str, max_pages: int = 10, max_chars: int = 50_000) ->
                 total_chars += min(len(page_text), remaining)
                 if total_chars >= max_chars:
                     break
-        result = "\n".join(parts)
+        result = page_separator.join(parts)
         return result[:max_chars]
     except Exception as ex:
         logger.exception(f"Failed extracting text: {ex}")
         return ""
+
+
+def percentile(values: list, pct: float) -> float | None:
+    """Returns the *pct* percentile of *values* using linear interpolation.
+
+    Args:
+        values (list): The numeric sample, in any order. ``None`` entries are ignored.
+        pct (float): The percentile between 0 and 100, e.g. 90 for the p90.
+
+    Returns:
+        float | None: The percentile or ``None`` for an empty sample.
+    """
+    data = sorted(v for v in values if v is not None)
+    if not data:
+        return None
+    if len(data) == 1:
+        return float(data[0])
+    rank = (len(data) - 1) * max(0.0, min(100.0, pct)) / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(data) - 1)
+    return float(data[lower] + (data[upper] - data[lower]) * (rank - lower))
@@ -0,0 +1,103 @@
+"""Shared HTTP clients of a service process.
+
+Creating a client per request means a new TCP connection and TLS handshake
+to OpenAI, Ollama or Microsoft Graph for every document. The clients here are
+created lazily on first use, keep their connections alive in a pool and are
+shared by all threads of the process. Each backend has its own default
+timeout.
+
+When the settings change (Redis pub/sub, see :mod:`scansynclib.settings`)
+all clients are dropped and rebuilt on their next use, so a new API key or
+Ollama server takes effect without restarting the service.
+"""
+
+import hashlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scansynclib.logging import logger
+
+# Default (connect, read) timeouts in seconds per backend.
+TIMEOUTS = {
+    "ollama": (10, 120),
+    "graph": (10, 300),
+    "openai": (10, 60),
+}
+DEFAULT_TIMEOUT = (10, 60)
+
+# Connections kept alive per host. Sized for the worker threads of a service.
+POOL_SIZE = 10
+
+_lock = threading.Lock()
+_sessions = {}
+_openai_clients = {}
+_watching = False
+
+
+class _Session(requests.Session):
+    """Session applying a default timeout to requests that don't set one."""
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _watch_settings():
+    """Rebuild the clients whenever the settings change."""
+    global _watching
+    if _watching:
+        return
+    _watching = True
+    from scansynclib.settings import settings_manager
+    settings_manager.add_listener(reset)
+
+
+def session(backend: str) -> requests.Session:
+    """Return the pooled session of ``backend`` (``"ollama"`` or ``"graph"``)."""
+    client = _sessions.get(backend)
+    if client is None:
+        _watch_settings()
+        with _lock:
+            client = _sessions.get(backend)
+            if client is None:
+                client = _sessions[backend] = _Session(TIMEOUTS.get(backend, DEFAULT_TIMEOUT))
+    return client
+
+
+def openai_client(api_key: str):
+    """Return the pooled OpenAI client of ``api_key``."""
+    # Keyed by a hash of the key, a changed key gets a new client.
+    fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    client = _openai_clients.get(fingerprint)
+    if client is None:
+        _watch_settings()
+        import httpx
+        from openai import OpenAI
+        connect, read = TIMEOUTS["openai"]
+        with _lock:
+            client = _openai_clients.get(fingerprint)
+            if client is None:
+                client = _openai_clients[fingerprint] = OpenAI(api_key=api_key, timeout=httpx.Timeout(read, connect=connect))
+    return client
+
+
+def reset():
+    """Drop all clients, they are created again on their next use.
+
+    The clients aren't closed, requests still running on them finish and
+    their connections are released once the last reference is gone.
+    """
+    with _lock:
+        dropped = len(_sessions) + len(_openai_clients)
+        _sessions.clear()
+        _openai_clients.clear()
+    if dropped:
+        logger.debug(f"Dropped {dropped} HTTP clients after a settings change")
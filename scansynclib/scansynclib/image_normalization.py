@@ -0,0 +1,199 @@
+"""Normalize the page images of a scan before OCR.
+
+Scanners and phone apps often deliver pages at 600 DPI or more, or in colour
+although the page is plain black text. ocrmypdf rasterizes, cleans and
+optimizes every one of those pixels and Tesseract gains nothing from the extra
+resolution beyond ~300 DPI. Before OCR, every page image whose effective
+resolution exceeds the profile's ``downsample_above_dpi`` is resampled to
+``downsample_to_dpi``, and colour images without colour content are converted
+to grayscale. Images are replaced in place, so the page layout, vector content
+and existing text are kept.
+
+ocrmypdf builds the OCR file from its input, so the normalized images end up
+in the published file. Normalization is therefore off by default and only
+enabled for profiles that favour speed over image quality, like ``fast``. An
+image is only replaced if it gets smaller.
+"""
+
+import os
+import time
+
+from scansynclib.logging import logger
+
+# Points per inch of PDF user space.
+POINTS_PER_INCH = 72
+
+# A pixel counts as coloured if its channels differ by more than this ...
+GRAY_TOLERANCE = 24
+# ... and an image is treated as gray if at most this share of its pixels is coloured.
+MAX_COLOR_SHARE = 0.005
+
+# Longer side in pixels of the thumbnail the colour content is checked on.
+THUMBNAIL_SIZE = 256
+
+# Quality of the JPEG the resampled images are stored as.
+JPEG_QUALITY = 85
+
+
+class NormalizationResult:
+    """Outcome of :func:`normalize_pdf`.
+
+    ``samples_before`` and ``samples_after`` count pixels times colour
+    components of all page images, the work ocrmypdf and Tesseract scale with.
+    """
+    def __init__(self, output_path: str, pages: int, images: int, bytes_before: int, bytes_after: int,
+                 samples_before: int, samples_after: int, seconds: float):
+        self.output_path = output_path
+        self.pages = pages
+        self.images = images
+        self.bytes_before = bytes_before
+        self.bytes_after = bytes_after
+        self.samples_before = samples_before
+        self.samples_after = samples_after
+        self.seconds = seconds
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def seconds_saved(self, ocr_seconds: float) -> float:
+        """Estimate the seconds saved by an OCR run of ``ocr_seconds`` on the normalized file.
+
+        Assumes the OCR time grows linearly with the image samples and
+        subtracts the time spent normalizing.
+        """
+        if not self.samples_after:
+            return 0.0
+        return ocr_seconds * (self.samples_before / self.samples_after - 1) - self.seconds
+
+
+def effective_dpi(pixels: int, points: float) -> float:
+    """Return the resolution of an image ``pixels`` wide shown ``points`` wide on the page."""
+    if points <= 0:
+        return 0.0
+    return pixels * POINTS_PER_INCH / points
+
+
+def target_size(width: int, height: int, dpi: float, target_dpi: int) -> tuple[int, int]:
+    """Return the pixel size of a ``width`` x ``height`` image at ``dpi`` resampled to ``target_dpi``."""
+    scale = target_dpi / dpi
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def is_grayscale(samples: bytes, components: int, tolerance: int = GRAY_TOLERANCE, max_color_share: float = MAX_COLOR_SHARE) -> bool:
+    """Return whether the RGB ``samples`` (``components`` bytes per pixel) have no colour content."""
+    pixels = len(samples) // components
+    if not pixels:
+        return True
+    allowed = int(pixels * max_color_share)
+    coloured = 0
+    for offset in range(0, pixels * components, components):
+        r, g, b = samples[offset], samples[offset + 1], samples[offset + 2]
+        if max(r, g, b) - min(r, g, b) > tolerance:
+            coloured += 1
+            if coloured > allowed:
+                return False
+    return True
+
+
+def _has_color(pymupdf, pixmap) -> bool:
+    scale = THUMBNAIL_SIZE / max(pixmap.width, pixmap.height)
+    if scale < 1:
+        pixmap = pymupdf.Pixmap(pixmap, max(1, int(pixmap.width * scale)), max(1, int(pixmap.height * scale)), None)
+    return not is_grayscale(pixmap.samples, pixmap.n)
+
+
+def _normalize_image(pymupdf, document, page, image, profile) -> tuple[int, int] | None:
+    """Replace one page image if it is oversized or gray in colour.
+
+    Returns:
+        tuple[int, int] | None: The samples before and after or ``None`` if the image was kept.
+    """
+    xref, smask, width, height, bits = image[:5]
+    rects = page.get_image_rects(xref)
+    # Bilevel scans are small and lossless already, images with a soft mask would lose it.
+    if not rects or smask or bits == 1:
+        return None
+    pixmap = pymupdf.Pixmap(document, xref)
+    if pixmap.colorspace is None:
+        return None
+    before = width * height * pixmap.colorspace.n
+
+    # The image may be shown several times, the largest rect has the lowest resolution.
+    rect = max(rects, key=lambda r: r.width * r.height)
+    dpi = min(effective_dpi(width, rect.width), effective_dpi(height, rect.height))
+    downsample = bool(profile.downsample_above_dpi) and dpi > profile.downsample_above_dpi
+    if pixmap.alpha:
+        pixmap = pymupdf.Pixmap(pixmap, 0)
+    if pixmap.colorspace.n == 4:
+        pixmap = pymupdf.Pixmap(pymupdf.csRGB, pixmap)
+    to_gray = profile.grayscale_detection and pixmap.colorspace.n == 3 and not _has_color(pymupdf, pixmap)
+    if not downsample and not to_gray:
+        return None
+
+    if to_gray:
+        pixmap = pymupdf.Pixmap(pymupdf.csGRAY, pixmap)
+    if downsample:
+        new_width, new_height = target_size(width, height, dpi, profile.downsample_to_dpi)
+        pixmap = pymupdf.Pixmap(pixmap, new_width, new_height, None)
+    stream = pixmap.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+    # Re-encoding a well compressed scan can make it bigger, and lossy for nothing.
+    if len(stream) >= len(document.xref_stream_raw(xref)):
+        return None
+    page.replace_image(xref, stream=stream)
+    return before, pixmap.width * pixmap.height * pixmap.colorspace.n
+
+
+def normalize_pdf(input_path: str, output_path: str, profile) -> NormalizationResult | None:
+    """Write a copy of ``input_path`` with oversized and gray colour images normalized to ``output_path``.
+
+    Args:
+        profile: The :class:`~scansynclib.settings_schema.OcrProfile` of the document.
+
+    Returns:
+        NormalizationResult | None: The savings, or ``None`` if no image was
+        changed or the file couldn't be normalized. ``output_path`` is only
+        written if a result is returned.
+    """
+    if not profile.downsample_above_dpi and not profile.grayscale_detection:
+        return None
+    try:
+        import pymupdf
+    except ImportError:
+        logger.warning("PyMuPDF is not installed, skipping image normalization")
+        return None
+
+    started = time.monotonic()
+    try:
+        with pymupdf.open(input_path) as document:
+            pages = images = samples_before = samples_after = 0
+            seen = set()
+            for page in document:
+                page_changed = False
+                for image in page.get_images(full=True):
+                    if image[0] in seen:
+                        continue
+                    seen.add(image[0])
+                    samples = _normalize_image(pymupdf, document, page, image, profile)
+                    if samples is None:
+                        continue
+                    samples_before += samples[0]
+                    samples_after += samples[1]
+                    images += 1
+                    page_changed = True
+                pages += page_changed
+            if not images:
+                return None
+            document.save(output_path, garbage=3, deflate=True)
+    except Exception as e:
+        logger.warning(f"Could not normalize the images of {input_path}: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+
+    result = NormalizationResult(
+        output_path, pages, images, os.path.getsize(input_path), os.path.getsize(output_path),
+        samples_before, samples_after, time.monotonic() - started,
+    )
+    logger.info(f"Normalized {images} images on {pages} pages of {input_path}, {result.bytes_saved // 1024} KB saved")
+    return result
@@ -0,0 +1,143 @@
+"""Pick the Tesseract languages of a document before OCR.
+
+Every language loaded into Tesseract slows down the recognition of every
+page, yet most shares only receive documents in a single language. Before the
+full OCR run the first page is rendered at a low resolution and recognized
+with all candidate languages once. The language whose common words dominate
+the sample is used for the full run. If the sample is inconclusive, the
+language most documents of the same share were detected in is used, and if
+there is no clear history either, all candidate languages are kept.
+"""
+
+import re
+import subprocess
+from collections import Counter
+
+from scansynclib.logging import logger
+
+# Resolution of the rendered sample page. Enough to read body text, but
+# several times faster to recognize than the 300 DPI of a full OCR run.
+SAMPLE_DPI = 100
+
+# Seconds the sample recognition may take before detection is skipped.
+SAMPLE_TIMEOUT = 30
+
+# The sample needs at least this many stopword hits to be conclusive ...
+MIN_STOPWORD_HITS = 5
+# ... and the winning language must have this share of all hits.
+MIN_CONFIDENCE = 0.75
+
+# Share of the recent documents of a share that must agree on a language.
+MIN_HISTORY_AGREEMENT = 0.8
+
+# Frequent short words of each language. They carry no meaning of their own,
+# which makes them a robust signal even in noisy low resolution OCR output.
+STOPWORDS = {
+    "eng": {"the", "and", "of", "to", "in", "is", "for", "on", "with", "that", "this", "by", "are", "be", "from", "your", "you", "we", "our", "at", "not", "or", "as", "will", "please", "have"},
+    "deu": {"der", "die", "das", "und", "ist", "nicht", "mit", "von", "den", "für", "auf", "des", "dem", "ein", "eine", "zu", "im", "sie", "wir", "ihr", "ihre", "bitte", "bei", "oder", "wird", "sind"},
+    "fra": {"le", "la", "les", "et", "des", "du", "une", "est", "pour", "que", "dans", "qui", "sur", "pas", "par", "vous", "nous", "avec", "au", "aux", "votre", "sont"},
+    "spa": {"el", "los", "las", "del", "y", "que", "una", "por", "con", "para", "es", "su", "al", "lo", "como", "más", "pero", "sus", "usted", "este", "esta"},
+    "ita": {"il", "di", "che", "della", "per", "con", "non", "una", "sono", "gli", "alla", "nel", "del", "dei", "questo", "come", "anche", "essere"},
+    "nld": {"de", "het", "een", "en", "van", "is", "dat", "op", "te", "voor", "niet", "met", "zijn", "ook", "wij", "uw", "aan", "bij", "worden"},
+}
+
+_WORD = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def score_text(text: str, candidates: list[str]) -> Counter:
+    """Count the stopwords of each candidate language in ``text``."""
+    scores = Counter({language: 0 for language in candidates})
+    for word in _WORD.findall(text.lower()):
+        for language in candidates:
+            if word in STOPWORDS.get(language, ()):
+                scores[language] += 1
+    return scores
+
+
+def pick_language(text: str, candidates: list[str]) -> str | None:
+    """Return the language of ``text`` or ``None`` if the text is inconclusive."""
+    scores = score_text(text, [language for language in candidates if language in STOPWORDS])
+    total = sum(scores.values())
+    if total < MIN_STOPWORD_HITS:
+        return None
+    language, hits = scores.most_common(1)[0]
+    if hits / total < MIN_CONFIDENCE:
+        return None
+    return language
+
+
+def render_sample(path: str, dpi: int = SAMPLE_DPI) -> bytes | None:
+    """Render the first page of a PDF or image as PNG at ``dpi``."""
+    try:
+        import pymupdf
+        with pymupdf.open(path) as document:
+            if document.page_count == 0:
+                return None
+            return document[0].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY).tobytes("png")
+    except Exception as e:
+        logger.debug(f"Could not render a language sample of {path}: {e}")
+        return None
+
+
+def recognize_sample(png: bytes, languages: list[str]) -> str:
+    """Run Tesseract on the sample with all ``languages`` and return the text."""
+    result = subprocess.run(
+        ["tesseract", "stdin", "stdout", "-l", "+".join(languages), "--psm", "3"],
+        input=png, capture_output=True, timeout=SAMPLE_TIMEOUT, check=True,
+    )
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+def detect_language(path: str, candidates: list[str]) -> str | None:
+    """Detect the language of the first page of ``path`` among ``candidates``."""
+    sample = render_sample(path)
+    if sample is None:
+        return None
+    try:
+        text = recognize_sample(sample, candidates)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Language detection of {path} failed: {e}")
+        return None
+    return pick_language(text, candidates)
+
+
+def history_language(share: str, candidates: list[str], size: int) -> str | None:
+    """Return the language most recent documents of ``share`` were detected in.
+
+    Returns ``None`` without enough history or if the documents don't agree.
+    """
+    if not share or size <= 0:
+        return None
+    # Imported lazily, sqlite_wrapper initializes the database on import.
+    from scansynclib.sqlite_wrapper import execute_query
+    rows = execute_query(
+        "SELECT detected_language FROM scanneddata WHERE local_filepath = ? AND detected_language IS NOT NULL ORDER BY id DESC LIMIT ?",
+        (share, size), fetchall=True
+    ) or []
+    languages = Counter(row["detected_language"] for row in rows)
+    if sum(languages.values()) < size:
+        return None
+    language, count = languages.most_common(1)[0]
+    if language not in candidates or count / size < MIN_HISTORY_AGREEMENT:
+        return None
+    return language
+
+
+def choose_languages(path: str, share: str, candidates: list[str], history_size: int) -> tuple[list[str], str | None]:
+    """Return the Tesseract languages for a document and the detected language.
+
+    Returns:
+        tuple[list[str], str | None]: The languages to pass to ocrmypdf and
+        the language detected from the sample (``None`` if inconclusive).
+    """
+    if len(candidates) < 2:
+        return list(candidates), None
+    detected = detect_language(path, candidates)
+    if detected:
+        logger.debug(f"Detected language {detected} for {path}")
+        return [detected], detected
+    learned = history_language(share, candidates, history_size)
+    if learned:
+        logger.debug(f"Language sample of {path} inconclusive, using {learned} from the share history")
+        return [learned], None
+    return list(candidates), None
@@ -0,0 +1,272 @@
+"""Prometheus style instrumentation shared by all ScanSync services.
+
+Services record counters, gauges and histograms into a small in-process
+buffer. A daemon thread flushes the buffer to Redis every
+:data:`FLUSH_INTERVAL` seconds, so all replicas of a service add up to one
+coherent set of series. The web service renders the aggregated values in the
+Prometheus text format on ``/metrics``.
+
+Redis layout:
+
+* ``metrics:meta`` - hash of metric name to ``{"type": ..., "help": ...}``.
+* ``metrics:values:<name>`` - hash of series (sample suffix and rendered
+  labels) to the current value.
+* ``metrics:gauges:<instance>`` - hash of metric name and series to the
+  current value of the gauges of one replica. Gauges carry an ``instance``
+  label, as replicas would overwrite each other's values, and expire when the
+  replica stops flushing.
+
+Recording never raises and never blocks on Redis; if Redis is unavailable
+the buffered values are kept and sent with the next successful flush.
+"""
+
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from scansynclib.logging import logger
+
+FLUSH_INTERVAL = 10
+
+META_KEY = "metrics:meta"
+VALUES_KEY_PREFIX = "metrics:values:"
+GAUGES_KEY_PREFIX = "metrics:gauges:"
+
+# Flush intervals the gauges of a replica outlive its last flush.
+GAUGE_TTL_INTERVALS = 3
+
+# Value of the ``instance`` label of gauges, the container's hostname by default.
+INSTANCE = os.getenv("METRICS_INSTANCE") or socket.gethostname()
+
+# Default histogram buckets (seconds), from fast SQL queries to long OCR runs.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+_SEPARATOR = "\t"
+
+ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() != "false"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _render_labels(labels: dict) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def _series(suffix: str, labels: dict) -> str:
+    return f"{suffix}{_SEPARATOR}{_render_labels(labels)}"
+
+
+class MetricsBuffer:
+    """Thread safe, in-process buffer of metric updates flushed to Redis."""
+
+    def __init__(self, redis_factory=None, flush_interval: float = FLUSH_INTERVAL, instance: str = INSTANCE):
+        self._redis_factory = redis_factory
+        self._flush_interval = flush_interval
+        self._instance = instance
+        self._lock = threading.Lock()
+        self._increments = {}
+        self._gauges = {}
+        self._meta = {}
+        self._thread = None
+        self._stopped = threading.Event()
+        self._failing = False
+
+    def _redis(self):
+        if self._redis_factory is None:
+            from scansynclib.redis_client import get_redis
+            return get_redis()
+        return self._redis_factory()
+
+    def _register(self, name: str, metric_type: str, help_text: str):
+        if name not in self._meta:
+            self._meta[name] = {"type": metric_type, "help": help_text}
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            # Creating the client imports redis, which fails during interpreter shutdown.
+            try:
+                self._redis()
+            except Exception:
+                pass
+            self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+            self._thread.start()
+
+    def inc(self, name: str, value: float = 1, help_text: str = "", **labels):
+        """Increase the counter ``name`` by ``value``."""
+        with self._lock:
+            self._register(name, "counter", help_text)
+            key = (name, _series("", labels))
+            self._increments[key] = self._increments.get(key, 0.0) + value
+            self._ensure_thread()
+
+    def set_gauge(self, name: str, value: float, help_text: str = "", **labels):
+        """Set the gauge ``name`` of this replica to ``value``."""
+        with self._lock:
+            self._register(name, "gauge", help_text)
+            self._gauges[(name, _series("", {**labels, "instance": self._instance}))] = float(value)
+            self._ensure_thread()
+
+    def observe(self, name: str, value: float, help_text: str = "", buckets=DEFAULT_BUCKETS, **labels):
+        """Add an observation of ``value`` to the histogram ``name``."""
+        with self._lock:
+            self._register(name, "histogram", help_text)
+            for bound in (*buckets, float("inf")):
+                if value <= bound:
+                    key = (name, _series("bucket", {**labels, "le": _format_value(bound)}))
+                    self._increments[key] = self._increments.get(key, 0.0) + 1
+            for suffix, amount in (("sum", value), ("count", 1)):
+                key = (name, _series(suffix, labels))
+                self._increments[key] = self._increments.get(key, 0.0) + amount
+            self._ensure_thread()
+
+    def flush(self) -> bool:
+        """Send the buffered values to Redis. Returns ``False`` if Redis failed."""
+        with self._lock:
+            increments, self._increments = self._increments, {}
+            # Gauges are sent with every flush, that keeps them from expiring.
+            gauges = dict(self._gauges)
+            meta = dict(self._meta)
+        if not increments and not gauges:
+            return True
+        try:
+            pipe = self._redis().pipeline(transaction=False)
+            for name, info in meta.items():
+                pipe.hset(META_KEY, name, json.dumps(info))
+            for (name, series), value in increments.items():
+                pipe.hincrbyfloat(VALUES_KEY_PREFIX + name, series, value)
+            if gauges:
+                gauges_key = GAUGES_KEY_PREFIX + self._instance
+                pipe.hset(gauges_key, mapping={f"{name}{_SEPARATOR}{series}": value for (name, series), value in gauges.items()})
+                pipe.expire(gauges_key, int(self._flush_interval * GAUGE_TTL_INTERVALS))
+            pipe.execute()
+            self._failing = False
+            return True
+        except Exception as e:
+            # Keep the values for the next attempt; counters merge into the
+            # same series so the buffer does not grow while Redis is down.
+            with self._lock:
+                for key, value in increments.items():
+                    self._increments[key] = self._increments.get(key, 0.0) + value
+            if not self._failing:
+                logger.warning(f"Failed to flush metrics to Redis: {e}")
+                self._failing = True
+            return False
+
+    def _run(self):
+        while not self._stopped.wait(self._flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the flush thread and send the remaining values, e.g. on exit."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._flush_interval)
+        self.flush()
+
+
+class _NullBuffer:
+    """Drop-in buffer used when metrics are disabled via ``METRICS_ENABLED``."""
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def set_gauge(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def flush(self):
+        return True
+
+    def close(self):
+        pass
+
+
+_buffer = MetricsBuffer() if ENABLED else _NullBuffer()
+atexit.register(_buffer.close)
+
+
+def inc(name: str, value: float = 1, help_text: str = "", **labels):
+    """Increase the counter ``name`` by ``value`` (shared buffer)."""
+    _buffer.inc(name, value, help_text, **labels)
+
+
+def set_gauge(name: str, value: float, help_text: str = "", **labels):
+    """Set the gauge ``name`` to ``value`` (shared buffer)."""
+    _buffer.set_gauge(name, value, help_text, **labels)
+
+
+def observe(name: str, value: float, help_text: str = "", buckets=DEFAULT_BUCKETS, **labels):
+    """Add ``value`` to the histogram ``name`` (shared buffer)."""
+    _buffer.observe(name, value, help_text, buckets, **labels)
+
+
+@contextmanager
+def timer(name: str, help_text: str = "", buckets=DEFAULT_BUCKETS, **labels):
+    """Observe the duration of the ``with`` block in the histogram ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, help_text, buckets, **labels)
+
+
+def flush() -> bool:
+    """Flush the shared buffer immediately."""
+    return _buffer.flush()
+
+
+def render_prometheus(redis_client=None, extra: list = None) -> str:
+    """Render all metrics stored in Redis in the Prometheus text format.
+
+    Args:
+        redis_client: Redis client to read from, defaults to the shared one.
+        extra (list): Additional ``(name, type, help, [(labels, value), ...])``
+            tuples computed at scrape time, e.g. queue depths.
+
+    Returns:
+        str: The exposition text.
+    """
+    if redis_client is None:
+        from scansynclib.redis_client import get_redis
+        redis_client = get_redis()
+
+    gauges = {}
+    for key in redis_client.scan_iter(match=GAUGES_KEY_PREFIX + "*"):
+        for field, value in (redis_client.hgetall(key) or {}).items():
+            name, _, series = field.partition(_SEPARATOR)
+            gauges.setdefault(name, {})[series] = value
+
+    lines = []
+    meta = redis_client.hgetall(META_KEY) or {}
+    for name in sorted(meta):
+        info = json.loads(meta[name])
+        values = {**(redis_client.hgetall(VALUES_KEY_PREFIX + name) or {}), **gauges.get(name, {})}
+        if info.get("help"):
+            lines.append(f"# HELP {name} {info['help']}")
+        lines.append(f"# TYPE {name} {info['type']}")
+        for series in sorted(values):
+            suffix, _, labels = series.partition(_SEPARATOR)
+            sample = f"{name}_{suffix}" if suffix else name
+            lines.append(f"{sample}{{{labels}}} {_format_value(float(values[series]))}" if labels else f"{sample} {_format_value(float(values[series]))}")
+
+    for name, metric_type, help_text, samples in extra or []:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            rendered = _render_labels(labels)
+            lines.append(f"{name}{{{rendered}}} {_format_value(value)}" if rendered else f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,224 @@
+"""Split large documents into page range chunks that are OCR'd in parallel.
+
+A 200 page scan would otherwise be OCR'd by a single replica while the others
+sit idle. The metadata service cuts documents above ``fan_out_pages`` into
+chunks of ``chunk_pages`` pages and publishes one sub-job per chunk on
+``ocr_queue``. Any OCR replica can process a chunk; the replica finishing the
+last chunk claims the merge and assembles the OCR'd chunks back into one
+document in page order.
+
+Chunks are tracked in ``ocr_jobs``: the document gets a parent job and every
+chunk a job pointing to it via ``parent_id``. The merge is claimed with a
+conditional update of the parent job, so only one replica merges even if two
+chunks finish at the same time.
+"""
+
+import copy
+import os
+import shutil
+
+from pypdf import PdfReader, PdfWriter
+
+from scansynclib import text_store
+from scansynclib.config import config
+from scansynclib.logging import logger
+from scansynclib.ProcessItem import OCRStatus, ProcessItem
+
+CHUNK_DIR = config.get("ocrChunks.path", "data/ocr-chunks")
+
+
+class OcrChunk:
+    """The page range of a split document a single OCR sub-job works on.
+
+    Page numbers are 1-based and inclusive.
+    """
+    def __init__(self, job_id: int, parent_job_id: int, index: int, count: int, page_start: int, page_end: int, directory: str):
+        self.job_id = job_id
+        self.parent_job_id = parent_job_id
+        self.index = index
+        self.count = count
+        self.page_start = page_start
+        self.page_end = page_end
+        self.directory = directory
+
+    @property
+    def pages(self) -> int:
+        return self.page_end - self.page_start + 1
+
+    @property
+    def input_path(self) -> str:
+        return chunk_paths(self.directory, self.index)[0]
+
+    @property
+    def output_path(self) -> str:
+        return chunk_paths(self.directory, self.index)[1]
+
+    @property
+    def sidecar_path(self) -> str:
+        return sidecar_path(self.directory, self.index)
+
+
+def chunk_directory(document_id: int) -> str:
+    """Return the working directory of the chunks of a document."""
+    return os.path.join(CHUNK_DIR, str(document_id))
+
+
+def chunk_paths(directory: str, index: int) -> tuple[str, str]:
+    """Return the input and OCR output path of chunk ``index``."""
+    return os.path.join(directory, f"chunk_{index:04d}.pdf"), os.path.join(directory, f"chunk_{index:04d}_OCR.pdf")
+
+
+def sidecar_path(directory: str, index: int) -> str:
+    """Return the path of the OCR text sidecar of chunk ``index``."""
+    return os.path.join(directory, f"chunk_{index:04d}_OCR.txt")
+
+
+def normalized_path(directory: str, index: int) -> str:
+    """Return the path of the chunk with normalized page images, see :mod:`scansynclib.image_normalization`."""
+    return os.path.join(directory, f"chunk_{index:04d}_normalized.pdf")
+
+
+def plan_chunks(pages: int, chunk_pages: int) -> list[tuple[int, int]]:
+    """Return the ``(page_start, page_end)`` ranges of the chunks of a document.
+
+    A short remainder is added to the last chunk instead of creating a tiny
+    chunk of its own.
+    """
+    if pages <= 0:
+        return []
+    ranges = [(start, min(start + chunk_pages - 1, pages)) for start in range(1, pages + 1, chunk_pages)]
+    if len(ranges) > 1 and ranges[-1][1] - ranges[-1][0] + 1 < chunk_pages / 2:
+        last_start, _ = ranges.pop(-2)
+        ranges[-1] = (last_start, pages)
+    return ranges
+
+
+def should_fan_out(pages: int, ocr_settings) -> bool:
+    """Return whether a document with ``pages`` pages is split into chunks."""
+    return bool(ocr_settings.fan_out_pages) and pages > ocr_settings.fan_out_pages and pages > ocr_settings.chunk_pages
+
+
+def split_pdf(source: str, directory: str, ranges: list[tuple[int, int]]):
+    """Write one PDF per page range of ``source`` into ``directory``."""
+    os.makedirs(directory, exist_ok=True)
+    reader = PdfReader(source)
+    for index, (page_start, page_end) in enumerate(ranges):
+        writer = PdfWriter()
+        for page_number in range(page_start - 1, page_end):
+            writer.add_page(reader.pages[page_number])
+        with open(chunk_paths(directory, index)[0], "wb") as f:
+            writer.write(f)
+
+
+def merge_chunks(directory: str, count: int, output_path: str):
+    """Concatenate the OCR outputs of ``count`` chunks in page order."""
+    writer = PdfWriter()
+    for index in range(count):
+        writer.append(chunk_paths(directory, index)[1])
+    with open(output_path, "wb") as f:
+        writer.write(f)
+
+
+def merge_sidecars(directory: str, count: int) -> str | None:
+    """Concatenate the OCR text of ``count`` chunks in page order.
+
+    Returns ``None`` if the text of any chunk is unavailable.
+    """
+    texts = []
+    for index in range(count):
+        text = text_store.read_sidecar(sidecar_path(directory, index))
+        if text is None:
+            return None
+        texts.append(text.rstrip(text_store.PAGE_SEPARATOR))
+    return text_store.PAGE_SEPARATOR.join(texts)
+
+
+def remove_chunks(directory: str):
+    """Remove the working directory of a split document."""
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def fan_out(item: ProcessItem, ocr_settings) -> list[ProcessItem]:
+    """Split ``item`` into chunk sub-jobs and register them in ``ocr_jobs``.
+
+    Returns:
+        list[ProcessItem]: One item per chunk to publish on ``ocr_queue``, or an
+        empty list if the document is not split.
+    """
+    # Imported lazily, sqlite_wrapper initializes the database on import.
+    from scansynclib.sqlite_wrapper import execute_query
+
+    ranges = plan_chunks(item.pdf_pages, ocr_settings.chunk_pages)
+    if len(ranges) < 2:
+        return []
+
+    directory = chunk_directory(item.db_id)
+    split_pdf(item.local_file_path, directory, ranges)
+
+    parent_job_id = execute_query(
+        "INSERT INTO ocr_jobs (scanneddata_id, ocr_status, chunk_count, page_start, page_end) VALUES (?, ?, ?, ?, ?)",
+        (item.db_id, OCRStatus.PENDING.name, len(ranges), 1, item.pdf_pages),
+        return_last_id=True
+    )
+    if not parent_job_id:
+        remove_chunks(directory)
+        raise RuntimeError(f"Failed to create the OCR job of {item.filename}")
+
+    chunk_items = []
+    for index, (page_start, page_end) in enumerate(ranges):
+        job_id = execute_query(
+            """INSERT INTO ocr_jobs (scanneddata_id, ocr_status, parent_id, chunk_index, chunk_count, page_start, page_end)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (item.db_id, OCRStatus.PENDING.name, parent_job_id, index, len(ranges), page_start, page_end),
+            return_last_id=True
+        )
+        chunk_item = copy.copy(item)
+        chunk_item.chunk = OcrChunk(job_id, parent_job_id, index, len(ranges), page_start, page_end, directory)
+        chunk_item.ocr_db_id = job_id
+        chunk_items.append(chunk_item)
+
+    item.ocr_db_id = parent_job_id
+    logger.info(f"Split {item.filename} ({item.pdf_pages} pages) into {len(ranges)} OCR chunks")
+    return chunk_items
+
+
+def mark_parent_processing(parent_job_id: int):
+    """Move the parent job to ``PROCESSING`` once the first chunk starts."""
+    from scansynclib.sqlite_wrapper import execute_query
+    execute_query(
+        "UPDATE ocr_jobs SET ocr_status = ?, started = DATETIME('now', 'localtime') WHERE id = ? AND ocr_status = ?",
+        (OCRStatus.PROCESSING.name, parent_job_id, OCRStatus.PENDING.name)
+    )
+
+
+def claim_merge(parent_job_id: int) -> bool:
+    """Claim the merge of a split document once none of its chunks is outstanding.
+
+    Returns:
+        bool: ``True`` for exactly one caller, after all chunks finished.
+    """
+    from scansynclib.sqlite_wrapper import execute_query
+
+    outstanding = execute_query(
+        "SELECT COUNT(*) FROM ocr_jobs WHERE parent_id = ? AND ocr_status IN (?, ?)",
+        (parent_job_id, OCRStatus.PENDING.name, OCRStatus.PROCESSING.name),
+        return_scalar=True
+    )
+    if outstanding is None or outstanding > 0:
+        return False
+    claimed = execute_query(
+        "UPDATE ocr_jobs SET ocr_status = ? WHERE id = ? AND ocr_status IN (?, ?)",
+        (OCRStatus.MERGING.name, parent_job_id, OCRStatus.PENDING.name, OCRStatus.PROCESSING.name),
+        return_rowcount=True
+    )
+    return claimed == 1
+
+
+def failed_chunks(parent_job_id: int) -> int:
+    """Return the number of chunks of a split document that did not complete."""
+    from scansynclib.sqlite_wrapper import execute_query
+    return execute_query(
+        "SELECT COUNT(*) FROM ocr_jobs WHERE parent_id = ? AND ocr_status != ?",
+        (parent_job_id, OCRStatus.COMPLETED.name),
+        return_scalar=True
+    ) or 0
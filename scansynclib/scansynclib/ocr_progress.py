@@ -0,0 +1,134 @@
+"""Live per-page progress of running OCR jobs.
+
+ocrmypdf reports the progress of each of its phases (scanning, OCR, PDF/A
+conversion, ...) through a progress bar class provided by a plugin. The OCR
+service installs such a plugin (``ocr_service/ocr_progress_plugin.py``) that
+forwards every update to the :class:`OcrProgress` of the document currently
+processed. Updates are throttled and broadcast as plain dict events on the SSE
+exchange, so the dashboard can show the pages done and an ETA and make jobs
+that stopped progressing visible long before ``tesseract_timeout``.
+"""
+
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+
+from scansynclib.logging import logger
+
+# Type of the SSE event, the web service forwards dict events unchanged.
+EVENT_TYPE = "ocr_progress"
+
+# Minimum seconds between two events of the same document.
+MIN_INTERVAL = 2.0
+
+_lock = threading.Lock()
+_active = None
+
+
+def publish_event(event: dict):
+    """Broadcast ``event`` to the SSE clients of the web service."""
+    # Imported lazily, sqlite_wrapper initializes the database on import.
+    from scansynclib.sqlite_wrapper import SSE_EXCHANGE
+    from scansynclib.rabbitmq import publish_to_exchange
+    if not publish_to_exchange(SSE_EXCHANGE, pickle.dumps(event), exchange_type="fanout", persistent=False):
+        logger.debug(f"Failed to publish OCR progress of document {event.get('id')}")
+
+
+class OcrProgress:
+    """Throttled progress of one ocrmypdf run.
+
+    Args:
+        document_id: ``scanneddata`` id the events are shown for.
+        pages: Number of pages processed by the run.
+        chunk: The :class:`~scansynclib.ocr_fanout.OcrChunk` processed, if the document was split.
+        publish: Callable receiving the events, defaults to :func:`publish_event`.
+        clock: Monotonic clock, replaceable in tests.
+        min_interval: Minimum seconds between two events.
+    """
+    def __init__(self, document_id: int, pages: int, chunk=None, publish=publish_event, clock=time.monotonic, min_interval: float = MIN_INTERVAL):
+        self.document_id = document_id
+        self.pages = pages or 0
+        self.chunk = chunk
+        self.publish = publish
+        self.clock = clock
+        self.min_interval = min_interval
+        self.phase = None
+        self.unit = None
+        self.total = 0
+        self.completed = 0
+        self.phase_started = None
+        self.last_published = None
+
+    def start_phase(self, phase: str, total, unit: str = None):
+        """Begin a new ocrmypdf phase with ``total`` steps."""
+        self.phase = phase
+        self.unit = unit
+        self.total = total or 0
+        self.completed = 0
+        self.phase_started = self.clock()
+        self.last_published = None
+        self._publish()
+
+    def update(self, n: float = 1, completed: float = None):
+        """Advance the current phase by ``n`` steps or set it to ``completed`` steps."""
+        self.completed = completed if completed is not None else self.completed + n
+        now = self.clock()
+        finished = self.total and self.completed >= self.total
+        if finished or self.last_published is None or now - self.last_published >= self.min_interval:
+            self._publish()
+
+    @property
+    def fraction(self) -> float:
+        if not self.total:
+            return 0.0
+        return max(0.0, min(1.0, self.completed / self.total))
+
+    def eta_seconds(self) -> int | None:
+        """Estimate the remaining seconds of the current phase from its rate so far."""
+        fraction = self.fraction
+        if not fraction or self.phase_started is None:
+            return None
+        elapsed = self.clock() - self.phase_started
+        return int(elapsed / fraction * (1 - fraction))
+
+    def event(self) -> dict:
+        """Return the SSE event describing the current progress."""
+        event = dict(
+            type=EVENT_TYPE,
+            id=self.document_id,
+            phase=self.phase,
+            unit=self.unit,
+            fraction=round(self.fraction, 3),
+            pages_done=int(self.fraction * self.pages),
+            pages_total=self.pages,
+            eta_seconds=self.eta_seconds(),
+        )
+        if self.chunk is not None:
+            event.update(chunk_index=self.chunk.index, chunk_count=self.chunk.count)
+        return event
+
+    def _publish(self):
+        self.last_published = self.clock()
+        try:
+            self.publish(self.event())
+        except Exception:
+            logger.exception(f"Failed publishing OCR progress of document {self.document_id}")
+
+
+@contextmanager
+def tracking(progress: OcrProgress):
+    """Make ``progress`` receive the progress bar updates of ocrmypdf runs in this block."""
+    global _active
+    with _lock:
+        _active = progress
+    try:
+        yield progress
+    finally:
+        with _lock:
+            _active = None
+
+
+def active() -> OcrProgress | None:
+    """Return the progress of the ocrmypdf run in progress, if any."""
+    return _active
@@ -0,0 +1,121 @@
+"""Where the OCR service works and where finished OCR files are kept.
+
+ocrmypdf used to write ``*_OCR.pdf`` next to the scan on the volume Samba
+serves, so every intermediate and final write competed with SMB clients and
+the detection and metadata services had to filter the working files out of
+the shares. Now OCR runs in a local scratch directory (tmpfs if it has room
+for the document) and the finished file is moved atomically into the output
+area, from where file naming and upload pick it up.
+"""
+
+import errno
+import glob
+import os
+import shutil
+import tempfile
+
+from scansynclib.config import config
+from scansynclib.logging import logger
+
+OUTPUT_DIR = config.get("ocrOutput.path", "data/ocr-output")
+
+# Empty selects tmpfs if it has room for the document, else the system temp dir.
+SCRATCH_DIR = config.get("ocrScratch.path", "")
+
+TMPFS_DIR = "/dev/shm"
+
+# ocrmypdf keeps several rasterized copies of each page around, so the scratch
+# space needed is a multiple of the input size.
+SCRATCH_FACTOR = 10
+SCRATCH_RESERVE = 256 * 2**20
+
+
+def output_path(share: str, filename_without_extension: str, document_id: int = None) -> str:
+    """Return the path of the OCR file of a scan in the output area.
+
+    The ID of the document keeps scans of the same name apart, e.g. from
+    different subfolders of a share.
+    """
+    prefix = f"{document_id}_" if document_id is not None else ""
+    return os.path.join(OUTPUT_DIR, share or "", f"{prefix}{filename_without_extension}_OCR.pdf")
+
+
+def document_outputs(share: str, document_id: int) -> list[str]:
+    """Return the OCR files of a document in the output area, whatever it was renamed to since."""
+    return glob.glob(os.path.join(glob.escape(os.path.join(OUTPUT_DIR, share or "")), f"{document_id}_*_OCR.pdf"))
+
+
+def _free_bytes(path: str) -> int:
+    try:
+        stats = os.statvfs(path)
+    except OSError:
+        return 0
+    return stats.f_bavail * stats.f_frsize
+
+
+def scratch_root(input_size: int = 0) -> str:
+    """Return the directory OCR scratch directories are created in.
+
+    Uses the configured ``ocrScratch.path`` or, if unset, tmpfs when it has
+    room for a document of ``input_size`` bytes.
+    """
+    if SCRATCH_DIR:
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+        return SCRATCH_DIR
+    needed = input_size * SCRATCH_FACTOR + SCRATCH_RESERVE
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK) and _free_bytes(TMPFS_DIR) >= needed:
+        return TMPFS_DIR
+    return tempfile.gettempdir()
+
+
+class ScratchDirectory:
+    """Private working directory of one OCR run, removed by :meth:`cleanup`."""
+    def __init__(self, input_path: str = None):
+        try:
+            input_size = os.path.getsize(input_path) if input_path else 0
+        except OSError:
+            input_size = 0
+        self.path = tempfile.mkdtemp(prefix="scansync_ocr_", dir=scratch_root(input_size))
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+        return False
+
+
+def publish(source: str, destination: str) -> bool:
+    """Move a finished OCR file into the output area atomically.
+
+    Readers of ``destination`` either see the complete file or none. If
+    ``source`` doesn't exist, a stale ``destination`` is removed so it can't be
+    mistaken for the result of this run.
+
+    Returns:
+        bool: Whether ``source`` was published.
+    """
+    if not os.path.exists(source):
+        if os.path.exists(destination):
+            logger.warning(f"Removing stale OCR file {destination}")
+            os.remove(destination)
+        return False
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Scratch and output area are on different file systems. Copy next to
+        # the destination first, renaming within a file system is atomic.
+        partial = destination + ".partial"
+        shutil.copyfile(source, partial)
+        os.replace(partial, destination)
+        os.remove(source)
+    return True
@@ -0,0 +1,188 @@
+"""Run OCR in a supervised child process.
+
+``tesseract_timeout`` only limits single pages, so a pathological document can
+still occupy an OCR replica for hours or exhaust its memory. The OCR service
+therefore runs ocrmypdf through :func:`run_supervised`: the run happens in a
+child process in its own process group, which is killed together with all
+ocrmypdf workers and Tesseract processes once
+
+* the wall-clock deadline scaled by the page count passed,
+* the RSS of the process group exceeds the memory limit, or
+* cancellation of the document was requested from the dashboard.
+
+Cancellation requests are Redis keys (``ocr_cancel:<document id>``), so every
+OCR replica sees them no matter which one processes the document.
+"""
+
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+import redis
+
+from scansynclib.logging import logger
+from scansynclib.ProcessItem import OCRStatus
+
+CANCEL_KEY = "ocr_cancel:{}"
+
+# Cancellation requests of documents that never reach the OCR service expire.
+CANCEL_TTL = 24 * 60 * 60
+
+POLL_INTERVAL = 1.0
+
+
+# OCR statuses of runs the watchdog stopped, see :class:`OcrAborted`.
+ABORTED_STATUSES = frozenset({OCRStatus.TIMEOUT, OCRStatus.MEMORY_LIMIT, OCRStatus.CANCELLED})
+
+
+class OcrAborted(Exception):
+    """The OCR run was stopped by the watchdog, ``status`` tells why."""
+    def __init__(self, status: OCRStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def deadline_for(pages: int, ocr_settings) -> float:
+    """Return the seconds an OCR run of ``pages`` pages may take."""
+    return ocr_settings.timeout_base + ocr_settings.timeout_per_page * max(pages or 0, 1)
+
+
+def _redis():
+    from scansynclib.redis_client import get_redis
+    return get_redis()
+
+
+def request_cancel(document_id: int) -> bool:
+    """Ask the OCR replica processing ``document_id`` to stop."""
+    try:
+        _redis().set(CANCEL_KEY.format(document_id), 1, ex=CANCEL_TTL)
+        return True
+    except redis.RedisError as e:
+        logger.error(f"Failed to request the OCR cancellation of document {document_id}: {e}")
+        return False
+
+
+def cancel_requested(document_id: int) -> bool:
+    """Return whether cancelling the OCR of ``document_id`` was requested."""
+    if document_id is None:
+        return False
+    try:
+        return _redis().get(CANCEL_KEY.format(document_id)) is not None
+    except redis.RedisError as e:
+        logger.warning(f"Could not check the OCR cancellation of document {document_id}: {e}")
+        return False
+
+
+def clear_cancel(document_id: int):
+    """Forget a cancellation request once the document left the OCR service."""
+    if document_id is None:
+        return
+    try:
+        _redis().delete(CANCEL_KEY.format(document_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not clear the OCR cancellation of document {document_id}: {e}")
+
+
+def process_group_rss(pgid: int) -> int:
+    """Return the summed resident memory in bytes of all processes in group ``pgid``."""
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, the fields after it don't.
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            total += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def _run_child(conn, function, args, kwargs, progress, tmpdir):
+    """Entry point of the child process."""
+    os.setsid()
+    # ocrmypdf's work folders end up here and are removed even if the child is killed.
+    os.environ["TMPDIR"] = tmpdir
+    tempfile.tempdir = None
+    try:
+        from scansynclib import ocr_progress
+        with ocr_progress.tracking(progress):
+            result = function(*args, **kwargs)
+        conn.send(("ok", result))
+    except BaseException as e:
+        try:
+            conn.send(("error", e))
+        except Exception:
+            conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+    finally:
+        conn.close()
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+    process.join(5)
+
+
+def run_supervised(function, args=(), kwargs=None, *, deadline: float, rss_limit: int = 0, cancelled=lambda: False,
+                   progress=None, workdir: str = None, rss=process_group_rss, clock=time.monotonic, poll_interval: float = POLL_INTERVAL):
+    """Call ``function(*args, **kwargs)`` in a supervised child process and return its result.
+
+    Exceptions raised by ``function`` are re-raised.
+
+    Args:
+        deadline: Seconds the run may take.
+        rss_limit: Maximum resident memory in bytes of the child and its workers, ``0`` disables the limit.
+        cancelled: Polled while the child runs, returns ``True`` to stop it.
+        progress: :class:`~scansynclib.ocr_progress.OcrProgress` receiving the progress of the run.
+        workdir: Directory the temporary files of the child are created in, defaults to the system temp dir.
+
+    Raises:
+        OcrAborted: The child was killed by the watchdog.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    tmpdir = tempfile.mkdtemp(prefix="scansync_ocr_tmp_", dir=workdir)
+    process = context.Process(target=_run_child, args=(sender, function, args, kwargs or {}, progress, tmpdir))
+    started = clock()
+    process.start()
+    sender.close()
+    try:
+        while True:
+            if receiver.poll(poll_interval):
+                try:
+                    status, value = receiver.recv()
+                except EOFError:
+                    status, value = "error", RuntimeError(f"OCR process exited with code {process.exitcode}")
+                process.join()
+                if status == "error":
+                    raise value
+                return value
+            if not process.is_alive():
+                raise RuntimeError(f"OCR process exited with code {process.exitcode}")
+
+            elapsed = clock() - started
+            if elapsed > deadline:
+                _kill(process)
+                raise OcrAborted(OCRStatus.TIMEOUT, f"OCR exceeded its deadline of {int(deadline)} seconds")
+            if rss_limit:
+                used = rss(process.pid)
+                if used > rss_limit:
+                    _kill(process)
+                    raise OcrAborted(OCRStatus.MEMORY_LIMIT, f"OCR used {used // 2**20} MB, more than the limit of {rss_limit // 2**20} MB")
+            if cancelled():
+                _kill(process)
+                raise OcrAborted(OCRStatus.CANCELLED, "OCR was cancelled")
+    finally:
+        if process.is_alive():
+            _kill(process)
+        receiver.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
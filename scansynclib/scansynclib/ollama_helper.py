@@ -1,11 +1,177 @@
+import json
+import threading
+import time
+from datetime import datetime
+
 import requests
 from tenacity import RetryError, retry, retry_if_exception, stop_after_attempt, wait_random_exponential
 import urllib3
 from scansynclib.ProcessItem import FileNamingStatus, ProcessItem
-from scansynclib.helpers import extract_text, validate_smb_filename
+from scansynclib.helpers import percentile, validate_smb_filename
+from scansynclib import text_store
 from scansynclib.logging import logger
 from scansynclib.sqlite_wrapper import execute_query
 from scansynclib.settings import settings
+from scansynclib import filename_cache, http_clients, metrics, prompt_excerpt
+from scansynclib.circuit_breaker import CircuitBreaker, CircuitOpenError
+from scansynclib.rate_limiter import RateLimiter
+
+
+SYSTEM_PROMPT = (
+    "You are a filename generator. "
+    "Given the content of a PDF, respond with a single, suitable filename only. "
+    "Do not include any explanations or additional text. "
+    "Do not use quotation marks. "
+    "Do not add a file extension. "
+    "The filename must be in the original language of the content. "
+    "Do not mix languages. "
+    "Make the filename safe for SMB: no special characters, only use letters, numbers, and underscores. "
+    "Replace all spaces with underscores. "
+    "Seperate words using underscores, do not use spaces. "
+    "Maximum filename length is 30 characters. "
+    "Return only the filename – nothing else, also no notes."
+)
+
+rate_limiter = RateLimiter("ollama", lambda: (settings.file_naming.requests_per_minute, settings.file_naming.tokens_per_minute))
+
+# Filenames are asked to be at most this long, the rest of a streamed answer isn't read.
+MAX_FILENAME_CHARS = 30
+# Tokens Ollama may generate for a filename.
+MAX_FILENAME_TOKENS = 32
+
+# Seconds the probe of an unreachable Ollama server may take.
+PROBE_TIMEOUT = 5
+
+
+def probe_ollama() -> bool:
+    """Return whether the configured Ollama server answers."""
+    url = f"{settings.file_naming.ollama_server_url}:{settings.file_naming.ollama_server_port}"
+    return http_clients.session("ollama").get(url, timeout=PROBE_TIMEOUT).status_code == 200
+
+
+circuit_breaker = CircuitBreaker(
+    "ollama", probe_ollama, lambda: (settings.file_naming.circuit_failure_threshold, settings.file_naming.circuit_probe_interval)
+)
+
+# The model stays loaded at least this many seconds after a request ...
+MIN_KEEP_ALIVE = 5 * 60
+# ... and, within ollama_keep_alive_max, this factor times the p90 gap between two documents.
+KEEP_ALIVE_FACTOR = 1.5
+# Recent file naming jobs the scan cadence is measured on.
+CADENCE_SAMPLE = 50
+# Seconds the measured keep_alive is reused before the cadence is measured again.
+CADENCE_REFRESH = 600
+
+_keep_alive = {"seconds": None, "measured": 0.0}
+_keep_alive_lock = threading.Lock()
+
+
+def keep_alive_for(gaps: list[float], maximum: int) -> int:
+    """Return the seconds Ollama should keep the model loaded for documents arriving ``gaps`` seconds apart."""
+    usual_gap = percentile(gaps, 90) or 0
+    return int(min(maximum, max(MIN_KEEP_ALIVE, usual_gap * KEEP_ALIVE_FACTOR)))
+
+
+def scan_gaps() -> list[float]:
+    """Return the seconds between the recent file naming jobs."""
+    rows = execute_query("SELECT started FROM file_naming_jobs ORDER BY id DESC LIMIT ?", (CADENCE_SAMPLE,), fetchall=True) or []
+    started = []
+    for row in rows:
+        try:
+            started.append(datetime.fromisoformat(row["started"]))
+        except (TypeError, ValueError):
+            continue
+    started.sort()
+    return [(later - earlier).total_seconds() for earlier, later in zip(started, started[1:])]
+
+
+def keep_alive_seconds() -> int | None:
+    """Return the ``keep_alive`` to send with Ollama requests, ``None`` leaves Ollama's default."""
+    maximum = settings.file_naming.ollama_keep_alive_max * 60
+    if not maximum:
+        return None
+    with _keep_alive_lock:
+        if _keep_alive["seconds"] is None or time.monotonic() - _keep_alive["measured"] > CADENCE_REFRESH:
+            try:
+                _keep_alive["seconds"] = keep_alive_for(scan_gaps(), maximum)
+            except Exception:
+                logger.exception("Failed to measure the scan cadence, keeping the model loaded for the maximum time")
+                _keep_alive["seconds"] = maximum
+            _keep_alive["measured"] = time.monotonic()
+            logger.debug(f"Asking Ollama to keep the model loaded for {_keep_alive['seconds']} seconds")
+        return min(_keep_alive["seconds"], maximum)
+
+
+def record_load_duration(response: dict):
+    """Record the time Ollama spent loading the model for a request.
+
+    Only the last chunk of an answer carries ``load_duration``, streamed
+    answers stopped early don't report it. Their time to the first chunk,
+    which includes loading the model, is recorded by :func:`generate_filename_ollama`.
+    """
+    load_duration = response.get("load_duration")
+    if load_duration:
+        metrics.observe("scansync_ollama_model_load_seconds", load_duration / 1e9, "Time Ollama spent loading the model", model=response.get("model", ""))
+
+
+def read_filename_stream(lines, max_chars: int = MAX_FILENAME_CHARS, on_first_chunk=None) -> tuple[str, dict]:
+    """Read a streamed Ollama answer until the filename is complete.
+
+    Stops at the first line break after the filename, after ``max_chars``
+    characters or at the end of the answer, whichever comes first.
+
+    Args:
+        lines: The NDJSON lines of the streamed response.
+        on_first_chunk (Callable): Called with the first chunk once it arrived.
+
+    Returns:
+        tuple[str, dict]: The filename and the last chunk read, which carries
+        the statistics of the generation if it was read to the end.
+    """
+    text = ""
+    last = {}
+    for line in lines:
+        if not line:
+            continue
+        last = json.loads(line)
+        if on_first_chunk is not None and not text:
+            on_first_chunk(last)
+            on_first_chunk = None
+        text += last.get("response", "")
+        started = text.lstrip()
+        if "\n" in started or len(started) >= max_chars or last.get("done"):
+            break
+    filename = text.strip().split("\n", 1)[0].strip()
+    return filename[:max_chars], last
+
+
+def warm_up_model() -> bool:
+    """Load the configured model into Ollama's memory, so the next document doesn't wait for it.
+
+    Returns:
+        bool: Whether the model is loaded.
+    """
+    model = settings.file_naming.ollama_model
+    if not (settings.file_naming.ollama_server_url and settings.file_naming.ollama_server_port and model):
+        return False
+    url = f"{settings.file_naming.ollama_server_url}:{settings.file_naming.ollama_server_port}/api/generate"
+    # A request without prompt only loads the model.
+    payload = {"model": model, "stream": False}
+    keep_alive = keep_alive_seconds()
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    try:
+        response = http_clients.session("ollama").post(url, json=payload)
+    except requests.RequestException as e:
+        logger.warning(f"Could not warm up Ollama model {model}: {e}")
+        return False
+    if response.status_code != 200:
+        logger.warning(f"Could not warm up Ollama model {model}: {response.status_code} - {response.text}")
+        return False
+    data = response.json()
+    record_load_duration(data)
+    logger.info(f"Ollama model {model} is loaded, took {data.get('load_duration', 0) / 1e9:.1f}s")
+    return True
 
 
 def test_ollama_server(server_url, server_port, model):
@@ -83,7 +249,7 @@ def generate_filename_ollama(item: ProcessItem) -> str:
         return item.filename_without_extension
 
     # Get PDF Text
-    pdf_text = extract_text(item.ocr_file)
+    pdf_text = text_store.get_text(item, keep_pages=True)
 
     if not pdf_text:
         logger.warning("Failed to extract text from PDF. Using default filename.")
@@ -93,37 +259,69 @@ def generate_filename_ollama(item: ProcessItem) -> str:
         )
         return item.filename_without_extension
 
+    # Only the parts of the text that matter for the name, see prompt_excerpt
+    pdf_text = prompt_excerpt.build_excerpt(pdf_text, settings.file_naming.excerpt_budget(settings.file_naming.ollama_model))
+    cache_key = filename_cache.cache_key("ollama", settings.file_naming.ollama_model, SYSTEM_PROMPT, pdf_text)
+    cached_filename = filename_cache.lookup(item.file_naming_db_id, cache_key)
+    if cached_filename:
+        logger.info(f"Using cached filename {cached_filename} for {item.filename}")
+        execute_query(
+            "UPDATE file_naming_jobs SET file_naming_status = ?, success = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+            (FileNamingStatus.COMPLETED.name, True, item.file_naming_db_id)
+        )
+        return cached_filename
+
+    if not circuit_breaker.allow():
+        logger.warning(f"Ollama server is unreachable, keeping the name of {item.filename}")
+        execute_query(
+            "UPDATE file_naming_jobs SET file_naming_status = ?, error_description = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+            (FileNamingStatus.NO_SERVER_CONNECTION.name, FileNamingStatus.NO_SERVER_CONNECTION.value, item.file_naming_db_id)
+        )
+        return item.filename_without_extension
+
     # Send text to Ollama for filename generation
     try:
-        system_prompt = (
-            "You are a filename generator. "
-            "Given the content of a PDF, respond with a single, suitable filename only. "
-            "Do not include any explanations or additional text. "
-            "Do not use quotation marks. "
-            "Do not add a file extension. "
-            "The filename must be in the original language of the content. "
-            "Do not mix languages. "
-            "Make the filename safe for SMB: no special characters, only use letters, numbers, and underscores. "
-            "Replace all spaces with underscores. "
-            "Seperate words using underscores, do not use spaces. "
-            "Maximum filename length is 30 characters. "
-            "Return only the filename – nothing else, also no notes."
-        )
         payload = {
             "model": settings.file_naming.ollama_model,
-            "system": system_prompt,
+            "system": SYSTEM_PROMPT,
             "prompt": pdf_text,
-            "stream": False
+            "stream": settings.file_naming.ollama_streaming,
+            # Bounds the generation if the answer isn't streamed or the model ignores the prompt.
+            # No newline stop sequence, some models start their answer with a line break.
+            "options": {"num_predict": MAX_FILENAME_TOKENS},
         }
+        keep_alive = keep_alive_seconds()
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
         headers = {"Content-Type": "application/json"}
+        # Timed up to the end of the answer, a streamed response only starts with the headers.
+        started = time.perf_counter()
         response = post_to_ollama(payload, headers)
-        logger.debug(f"Ollama response status code: {response.status_code}, response text: {response.text}")
+        logger.debug(f"Ollama response status code: {response.status_code}")
         if response.status_code == 200:
-            new_filename = response.json().get('response', '').strip()
+            if payload["stream"]:
+                def first_chunk(chunk):
+                    metrics.observe(
+                        "scansync_ollama_first_chunk_seconds", time.perf_counter() - started,
+                        "Time until Ollama streamed the first chunk, including loading the model", model=payload["model"]
+                    )
+                try:
+                    new_filename, final_chunk = read_filename_stream(response.iter_lines(), on_first_chunk=first_chunk)
+                finally:
+                    # Closing the connection cancels a generation that is still running.
+                    response.close()
+            else:
+                final_chunk = response.json()
+                new_filename = final_chunk.get('response', '').strip()
+            metrics.observe("scansync_llm_request_seconds", time.perf_counter() - started, "Latency of file naming LLM requests",
+                            provider="ollama", model=payload["model"])
+            logger.debug(f"Ollama response: {new_filename}")
+            record_load_duration(final_chunk)
             if new_filename:
                 logger.info(f"Extracted filename from Ollama response: {new_filename}")
                 sanitized_filename = validate_smb_filename(new_filename)
                 logger.debug(f"Sanitized Ollama filename: {sanitized_filename}")
+                filename_cache.put(cache_key, sanitized_filename)
                 execute_query(
                     "UPDATE file_naming_jobs SET file_naming_status = ?, success = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
                     (FileNamingStatus.COMPLETED.name, True, item.file_naming_db_id)
@@ -168,7 +366,7 @@ def generate_filename_ollama(item: ProcessItem) -> str:
                 (FileNamingStatus.FAILED.name, error_info if error_info else response.text, item.file_naming_db_id)
             )
             return item.filename_without_extension
-    except RetryError as retryerr:
+    except (RetryError, CircuitOpenError) as retryerr:
         logger.error(f"Error connecting to Ollama server: {str(retryerr)}")
         execute_query(
             "UPDATE file_naming_jobs SET file_naming_status = ?, error_description = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
@@ -182,4 +380,15 @@ def generate_filename_ollama(item: ProcessItem) -> str:
        retry=retry_if_exception(is_retryable_exception))
 def post_to_ollama(payload, headers):
     url = f"{settings.file_naming.ollama_server_url}:{settings.file_naming.ollama_server_port}/api/generate"
-    return requests.post(url, json=payload, headers=headers, timeout=120)
+    # Checked before every attempt, so the retries stop once other requests opened the circuit.
+    if not circuit_breaker.allow():
+        raise CircuitOpenError(f"Ollama server {url} is unreachable")
+    rate_limiter.acquire(prompt_excerpt.estimate_tokens(payload.get("system", "") + payload.get("prompt", "")))
+    try:
+        response = http_clients.session("ollama").post(url, json=payload, headers=headers, stream=bool(payload.get("stream")))
+    except requests.exceptions.ConnectionError:
+        # Includes connect timeouts, a slow model answering late isn't a reason to skip Ollama.
+        circuit_breaker.record_failure()
+        raise
+    circuit_breaker.record_success()
+    return response
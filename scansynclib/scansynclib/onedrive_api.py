@@ -7,8 +7,18 @@ import msal
 import requests
 import base64
 from scansynclib.sqlite_wrapper import update_scanneddata_database
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from scansynclib.settings import settings
+from scansynclib import http_clients, metrics
+
+# Graph answers with these status codes when requests are throttled.
+GRAPH_THROTTLING_STATUS_CODES = (429, 503)
+
+
+def _count_graph_response(response, operation: str):
+    """Record Graph API throttling responses."""
+    if response.status_code in GRAPH_THROTTLING_STATUS_CODES:
+        metrics.inc("scansync_graph_throttled_total", 1, "Throttled Microsoft Graph requests", operation=operation, status=str(response.status_code))
 
 
 TOKEN_FILE = '/app/data/token.json'
@@ -99,6 +109,7 @@ def get_access_token():
             msal_app = msal.ConfidentialClientApplication(
                 settings.onedrive.client_id,
                 authority=settings.onedrive.authority,
+                http_client=http_clients.session("graph"),
             )
 
         expires_at = token_data.get("expires_at", 0)
@@ -142,7 +153,7 @@ def get_user_info(refresh=False):
 
     graph_api_url = 'https://graph.microsoft.com/v1.0/me?$select=id,displayName,mail'
     headers = {'Authorization': 'Bearer ' + access_token}
-    response = requests.get(graph_api_url, headers=headers)
+    response = http_clients.session("graph").get(graph_api_url, headers=headers)
 
     if response.status_code == 200:
         logger.debug("User info retrieved successfully")
@@ -173,7 +184,7 @@ def get_user_photo(refresh=False):
 
     graph_api_url = 'https://graph.microsoft.com/v1.0/me/photo/$value'
     headers = {'Authorization': 'Bearer ' + access_token}
-    response = requests.get(graph_api_url, headers=headers)
+    response = http_clients.session("graph").get(graph_api_url, headers=headers)
     if response.status_code == 200:
         logger.debug("User photo retrieved successfully")
         with open(USER_IMAGE_FILE, 'wb') as file:
@@ -197,7 +208,7 @@ def fetch_graph_api_data(endpoint):
             return None
 
         headers = {'Authorization': 'Bearer ' + access_token}
-        response = requests.get(endpoint, headers=headers)
+        response = http_clients.session("graph").get(endpoint, headers=headers)
         logger.debug(f"Fetching data from {endpoint}")
         if response.status_code == 200:
             logger.debug(f"Data retrieved successfully from {endpoint}")
@@ -272,11 +283,15 @@ def upload_small(item: ProcessItem, onedriveitem: OneDriveDestination) -> bool:
         upload_url = f"https://graph.microsoft.com/v1.0/drives/{onedriveitem.remote_drive_id}/items/{onedriveitem.remote_folder_id}:/{item.filename}:/content?@microsoft.graph.conflictBehavior=rename"
         headers = {'Authorization': 'Bearer ' + access_token, 'Content-Type': 'text/plain'}
 
-        with open(item.ocr_file, 'rb') as file:
-            response = requests.put(upload_url, headers=headers, data=file)
+        with metrics.timer("scansync_upload_request_seconds", "Duration of OneDrive upload requests", method="small"):
+            with open(item.ocr_file, 'rb') as file:
+                response = http_clients.session("graph").put(upload_url, headers=headers, data=file)
+        _count_graph_response(response, "upload")
         logger.debug(f"Received response {response.text} with status code {response.status_code} for upload to {upload_url}")
         if response.status_code == 201:
             logger.debug("Upload completed successfully")
+            metrics.inc("scansync_upload_bytes_total", file_size, "Bytes uploaded to OneDrive")
+            onedriveitem.item_id = response.json().get("id")
             webUrl = response.json().get("webUrl")
             if webUrl:
                 logger.debug(f"File is accessible at {webUrl}")
@@ -312,12 +327,13 @@ def upload(item: ProcessItem, onedriveitem: OneDriveDestination) -> bool:
 
         # Create an upload session
         logger.debug(f"Creating upload session for {item.ocr_file} to {upload_session_url}")
-        session_response = requests.post(
+        session_response = http_clients.session("graph").post(
             upload_session_url,
             headers={'Authorization': 'Bearer ' + access_token},
             json={"item": {"@microsoft.graph.conflictBehavior": "rename"}}
         )
 
+        _count_graph_response(session_response, "upload_session")
         if session_response.status_code != 200:
             logger.error(f"Failed to create upload session: {session_response.status_code} - {session_response.text}")
             return False
@@ -344,17 +360,21 @@ def upload(item: ProcessItem, onedriveitem: OneDriveDestination) -> bool:
                 percentage = (end + 1) / file_size * 100
                 logger.debug(f"Uploading {item.filename} chunk {start}-{end} of {file_size} bytes ({percentage:.2f}%)")
                 try:
-                    chunk_response = requests.put(upload_url, headers=headers, data=chunk_data)
+                    with metrics.timer("scansync_upload_request_seconds", "Duration of OneDrive upload requests", method="chunk"):
+                        chunk_response = http_clients.session("graph").put(upload_url, headers=headers, data=chunk_data)
                 except requests.exceptions.RequestException as e:
                     logger.error(f"Request exception during chunk upload: {str(e)}")
                     return False
+                _count_graph_response(chunk_response, "upload_chunk")
 
                 if chunk_response.status_code not in (200, 201, 202):
                     logger.error(f"Failed to upload chunk: {chunk_response.status_code} - {chunk_response.text}")
                     return False
+                metrics.inc("scansync_upload_bytes_total", len(chunk_data), "Bytes uploaded to OneDrive")
                 if chunk_response.status_code == 201:
                     logger.debug("Upload completed successfully")
                     logger.debug(f"Response: {chunk_response.json()}")
+                    onedriveitem.item_id = chunk_response.json().get("id")
                     webUrl = chunk_response.json().get("webUrl")
                     if webUrl:
                         logger.debug(f"File is accessible at {webUrl}")
@@ -372,3 +392,32 @@ def upload(item: ProcessItem, onedriveitem: OneDriveDestination) -> bool:
     except Exception as e:
         logger.exception(f"An unexpected error occurred during upload: {str(e)}")
     return False
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_random_exponential(multiplier=2, min=5, max=60),
+       retry=retry_if_exception_type(requests.exceptions.RequestException), reraise=True)
+def rename_item(drive_id: str, item_id: str, name: str) -> dict | None:
+    """Rename an uploaded file in OneDrive.
+
+    Throttled requests, server errors and connection problems are retried.
+
+    Returns:
+        dict: The renamed drive item with its new ``name`` and ``webUrl``, ``None`` if Graph refused the rename.
+
+    Raises:
+        requests.exceptions.RequestException: The rename still failed after the retries.
+    """
+    access_token = get_access_token()
+    if not access_token:
+        logger.error("No access token available to rename file")
+        return None
+    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}?@microsoft.graph.conflictBehavior=rename"
+    response = http_clients.session("graph").patch(url, headers={'Authorization': 'Bearer ' + access_token}, json={"name": name})
+    _count_graph_response(response, "rename")
+    if response.status_code == 200:
+        logger.debug(f"Renamed item {item_id} to {name}")
+        return response.json()
+    logger.error(f"Failed to rename item {item_id} to {name}: {response.status_code} - {response.text}")
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return None
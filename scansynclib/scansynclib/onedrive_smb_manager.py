@@ -5,10 +5,10 @@ import os
 import shutil
 
 
-def add(smb_name: str, drive_id: str, folder_id: str, onedrive_path: str, web_url: str) -> int:
+def add(smb_name: str, drive_id: str, folder_id: str, onedrive_path: str, web_url: str, priority: int = 0, text_layer_mode: str = "pdfa", ocr_profile: str = None) -> int:
     logger.info("Adding SMB share to database")
-    query = "INSERT INTO smb_onedrive (smb_name, drive_id, folder_id, onedrive_path, web_url) VALUES (?, ?, ?, ?, ?)"
-    db_id = execute_query(query, (smb_name, drive_id, folder_id, onedrive_path, web_url), return_last_id=True)
+    query = "INSERT INTO smb_onedrive (smb_name, drive_id, folder_id, onedrive_path, web_url, priority, text_layer_mode, ocr_profile) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    db_id = execute_query(query, (smb_name, drive_id, folder_id, onedrive_path, web_url, priority, text_layer_mode, ocr_profile), return_last_id=True)
 
     if db_id is None:
         logger.error("Failed to add SMB share to database")
@@ -26,7 +26,7 @@ def add(smb_name: str, drive_id: str, folder_id: str, onedrive_path: str, web_ur
     return db_id
 
 
-def edit(smb_id: int, smb_name: str, drive_id: str, folder_id: str, onedrive_path: str, web_url: str) -> bool:
+def edit(smb_id: int, smb_name: str, drive_id: str, folder_id: str, onedrive_path: str, web_url: str, priority: int = 0, text_layer_mode: str = "pdfa", ocr_profile: str = None) -> bool:
     logger.info(f"Editing SMB share with ID {smb_id} in database")
 
     # get old smb name
@@ -59,8 +59,8 @@ def edit(smb_id: int, smb_name: str, drive_id: str, folder_id: str, onedrive_pat
         logger.debug("SMB name has not changed, no need to rename folder")
 
     # Update the SMB share in the database
-    query = "UPDATE smb_onedrive SET smb_name = ?, drive_id = ?, folder_id = ?, onedrive_path = ?, web_url = ? WHERE id = ?"
-    result = execute_query(query, (smb_name, drive_id, folder_id, onedrive_path, web_url, smb_id))
+    query = "UPDATE smb_onedrive SET smb_name = ?, drive_id = ?, folder_id = ?, onedrive_path = ?, web_url = ?, priority = ?, text_layer_mode = ?, ocr_profile = ? WHERE id = ?"
+    result = execute_query(query, (smb_name, drive_id, folder_id, onedrive_path, web_url, priority, text_layer_mode, ocr_profile, smb_id))
 
     if result is not True:
         logger.error("Failed to edit SMB share in database")
@@ -2,9 +2,12 @@ from openai import OpenAI, AuthenticationError, RateLimitError
 from scansynclib.ProcessItem import FileNamingStatus, ProcessItem
 from scansynclib.logging import logger
 from tenacity import Retrying, RetryError, stop_after_attempt, wait_random_exponential, retry_if_exception_type
-from scansynclib.helpers import validate_smb_filename, extract_text
+from scansynclib.helpers import validate_smb_filename
+from scansynclib import text_store
 from scansynclib.sqlite_wrapper import execute_query
 from scansynclib.settings import settings
+from scansynclib import batch_naming, filename_cache, http_clients, metrics, prompt_excerpt
+from scansynclib.rate_limiter import RateLimiter
 
 
 OPENAI_MODEL = "gpt-4.1-nano"
@@ -12,6 +15,24 @@ TOKEN_FILE = '/app/data/token_openai.json'
 USER_PROFILE_FILE = '/app/data/user_profile_openai.json'
 USER_IMAGE_FILE = '/app/data/user_image_openai.jpeg'
 
+INSTRUCTIONS = (
+    "Identify a suitable filename for the following pdf content. Keep the language of the file name in the original language and do not add any other language. "
+    "Make the filename safe for SMB. Do not add a file extension. Separate words with a underscore. Have a maximum filename length of 30 characters. "
+    "Only return the filename without any additional text."
+)
+
+BATCH_INSTRUCTIONS = (
+    "Identify a suitable filename for each of the following pdf contents. Each content starts with a heading '### Document <number>'. "
+    "Keep the language of each file name in the original language of its document and do not add any other language. "
+    "Make the filenames safe for SMB. Do not add a file extension. Separate words with a underscore. Have a maximum filename length of 30 characters. "
+    "Only return a JSON list of the filenames in the order of the documents, without any additional text."
+)
+
+# Tokens of the answer, counted against the tokens per minute like the prompt.
+RESPONSE_TOKENS = 20
+
+rate_limiter = RateLimiter("openai", lambda: (settings.file_naming.requests_per_minute, settings.file_naming.tokens_per_minute))
+
 
 def test_key(key) -> tuple[int, str]:
     """
@@ -76,7 +97,7 @@ def generate_filename_openai(item: ProcessItem) -> str:
         return item.filename_without_extension
 
     # Get PDF Text
-    pdf_text = extract_text(item.ocr_file)
+    pdf_text = text_store.get_text(item, keep_pages=True)
 
     if not pdf_text:
         logger.warning("Failed to extract text from PDF. Using default filename.")
@@ -86,9 +107,19 @@ def generate_filename_openai(item: ProcessItem) -> str:
         )
         return item.filename_without_extension
 
-    client = OpenAI(
-        api_key=settings.file_naming.openai_api_key,
-    )
+    # Only the parts of the text that matter for the name, see prompt_excerpt
+    pdf_text = prompt_excerpt.build_excerpt(pdf_text, settings.file_naming.excerpt_budget(OPENAI_MODEL))
+    cache_key = filename_cache_key(pdf_text)
+    cached_filename = filename_cache.lookup(item.file_naming_db_id, cache_key)
+    if cached_filename:
+        logger.info(f"Using cached filename {cached_filename} for {item.filename}")
+        execute_query(
+            "UPDATE file_naming_jobs SET file_naming_status = ?, success = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
+            (FileNamingStatus.COMPLETED.name, True, item.file_naming_db_id)
+        )
+        return cached_filename
+
+    client = http_clients.openai_client(settings.file_naming.openai_api_key)
 
     try:
         # Retry logic for OpenAI API calls
@@ -102,15 +133,23 @@ def generate_filename_openai(item: ProcessItem) -> str:
         )
         for attempt in retry_strategy:
             with attempt:
-                openai_filename = client.responses.create(
-                    model=OPENAI_MODEL,
-                    instructions="Identify a suitable filename for the following pdf content. Keep the language of the file name in the original language and do not add any other language. Make the filename safe for SMB. Do not add a file extension. Separate words with a underscore. Have a maximum filename length of 30 characters. Only return the filename without any additional text.",
-                    input=pdf_text,
-                )
+                rate_limiter.acquire(prompt_excerpt.estimate_tokens(INSTRUCTIONS + pdf_text) + RESPONSE_TOKENS)
+                try:
+                    with metrics.timer("scansync_llm_request_seconds", "Latency of file naming LLM requests", provider="openai", model=OPENAI_MODEL):
+                        openai_filename = client.responses.create(
+                            model=OPENAI_MODEL,
+                            instructions=INSTRUCTIONS,
+                            input=pdf_text,
+                        )
+                except RateLimitError:
+                    # Make the other requests and replicas back off as well.
+                    rate_limiter.drain()
+                    raise
         if openai_filename:
             logger.debug(f"Received OpenAI filename: {openai_filename.output_text}")
             sanitized_filename = validate_smb_filename(openai_filename.output_text)
             logger.debug(f"Sanitized OpenAI filename: {sanitized_filename}")
+            filename_cache.put(cache_key, sanitized_filename)
             execute_query(
                 "UPDATE file_naming_jobs SET file_naming_status = ?, success = ?, finished = DATETIME('now', 'localtime') WHERE id = ?",
                 (FileNamingStatus.COMPLETED.name, True, item.file_naming_db_id)
@@ -144,6 +183,43 @@ def generate_filename_openai(item: ProcessItem) -> str:
             (FileNamingStatus.FAILED.name, str(ex), item.file_naming_db_id)
         )
         return item.filename_without_extension
-    finally:
-        # Close the OpenAI client connection
-        client.close()
+
+
+def filename_cache_key(excerpt: str) -> str:
+    """Returns the filename cache key of naming ``excerpt`` with OpenAI, for single and batch requests alike."""
+    return filename_cache.cache_key("openai", OPENAI_MODEL, INSTRUCTIONS, excerpt)
+
+
+def request_filenames_openai(excerpts: list[str]) -> str:
+    """
+    Asks OpenAI for the filenames of several documents at once, see :mod:`scansynclib.batch_naming`.
+
+    Parameters:
+    - excerpts (list[str]): The excerpts of the documents, see :mod:`scansynclib.prompt_excerpt`.
+
+    Returns:
+    - str: The answer, a JSON list of filenames unless the model misbehaved.
+    """
+    prompt = batch_naming.build_prompt(excerpts)
+    client = http_clients.openai_client(settings.file_naming.openai_api_key)
+    retry_strategy = Retrying(
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(multiplier=10, min=10, max=30),
+        retry=retry_if_exception_type(RateLimitError),
+        reraise=True,
+    )
+    for attempt in retry_strategy:
+        with attempt:
+            rate_limiter.acquire(prompt_excerpt.estimate_tokens(BATCH_INSTRUCTIONS + prompt) + RESPONSE_TOKENS * len(excerpts))
+            try:
+                with metrics.timer("scansync_llm_request_seconds", "Latency of file naming LLM requests", provider="openai", model=OPENAI_MODEL):
+                    response = client.responses.create(
+                        model=OPENAI_MODEL,
+                        instructions=BATCH_INSTRUCTIONS,
+                        input=prompt,
+                    )
+            except RateLimitError:
+                rate_limiter.drain()
+                raise
+    logger.debug(f"Received OpenAI batch answer: {response.output_text}")
+    return response.output_text
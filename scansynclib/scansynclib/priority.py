@@ -0,0 +1,51 @@
+from scansynclib.rabbitmq import MAX_PRIORITY
+from scansynclib.settings_schema import PrioritySettings
+
+# Base priorities for the three page count bands. They leave room on both
+# sides so the per-share offset can still move a document up or down.
+PRIORITY_SMALL = 8
+PRIORITY_MEDIUM = 5
+PRIORITY_LARGE = 2
+
+# Allowed range of the per-share priority offset stored in smb_onedrive.
+SHARE_PRIORITY_MIN = -3
+SHARE_PRIORITY_MAX = 3
+
+
+def clamp_share_priority(value) -> int:
+    """Convert a user supplied share priority into a valid offset."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(SHARE_PRIORITY_MIN, min(SHARE_PRIORITY_MAX, value))
+
+
+def compute_priority(pdf_pages: int, share_priority: int = 0, priority_settings: PrioritySettings = None) -> int:
+    """Compute the RabbitMQ message priority of a document.
+
+    Small documents get a high base priority so interactive scans overtake
+    bulk archive scans waiting in the same queue. The share offset is added
+    on top and the result is clamped to ``0 - MAX_PRIORITY``.
+
+    Args:
+        pdf_pages (int): Number of pages of the document. ``0`` (unknown, e.g.
+            an image) is treated as a single page.
+        share_priority (int): Priority offset of the SMB share.
+        priority_settings (PrioritySettings): Page thresholds, defaults apply if omitted.
+
+    Returns:
+        int: The message priority.
+    """
+    if priority_settings is None:
+        priority_settings = PrioritySettings()
+    pages = max(1, pdf_pages or 0)
+
+    if pages <= priority_settings.small_document_pages:
+        base = PRIORITY_SMALL
+    elif pages <= priority_settings.large_document_pages:
+        base = PRIORITY_MEDIUM
+    else:
+        base = PRIORITY_LARGE
+
+    return max(0, min(MAX_PRIORITY, base + clamp_share_priority(share_priority)))
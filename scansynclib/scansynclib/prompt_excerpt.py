@@ -0,0 +1,111 @@
+"""Bounded excerpts of document text for file naming prompts.
+
+A filename is derived from little more than the sender, the subject and the
+date of a document, yet the naming helpers used to send up to 50,000
+characters to the LLM. The prompt size dominates the latency of a local
+Ollama model and the cost of OpenAI. :func:`build_excerpt` keeps the
+document text within a token budget by selecting, in document order,
+
+* the first page, where letters put sender, subject and date,
+* headings,
+* lines with dates or amounts, and
+* sender blocks (company names, addresses, contact lines)
+
+of the remaining pages.
+"""
+
+import math
+import re
+
+# Rough number of characters per token of the BPE tokenizers used by OpenAI
+# and common Ollama models for European languages.
+CHARS_PER_TOKEN = 4
+
+# Share of the budget the first page may use, the rest is for selected lines.
+FIRST_PAGE_SHARE = 0.6
+
+PAGE_SEPARATOR = "\f"
+
+_DATE = re.compile(
+    r"\b(\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}\.? ?(jan|feb|mar|mär|apr|may|mai|jun|jul|aug|sep|oct|okt|nov|dec|dez)[a-zä]*\.? \d{4})\b",
+    re.IGNORECASE,
+)
+_AMOUNT = re.compile(r"(€|\$|£|\bEUR\b|\bUSD\b|\bCHF\b|\bGBP\b)\s?\d|\d[\d.,']*\d\s?(€|\$|£|EUR\b|USD\b|CHF\b|GBP\b)", re.IGNORECASE)
+_SENDER = re.compile(
+    r"\b(GmbH|AG|KG|e\.\s?V\.|Ltd|Inc|LLC|S\.A\.|B\.V\.|SARL|Sp\. z o\.o\.)\b|@|www\.|\b(Tel|Phone|Telefon|Fax|IBAN|USt|VAT)\b|^\s*(From|Von|Absender)\s*:",
+    re.IGNORECASE,
+)
+_POSTAL_ADDRESS = re.compile(r"\b\d{4,5}\s+[A-ZÄÖÜ][a-zäöüß]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of ``text``."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def is_heading(line: str) -> bool:
+    """Return whether ``line`` looks like a heading or subject line."""
+    words = line.split()
+    if not 1 <= len(words) <= 8 or not any(c.isalpha() for c in line):
+        return False
+    letters = [c for c in line if c.isalpha()]
+    return line.endswith(":") or sum(c.isupper() for c in letters) / len(letters) > 0.7 or line.lower().startswith(("subject", "betreff", "re:", "objet"))
+
+
+def is_relevant(line: str) -> bool:
+    """Return whether ``line`` helps choosing a filename."""
+    return bool(is_heading(line) or _DATE.search(line) or _AMOUNT.search(line) or _SENDER.search(line) or _POSTAL_ADDRESS.search(line))
+
+
+def _take(lines: list[str], budget: int) -> tuple[list[str], int]:
+    """Return the leading ``lines`` that fit into ``budget`` tokens and the tokens left.
+
+    The first line that doesn't fit is truncated to the tokens left.
+    """
+    taken = []
+    for line in lines:
+        tokens = estimate_tokens(line) + 1
+        if tokens > budget:
+            if budget > 1:
+                taken.append(line[:(budget - 1) * CHARS_PER_TOKEN])
+                budget = 0
+            break
+        taken.append(line)
+        budget -= tokens
+    return taken, budget
+
+
+def build_excerpt(text: str, max_tokens: int) -> str:
+    """Return an excerpt of ``text`` of at most ``max_tokens`` tokens for a file naming prompt.
+
+    Texts within the budget are returned unchanged. The page breaks (form
+    feeds) of ``text`` tell the first page from the rest, see
+    :func:`~scansynclib.text_store.get_text`. Without them the whole text is
+    treated as the first page.
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text or ""
+    pages = text.split(PAGE_SEPARATOR)
+    first_page = [line.strip() for line in pages[0].splitlines() if line.strip()]
+    excerpt, remaining = _take(first_page, int(max_tokens * FIRST_PAGE_SHARE))
+    remaining += max_tokens - int(max_tokens * FIRST_PAGE_SHARE)
+
+    # Lines of the first page that didn't fit are still candidates.
+    candidates = first_page[len(excerpt):]
+    for page in pages[1:]:
+        candidates.extend(line.strip() for line in page.splitlines() if line.strip())
+    # The full text of a truncated line isn't a candidate either.
+    seen = set(first_page[:len(excerpt)])
+    for line in candidates:
+        if line in seen or not is_relevant(line):
+            continue
+        tokens = estimate_tokens(line) + 1
+        if tokens > remaining:
+            continue
+        excerpt.append(line)
+        seen.add(line)
+        remaining -= tokens
+    if not excerpt:
+        # E.g. a blank first page and nothing relevant after it.
+        return text.strip()[:max_tokens * CHARS_PER_TOKEN]
+    return "\n".join(excerpt)
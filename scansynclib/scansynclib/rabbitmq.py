@@ -25,6 +25,7 @@ import time
 import pika
 import pika.exceptions
 
+from scansynclib import tracing
 from scansynclib.logging import logger
 
 # Host of the RabbitMQ broker. All services run in the same docker network and
@@ -45,6 +46,18 @@ CONNECTION_RETRY_DELAY = 2
 # Delay before a consumer loop retries after the connection was lost.
 RECONNECT_DELAY = 5
 
+# Seconds a worker thread waits for the consumer thread to send its ack.
+ACK_TIMEOUT = 30
+
+# Highest message priority supported by the stage queues. RabbitMQ keeps one
+# internal sub-queue per priority level, so a small range is preferred.
+MAX_PRIORITY = 10
+
+# Stage queues that are declared as priority queues. Small, interactive scans
+# are published with a higher priority so they overtake bulk archive scans
+# that are already waiting in the same queue.
+PRIORITY_QUEUES = ("ocr_queue", "file_naming_queue", "upload_queue")
+
 # Exceptions that indicate the underlying connection/channel is gone and a
 # reconnect should be attempted.
 _CONNECTION_ERRORS = (
@@ -57,6 +70,44 @@ _CONNECTION_ERRORS = (
 )
 
 
+def queue_arguments(queue_name: str) -> dict | None:
+    """Return the ``queue_declare`` arguments for ``queue_name``.
+
+    Stage queues listed in :data:`PRIORITY_QUEUES` are declared with
+    ``x-max-priority``; every other queue keeps the default (no arguments).
+    """
+    if queue_name in PRIORITY_QUEUES:
+        return {"x-max-priority": MAX_PRIORITY}
+    return None
+
+
+def declare_on(channel, queue_name: str, durable: bool = True):
+    """Declare ``queue_name`` on ``channel`` and return the channel to keep using.
+
+    A stage queue that already exists without priority support (e.g. created
+    by an older release) closes the channel with PRECONDITION_FAILED. It is
+    used as a plain FIFO queue instead, on a fresh channel that is returned.
+    """
+    arguments = queue_arguments(queue_name)
+    if not arguments:
+        channel.queue_declare(queue=queue_name, durable=durable)
+        return channel
+    try:
+        channel.queue_declare(queue=queue_name, durable=durable, arguments=arguments)
+        return channel
+    except pika.exceptions.ChannelClosedByBroker as e:
+        if e.reply_code != 406:
+            raise
+    # Priorities take effect once the queue has been deleted and is re-declared.
+    logger.warning(
+        f"Queue '{queue_name}' exists with different arguments, priorities are disabled for it. "
+        "Delete the queue in RabbitMQ to enable priority lanes."
+    )
+    channel = channel.connection.channel()
+    channel.queue_declare(queue=queue_name, passive=True)
+    return channel
+
+
 class RabbitMQClient:
     """A resilient, reusable RabbitMQ connection wrapper.
 
@@ -74,6 +125,8 @@ class RabbitMQClient:
         self._channel = None
         self._declared_queues = set()
         self._declared_exchanges = set()
+        # QoS of every new channel, set by consume().
+        self._prefetch_count = 1
         # BlockingConnection is not thread safe; serialise access so the client
         # can be shared between e.g. Flask request threads.
         self._lock = threading.RLock()
@@ -86,22 +139,29 @@ class RabbitMQClient:
             blocked_connection_timeout=300,
         )
 
-    def _connect(self) -> bool:
-        """Establish the connection, retrying a bounded number of times."""
+    def _connect(self, attempts: int = CONNECTION_ATTEMPTS, timeout: float = None) -> bool:
+        """Establish the connection, retrying a bounded number of times.
+
+        ``timeout`` limits the seconds a single attempt may take.
+        """
         self._close_quietly()
-        for attempt in range(1, CONNECTION_ATTEMPTS + 1):
+        parameters = self._parameters
+        if timeout is not None:
+            parameters.socket_timeout = parameters.stack_timeout = timeout
+        for attempt in range(1, attempts + 1):
             try:
-                self._connection = pika.BlockingConnection(self._parameters)
+                self._connection = pika.BlockingConnection(parameters)
                 self._channel = self._connection.channel()
-                self._channel.basic_qos(prefetch_count=1)
+                self._channel.basic_qos(prefetch_count=self._prefetch_count)
                 # Queues/exchanges must be re-declared on the fresh channel.
                 self._declared_queues.clear()
                 self._declared_exchanges.clear()
                 logger.info(f"Connected to RabbitMQ ({self._name}) on channel {self._channel.channel_number}.")
                 return True
             except _CONNECTION_ERRORS as e:
-                logger.warning(f"RabbitMQ connection attempt {attempt}/{CONNECTION_ATTEMPTS} failed: {e}")
-                time.sleep(CONNECTION_RETRY_DELAY)
+                logger.warning(f"RabbitMQ connection attempt {attempt}/{attempts} failed: {e}")
+                if attempt < attempts:
+                    time.sleep(CONNECTION_RETRY_DELAY)
         logger.critical("Couldn't connect to RabbitMQ.")
         return False
 
@@ -155,16 +215,67 @@ class RabbitMQClient:
                 return True
             return self._connect()
 
+    def _reopen_channel(self):
+        """Open a fresh channel after the broker closed the current one."""
+        self._channel = self._connection.channel()
+        self._channel.basic_qos(prefetch_count=self._prefetch_count)
+
     def declare_queue(self, queue_name: str, durable: bool = True) -> bool:
         with self._lock:
             if not queue_name or queue_name in self._declared_queues:
                 return True
             if not self.ensure_connection():
                 return False
-            self._channel.queue_declare(queue=queue_name, durable=durable)
+            channel = declare_on(self._channel, queue_name, durable)
+            if channel is not self._channel:
+                # The broker closed the channel, the fresh one needs the consumer's QoS.
+                self._channel = channel
+                self._channel.basic_qos(prefetch_count=self._prefetch_count)
             self._declared_queues.add(queue_name)
             return True
 
+    def queue_depth(self, queue_name: str, timeout: float = None) -> int | None:
+        """Return the number of ready messages in ``queue_name``.
+
+        Uses a passive ``queue_declare`` which never creates or modifies the
+        queue. A queue that does not exist yet counts as empty. ``None`` is
+        returned if the broker can't be reached.
+
+        With a ``timeout`` the depth is read with a single attempt that waits
+        at most about that many seconds for the client and the broker, e.g.
+        while answering a request.
+        """
+        if timeout is None:
+            return self._queue_depth(queue_name, attempts=2)
+        if not self._lock.acquire(timeout=timeout):
+            logger.warning(f"RabbitMQ client is busy, skipping the depth of queue '{queue_name}'")
+            return None
+        try:
+            if not self.is_open() and not self._connect(attempts=1, timeout=timeout):
+                return None
+            return self._queue_depth(queue_name, attempts=1)
+        finally:
+            self._lock.release()
+
+    def _queue_depth(self, queue_name: str, attempts: int) -> int | None:
+        with self._lock:
+            for attempt in range(attempts):
+                try:
+                    if not self.ensure_connection():
+                        return None
+                    result = self._channel.queue_declare(queue=queue_name, passive=True)
+                    return result.method.message_count
+                except pika.exceptions.ChannelClosedByBroker as e:
+                    if e.reply_code != 404:
+                        logger.warning(f"Failed to read depth of queue '{queue_name}': {e}")
+                        return None
+                    self._reopen_channel()
+                    return 0
+                except _CONNECTION_ERRORS as e:
+                    logger.warning(f"RabbitMQ queue depth check failed ({e}); reconnecting (attempt {attempt + 1}/{attempts}).")
+                    self._close_quietly()
+            return None
+
     def declare_exchange(self, exchange: str, exchange_type: str = "fanout") -> bool:
         with self._lock:
             if not exchange or exchange in self._declared_exchanges:
@@ -184,6 +295,8 @@ class RabbitMQClient:
         persistent: bool = True,
         declare_queue: bool = True,
         exchange_type: str = None,
+        priority: int = None,
+        headers: dict = None,
     ) -> bool:
         """Publish a message, transparently reconnecting on failure.
 
@@ -195,13 +308,27 @@ class RabbitMQClient:
             persistent: Mark the message as persistent (delivery_mode=2).
             declare_queue: Declare ``queue_name`` before publishing.
             exchange_type: If given, declare ``exchange`` with this type.
+            priority: Optional message priority (0 - :data:`MAX_PRIORITY`).
+            headers: Optional AMQP headers. Messages published to a queue
+                always carry the trace context of the current span.
 
         Returns:
             ``True`` if the message was published, ``False`` otherwise.
         """
         if routing_key is None:
             routing_key = queue_name
-        properties = pika.BasicProperties(delivery_mode=2) if persistent else None
+        if priority is not None:
+            priority = max(0, min(MAX_PRIORITY, int(priority)))
+        if queue_name:
+            headers = tracing.inject_headers(headers)
+        if persistent or priority is not None or headers:
+            properties = pika.BasicProperties(
+                delivery_mode=2 if persistent else None,
+                priority=priority,
+                headers=headers or None,
+            )
+        else:
+            properties = None
 
         with self._lock:
             # Two attempts: the first may fail on a stale connection, the retry
@@ -239,12 +366,17 @@ class RabbitMQClient:
             queue_names: A queue name or list of queue names to declare. The
                 first queue is the one that is actually consumed.
             on_message_callback: The pika message callback.
-            prefetch_count: QoS prefetch count.
+            prefetch_count: QoS prefetch count. Keep this at 1 for priority
+                queues, otherwise already prefetched low priority messages
+                are processed before newly arrived high priority ones.
             auto_ack: Whether to auto-acknowledge messages.
         """
         if isinstance(queue_names, str):
             queue_names = [queue_names]
         consume_queue = queue_names[0]
+        self._prefetch_count = prefetch_count
+        # Record every delivery as a span of the document's trace.
+        traced_callback = tracing.traced_callback(consume_queue, on_message_callback)
 
         while True:
             try:
@@ -256,7 +388,7 @@ class RabbitMQClient:
                     self.declare_queue(queue_name)
                 self._channel.basic_consume(
                     queue=consume_queue,
-                    on_message_callback=on_message_callback,
+                    on_message_callback=traced_callback,
                     auto_ack=auto_ack,
                 )
                 logger.info(f"Consuming from queue '{consume_queue}', waiting for messages...")
@@ -287,18 +419,26 @@ def get_publisher() -> RabbitMQClient:
     return _publisher
 
 
-def publish(queue_name: str, body: bytes, persistent: bool = True) -> bool:
+def publish(queue_name: str, body: bytes, persistent: bool = True, priority: int = None) -> bool:
     """Publish raw ``body`` to ``queue_name`` on the shared connection."""
-    return _publisher.publish(body, queue_name=queue_name, persistent=persistent)
+    return _publisher.publish(body, queue_name=queue_name, persistent=persistent, priority=priority)
 
 
 def forward_to_rabbitmq(queue_name: str, item) -> bool:
     """Serialise ``item`` and forward it to ``queue_name``.
 
     Uses the shared, long-lived publisher connection instead of opening and
-    closing a new connection for every message.
+    closing a new connection for every message. The item's ``priority`` (set
+    by the metadata service) is carried along so it keeps its lane in every
+    stage queue.
     """
-    ok = _publisher.publish(pickle.dumps(item), queue_name=queue_name, persistent=True)
+    ok = _publisher.publish(
+        pickle.dumps(item),
+        queue_name=queue_name,
+        persistent=True,
+        priority=getattr(item, "priority", None),
+        headers=tracing.inject_headers(document_id=getattr(item, "db_id", None)),
+    )
     if ok:
         logger.info(f"Item {getattr(item, 'filename', item)} forwarded to {queue_name}.")
     else:
@@ -306,6 +446,11 @@ def forward_to_rabbitmq(queue_name: str, item) -> bool:
     return ok
 
 
+def queue_depth(queue_name: str, timeout: float = None) -> int | None:
+    """Return the number of ready messages in ``queue_name`` (shared connection)."""
+    return _publisher.queue_depth(queue_name, timeout)
+
+
 def publish_to_exchange(exchange: str, body: bytes, exchange_type: str = "fanout", persistent: bool = False) -> bool:
     """Publish ``body`` to a (declared) exchange on the shared connection."""
     return _publisher.publish(
@@ -328,6 +473,33 @@ def consume(queue_names, on_message_callback, prefetch_count: int = 1, auto_ack:
     client.consume(queue_names, on_message_callback, prefetch_count=prefetch_count, auto_ack=auto_ack)
 
 
+def ack_threadsafe(channel, delivery_tag: int, timeout: float = ACK_TIMEOUT):
+    """Acknowledge a delivery from a thread other than the consumer's.
+
+    pika channels aren't thread safe, so the ack is scheduled on the thread
+    running the connection and awaited.
+
+    Raises:
+        pika.exceptions.AMQPError: The ack failed or the connection is gone.
+    """
+    done = threading.Event()
+    errors = []
+
+    def ack():
+        try:
+            channel.basic_ack(delivery_tag=delivery_tag)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    channel.connection.add_callback_threadsafe(ack)
+    if not done.wait(timeout):
+        raise pika.exceptions.AMQPError(f"Timed out acknowledging delivery {delivery_tag}")
+    if errors:
+        raise errors[0]
+
+
 def connect_rabbitmq(queue_names: list = None, heartbeat: int = DEFAULT_HEARTBEAT):
     """Backwards compatible helper returning a ``(connection, channel)`` tuple.
 
@@ -343,7 +515,7 @@ def connect_rabbitmq(queue_names: list = None, heartbeat: int = DEFAULT_HEARTBEA
             channel = connection.channel()
             if queue_names:
                 for queue_name in queue_names:
-                    channel.queue_declare(queue=queue_name, durable=True)
+                    channel = declare_on(channel, queue_name)
             channel.basic_qos(prefetch_count=1)
             return connection, channel
         except (socket.gaierror, pika.exceptions.AMQPConnectionError):
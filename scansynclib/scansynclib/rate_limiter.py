@@ -0,0 +1,132 @@
+"""Request and token rate limit shared by all file naming replicas.
+
+With several naming requests in flight per replica, and possibly several
+replicas, the OpenAI quota is easily exceeded, and every 429 costs a backoff
+of 10 to 30 seconds. :class:`RateLimiter` keeps two token buckets in Redis,
+one refilled with ``requests_per_minute`` requests and one with
+``tokens_per_minute`` prompt tokens per minute. A request waits until both
+buckets hold enough for it, so all replicas together stay within the quota.
+
+Redis layout:
+
+* ``rate_limit:<name>`` - hash with the ``requests`` and ``tokens`` left in
+  the buckets and the time they were ``updated``.
+"""
+
+import time
+
+import redis
+
+from scansynclib.logging import logger
+
+KEY = "rate_limit:{}"
+
+# Seconds after which an idle bucket is forgotten, it is full again by then anyway.
+BUCKET_TTL = 120
+
+# Longest single sleep while waiting for the buckets to refill.
+MAX_SLEEP = 5.0
+
+
+class RateLimiter:
+    """Token buckets of requests and tokens per minute shared through Redis.
+
+    Args:
+        name: Name of the limited API, e.g. ``"openai"``.
+        limits_source (Callable): Returns the current ``(requests_per_minute,
+            tokens_per_minute)``, ``0`` disables a limit.
+        redis_factory (Callable): Returns the Redis client, defaults to the shared one.
+        clock (Callable): Wall clock shared by the replicas, replaceable in tests.
+        sleep (Callable): Sleep function used while waiting for the buckets.
+    """
+
+    def __init__(self, name: str, limits_source, redis_factory=None, clock=time.time, sleep=time.sleep):
+        self.key = KEY.format(name)
+        self._limits_source = limits_source
+        self._redis_factory = redis_factory
+        self._clock = clock
+        self._sleep = sleep
+
+    def _redis(self):
+        if self._redis_factory is None:
+            from scansynclib.redis_client import get_redis
+            return get_redis()
+        return self._redis_factory()
+
+    @staticmethod
+    def _refill(level, capacity: int, elapsed: float) -> float:
+        if level is None:
+            return float(capacity)
+        return min(float(capacity), float(level) + elapsed * capacity / 60)
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take one request and ``tokens`` tokens from the buckets if both hold enough.
+
+        Returns:
+            float: ``0`` if acquired, otherwise the seconds until the buckets hold enough.
+        """
+        rpm, tpm = self._limits_source()
+        client = self._redis()
+        with client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    now = self._clock()
+                    state = pipe.hgetall(self.key)
+                    elapsed = max(0.0, now - float(state.get("updated", now)))
+                    wait = 0.0
+                    levels = {}
+                    for field, capacity, cost in (("requests", rpm, 1), ("tokens", tpm, tokens)):
+                        if not capacity:
+                            continue
+                        # A request larger than the bucket would never fit, it waits for a full bucket instead.
+                        cost = min(cost, capacity)
+                        level = self._refill(state.get(field), capacity, elapsed)
+                        levels[field] = level - cost
+                        if level < cost:
+                            wait = max(wait, (cost - level) * 60 / capacity)
+                    if wait:
+                        pipe.unwatch()
+                        return wait
+                    pipe.multi()
+                    pipe.hset(self.key, mapping={**levels, "updated": now})
+                    pipe.expire(self.key, BUCKET_TTL)
+                    pipe.execute()
+                    return 0.0
+                except redis.WatchError:
+                    # Another replica took from the buckets in between, retry.
+                    continue
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until one request with ``tokens`` tokens is within the limits.
+
+        Never blocks if Redis is unreachable, the API's own rate limit
+        handling takes over then.
+
+        Returns:
+            float: The seconds waited.
+        """
+        rpm, tpm = self._limits_source()
+        if not rpm and not tpm:
+            return 0.0
+        started = self._clock()
+        try:
+            while True:
+                wait = self.try_acquire(tokens)
+                if not wait:
+                    waited = self._clock() - started
+                    if waited:
+                        logger.debug(f"Waited {waited:.1f}s for the rate limit of {self.key}")
+                    return waited
+                self._sleep(min(wait, MAX_SLEEP))
+        except redis.RedisError as e:
+            logger.warning(f"Rate limit {self.key} unavailable, sending the request anyway: {e}")
+            return self._clock() - started
+
+    def drain(self):
+        """Empty the buckets after the API answered with a rate limit error."""
+        try:
+            self._redis().hset(self.key, mapping={"requests": 0, "tokens": 0, "updated": self._clock()})
+            self._redis().expire(self.key, BUCKET_TTL)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to drain rate limit {self.key}: {e}")
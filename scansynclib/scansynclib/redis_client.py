@@ -0,0 +1,30 @@
+"""Shared Redis connection for helpers that keep cross-service state in Redis."""
+
+import os
+import threading
+
+import redis
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """Return the process-wide Redis client, creating it on first use.
+
+    The connection URL is read from ``REDIS_URL`` (defaults to the ``redis``
+    service of the docker compose setup). The client is thread safe and keeps
+    its own connection pool.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://redis:6379"), decode_responses=True)
+    return _client
+
+
+def set_redis(client):
+    """Replace the shared client, e.g. with a fake in tests."""
+    global _client
+    _client = client
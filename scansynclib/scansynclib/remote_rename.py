@@ -0,0 +1,133 @@
+"""Renaming documents in OneDrive after they were uploaded.
+
+By default a document is uploaded only after file naming finished, so a slow
+LLM delays every document reaching OneDrive. With
+``settings.file_naming.rename_after_upload`` the OCR service forwards the
+document to the upload and the file naming queue at once. The upload uses
+the original name, and once both the upload and the naming are done the
+uploaded files are renamed with a Graph PATCH.
+
+Upload and naming finish in any order, in different services. Each records
+its half in the ``remote_renames`` table and then tries to :func:`claim`
+the rename, which only succeeds once both halves are present and only for
+one of them.
+"""
+
+import json
+import os
+
+from scansynclib.ProcessItem import ProcessItem, ProcessStatus
+from scansynclib.logging import logger
+from scansynclib import metrics
+
+
+def record_filename(item: ProcessItem, filename: str):
+    """Record the name file naming chose for ``item`` and rename it if it is uploaded already."""
+    from scansynclib.sqlite_wrapper import execute_query
+    execute_query(
+        "INSERT INTO remote_renames (scanneddata_id, filename) VALUES (?, ?) "
+        "ON CONFLICT(scanneddata_id) DO UPDATE SET filename = excluded.filename",
+        (item.db_id, filename)
+    )
+    try_rename(item)
+
+
+def record_uploaded(item: ProcessItem):
+    """Record the uploaded files of ``item`` and rename them if it is named already."""
+    from scansynclib.sqlite_wrapper import execute_query
+    remote_items = [
+        {"drive_id": destination.remote_drive_id, "item_id": destination.item_id, "web_url": destination.web_url or ""}
+        for destination in item.OneDriveDestinations
+    ]
+    execute_query(
+        "INSERT INTO remote_renames (scanneddata_id, remote_items) VALUES (?, ?) "
+        "ON CONFLICT(scanneddata_id) DO UPDATE SET remote_items = excluded.remote_items",
+        (item.db_id, json.dumps(remote_items))
+    )
+    try_rename(item)
+
+
+def claim(document_id: int) -> bool:
+    """Claim the rename of a document once it is uploaded and named.
+
+    Returns:
+        bool: ``True`` for exactly one caller, after both halves were recorded.
+    """
+    from scansynclib.sqlite_wrapper import execute_query
+    claimed = execute_query(
+        "UPDATE remote_renames SET claimed = 1 WHERE scanneddata_id = ? AND claimed = 0 AND filename IS NOT NULL AND remote_items IS NOT NULL",
+        (document_id,),
+        return_rowcount=True
+    )
+    return claimed == 1
+
+
+def try_rename(item: ProcessItem) -> bool:
+    """Rename the uploaded files of ``item`` if this caller claims the rename.
+
+    Returns:
+        bool: Whether the files were renamed.
+    """
+    if not claim(item.db_id):
+        return False
+    from scansynclib.sqlite_wrapper import execute_query
+    from scansynclib.onedrive_api import rename_item
+
+    row = execute_query("SELECT filename, remote_items FROM remote_renames WHERE scanneddata_id = ?", (item.db_id,), fetchone=True)
+    filename = row["filename"] + ".pdf"
+    names, web_urls, failed = [], [], 0
+    for destination in json.loads(row["remote_items"]):
+        renamed = None
+        if destination.get("item_id"):
+            try:
+                renamed = rename_item(destination["drive_id"], destination["item_id"], filename)
+            except Exception:
+                logger.exception(f"Failed to rename {destination['item_id']} to {filename}")
+        if renamed:
+            names.append(renamed.get("name", filename))
+            web_urls.append(renamed.get("webUrl") or destination.get("web_url", ""))
+        else:
+            failed += 1
+            web_urls.append(destination.get("web_url", ""))
+
+    error = f"Failed to rename {failed} of {len(web_urls)} uploaded files" if failed else None
+    metrics.inc("scansync_remote_renames_total", 1, "Renames of uploaded files after file naming", result="failed" if failed else "renamed")
+    if not names:
+        # Nothing was renamed, the next record of either half claims the rename again.
+        execute_query("UPDATE remote_renames SET claimed = 0, error_description = ? WHERE scanneddata_id = ?", (error, item.db_id))
+        logger.error(f"{error} of {item.filename}")
+        return False
+    execute_query(
+        "UPDATE remote_renames SET finished = DATETIME('now', 'localtime'), error_description = ? WHERE scanneddata_id = ?",
+        (error, item.db_id)
+    )
+
+    item.filename = names[0]
+    item.filename_without_extension = os.path.splitext(names[0])[0]
+    # Leaves the status alone, the upload may have completed the document already.
+    execute_query(
+        "UPDATE scanneddata SET file_name = ?, web_url = ?, modified = DATETIME('now', 'localtime') WHERE id = ?",
+        (item.filename, ",".join(web_urls), item.db_id)
+    )
+    notify_renamed(item, web_urls)
+    if failed:
+        logger.warning(f"{error} of {item.filename}")
+    else:
+        logger.info(f"Renamed the uploaded files to {item.filename}")
+    return True
+
+
+def notify_renamed(item: ProcessItem, web_urls: list[str]):
+    """Show the new name in the dashboard, with the status the document has now.
+
+    The item may come from file naming, whose status predates the upload.
+    """
+    from scansynclib.sqlite_wrapper import execute_query, notify_sse_clients
+    row = execute_query("SELECT file_status FROM scanneddata WHERE id = ?", (item.db_id,), fetchone=True)
+    try:
+        item.status = ProcessStatus(row["file_status"])
+    except (TypeError, ValueError):
+        pass
+    for destination, web_url in zip(item.OneDriveDestinations or [], web_urls):
+        destination.web_url = web_url
+    notify_sse_clients(item)
@@ -0,0 +1,356 @@
+"""Deterministic filenames from rules, tried before asking an LLM.
+
+Most scanned letters are named after little more than their date, their
+sender and what kind of document they are. These are usually recognizable
+without a language model, which costs seconds per document with a local Ollama
+model and money with OpenAI. :func:`suggest` derives a filename from
+
+* the per-share templates of ``settings.file_naming.naming_rules``, regular
+  expressions whose named groups fill a filename template,
+* the document date, normalized to ``YYYY-MM-DD``,
+* the sender, recognized by its legal form or by the senders learned from
+  earlier documents of the same share (``sender_vocabulary`` table), and
+* the document type, recognized by keywords.
+
+Every rule in :data:`RULES` returns a :class:`Suggestion` with a confidence
+between 0 and 1. The file naming service only asks the LLM if the best
+suggestion is less confident than ``rules_min_confidence``. Names the LLM
+chose are fed back through :func:`learn`, so the vocabulary of a share grows
+with every document.
+"""
+
+import re
+from datetime import date
+
+from scansynclib.logging import logger
+from scansynclib.helpers import validate_smb_filename
+from scansynclib import metrics
+
+# Lines at the top of the first page searched for the date, sender and type.
+HEADER_LINES = 25
+
+# Documents of a share a sender has to appear in before it counts as known.
+MIN_SENDER_HITS = 2
+
+# Learned senders appearing in more than this share of a share's documents are
+# ignored, a name in nearly every letter is the recipient's, not a sender's.
+MAX_SENDER_SHARE = 0.6
+# Documents a share needs before MAX_SENDER_SHARE applies.
+MIN_SHARE_DOCUMENTS = 5
+
+# Confidence contributed by each part of a composed filename.
+DATE_WEIGHT = 0.35
+KNOWN_SENDER_WEIGHT = 0.4
+SENDER_WEIGHT = 0.2
+TYPE_WEIGHT = 0.25
+
+# Applies to the rules of all shares.
+ALL_SHARES = "*"
+
+MONTHS = {
+    "jan": 1, "januar": 1, "january": 1, "jänner": 1,
+    "feb": 2, "februar": 2, "february": 2,
+    "mar": 3, "mär": 3, "märz": 3, "march": 3,
+    "apr": 4, "april": 4,
+    "may": 5, "mai": 5,
+    "jun": 6, "juni": 6, "june": 6,
+    "jul": 7, "juli": 7, "july": 7,
+    "aug": 8, "august": 8,
+    "sep": 9, "sept": 9, "september": 9,
+    "oct": 10, "okt": 10, "oktober": 10, "october": 10,
+    "nov": 11, "november": 11,
+    "dec": 12, "dez": 12, "dezember": 12, "december": 12,
+}
+_MONTH = "|".join(sorted((re.escape(name) for name in MONTHS), key=len, reverse=True))
+
+# (pattern, order of the day, month and year groups)
+_DATE_FORMATS = (
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), ("year", "month", "day")),
+    (re.compile(r"\b(\d{1,2})\.\s?(\d{1,2})\.\s?(\d{4}|\d{2})\b"), ("day", "month", "year")),
+    (re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b"), ("day", "month", "year")),
+    (re.compile(rf"\b(\d{{1,2}})\.?\s+({_MONTH})\.?\s+(\d{{4}})\b", re.IGNORECASE), ("day", "month", "year")),
+    (re.compile(rf"\b({_MONTH})\.?\s+(\d{{1,2}}),?\s+(\d{{4}})\b", re.IGNORECASE), ("month", "day", "year")),
+)
+_DATE_LABEL = re.compile(r"\b(datum|date|dated|vom|den|stand)\b", re.IGNORECASE)
+# Dates that are never the date of the document itself.
+_OTHER_DATE_LABEL = re.compile(r"\b(geburtsdatum|geboren|date of birth|born|fällig|zahlbar|due|bis|until|valid)\b", re.IGNORECASE)
+
+_LEGAL_FORM = re.compile(
+    r"[\s,]+(GmbH\s*&\s*Co\.?\s*KG|GmbH|gGmbH|AG|KGaA|KG|OHG|UG(\s*\(haftungsbeschränkt\))?|e\.\s?V\.|SE|Ltd\.?|Inc\.?|LLC|plc|S\.A\.|B\.V\.|SARL|Sp\. z o\.o\.)(?=$|[\s,.])",
+    re.IGNORECASE,
+)
+_SENDER_LABEL = re.compile(r"^\s*(From|Von|Absender)\s*:\s*(.+)$", re.IGNORECASE)
+# First line of the recipient's address block.
+_RECIPIENT = re.compile(r"^\s*(Herrn?|Frau|Familie|Eheleute|An|z\.\s?Hd\.?|Mr\.?|Mrs\.?|Ms\.?|Miss|Attn\.?|To)(\s|:|$)", re.IGNORECASE)
+# Lines of an address block after the name, e.g. street and city.
+ADDRESS_LINES = 2
+
+# (filename part, keywords), searched in the header. The label keeps the
+# language of the keyword, like the LLM keeps the language of the document.
+DOCUMENT_TYPES = (
+    ("Kontoauszug", ("kontoauszug",)),
+    ("Bank_Statement", ("bank statement", "account statement", "statement of account")),
+    ("Lohnabrechnung", ("lohnabrechnung", "gehaltsabrechnung", "entgeltabrechnung", "verdienstabrechnung")),
+    ("Payslip", ("payslip", "pay slip", "salary statement")),
+    ("Mahnung", ("mahnung", "zahlungserinnerung")),
+    ("Payment_Reminder", ("payment reminder", "overdue notice")),
+    ("Gutschrift", ("gutschrift",)),
+    ("Credit_Note", ("credit note",)),
+    ("Rechnung", ("rechnung",)),
+    ("Invoice", ("invoice",)),
+    ("Angebot", ("angebot", "kostenvoranschlag")),
+    ("Quote", ("quotation",)),
+    ("Kündigung", ("kündigung",)),
+    ("Vertrag", ("vertrag",)),
+    ("Contract", ("contract", "agreement")),
+    ("Bescheid", ("bescheid",)),
+    ("Lieferschein", ("lieferschein",)),
+    ("Delivery_Note", ("delivery note", "packing slip")),
+    ("Quittung", ("quittung", "kassenbon")),
+    ("Receipt", ("receipt",)),
+)
+_DOCUMENT_TYPES = tuple(
+    (label, re.compile(r"\b(" + "|".join(re.escape(keyword) for keyword in keywords) + r")", re.IGNORECASE))
+    for label, keywords in DOCUMENT_TYPES
+)
+
+
+def _settings():
+    from scansynclib.settings import settings
+    return settings.file_naming
+
+
+class Suggestion:
+    """A filename proposed by a rule.
+
+    Args:
+        filename: The proposed filename without extension.
+        confidence: How likely the filename matches what a user would choose, from 0 to 1.
+        rule: Name of the rule that proposed it.
+    """
+    def __init__(self, filename: str, confidence: float, rule: str):
+        self.filename = filename
+        self.confidence = confidence
+        self.rule = rule
+
+    def __repr__(self):
+        return f"Suggestion({self.filename!r}, {self.confidence:.2f}, {self.rule!r})"
+
+
+def header(text: str) -> list[str]:
+    """Return the non-empty lines at the top of the first page of ``text``."""
+    first_page = text.split("\f", 1)[0]
+    return [line.strip() for line in first_page.splitlines() if line.strip()][:HEADER_LINES]
+
+
+def parse_date(line: str) -> date | None:
+    """Return the first plausible date in ``line``."""
+    for pattern, order in _DATE_FORMATS:
+        for match in pattern.finditer(line):
+            parts = dict(zip(order, match.groups()))
+            month = parts["month"]
+            month = int(month) if month.isdigit() else MONTHS[month.lower()]
+            year = int(parts["year"])
+            if year < 100:
+                year += 2000 if year <= date.today().year % 100 else 1900
+            try:
+                found = date(year, month, int(parts["day"]))
+            except ValueError:
+                continue
+            if 1990 <= found.year <= date.today().year + 1:
+                return found
+    return None
+
+
+def extract_date(lines: list[str]) -> date | None:
+    """Return the date of the document, preferring dates labeled as such."""
+    first = None
+    for line in lines:
+        if _OTHER_DATE_LABEL.search(line):
+            continue
+        found = parse_date(line)
+        if found is None:
+            continue
+        if _DATE_LABEL.search(line):
+            return found
+        first = first or found
+    return first
+
+
+def sender_lines(lines: list[str]) -> list[str]:
+    """Return ``lines`` without the recipient's address block."""
+    kept = []
+    skip = 0
+    for line in lines:
+        if _RECIPIENT.match(line):
+            skip = ADDRESS_LINES + 1
+        if skip:
+            skip -= 1
+            continue
+        kept.append(line)
+    return kept
+
+
+def sender_candidates(lines: list[str]) -> list[str]:
+    """Return the names of companies and organisations in ``lines``, without their legal form."""
+    candidates = []
+    for line in lines:
+        labeled = _SENDER_LABEL.match(line)
+        if labeled:
+            line = labeled.group(2)
+        elif not _LEGAL_FORM.search(line):
+            continue
+        # Addresses often follow the name on the same line.
+        name = _LEGAL_FORM.split(line)[0].split(",")[0]
+        name = " ".join(re.sub(r"[^\w&.\- ]", " ", name).split())
+        if 2 <= len(name) <= 40 and any(c.isalpha() for c in name) and name not in candidates:
+            candidates.append(name)
+    return candidates
+
+
+def document_type(lines: list[str]) -> str | None:
+    """Return the filename part of the first document type found in ``lines``."""
+    best = None
+    for label, pattern in _DOCUMENT_TYPES:
+        for index, line in enumerate(lines):
+            if pattern.search(line):
+                if best is None or index < best[0]:
+                    best = (index, label)
+                break
+    return best[1] if best else None
+
+
+def known_senders(share: str) -> dict[str, int]:
+    """Return the learned senders of ``share`` with the number of documents they appeared in.
+
+    Senders found in too many of the share's documents are left out, see :data:`MAX_SENDER_SHARE`.
+    """
+    # Imported lazily, sqlite_wrapper initializes the database on import.
+    from scansynclib.sqlite_wrapper import execute_query
+    documents = execute_query("SELECT documents FROM sender_vocabulary_documents WHERE share = ?", (share or "",), return_scalar=True) or 0
+    rows = execute_query("SELECT sender, hits FROM sender_vocabulary WHERE share = ?", (share or "",), fetchall=True) or []
+    return {
+        row["sender"]: row["hits"] for row in rows
+        if documents < MIN_SHARE_DOCUMENTS or row["hits"] <= documents * MAX_SENDER_SHARE
+    }
+
+
+def find_sender(lines: list[str], vocabulary: dict[str, int]) -> tuple[str | None, bool]:
+    """Return the sender of the document and whether it is a known sender of the share."""
+    lines = sender_lines(lines)
+    haystack = "\n".join(lines).lower()
+    known = [
+        (hits, sender) for sender, hits in vocabulary.items()
+        if hits >= MIN_SENDER_HITS and re.search(rf"\b{re.escape(sender.lower())}\b", haystack)
+    ]
+    if known:
+        return max(known)[1], True
+    candidates = sender_candidates(lines)
+    return (candidates[0] if candidates else None), False
+
+
+def compose(found_date: date | None, sender: str | None, doc_type: str | None) -> str:
+    """Return the filename of the parts that were found."""
+    parts = [found_date.isoformat() if found_date else None, sender.replace(" ", "_") if sender else None, doc_type]
+    return validate_smb_filename("_".join(part for part in parts if part))
+
+
+def template_rule(text: str, share: str, context: dict) -> Suggestion | None:
+    """Apply the first matching naming rule configured for ``share`` or all shares."""
+    rules = _settings().naming_rules
+    for rule in rules.get(share, []) + rules.get(ALL_SHARES, []):
+        try:
+            match = re.search(rule.pattern, text, re.IGNORECASE | re.MULTILINE)
+        except re.error as e:
+            logger.warning(f"Invalid naming rule {rule.pattern!r} of share {share}: {e}")
+            continue
+        if not match:
+            continue
+        fields = {**context, **{key: value for key, value in match.groupdict().items() if value}}
+        try:
+            filename = rule.template.format(**fields)
+        except (KeyError, IndexError, ValueError):
+            # The template needs a part that wasn't found in this document.
+            logger.debug(f"Naming rule {rule.pattern!r} matched, but its template {rule.template!r} could not be filled")
+            continue
+        return Suggestion(validate_smb_filename(filename), 1.0, "template")
+    return None
+
+
+def composed_rule(text: str, share: str, context: dict) -> Suggestion | None:
+    """Compose the filename of date, sender and document type."""
+    if not any(context.values()):
+        return None
+    confidence = (
+        (DATE_WEIGHT if context["date"] else 0)
+        + (KNOWN_SENDER_WEIGHT if context["known_sender"] else SENDER_WEIGHT if context["sender"] else 0)
+        + (TYPE_WEIGHT if context["type"] else 0)
+    )
+    return Suggestion(compose(context["parsed_date"], context["sender"], context["type"]), round(confidence, 2), "composed")
+
+
+# Tried in order, the first suggestion above the confidence threshold wins.
+RULES = [template_rule, composed_rule]
+
+
+def suggest(text: str, share: str) -> Suggestion | None:
+    """Return the most confident filename the rules derive from ``text``, if any."""
+    if not text:
+        return None
+    lines = header(text)
+    found_date = extract_date(lines)
+    sender, known = find_sender(lines, known_senders(share))
+    context = {
+        "parsed_date": found_date,
+        "date": found_date.isoformat() if found_date else "",
+        "year": str(found_date.year) if found_date else "",
+        "month": f"{found_date.month:02d}" if found_date else "",
+        "sender": sender or "",
+        "known_sender": known,
+        "type": document_type(lines) or "",
+    }
+    threshold = _settings().rules_min_confidence
+    best = None
+    for rule in RULES:
+        suggestion = rule(text, share, context)
+        if suggestion is None:
+            continue
+        if best is None or suggestion.confidence > best.confidence:
+            best = suggestion
+        if best.confidence >= threshold:
+            break
+    if best:
+        logger.debug(f"Rules suggest {best}")
+        metrics.observe("scansync_rule_namer_confidence", best.confidence, "Confidence of filenames suggested by rules", rule=best.rule)
+    return best
+
+
+def learn(share: str, text: str, filename: str):
+    """Add the sender of a named document to the vocabulary of ``share``.
+
+    Only organisations of the header outside the recipient's address block
+    (see :func:`sender_candidates`) are learned, and only those ``filename``
+    agrees with, so a sender the LLM didn't name isn't learned either.
+    """
+    if not text:
+        return
+    from scansynclib.sqlite_wrapper import execute_query
+    execute_query(
+        "INSERT INTO sender_vocabulary_documents (share, documents) VALUES (?, 1) "
+        "ON CONFLICT(share) DO UPDATE SET documents = documents + 1",
+        (share or "",)
+    )
+    filename_words = {word.lower() for word in re.split(r"[_\s\-]+", filename or "") if word}
+    senders = [
+        sender for sender in sender_candidates(sender_lines(header(text)))
+        if any(word.lower() in filename_words for word in sender.split())
+    ]
+    if not senders:
+        return
+    for sender in senders:
+        execute_query(
+            "INSERT INTO sender_vocabulary (share, sender, hits) VALUES (?, ?, 1) "
+            "ON CONFLICT(share, sender) DO UPDATE SET hits = hits + 1, last_seen = DATETIME('now', 'localtime')",
+            (share or "", sender)
+        )
+    logger.debug(f"Learned senders {senders} for share {share}")
@@ -102,6 +102,7 @@ class SettingsManager:
         self._pubsub.subscribe(REDIS_CHANNEL)
         self._lock = threading.Lock()
         self._stopping = False
+        self._listeners = []
 
         raw = self._redis.get(REDIS_KEY)
         if raw:
@@ -168,6 +169,17 @@ class SettingsManager:
             self._redis.publish(REDIS_CHANNEL, "update")
         logger.debug("Settings updated and published to Redis.")
 
+    def add_listener(self, callback):
+        """Call ``callback()`` after settings changed by any service were reloaded."""
+        self._listeners.append(callback)
+
+    def _notify_listeners(self):
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception:
+                logger.exception(f"Settings listener {callback} failed")
+
     def _listen_pubsub(self):
         try:
             for message in self._pubsub.listen():
@@ -179,6 +191,7 @@ class SettingsManager:
                         raw = self._redis.get(REDIS_KEY)
                         if raw:
                             self.settings.update_from_json(raw)
+                    self._notify_listeners()
         except (redis.exceptions.ConnectionError, redis.exceptions.RedisError,
                 ValueError, OSError) as e:
             # ValueError / OSError happen when the pubsub socket is closed
@@ -1,6 +1,6 @@
 from enum import Enum
-from typing import Annotated
-from pydantic import BaseModel, Field
+from typing import Annotated, Literal
+from pydantic import BaseModel, Field, model_validator
 
 
 class FileNamingMethod(Enum):
@@ -10,6 +10,16 @@ class FileNamingMethod(Enum):
     NONE = "none"
 
 
+class NamingRule(BaseModel):
+    """A filename template applied to documents matching a regular expression, see :mod:`scansynclib.rule_namer`."""
+
+    pattern: str = Field(..., description="Regular expression searched in the document text")
+    """Regular expression searched case-insensitively in the document text. Its named groups are available in the template."""
+
+    template: str = Field(..., description="Filename template, e.g. '{date}_Stadtwerke_{customer}'")
+    """Filename template filled with the named groups of ``pattern`` and ``date``, ``year``, ``month``, ``sender`` and ``type``."""
+
+
 class FileNamingSettings(BaseModel):
     """Settings for file naming using OpenAI or Ollama."""
 
@@ -27,6 +37,64 @@ class FileNamingSettings(BaseModel):
     ollama_model: str = Field("", description="Ollama model for file naming")
     """Ollama model for file naming, e.g., 'llama2'."""
 
+    concurrency: Annotated[int, Field(strict=True, ge=1, le=32, description="Naming requests a file naming replica runs at once, applies after a restart")] = 4
+    """Documents a file naming replica names concurrently. Read when the service starts."""
+
+    requests_per_minute: Annotated[int, Field(strict=True, ge=0, description="LLM requests per minute of all replicas, 0 disables the limit")] = 0
+    """Requests per minute all file naming replicas together may send to the LLM, see :mod:`scansynclib.rate_limiter`."""
+
+    tokens_per_minute: Annotated[int, Field(strict=True, ge=0, description="Prompt tokens per minute of all replicas, 0 disables the limit")] = 0
+    """Prompt tokens per minute all file naming replicas together may send to the LLM."""
+
+    batch_size: Annotated[int, Field(strict=True, ge=1, le=50, description="Documents named with one OpenAI request during bulk imports, 1 disables batching")] = 10
+    """Documents named together with one OpenAI request while the naming queue is deep, see :mod:`scansynclib.batch_naming`."""
+
+    batch_queue_threshold: Annotated[int, Field(strict=True, ge=1, description="Depth of the naming queue from which documents are named in batches")] = 50
+    """Waiting documents in ``file_naming_queue`` from which they are named in batches instead of one by one."""
+
+    ollama_streaming: bool = Field(True, description="Stream Ollama answers and stop after the first line")
+    """Whether the Ollama answer is streamed and the generation stopped as soon as the filename is complete."""
+
+    ollama_keep_alive_max: Annotated[int, Field(strict=True, ge=0, description="Maximum minutes Ollama keeps the model loaded between documents, 0 uses Ollama's default")] = 120
+    """Upper bound of the ``keep_alive`` sent to Ollama, which is sized to the usual gap between two scans."""
+
+    circuit_failure_threshold: Annotated[int, Field(strict=True, ge=1, description="Consecutive connection failures after which Ollama is skipped")] = 3
+    """Connection failures in a row after which naming skips Ollama until it is reachable again, see :mod:`scansynclib.circuit_breaker`."""
+
+    circuit_probe_interval: Annotated[int, Field(strict=True, ge=1, description="Seconds between two checks whether Ollama is reachable again")] = 30
+    """Seconds between two probes of an unreachable Ollama server."""
+
+    excerpt_tokens: Annotated[int, Field(strict=True, ge=100, description="Tokens of document text sent to the LLM for naming")] = 1500
+    """Budget of the document excerpt sent to the LLM, see :mod:`scansynclib.prompt_excerpt`."""
+
+    excerpt_tokens_per_model: dict[str, Annotated[int, Field(strict=True, ge=100)]] = Field(default_factory=dict, description="Excerpt budgets overriding excerpt_tokens per model")
+    """Excerpt budgets of single models, e.g. a larger budget for a model with a long context."""
+
+    rename_after_upload: bool = Field(False, description="Upload documents with their original name and rename them in OneDrive once named")
+    """Whether file naming runs next to the upload instead of before it, so a slow LLM doesn't delay documents reaching OneDrive."""
+
+    rules_enabled: bool = Field(False, description="Name documents by rules and only ask the LLM if the rules are unsure")
+    """Whether :mod:`scansynclib.rule_namer` names documents before the LLM is asked. Senders are learned either way, enable it once they are."""
+
+    rules_min_confidence: Annotated[float, Field(ge=0, le=1, description="Confidence from which a filename of the rules is used without the LLM")] = 0.85
+    """Confidence a rule based filename needs to be used, less confident documents are named by the LLM."""
+
+    naming_rules: dict[str, list[NamingRule]] = Field(default_factory=dict, description="Naming rules per share, '*' applies to all shares")
+    """Filename templates per SMB share, tried before the date, sender and type are composed to a filename."""
+
+    cache_enabled: bool = Field(True, description="Reuse generated filenames of documents with the same text")
+    """Whether generated filenames are cached, so repeated documents are named without an LLM request."""
+
+    cache_ttl_days: Annotated[int, Field(strict=True, ge=1, description="Days an unused cached filename is kept")] = 30
+    """Days a cached filename is kept after its last use."""
+
+    cache_max_entries: Annotated[int, Field(strict=True, ge=1, description="Maximum number of cached filenames")] = 10000
+    """Maximum number of cached filenames, the least recently used ones are evicted first."""
+
+    def excerpt_budget(self, model: str) -> int:
+        """Return the token budget of the document excerpt sent to ``model``."""
+        return self.excerpt_tokens_per_model.get(model, self.excerpt_tokens)
+
 
 class OneDriveSettings(BaseModel):
     """Settings for OneDrive integration."""
@@ -41,9 +109,167 @@ class OneDriveSettings(BaseModel):
     """OneDrive scope for permissions, defaulting to read/write access."""
 
 
+class PrioritySettings(BaseModel):
+    """Settings for the priority lanes of the processing queues."""
+
+    small_document_pages: Annotated[int, Field(strict=True, ge=1, description="Documents up to this page count get the highest base priority")] = 5
+    """Documents with up to this many pages are treated as interactive scans."""
+
+    large_document_pages: Annotated[int, Field(strict=True, ge=1, description="Documents above this page count get the lowest base priority")] = 50
+    """Documents with more pages than this are treated as bulk archive scans."""
+
+
+class BackpressureSettings(BaseModel):
+    """Settings for the queue depth based backpressure between the pipeline stages."""
+
+    enabled: bool = Field(True, description="Throttle detection and metadata when downstream queues are deep")
+    """Whether detection and metadata slow down when the downstream queues fill up."""
+
+    throttle_watermark: Annotated[int, Field(strict=True, ge=1, description="Queue depth above which publishing is throttled")] = 50
+    """Queue depth at which new documents are only released in small batches."""
+
+    pause_watermark: Annotated[int, Field(strict=True, ge=1, description="Queue depth above which publishing is paused")] = 200
+    """Queue depth at which no new documents are released at all."""
+
+    resume_watermark: Annotated[int, Field(strict=True, ge=0, description="Queue depth below which a paused pipeline resumes")] = 100
+    """Queue depth a paused pipeline has to drain to before it resumes."""
+
+    throttle_batch_size: Annotated[int, Field(strict=True, ge=1, description="Documents released per scan while throttled")] = 5
+    """Number of documents detection publishes per scan interval while throttled."""
+
+    check_interval: Annotated[int, Field(strict=True, ge=1, description="Seconds between two queue depth checks")] = 5
+    """Seconds the measured queue depths are cached and a paused stage waits between checks."""
+
+    @model_validator(mode="after")
+    def check_watermarks(self):
+        """Throttling has to start before the pause, and a paused stage has to resume below the pause."""
+        if self.throttle_watermark > self.pause_watermark:
+            raise ValueError("throttle_watermark must not be above pause_watermark")
+        if self.resume_watermark >= self.pause_watermark:
+            raise ValueError("resume_watermark must be below pause_watermark")
+        return self
+
+
+class OcrProfile(BaseModel):
+    """A named set of ocrmypdf options, selectable per SMB share."""
+
+    output_type: Literal["pdfa", "pdf"] = Field("pdfa", description="Output format, 'pdfa' for archival or 'pdf'")
+    """Output format of the OCR file. PDF/A conversion costs time but is suited for archiving."""
+
+    optimize: Annotated[int, Field(strict=True, ge=0, le=3, description="ocrmypdf optimization level, 0 disables optimization")] = 2
+    """ocrmypdf optimization level, higher levels produce smaller files but take longer."""
+
+    jpg_quality: Annotated[int, Field(strict=True, ge=1, le=100, description="JPEG quality used when optimizing")] = 80
+    """JPEG quality used by the optimizer."""
+
+    png_quality: Annotated[int, Field(strict=True, ge=1, le=100, description="PNG quality used when optimizing")] = 80
+    """PNG quality used by the optimizer."""
+
+    languages: list[str] = Field(default_factory=lambda: ["eng", "deu"], description="Tesseract languages")
+    """Tesseract language packs to recognize, every additional language slows down OCR."""
+
+    rotate_pages: bool = Field(True, description="Detect and fix the page orientation")
+    """Whether pages are rotated to the correct orientation before OCR."""
+
+    tesseract_timeout: Annotated[int, Field(strict=True, ge=0, description="Seconds Tesseract may spend on one page")] = 120
+    """Seconds Tesseract may spend on a single page."""
+
+    downsample_above_dpi: Annotated[int, Field(strict=True, ge=0, description="Downsample page images above this resolution before OCR, 0 disables downsampling")] = 0
+    """Page images with a higher effective resolution are resampled to ``downsample_to_dpi`` before OCR. ``0`` keeps the original resolution.
+
+    The OCR file is built from the resampled images, so this trades image quality for speed."""
+
+    downsample_to_dpi: Annotated[int, Field(strict=True, ge=72, description="Resolution oversized page images are downsampled to")] = 300
+    """Resolution oversized page images are resampled to, Tesseract gains little above 300 DPI."""
+
+    grayscale_detection: bool = Field(False, description="Convert colour page images without colour content to grayscale before OCR")
+    """Whether colour images that only contain gray tones are converted to grayscale before OCR, the OCR file keeps the gray images."""
+
+    def ocrmypdf_options(self) -> dict:
+        """Return the profile as keyword arguments of ``ocrmypdf.ocr``."""
+        options = dict(
+            output_type=self.output_type,
+            skip_text=True,
+            rotate_pages=self.rotate_pages,
+            optimize=self.optimize,
+            language=list(self.languages),
+            tesseract_timeout=self.tesseract_timeout,
+        )
+        if self.optimize:
+            options.update(jpg_quality=self.jpg_quality, png_quality=self.png_quality)
+        return options
+
+
+def default_ocr_profiles() -> dict[str, OcrProfile]:
+    return {
+        "archival": OcrProfile(),
+        "fast": OcrProfile(output_type="pdf", optimize=0, languages=["eng"], rotate_pages=False, tesseract_timeout=60,
+                           downsample_above_dpi=400, grayscale_detection=True),
+    }
+
+
+class OcrSettings(BaseModel):
+    """Settings for the OCR service and the CPU budget shared by its replicas."""
+
+    cpu_budget: Annotated[int, Field(strict=True, ge=0, description="CPU cores shared by all OCR replicas, 0 uses the physical cores")] = 0
+    """Total number of cores all OCR replicas may use at once. ``0`` uses the physical cores of the host."""
+
+    pages_per_core: Annotated[int, Field(strict=True, ge=1, description="Pages per requested CPU core")] = 4
+    """A document asks for one core per this many pages."""
+
+    max_cores_per_document: Annotated[int, Field(strict=True, ge=0, description="Maximum cores a single document may use, 0 uses half of the budget")] = 0
+    """Upper limit of cores for one document, so a huge scan can't starve the other replicas. ``0`` uses half of the budget."""
+
+    acquire_timeout: Annotated[int, Field(strict=True, ge=1, description="Seconds to wait for a free CPU core before running with a single core")] = 300
+    """Seconds a replica waits for free cores before it runs the document on a single core anyway."""
+
+    fan_out_pages: Annotated[int, Field(strict=True, ge=0, description="Split documents with more pages into OCR chunks, 0 disables splitting")] = 60
+    """Documents with more pages are split into chunks that any OCR replica can process. ``0`` disables splitting."""
+
+    chunk_pages: Annotated[int, Field(strict=True, ge=1, description="Pages per OCR chunk of a split document")] = 20
+    """Number of pages per chunk of a split document."""
+
+    profiles: dict[str, OcrProfile] = Field(default_factory=default_ocr_profiles, description="Named OCR profiles selectable per share")
+    """Named OCR profiles, e.g. a ``fast`` profile for high-volume shares and an ``archival`` one for documents to keep."""
+
+    default_profile: str = Field("archival", description="OCR profile of shares without an own profile")
+    """Name of the profile used for shares that don't select one."""
+
+    watchdog_enabled: bool = Field(True, description="Run OCR in a supervised child process with a deadline and a memory limit")
+    """Run ocrmypdf in a child process that is killed on timeout, memory overuse or cancellation."""
+
+    timeout_base: Annotated[int, Field(strict=True, ge=1, description="Seconds every OCR run may take in addition to its per page allowance")] = 300
+    """Fixed part of the wall-clock deadline of an OCR run."""
+
+    timeout_per_page: Annotated[int, Field(strict=True, ge=1, description="Seconds an OCR run may take per page")] = 30
+    """Per page part of the wall-clock deadline of an OCR run."""
+
+    memory_limit_mb: Annotated[int, Field(strict=True, ge=0, description="Maximum memory of an OCR run in MB, 0 disables the limit")] = 4096
+    """Resident memory of ocrmypdf and its Tesseract processes at which the run is stopped."""
+
+    detect_language: bool = Field(True, description="Detect the document language to load only the needed Tesseract models")
+    """Recognize a low resolution sample of the first page to pick a single language of the profile."""
+
+    language_history_size: Annotated[int, Field(strict=True, ge=0, description="Recent documents of a share used as fallback if detection is uncertain, 0 disables")] = 10
+    """If the sample is inconclusive and this many recent documents of the share agree on a language, that language is used."""
+
+    def profile(self, name: str = None) -> OcrProfile:
+        """Return the profile ``name``, falling back to the default profile and the built-in archival options."""
+        return self.profiles.get(name or self.default_profile) or self.profiles.get(self.default_profile) or OcrProfile()
+
+
 class SettingsSchema(BaseModel):
     file_naming: FileNamingSettings = FileNamingSettings()
     """Settings for file naming, including OpenAI and Ollama configurations."""
 
     onedrive: OneDriveSettings = OneDriveSettings()
     """Settings for OneDrive integration, including client ID and authority URL."""
+
+    priority: PrioritySettings = PrioritySettings()
+    """Settings for the page count based priority of queued documents."""
+
+    backpressure: BackpressureSettings = BackpressureSettings()
+    """Settings for throttling detection and metadata when downstream queues are deep."""
+
+    ocr: OcrSettings = OcrSettings()
+    """Settings for the OCR service, including the CPU budget shared by its replicas."""
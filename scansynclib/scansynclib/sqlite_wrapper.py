@@ -1,10 +1,13 @@
 from contextlib import contextmanager
 import pickle
 import sqlite3
+import sys
+import time
 from scansynclib.config import config
 from scansynclib.logging import logger
-from scansynclib.ProcessItem import ProcessItem, StatusProgressBar
+from scansynclib.ProcessItem import ProcessItem, ProcessStatus, StatusProgressBar
 from scansynclib.rabbitmq import publish_to_exchange
+from scansynclib import metrics, stage_latency
 import os
 
 # Exchange used to broadcast live updates to the web service SSE clients.
@@ -28,7 +31,8 @@ def execute_query(
     fetchone=False,
     fetchall=False,
     return_last_id=False,
-    return_scalar=False
+    return_scalar=False,
+    return_rowcount=False
 ):
     """Executes a SQLite3 query and handles cursor.
 
@@ -39,10 +43,15 @@ def execute_query(
         fetchall (bool, optional): Return all results as list of dicts. Defaults to False.
         return_last_id (bool, optional): Return the last inserted row ID.
         return_scalar (bool, optional): Return the first column of the first row (e.g. for COUNT(*)).
+        return_rowcount (bool, optional): Return the number of rows changed, e.g. to tell if a conditional UPDATE claimed a row.
 
     Returns:
         Query result or None if not fetching.
     """
+    # Label query latency by the calling function, e.g. "ocr_service.main.start_processing"
+    caller = sys._getframe(1)
+    call_site = f"{caller.f_globals.get('__name__', '?')}.{caller.f_code.co_name}"
+    start = time.perf_counter()
     try:
         logger.debug(f"Executing SQL query: {query} with params {params}")
         with db_connection() as conn:
@@ -62,11 +71,16 @@ def execute_query(
             elif return_last_id:
                 logger.debug(f"Returning last row id: {cursor.lastrowid}")
                 return cursor.lastrowid
+            elif return_rowcount:
+                return cursor.rowcount
             else:
                 return True
     except Exception:
         logger.exception("Failed executing SQL query.")
+        metrics.inc("scansync_sqlite_query_errors_total", 1, "Failed SQLite queries by call site", call_site=call_site)
         return None
+    finally:
+        metrics.observe("scansync_sqlite_query_seconds", time.perf_counter() - start, "SQLite query latency by call site", call_site=call_site)
 
 
 def update_scanneddata_database(item: ProcessItem, update_values: dict):
@@ -92,6 +106,12 @@ def update_scanneddata_database(item: ProcessItem, update_values: dict):
             cursor.execute(query, (*update_values.values(), StatusProgressBar().get_progress(item.status), item.db_id))
             logger.debug(f"Updated database scanneddata for id {item.db_id} with values {update_values}")
 
+            # Persist the stage transition and roll up the latency of finished documents
+            if "file_status" in update_values and item.db_id is not None:
+                stage_latency.record_transition(cursor, item.db_id, item.status)
+                if item.status == ProcessStatus.COMPLETED:
+                    stage_latency.rollup_document(cursor, item.db_id)
+
             # Commit the changes and close the connection
             connection.commit()
             notify_sse_clients(item)
@@ -133,6 +153,70 @@ def upgrade_sql_database():
                 logger.info("Migration: Adding 'ocr_status' column to scanneddata table")
                 cursor.execute("ALTER TABLE scanneddata ADD COLUMN ocr_status TEXT")
                 conn.commit()
+
+            if "latency_rolled_up" not in columns:
+                logger.info("Migration: Adding 'latency_rolled_up' column to scanneddata table")
+                cursor.execute("ALTER TABLE scanneddata ADD COLUMN latency_rolled_up INTEGER NOT NULL DEFAULT 0")
+                conn.commit()
+
+            if "detected_language" not in columns:
+                logger.info("Migration: Adding 'detected_language' column to scanneddata table")
+                cursor.execute("ALTER TABLE scanneddata ADD COLUMN detected_language TEXT")
+                conn.commit()
+
+            cursor.execute("PRAGMA table_info(smb_onedrive)")
+            smb_columns = [row[1] for row in cursor.fetchall()]
+
+            if "priority" not in smb_columns:
+                logger.info("Migration: Adding 'priority' column to smb_onedrive table")
+                cursor.execute("ALTER TABLE smb_onedrive ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+                conn.commit()
+
+            if "text_layer_mode" not in smb_columns:
+                logger.info("Migration: Adding 'text_layer_mode' column to smb_onedrive table")
+                cursor.execute("ALTER TABLE smb_onedrive ADD COLUMN text_layer_mode TEXT NOT NULL DEFAULT 'pdfa'")
+                conn.commit()
+
+            if "ocr_profile" not in smb_columns:
+                logger.info("Migration: Adding 'ocr_profile' column to smb_onedrive table")
+                cursor.execute("ALTER TABLE smb_onedrive ADD COLUMN ocr_profile TEXT")
+                conn.commit()
+
+            cursor.execute("PRAGMA table_info(ocr_jobs)")
+            ocr_job_columns = [row[1] for row in cursor.fetchall()]
+
+            for column in ("parent_id", "chunk_index", "chunk_count", "page_start", "page_end"):
+                if column not in ocr_job_columns:
+                    logger.info(f"Migration: Adding '{column}' column to ocr_jobs table")
+                    cursor.execute(f"ALTER TABLE ocr_jobs ADD COLUMN {column} INTEGER")
+                    conn.commit()
+
+            for column, column_type in (("normalized_pages", "INTEGER"), ("bytes_saved", "INTEGER"), ("seconds_saved", "REAL")):
+                if column not in ocr_job_columns:
+                    logger.info(f"Migration: Adding '{column}' column to ocr_jobs table")
+                    cursor.execute(f"ALTER TABLE ocr_jobs ADD COLUMN {column} {column_type}")
+                    conn.commit()
+            # Created here instead of schema.sql, existing databases only get the column above
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ocr_jobs_parent ON ocr_jobs(parent_id)")
+            conn.commit()
+
+            cursor.execute("PRAGMA table_info(file_naming_jobs)")
+            file_naming_columns = [row[1] for row in cursor.fetchall()]
+
+            if "cache_hit" not in file_naming_columns:
+                logger.info("Migration: Adding 'cache_hit' column to file_naming_jobs table")
+                cursor.execute("ALTER TABLE file_naming_jobs ADD COLUMN cache_hit Boolean")
+                conn.commit()
+
+            if "confidence" not in file_naming_columns:
+                logger.info("Migration: Adding 'confidence' column to file_naming_jobs table")
+                cursor.execute("ALTER TABLE file_naming_jobs ADD COLUMN confidence REAL")
+                conn.commit()
+
+            if "batch_id" not in file_naming_columns:
+                logger.info("Migration: Adding 'batch_id' column to file_naming_jobs table")
+                cursor.execute("ALTER TABLE file_naming_jobs ADD COLUMN batch_id INTEGER")
+                conn.commit()
     except sqlite3.OperationalError as e:
         if "no such table: scanneddata" in str(e):
             logger.error("Database schema is missing. Please ensure the schema.sql file is present.")
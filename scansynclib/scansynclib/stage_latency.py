@@ -0,0 +1,237 @@
+"""Per-stage latency of documents, persisted as transitions and hourly rollups.
+
+Every change of a document's ``file_status`` is stored in the
+``status_transitions`` table. Once a document completes, the time it spent in
+each status (e.g. ``ocr_pending`` is the wait in the OCR queue, ``ocr`` the
+OCR itself) is added to the ``stage_latency_hourly`` rollup. Rollups hold a
+fixed-bucket histogram, so percentiles over any time window can be derived
+without scanning the per-document transitions.
+
+Transitions and rollups are written with a cursor of the caller's connection,
+in the same transaction as the status update itself.
+"""
+
+import json
+import time
+
+from scansynclib.ProcessItem import ProcessStatus, StatusProgressBar
+
+# Upper bounds (seconds) of the histogram buckets. The last bucket is open.
+HISTOGRAM_BOUNDS = [1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600, float("inf")]
+
+# Upper bounds (pages) and labels of the page count buckets.
+PAGE_BUCKETS = [(1, "1"), (5, "2-5"), (20, "6-20"), (100, "21-100"), (float("inf"), "100+")]
+
+# Stage name used for the time from detection until completion.
+TOTAL_STAGE = "total"
+
+
+def page_bucket(pages: int) -> str:
+    """Return the page count bucket label for ``pages``."""
+    pages = max(1, pages or 0)
+    for upper, label in PAGE_BUCKETS:
+        if pages <= upper:
+            return label
+    return PAGE_BUCKETS[-1][1]
+
+
+def empty_histogram() -> list[int]:
+    return [0] * len(HISTOGRAM_BOUNDS)
+
+
+def add_to_histogram(counts: list[int], seconds: float):
+    """Count ``seconds`` into the matching bucket of ``counts`` (in place)."""
+    for index, upper in enumerate(HISTOGRAM_BOUNDS):
+        if seconds <= upper:
+            counts[index] += 1
+            return
+
+
+def merge_histograms(target: list[int], source: list[int]):
+    """Add the bucket counts of ``source`` to ``target`` (in place)."""
+    for index, value in enumerate(source[:len(target)]):
+        target[index] += value
+
+
+def histogram_percentile(counts: list[int], pct: float) -> float | None:
+    """Approximate the ``pct`` percentile from histogram bucket counts.
+
+    Values are interpolated linearly inside the bucket. For the open last
+    bucket its lower bound is returned.
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = total * max(0.0, min(100.0, pct)) / 100
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            lower = HISTOGRAM_BOUNDS[index - 1] if index else 0
+            upper = HISTOGRAM_BOUNDS[index]
+            if upper == float("inf"):
+                return float(lower)
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+    return float(HISTOGRAM_BOUNDS[-2])
+
+
+def stage_name(status: str) -> str | None:
+    """Map a stored ``file_status`` value to its stage name, e.g. ``ocr_pending``."""
+    try:
+        return ProcessStatus(status).name.lower()
+    except ValueError:
+        return None
+
+
+def status_durations(transitions) -> dict[str, float]:
+    """Compute the seconds spent in each status from ordered ``(status, at)`` pairs.
+
+    The last status has no duration. The time from the first to the last
+    transition is reported as :data:`TOTAL_STAGE`.
+    """
+    durations = {}
+    transitions = list(transitions)
+    for (status, at), (_, next_at) in zip(transitions, transitions[1:]):
+        stage = stage_name(status)
+        if stage is None:
+            continue
+        durations[stage] = durations.get(stage, 0.0) + max(0.0, next_at - at)
+    if len(transitions) > 1:
+        durations[TOTAL_STAGE] = max(0.0, transitions[-1][1] - transitions[0][1])
+    return durations
+
+
+def record_transition(cursor, document_id: int, status: ProcessStatus, at: float = None):
+    """Store a status transition unless the document is already in ``status``."""
+    at = time.time() if at is None else at
+    cursor.execute(
+        """INSERT INTO status_transitions (scanneddata_id, status, status_code, at)
+           SELECT ?, ?, ?, ?
+           WHERE COALESCE((SELECT status FROM status_transitions WHERE scanneddata_id = ? ORDER BY id DESC LIMIT 1), '') != ?""",
+        (document_id, status.value, StatusProgressBar.get_progress(status), at, document_id, status.value),
+    )
+
+
+def delete_transitions(document_id: int) -> bool:
+    """Delete the transitions of a document, e.g. when the document is deleted. The rollups keep its durations."""
+    if document_id is None:
+        return False
+    from scansynclib.sqlite_wrapper import execute_query
+    return bool(execute_query("DELETE FROM status_transitions WHERE scanneddata_id = ?", (document_id,)))
+
+
+def prune_transitions(before: float) -> int | None:
+    """Delete the transitions before the ``before`` timestamp and return how many were deleted."""
+    from scansynclib.sqlite_wrapper import execute_query
+    return execute_query("DELETE FROM status_transitions WHERE at < ?", (before,), return_rowcount=True)
+
+
+def rollup_document(cursor, document_id: int) -> bool:
+    """Add the stage durations of a completed document to the hourly rollups.
+
+    A document is only rolled up once, even if it is marked completed again.
+
+    Returns:
+        bool: ``True`` if the document was added to the rollups.
+    """
+    cursor.execute("UPDATE scanneddata SET latency_rolled_up = 1 WHERE id = ? AND latency_rolled_up = 0", (document_id,))
+    if cursor.rowcount == 0:
+        return False
+
+    cursor.execute("SELECT local_filepath, pdf_pages FROM scanneddata WHERE id = ?", (document_id,))
+    share, pages = cursor.fetchone() or (None, 0)
+    cursor.execute("SELECT status, at FROM status_transitions WHERE scanneddata_id = ? ORDER BY at, id", (document_id,))
+    transitions = cursor.fetchall()
+    if not transitions:
+        return False
+
+    hour = time.strftime("%Y-%m-%d %H:00", time.localtime(transitions[-1][1]))
+    bucket = page_bucket(pages)
+    for stage, seconds in status_durations(transitions).items():
+        _add_to_rollup(cursor, hour, stage, share or "", bucket, seconds)
+    return True
+
+
+def _add_to_rollup(cursor, hour: str, stage: str, share: str, bucket: str, seconds: float):
+    cursor.execute(
+        "SELECT count, sum_seconds, histogram FROM stage_latency_hourly WHERE hour = ? AND stage = ? AND smb_name = ? AND page_bucket = ?",
+        (hour, stage, share, bucket),
+    )
+    row = cursor.fetchone()
+    if row:
+        count, sum_seconds, histogram = row[0], row[1], json.loads(row[2])
+    else:
+        count, sum_seconds, histogram = 0, 0.0, empty_histogram()
+    add_to_histogram(histogram, seconds)
+    cursor.execute(
+        """INSERT OR REPLACE INTO stage_latency_hourly (hour, stage, smb_name, page_bucket, count, sum_seconds, histogram)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (hour, stage, share, bucket, count + 1, sum_seconds + seconds, json.dumps(histogram)),
+    )
+
+
+def rollup_totals(since: str) -> list[dict] | None:
+    """Return the rollups from the ``since`` hour on, merged per stage, share and page bucket.
+
+    The hours are merged in SQL, so the number of rows doesn't grow with the
+    time window. The rows have the columns :func:`summarize` reads.
+    """
+    from scansynclib.sqlite_wrapper import execute_query
+    totals = execute_query(
+        """SELECT stage, smb_name, page_bucket, SUM(count) AS count, SUM(sum_seconds) AS sum_seconds
+           FROM stage_latency_hourly WHERE hour >= ? GROUP BY stage, smb_name, page_bucket""",
+        (since,),
+        fetchall=True
+    )
+    buckets = execute_query(
+        """SELECT stage, smb_name, page_bucket, bucket.key AS bucket, SUM(bucket.value) AS count
+           FROM stage_latency_hourly, json_each(stage_latency_hourly.histogram) AS bucket
+           WHERE hour >= ? GROUP BY stage, smb_name, page_bucket, bucket.key""",
+        (since,),
+        fetchall=True
+    )
+    if totals is None or buckets is None:
+        return None
+    histograms = {}
+    for row in buckets:
+        histogram = histograms.setdefault((row["stage"], row["smb_name"], row["page_bucket"]), empty_histogram())
+        if row["bucket"] < len(histogram):
+            histogram[row["bucket"]] += row["count"]
+    return [
+        dict(row, histogram=json.dumps(histograms.get((row["stage"], row["smb_name"], row["page_bucket"]), empty_histogram())))
+        for row in totals
+    ]
+
+
+def summarize(rows, group_key: str = None) -> dict:
+    """Merge rollup rows into count, average and p50/p90/p99 per stage.
+
+    Args:
+        rows (list[dict]): Rows of ``stage_latency_hourly``.
+        group_key (str): Optional column (``smb_name`` or ``page_bucket``) to group by first.
+
+    Returns:
+        dict: ``{stage: stats}`` or ``{group: {stage: stats}}`` if ``group_key`` is given.
+    """
+    merged = {}
+    for row in rows:
+        key = (row[group_key], row["stage"]) if group_key else (None, row["stage"])
+        entry = merged.setdefault(key, {"count": 0, "sum_seconds": 0.0, "histogram": empty_histogram()})
+        entry["count"] += row["count"]
+        entry["sum_seconds"] += row["sum_seconds"]
+        merge_histograms(entry["histogram"], json.loads(row["histogram"]))
+
+    result = {}
+    for (group, stage), entry in merged.items():
+        stats = {
+            "count": entry["count"],
+            "avg_seconds": round(entry["sum_seconds"] / entry["count"], 3) if entry["count"] else None,
+        }
+        for pct in (50, 90, 99):
+            value = histogram_percentile(entry["histogram"], pct)
+            stats[f"p{pct}_seconds"] = round(value, 3) if value is not None else None
+        if group_key:
+            result.setdefault(group, {})[stage] = stats
+        else:
+            result[stage] = stats
+    return result
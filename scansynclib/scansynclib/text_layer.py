@@ -0,0 +1,134 @@
+"""Detect documents that already carry a complete text layer.
+
+PDFs printed to a share or produced by scanners with built-in OCR already
+contain text on every page. Running them through a full ``ocrmypdf`` pass only
+costs time, so the OCR service checks the text coverage of each page with
+PyMuPDF first and, depending on the share's :class:`TextLayerMode`, passes
+such documents through or only converts them to PDF/A.
+
+A scanner stamping a date or a page number onto a scan adds a few characters
+of text, but leaves the scanned content without text. So the text has to
+cover a share of the page sized images, not just exist on the page.
+"""
+
+from enum import Enum
+
+from scansynclib.logging import logger
+
+# A page with images needs at least this many characters ...
+MIN_PAGE_CHARS = 20
+# ... and its words have to cover at least this share of the area of its large images.
+MIN_TEXT_COVERAGE = 0.02
+# Images covering at least this share of the page are scans, smaller ones e.g. logos.
+MIN_SCAN_SHARE = 0.25
+
+
+class TextLayerMode(Enum):
+    """How documents with a complete text layer are handled, configured per share.
+
+    OCR: Always run a full OCR pass.
+    PDFA: Skip OCR and only convert the document to PDF/A.
+    PASSTHROUGH: Skip OCR and keep the document as it is.
+    """
+    OCR = "ocr"
+    PDFA = "pdfa"
+    PASSTHROUGH = "passthrough"
+
+
+# From most to least processing, used if a document is shared to several shares.
+_STRICTNESS = [TextLayerMode.OCR, TextLayerMode.PDFA, TextLayerMode.PASSTHROUGH]
+
+
+def parse_mode(value) -> TextLayerMode:
+    """Convert a stored or user supplied mode, defaulting to :attr:`TextLayerMode.PDFA`."""
+    if isinstance(value, TextLayerMode):
+        return value
+    try:
+        return TextLayerMode(value)
+    except ValueError:
+        return TextLayerMode.PDFA
+
+
+def strictest_mode(values) -> TextLayerMode:
+    """Return the mode doing the most processing of ``values``."""
+    modes = [parse_mode(value) for value in values]
+    for mode in _STRICTNESS:
+        if mode in modes:
+            return mode
+    return TextLayerMode.PDFA
+
+
+def page_has_text(chars: int, image_count: int, coverage: float = 1.0) -> bool:
+    """Return whether a page needs no OCR.
+
+    Pages without any image (blank pages or pure vector graphics) have
+    nothing to recognize and count as covered. ``coverage`` is the share of
+    the large images covered by words, see :func:`text_coverage`.
+    """
+    return image_count == 0 or (chars >= MIN_PAGE_CHARS and coverage >= MIN_TEXT_COVERAGE)
+
+
+def _area(rect) -> float:
+    x0, y0, x1, y1 = rect[:4]
+    return max(x1 - x0, 0) * max(y1 - y0, 0)
+
+
+def _intersection(a, b) -> float:
+    return _area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+
+
+def text_coverage(word_rects, image_rects) -> float:
+    """Return the share of the area of ``image_rects`` covered by ``word_rects``.
+
+    Rects are ``(x0, y0, x1, y1)`` tuples, words may carry more entries like
+    those of PyMuPDF's ``get_text("words")``. Without images the page counts
+    as covered.
+    """
+    image_area = sum(_area(rect) for rect in image_rects)
+    if not image_area:
+        return 1.0
+    covered = sum(max(_intersection(word, image) for image in image_rects) for word in word_rects)
+    return min(covered / image_area, 1.0)
+
+
+def scan_rects(page) -> list[tuple]:
+    """Return the rects of the images of a PyMuPDF ``page`` large enough to be scans."""
+    page_area = _area(tuple(page.rect))
+    rects = []
+    for image in page.get_images(full=True):
+        for rect in page.get_image_rects(image[0]):
+            rect = tuple(rect)
+            if page_area and _area(rect) >= page_area * MIN_SCAN_SHARE:
+                rects.append(rect)
+    return rects
+
+
+def read_text_layer(pdf_path: str) -> str | None:
+    """Return the text of ``pdf_path`` if every page already has a text layer.
+
+    Pages are separated by form feeds like in the ocrmypdf sidecar.
+
+    Returns:
+        str | None: The text, or ``None`` if at least one page needs OCR or the
+        file can't be inspected.
+    """
+    try:
+        import pymupdf
+    except ImportError:
+        logger.warning("PyMuPDF is not installed, can't detect documents with an existing text layer.")
+        return None
+
+    try:
+        with pymupdf.open(pdf_path) as document:
+            texts = []
+            for page in document:
+                text = page.get_text()
+                coverage = text_coverage(page.get_text("words"), scan_rects(page))
+                if not page_has_text(len(text.strip()), len(page.get_images()), coverage):
+                    logger.debug(f"Page {page.number + 1} of {pdf_path} has no text layer, {coverage:.1%} of its scans have text")
+                    return None
+                texts.append(text)
+            return "\f".join(texts) if texts else None
+    except Exception as e:
+        logger.debug(f"Could not inspect the text layer of {pdf_path}: {e}")
+        return None
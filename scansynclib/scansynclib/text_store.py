@@ -0,0 +1,113 @@
+"""Text of OCR'd documents, stored once and shared by all consumers.
+
+The OCR service asks ocrmypdf for a plain text sidecar while it OCRs a
+document anyway. The text is compressed and stored in the ``document_text``
+table, so verifying the OCR result, generating a filename or any other
+consumer of the document text no longer has to parse the PDF with pypdf.
+
+Pages are separated by form feeds (``\\f``), as in the ocrmypdf sidecar.
+"""
+
+import os
+import re
+import zlib
+
+from scansynclib.helpers import extract_text
+from scansynclib.logging import logger
+
+PAGE_SEPARATOR = "\f"
+
+# ocrmypdf writes this placeholder instead of text for pages skipped by skip_text.
+SKIPPED_PAGE = re.compile(r"\[OCR skipped on page\(s\) [^\]]*\]")
+
+
+def compress(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def decompress(blob: bytes) -> str:
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def read_sidecar(path: str) -> str | None:
+    """Read the text sidecar written by ocrmypdf.
+
+    Returns:
+        str | None: The text, or ``None`` if the sidecar is missing, empty or
+        incomplete because pages with an existing text layer were skipped.
+    """
+    try:
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    except OSError as e:
+        logger.warning(f"Failed reading OCR sidecar {path}: {e}")
+        return None
+    if not text.strip() or SKIPPED_PAGE.search(text):
+        return None
+    return text
+
+
+def limit_text(text: str, max_pages: int = 10, max_chars: int = 50_000, keep_pages: bool = False) -> str:
+    """Return the first ``max_pages`` non-empty pages of ``text``, truncated to ``max_chars``.
+
+    Mirrors the limits of :func:`~scansynclib.helpers.extract_text`. Pages are
+    joined with form feeds if ``keep_pages`` is set, with newlines otherwise.
+    """
+    pages = [page for page in text.split(PAGE_SEPARATOR)[:max_pages] if page]
+    return (PAGE_SEPARATOR if keep_pages else "\n").join(pages)[:max_chars]
+
+
+def count_pages(text: str) -> int:
+    """Return the number of pages with text, ocrmypdf ends every page with a form feed, the last one too."""
+    return sum(1 for page in text.split(PAGE_SEPARATOR) if page.strip())
+
+
+def save_text(document_id: int, text: str, source: str = "sidecar") -> bool:
+    """Store the text of a document, replacing a previously stored text."""
+    if document_id is None or text is None:
+        return False
+    # Imported lazily, sqlite_wrapper initializes the database on import.
+    from scansynclib.sqlite_wrapper import execute_query
+    result = execute_query(
+        "INSERT OR REPLACE INTO document_text (scanneddata_id, text, chars, pages, source) VALUES (?, ?, ?, ?, ?)",
+        (document_id, compress(text), len(text), count_pages(text), source)
+    )
+    return bool(result)
+
+
+def delete_text(document_id: int) -> bool:
+    """Delete the stored text of a document, e.g. when the document is deleted."""
+    if document_id is None:
+        return False
+    from scansynclib.sqlite_wrapper import execute_query
+    return bool(execute_query("DELETE FROM document_text WHERE scanneddata_id = ?", (document_id,)))
+
+
+def load_text(document_id: int) -> str | None:
+    """Return the stored text of a document or ``None`` if none was stored."""
+    if document_id is None:
+        return None
+    from scansynclib.sqlite_wrapper import execute_query
+    blob = execute_query("SELECT text FROM document_text WHERE scanneddata_id = ?", (document_id,), return_scalar=True)
+    if blob is None:
+        return None
+    try:
+        return decompress(blob)
+    except (zlib.error, UnicodeDecodeError):
+        logger.exception(f"Stored text of document {document_id} is corrupt.")
+        return None
+
+
+def get_text(item, max_pages: int = 10, max_chars: int = 50_000, keep_pages: bool = False) -> str:
+    """Return the text of ``item``, from the store or, as a fallback, parsed from its OCR file.
+
+    With ``keep_pages`` the pages stay separated by form feeds, e.g. for
+    :func:`~scansynclib.prompt_excerpt.build_excerpt` to find the first page.
+    """
+    text = load_text(getattr(item, "db_id", None))
+    if text is not None:
+        return limit_text(text, max_pages, max_chars, keep_pages)
+    logger.debug(f"No stored text for {item.filename}, extracting it from {item.ocr_file}")
+    return extract_text(item.ocr_file, max_pages=max_pages, max_chars=max_chars, page_separator=PAGE_SEPARATOR if keep_pages else "\n")
@@ -0,0 +1,256 @@
+"""End-to-end tracing of a document through the pipeline.
+
+Every message published to a stage queue carries a small trace context in its
+AMQP headers: the trace id (one per document), the id of the span that
+published it, the document id and the time it was enqueued. Consumers open a
+span when a message is delivered and persist it to the ``pipeline_spans``
+table once the callback returns, which makes it possible to tell time spent
+waiting in a queue apart from time spent in a callback.
+
+The span of the message currently being processed is kept in a thread local
+so messages published from within a callback automatically continue the trace.
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from scansynclib import metrics
+from scansynclib.logging import logger
+
+TRACE_ID_HEADER = "x-trace-id"
+PARENT_SPAN_HEADER = "x-parent-span-id"
+ENQUEUED_AT_HEADER = "x-enqueued-at"
+DOCUMENT_ID_HEADER = "x-document-id"
+
+_local = threading.local()
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """A single stage of a document's trip through the pipeline."""
+
+    def __init__(self, stage: str, trace_id: str = None, parent_span_id: str = None,
+                 document_id: int = None, enqueued_at: float = None):
+        self.stage = stage
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.span_id = _new_id()
+        self.parent_span_id = parent_span_id
+        self.document_id = document_id
+        self.enqueued_at = enqueued_at
+        self.started_at = time.time()
+        self.finished_at = None
+        self.status = "ok"
+
+    @property
+    def queue_wait(self) -> float | None:
+        """Seconds the message waited in the queue before the span started."""
+        if self.enqueued_at is None:
+            return None
+        return max(0.0, self.started_at - self.enqueued_at)
+
+    @property
+    def duration(self) -> float | None:
+        """Seconds spent processing the message."""
+        if self.finished_at is None:
+            return None
+        return max(0.0, self.finished_at - self.started_at)
+
+
+def current_span() -> Span | None:
+    """Return the span of the message currently processed by this thread."""
+    return getattr(_local, "span", None)
+
+
+def set_document_id(document_id: int):
+    """Attach the document id to the current span, e.g. once metadata created the DB row."""
+    span = current_span()
+    if span is not None and document_id is not None:
+        span.document_id = document_id
+
+
+def inject_headers(headers: dict = None, document_id: int = None) -> dict:
+    """Return ``headers`` extended with the trace context of the current span.
+
+    Outside of a span (e.g. in the detection service) a new trace is started.
+    """
+    headers = dict(headers or {})
+    if document_id is None:
+        document_id = headers.get(DOCUMENT_ID_HEADER)
+    span = current_span()
+    if span is not None:
+        headers[TRACE_ID_HEADER] = span.trace_id
+        headers[PARENT_SPAN_HEADER] = span.span_id
+        if document_id is None:
+            document_id = span.document_id
+    else:
+        headers.setdefault(TRACE_ID_HEADER, uuid.uuid4().hex)
+    if document_id is not None:
+        headers[DOCUMENT_ID_HEADER] = int(document_id)
+    headers[ENQUEUED_AT_HEADER] = time.time()
+    return headers
+
+
+def start_span(stage: str, headers: dict = None) -> Span:
+    """Open a span for a delivered message and make it the current span."""
+    headers = headers or {}
+    enqueued_at = headers.get(ENQUEUED_AT_HEADER)
+    document_id = headers.get(DOCUMENT_ID_HEADER)
+    span = Span(
+        stage,
+        trace_id=headers.get(TRACE_ID_HEADER),
+        parent_span_id=headers.get(PARENT_SPAN_HEADER),
+        document_id=int(document_id) if document_id is not None else None,
+        enqueued_at=float(enqueued_at) if enqueued_at is not None else None,
+    )
+    _local.span = span
+    return span
+
+
+def finish_span(span: Span, status: str = None):
+    """Close ``span``, clear it from the thread and persist it."""
+    span.finished_at = time.time()
+    if status:
+        span.status = status
+    if current_span() is span:
+        _local.span = None
+    metrics.inc("scansync_stage_messages_total", 1, "Messages processed per stage", stage=span.stage, status=span.status)
+    metrics.observe("scansync_stage_processing_seconds", span.duration, "Time spent in the stage callback", stage=span.stage)
+    if span.queue_wait is not None:
+        metrics.observe("scansync_stage_queue_wait_seconds", span.queue_wait, "Time a message waited in the stage queue", stage=span.stage)
+    record_span(span)
+
+
+def record_span(span: Span):
+    """Persist a finished span to the ``pipeline_spans`` table.
+
+    Tracing must never break message processing, so failures are only logged.
+    """
+    try:
+        # Imported lazily, sqlite_wrapper imports the rabbitmq module which uses this module.
+        from scansynclib.sqlite_wrapper import execute_query
+        execute_query(
+            """INSERT INTO pipeline_spans
+               (trace_id, span_id, parent_span_id, document_id, stage, status,
+                enqueued_at, started_at, finished_at, queue_wait_seconds, processing_seconds)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (span.trace_id, span.span_id, span.parent_span_id, span.document_id, span.stage, span.status,
+             span.enqueued_at, span.started_at, span.finished_at, span.queue_wait, span.duration),
+        )
+        logger.debug(f"Recorded span {span.stage} of trace {span.trace_id}: waited {span.queue_wait}s, processed {span.duration}s")
+    except Exception:
+        logger.exception(f"Failed to record span {span.stage} of trace {span.trace_id}.")
+
+
+def delete_spans(document_id: int) -> bool:
+    """Delete the spans of a document, e.g. when the document is deleted."""
+    if document_id is None:
+        return False
+    from scansynclib.sqlite_wrapper import execute_query
+    return bool(execute_query("DELETE FROM pipeline_spans WHERE document_id = ?", (document_id,)))
+
+
+def prune_spans(before: float) -> int | None:
+    """Delete the spans started before the ``before`` timestamp and return how many were deleted."""
+    from scansynclib.sqlite_wrapper import execute_query
+    return execute_query("DELETE FROM pipeline_spans WHERE started_at < ?", (before,), return_rowcount=True)
+
+
+def stage_percentiles(since: float, percentiles=(50, 90, 99)) -> dict:
+    """Return the span count and the percentiles of queue wait and processing time per stage.
+
+    Only the spans at the ranks the percentiles interpolate between are read,
+    SQLite sorts the spans of the window instead of Python.
+
+    Returns:
+        dict: ``{stage: {"count": n, "queue_wait_p50": seconds, "processing_p50": seconds, ...}}``
+    """
+    from scansynclib.sqlite_wrapper import execute_query
+    stages = {}
+    for row in execute_query("SELECT stage, COUNT(*) AS count FROM pipeline_spans WHERE started_at >= ? GROUP BY stage", (since,), fetchall=True) or []:
+        stages[row["stage"]] = {"count": row["count"]}
+    for name, column in (("queue_wait", "queue_wait_seconds"), ("processing", "processing_seconds")):
+        # Zero-based ranks of the values below and above each percentile, see helpers.percentile.
+        ranks = " OR ".join(
+            f"rank = CAST((n - 1) * {pct} / 100.0 AS INTEGER) OR rank = MIN(CAST((n - 1) * {pct} / 100.0 AS INTEGER) + 1, n - 1)"
+            for pct in percentiles
+        )
+        rows = execute_query(
+            f"""SELECT stage, value, rank, n FROM (
+                    SELECT stage, {column} AS value,
+                           ROW_NUMBER() OVER (PARTITION BY stage ORDER BY {column}) - 1 AS rank,
+                           COUNT(*) OVER (PARTITION BY stage) AS n
+                    FROM pipeline_spans WHERE started_at >= ? AND {column} IS NOT NULL
+                ) WHERE {ranks}""",
+            (since,),
+            fetchall=True
+        ) or []
+        values, counts = {}, {}
+        for row in rows:
+            values.setdefault(row["stage"], {})[row["rank"]] = row["value"]
+            counts[row["stage"]] = row["n"]
+        for stage, stats in stages.items():
+            for pct in percentiles:
+                value = _interpolate(values.get(stage, {}), counts.get(stage, 0), pct)
+                stats[f"{name}_p{pct}"] = round(value, 3) if value is not None else None
+    return stages
+
+
+def _interpolate(values: dict[int, float], count: int, pct: float) -> float | None:
+    """Interpolate the ``pct`` percentile of ``count`` sorted values from the ``values`` by rank."""
+    if not count:
+        return None
+    rank = (count - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, count - 1)
+    return float(values[lower] + (values[upper] - values[lower]) * (rank - lower))
+
+
+def detach_span() -> Span | None:
+    """Take the current span off this thread to finish it elsewhere with :func:`resume_span`.
+
+    Used by callbacks that hand the message to a worker thread, the span then
+    covers the processing in the worker instead of the hand-over.
+    """
+    span = current_span()
+    if span is not None:
+        span.detached = True
+        _local.span = None
+    return span
+
+
+@contextmanager
+def resume_span(span: Span | None):
+    """Make a detached ``span`` the current span of this thread and finish it on exit."""
+    if span is None:
+        yield None
+        return
+    _local.span = span
+    status = "ok"
+    try:
+        yield span
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        finish_span(span, status)
+
+
+def traced_callback(stage: str, on_message_callback):
+    """Wrap a pika message callback so every delivery is recorded as a span."""
+    def wrapper(ch, method, properties, body):
+        span = start_span(stage, getattr(properties, "headers", None))
+        status = "ok"
+        try:
+            return on_message_callback(ch, method, properties, body)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            if not getattr(span, "detached", False):
+                finish_span(span, status)
+    return wrapper
@@ -0,0 +1,105 @@
+import pytest
+from pydantic import ValidationError
+
+from scansynclib.backpressure import BackpressureController, BackpressureState
+from scansynclib.settings_schema import BackpressureSettings
+
+
+class FakeClient:
+    def __init__(self, depths):
+        self.depths = depths
+        self.calls = 0
+
+    def queue_depth(self, queue_name):
+        self.calls += 1
+        return self.depths.get(queue_name)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_controller(depths, **settings):
+    client = FakeClient(depths)
+    clock = FakeClock()
+    config = BackpressureSettings(**settings)
+    controller = BackpressureController(client, list(depths), lambda: config, clock=clock)
+    return controller, client, clock
+
+
+def test_open_below_throttle_watermark():
+    controller, _, _ = make_controller({"ocr_queue": 3})
+    assert controller.state() == BackpressureState.OPEN
+    assert controller.depth == 3
+
+
+def test_depths_of_all_queues_are_summed():
+    controller, _, _ = make_controller({"metadata_queue": 30, "ocr_queue": 30}, throttle_watermark=50)
+    assert controller.state() == BackpressureState.THROTTLED
+    assert controller.depth == 60
+
+
+def test_pause_uses_hysteresis_until_resume_watermark():
+    controller, client, _ = make_controller({"ocr_queue": 250}, throttle_watermark=50, pause_watermark=200, resume_watermark=100)
+    assert controller.state() == BackpressureState.PAUSED
+
+    # Draining below the pause watermark is not enough to resume.
+    client.depths["ocr_queue"] = 150
+    assert controller.state(force=True) == BackpressureState.PAUSED
+
+    client.depths["ocr_queue"] = 90
+    assert controller.state(force=True) == BackpressureState.THROTTLED
+
+    client.depths["ocr_queue"] = 10
+    assert controller.state(force=True) == BackpressureState.OPEN
+
+
+def test_depth_is_cached_for_check_interval():
+    controller, client, clock = make_controller({"ocr_queue": 1}, check_interval=5)
+    controller.state()
+    controller.state()
+    assert client.calls == 1
+
+    clock.now += 5
+    controller.state()
+    assert client.calls == 2
+
+
+def test_unreachable_broker_keeps_previous_state():
+    controller, client, _ = make_controller({"ocr_queue": 500})
+    assert controller.state() == BackpressureState.PAUSED
+    client.depths["ocr_queue"] = None
+    assert controller.state(force=True) == BackpressureState.PAUSED
+
+
+def test_disabled_backpressure_is_always_open():
+    controller, client, _ = make_controller({"ocr_queue": 500}, enabled=False)
+    assert controller.state() == BackpressureState.OPEN
+    assert client.calls == 0
+
+
+def test_wait_while_paused_sleeps_until_drained():
+    controller, client, clock = make_controller({"ocr_queue": 500}, check_interval=5)
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+        client.depths["ocr_queue"] = 0
+
+    assert controller.wait_while_paused(sleep=sleep) == BackpressureState.OPEN
+    assert sleeps == [5]
+
+
+@pytest.mark.parametrize("watermarks", [
+    {"throttle_watermark": 300, "pause_watermark": 200},
+    {"resume_watermark": 200, "pause_watermark": 200},
+    {"resume_watermark": 250, "pause_watermark": 200},
+])
+def test_inconsistent_watermarks_are_rejected(watermarks):
+    with pytest.raises(ValidationError):
+        BackpressureSettings(**watermarks)
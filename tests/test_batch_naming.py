@@ -0,0 +1,139 @@
+import sqlite3
+import sys
+import types
+from pathlib import Path
+
+import fakeredis
+import pytest
+
+from scansynclib import batch_naming, filename_cache
+from scansynclib.settings_schema import FileNamingSettings
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Back the lazily imported execute_query with a throwaway SQLite database."""
+    db_file = tmp_path / "test.db"
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA.read_text())
+    conn.close()
+
+    def execute_query(query, params=(), fetchone=False, return_last_id=False, **kwargs):
+        with sqlite3.connect(db_file) as connection:
+            connection.row_factory = sqlite3.Row
+            cursor = connection.execute(query, params)
+            if fetchone:
+                return cursor.fetchone()
+            if return_last_id:
+                return cursor.lastrowid
+            return True
+
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = execute_query
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return execute_query
+
+
+@pytest.fixture
+def items(monkeypatch):
+    texts = {1: "Rechnung Stadtwerke", 2: "", 3: "Kontoauszug Musterbank", 4: "Vertrag Mobilfunk"}
+    monkeypatch.setattr("scansynclib.text_store.get_text", lambda item, **kwargs: texts[item.db_id])
+    return [types.SimpleNamespace(db_id=db_id, file_naming_db_id=None) for db_id in texts]
+
+
+def test_prompt_numbers_the_documents():
+    assert batch_naming.build_prompt(["first", "second"]) == "### Document 1\nfirst\n\n### Document 2\nsecond"
+
+
+def test_parse_filenames():
+    assert batch_naming.parse_filenames('```json\n["Rechnung_Stadtwerke", "", null, "Vertrag:Mobilfunk"]\n```', 4) == [
+        "Rechnung_Stadtwerke", None, None, "VertragMobilfunk"
+    ]
+
+
+@pytest.mark.parametrize("answer", ['["only one"]', '{"1": "Rechnung"}', "Rechnung_Stadtwerke"])
+def test_unparsable_answers(answer):
+    with pytest.raises(ValueError):
+        batch_naming.parse_filenames(answer, 2)
+
+
+def test_batch_names_documents_with_one_request(database, items):
+    requests = []
+
+    def request(texts):
+        requests.append(texts)
+        return '["Rechnung_Stadtwerke", "", "Vertrag_Mobilfunk"]'
+
+    batch = batch_naming.name_batch(items, "gpt", request)
+
+    # The document without text isn't sent
+    assert requests == [["Rechnung Stadtwerke", "Kontoauszug Musterbank", "Vertrag Mobilfunk"]]
+    assert [batch.filename(item) for item in items] == ["Rechnung_Stadtwerke", None, None, "Vertrag_Mobilfunk"]
+    row = database("SELECT size, named, error_description, finished FROM file_naming_batches WHERE id = ?", (batch.batch_id,), fetchone=True)
+    assert (row["size"], row["named"], row["error_description"]) == (4, 2, None)
+    assert row["finished"] is not None
+
+
+def test_failed_batch_falls_back_to_single_requests(database, items):
+    batch = batch_naming.name_batch(items, "gpt", lambda texts: "Sorry, I can't help with that.")
+
+    assert all(batch.filename(item) is None for item in items)
+    row = database("SELECT named, error_description FROM file_naming_batches WHERE id = ?", (batch.batch_id,), fetchone=True)
+    assert row["named"] == 0
+    assert row["error_description"]
+
+
+def test_jobs_reference_their_batch(database, items):
+    job_id = database("INSERT INTO file_naming_jobs (scanneddata_id, file_naming_status) VALUES (1, 'PENDING')", return_last_id=True)
+    items[0].file_naming_db_id = job_id
+    batch = batch_naming.name_batch(items[:1], "gpt", lambda texts: '["Rechnung"]')
+
+    batch.join(items[0])
+
+    assert database("SELECT batch_id FROM file_naming_jobs WHERE id = ?", (job_id,), fetchone=True)["batch_id"] == batch.batch_id
+
+
+def test_cached_documents_are_not_sent_and_answers_are_cached(database, items, monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(filename_cache, "_redis", lambda: client)
+    monkeypatch.setattr(filename_cache, "_settings", lambda: FileNamingSettings())
+    key = lambda excerpt: filename_cache.cache_key("openai", "gpt", "prompt", excerpt)  # noqa: E731
+    filename_cache.put(key("Kontoauszug Musterbank"), "Kontoauszug_Musterbank")
+    requests = []
+
+    def request(excerpts):
+        requests.append(excerpts)
+        return '["Rechnung_Stadtwerke", "Vertrag_Mobilfunk"]'
+
+    batch = batch_naming.name_batch(items, "gpt", request, max_tokens=100, cache_key=key)
+
+    assert requests == [["Rechnung Stadtwerke", "Vertrag Mobilfunk"]]
+    # The cached document is named by its single request from the cache
+    assert batch.filename(items[2]) is None
+    assert filename_cache.get(key("Rechnung Stadtwerke")) == "Rechnung_Stadtwerke"
+    assert filename_cache.get(key("Vertrag Mobilfunk")) == "Vertrag_Mobilfunk"
+
+
+def test_only_documents_of_the_batch_join_it(database, items):
+    batch = batch_naming.name_batch(items[:1], "gpt", lambda excerpts: '["Rechnung"]')
+    job_id = database("INSERT INTO file_naming_jobs (scanneddata_id, file_naming_status) VALUES (3, 'PENDING')", return_last_id=True)
+    items[2].file_naming_db_id = job_id
+
+    batch.join(items[2])
+
+    assert database("SELECT batch_id FROM file_naming_jobs WHERE id = ?", (job_id,), fetchone=True)["batch_id"] is None
+
+
+def test_queue_depth_is_cached(monkeypatch):
+    depths = iter([80, 10])
+    monkeypatch.setattr("scansynclib.rabbitmq.queue_depth", lambda queue: next(depths))
+    monkeypatch.setattr(batch_naming, "_depth", {"value": 0, "measured": None})
+    now = [100.0]
+
+    assert batch_naming.queue_is_deep(50, clock=lambda: now[0])
+    now[0] += 1
+    assert batch_naming.queue_is_deep(50, clock=lambda: now[0])
+    now[0] += batch_naming.DEPTH_CHECK_INTERVAL
+    assert not batch_naming.queue_is_deep(50, clock=lambda: now[0])
@@ -0,0 +1,89 @@
+import pytest
+import redis
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from scansynclib.circuit_breaker import CircuitBreaker  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def _breaker(client, probe=lambda: True, threshold=3):
+    breaker = CircuitBreaker("ollama", probe, lambda: (threshold, 30), redis_factory=lambda: client)
+    # Probes run synchronously in the tests.
+    breaker._start_prober = lambda: None
+    return breaker
+
+
+def test_opens_after_consecutive_failures(client):
+    breaker = _breaker(client)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_success_resets_the_failure_count(client):
+    breaker = _breaker(client)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_state_is_shared_between_replicas(client):
+    first, second = _breaker(client, threshold=1), _breaker(client, threshold=1)
+    first.record_failure()
+    assert not second.allow()
+
+
+def test_successful_probe_closes_the_circuit(client):
+    breaker = _breaker(client, threshold=1)
+    breaker.record_failure()
+
+    assert breaker.probe_once()
+    assert breaker.allow()
+
+
+def test_failed_probe_keeps_the_circuit_open(client):
+    def unreachable():
+        raise ConnectionError("refused")
+    breaker = _breaker(client, probe=unreachable, threshold=1)
+    breaker.record_failure()
+
+    assert not breaker.probe_once()
+    assert not breaker.allow()
+
+
+def test_only_one_replica_probes_per_interval(client):
+    probes = []
+    first = _breaker(client, probe=lambda: probes.append(1) and False, threshold=1)
+    second = _breaker(client, probe=lambda: probes.append(2) and False, threshold=1)
+    first.record_failure()
+
+    first.probe_once()
+    second.probe_once()
+    assert probes == [1]
+
+
+def test_probe_thread_closes_the_circuit(client):
+    breaker = CircuitBreaker("ollama", lambda: True, lambda: (1, 30), redis_factory=lambda: client, sleep=lambda seconds: None)
+    breaker.record_failure()
+
+    assert not breaker.allow()
+    breaker._prober.join(5)
+    assert breaker.allow()
+
+
+def test_unreachable_redis_keeps_the_circuit_closed():
+    def broken():
+        raise redis.ConnectionError("down")
+    breaker = CircuitBreaker("ollama", lambda: True, lambda: (1, 30), redis_factory=broken)
+    breaker.record_failure()
+    assert breaker.allow()
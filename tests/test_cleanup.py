@@ -71,10 +71,12 @@ def test_cleanup_marks_pending_documents_as_failed(smb, mocker):
     assert doc_id == 7
 
 
-def test_cleanup_removes_leftover_ocr_file(smb, mocker):
+def test_cleanup_removes_leftover_ocr_file(smb, mocker, tmp_path):
     scan = smb / "ShareA" / "scan.pdf"
     scan.write_bytes(b"%PDF-1.4 test")
-    ocr_file = smb / "ShareA" / "scan_OCR.pdf"
+    mocker.patch.object(cleanup.ocr_storage, "OUTPUT_DIR", str(tmp_path / "ocr-output"))
+    ocr_file = tmp_path / "ocr-output" / "ShareA" / "scan_OCR.pdf"
+    ocr_file.parent.mkdir(parents=True)
     ocr_file.write_bytes(b"%PDF-1.4 ocr")
 
     mocker.patch.object(
@@ -91,6 +93,26 @@ def test_cleanup_removes_leftover_ocr_file(smb, mocker):
     assert not (smb / "failed-documents" / "scan_OCR.pdf").exists()
 
 
+def test_cleanup_removes_the_ocr_file_of_a_renamed_document(smb, mocker, tmp_path):
+    mocker.patch.object(cleanup.ocr_storage, "OUTPUT_DIR", str(tmp_path / "ocr-output"))
+    ocr_file = tmp_path / "ocr-output" / "ShareA" / "4_scan_OCR.pdf"
+    other = tmp_path / "ocr-output" / "ShareA" / "41_scan_OCR.pdf"
+    ocr_file.parent.mkdir(parents=True)
+    ocr_file.write_bytes(b"%PDF-1.4 ocr")
+    other.write_bytes(b"%PDF-1.4 ocr")
+
+    mocker.patch.object(
+        cleanup,
+        "execute_query",
+        return_value=[{"id": 4, "file_name": "Invoice.pdf", "local_filepath": "ShareA"}],
+    )
+
+    cleanup.cleanup_dangling_documents()
+
+    assert not ocr_file.exists()
+    assert other.exists()
+
+
 def test_cleanup_marks_failed_even_when_file_missing(smb, mocker):
     execute_query = mocker.patch.object(
         cleanup,
@@ -112,3 +134,13 @@ def test_cleanup_noop_when_no_pending_documents(smb, mocker):
 
     update_calls = [c for c in execute_query.call_args_list if "UPDATE scanneddata" in c.args[0]]
     assert update_calls == []
+
+
+def test_old_traces_are_deleted(mocker):
+    prune_spans = mocker.patch.object(cleanup.tracing, "prune_spans", return_value=3)
+    prune_transitions = mocker.patch.object(cleanup.stage_latency, "prune_transitions", return_value=5)
+
+    cleanup.cleanup_old_traces(now=cleanup.TRACE_RETENTION_DAYS * 24 * 3600 + 100)
+
+    prune_spans.assert_called_once_with(100)
+    prune_transitions.assert_called_once_with(100)
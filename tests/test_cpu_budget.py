@@ -0,0 +1,95 @@
+import pytest
+import redis
+
+from scansynclib import cpu_budget
+from scansynclib.cpu_budget import CpuBudget, LEASE_TTL, LEASES_KEY, budget_size, cores_for_document
+from scansynclib.settings_schema import OcrSettings
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def eight_cores(monkeypatch):
+    monkeypatch.setattr(cpu_budget, "physical_cores", lambda: 8)
+
+
+def make_budget(**settings):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    clock = FakeClock()
+    config = OcrSettings(**settings)
+    budget = CpuBudget(lambda: config, redis_factory=lambda: client, clock=clock, sleep=clock.sleep)
+    return budget, client, clock
+
+
+def test_budget_defaults_to_physical_cores_and_is_capped_by_them():
+    assert budget_size(OcrSettings()) == 8
+    assert budget_size(OcrSettings(cpu_budget=4)) == 4
+    assert budget_size(OcrSettings(cpu_budget=32)) == 8
+
+
+def test_cores_scale_with_pages_up_to_half_the_budget():
+    settings = OcrSettings(pages_per_core=4)
+    assert cores_for_document(0, settings) == 1
+    assert cores_for_document(1, settings) == 1
+    assert cores_for_document(9, settings) == 3
+    assert cores_for_document(500, settings) == 4
+    assert cores_for_document(500, OcrSettings(pages_per_core=4, max_cores_per_document=6)) == 6
+
+
+def test_reserve_holds_tokens_until_released():
+    budget, client, _ = make_budget(cpu_budget=6)
+    with budget.reserve(4) as jobs:
+        assert jobs == 4
+        assert budget.in_use() == 4
+    assert budget.in_use() == 0
+    assert client.zcard(LEASES_KEY) == 0
+
+
+def test_second_document_gets_the_remaining_tokens():
+    budget, _, _ = make_budget(cpu_budget=6)
+    with budget.reserve(4):
+        with budget.reserve(4) as jobs:
+            assert jobs == 2
+            assert budget.in_use() == 6
+
+
+def test_waits_for_free_tokens_and_falls_back_to_one_core():
+    budget, _, clock = make_budget(cpu_budget=2, acquire_timeout=5)
+    with budget.reserve(2):
+        start = clock.now
+        with budget.reserve(2) as jobs:
+            assert jobs == 1
+        assert clock.now - start >= 5
+        # The fallback runs without a lease and must not release the held one.
+        assert budget.in_use() == 2
+
+
+def test_expired_leases_of_crashed_replicas_are_ignored():
+    budget, client, clock = make_budget(cpu_budget=4)
+    client.zadd(LEASES_KEY, {"crashed:4": clock.now + LEASE_TTL})
+    assert budget.try_acquire(2, 4) is None
+
+    clock.now += LEASE_TTL + 1
+    member, granted = budget.try_acquire(2, 4)
+    assert granted == 2
+    assert client.zrange(LEASES_KEY, 0, -1) == [member]
+
+
+def test_redis_failure_runs_on_single_core():
+    def broken():
+        raise redis.ConnectionError("down")
+
+    budget = CpuBudget(lambda: OcrSettings(), redis_factory=broken)
+    with budget.reserve(4) as jobs:
+        assert jobs == 1
@@ -115,6 +115,15 @@ def test_get_all_files_with_hidden_files(mocker):
     mock_os_walk.assert_called_once_with("/path/to/dir")
 
 
+def test_get_all_files_ignores_ocr_files_of_older_releases(mocker):
+    mock_os_walk = mocker.patch("os.walk")
+    mock_os_walk.return_value = [
+        ("/path/to/dir", [], ["scan.pdf", "scan_OCR.pdf"]),
+    ]
+
+    assert get_all_files("/path/to/dir") == {"/path/to/dir/scan.pdf"}
+
+
 def test_get_all_files_with_special_characters(mocker):
     # Mock os.walk to return a directory with special characters in filenames
     mock_os_walk = mocker.patch("os.walk")
@@ -198,3 +207,64 @@ def test_publish_new_files(mocker):
         body=mock_message,
         properties=mocker.ANY  # Ignore delivery_mode for this test
     )
+
+
+def test_split_for_backpressure_releases_everything_when_open():
+    from detection_service.main import split_for_backpressure
+    from scansynclib.backpressure import BackpressureState
+
+    grouped = {"a": ["/scans/a.pdf"], "b": ["/scans/b.pdf"]}
+    release, hold = split_for_backpressure(grouped, BackpressureState.OPEN, 1)
+    assert release == grouped
+    assert hold == {}
+
+
+def test_split_for_backpressure_limits_batch_when_throttled():
+    from detection_service.main import split_for_backpressure
+    from scansynclib.backpressure import BackpressureState
+
+    grouped = {"a": ["/scans/a.pdf"], "b": ["/scans/b.pdf"], "c": ["/scans/c.pdf"]}
+    release, hold = split_for_backpressure(grouped, BackpressureState.THROTTLED, 2)
+    assert list(release) == ["a", "b"]
+    assert list(hold) == ["c"]
+
+
+def test_split_for_backpressure_holds_everything_when_paused():
+    from detection_service.main import split_for_backpressure
+    from scansynclib.backpressure import BackpressureState
+
+    grouped = {"a": ["/scans/a.pdf"]}
+    release, hold = split_for_backpressure(grouped, BackpressureState.PAUSED, 5)
+    assert release == {}
+    assert hold == grouped
+
+
+def test_pending_files_survive_a_restart(tmp_path):
+    import fakeredis
+    from detection_service.main import load_pending, save_pending
+
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    held = tmp_path / "held.pdf"
+    held.write_bytes(b"%PDF")
+    save_pending([str(held), str(tmp_path / "deleted.pdf")], redis_client)
+
+    assert load_pending(redis_client) == {str(held)}
+    save_pending([], redis_client)
+    assert load_pending(redis_client) == set()
+
+
+@pytest.mark.parametrize("upload_depth, released", [(0, 3), (60, 2), (250, 0)])
+def test_deep_upload_queue_holds_files_back(mocker, upload_depth, released):
+    import detection_service.main as detection
+    from scansynclib.settings_schema import BackpressureSettings
+
+    settings = BackpressureSettings(throttle_batch_size=2)
+    client = mocker.Mock()
+    client.queue_depth.side_effect = lambda queue_name: upload_depth if queue_name == "upload_queue" else 0
+    controller = detection.backpressure_controller(client, lambda: settings)
+
+    grouped = {"a": ["/scans/a.pdf"], "b": ["/scans/b.pdf"], "c": ["/scans/c.pdf"]}
+    release, hold = detection.split_for_backpressure(grouped, controller.state(), settings.throttle_batch_size)
+
+    assert len(release) == released
+    assert len(hold) == 3 - released
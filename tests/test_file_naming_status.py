@@ -38,6 +38,7 @@ _settings_stub.settings = SimpleNamespace(
         ollama_server_url="",
         ollama_server_port=11434,
         ollama_model="",
+        rules_enabled=False,
     )
 )
 _original_settings = sys.modules.get("scansynclib.settings")
@@ -73,6 +74,12 @@ _restore_scansynclib_modules()
 from scansynclib.ProcessItem import ProcessItem, ItemType, FileNamingStatus, ProcessStatus  # noqa: E402
 
 
+@pytest.fixture(autouse=True)
+def no_learning(mocker):
+    """Learning senders reads the document text from the real database."""
+    return mocker.patch.object(fn_main, "learn_filename")
+
+
 @pytest.fixture
 def item(tmp_path):
     file_path = tmp_path / "doc.pdf"
@@ -149,5 +156,167 @@ def test_callback_skips_followup_when_ack_fails(item, mocker):
     fn_main.callback(ch, method, None, pickle.dumps(item))
 
     ch.basic_ack.assert_called_once_with(delivery_tag=456)
+    # Only the start of file naming is recorded, the item is not moved on to sync.
+    update.assert_called_once()
+    assert update.call_args.args[1] == {"file_status": ProcessStatus.FILENAME.value}
+    forward.assert_not_called()
+
+
+def test_worker_acknowledges_through_the_connection_thread(item, mocker):
+    mocker.patch.object(fn_main, "execute_query", return_value=item.file_naming_db_id)
+    mocker.patch.object(fn_main, "get_latest_file_naming_status", return_value=FileNamingStatus.COMPLETED)
+    mocker.patch.object(fn_main, "update_scanneddata_database")
+    forward = mocker.patch.object(fn_main, "forward_to_rabbitmq")
+    mocker.patch.object(fn_main.tracing, "record_span")
+    mocker.patch.object(fn_main, "executor", fn_main.ThreadPoolExecutor(max_workers=2))
+
+    ch = mocker.Mock()
+    ch.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+    method = mocker.Mock()
+    method.delivery_tag = 789
+
+    fn_main.dispatch(ch, method, None, pickle.dumps(item))
+    fn_main.executor.shutdown(wait=True)
+
+    ch.connection.add_callback_threadsafe.assert_called_once()
+    ch.basic_ack.assert_called_once_with(delivery_tag=789)
+    forward.assert_called_once()
+    assert forward.call_args.args[0] == "upload_queue"
+
+
+def test_confident_rules_skip_the_llm(item, mocker):
+    mocker.patch.object(fn_main.settings.file_naming, "method", FileNamingMethod.OPENAI)
+    mocker.patch.object(fn_main.settings.file_naming, "rules_enabled", True)
+    mocker.patch.object(fn_main, "name_by_rules", return_value="2024-03-12_Stadtwerke_Rechnung")
+    llm = mocker.patch.object(fn_main, "generate_filename_openai")
+    mocker.patch.object(fn_main, "execute_query", return_value=item.file_naming_db_id)
+    mocker.patch.object(fn_main, "get_latest_file_naming_status", return_value=FileNamingStatus.COMPLETED)
+    mocker.patch.object(fn_main, "update_scanneddata_database")
+    forward = mocker.patch.object(fn_main, "forward_to_rabbitmq")
+
+    ch = mocker.Mock()
+    method = mocker.Mock()
+    method.delivery_tag = 321
+
+    fn_main.callback(ch, method, None, pickle.dumps(item))
+
+    llm.assert_not_called()
+    assert forward.call_args.args[1].filename == "2024-03-12_Stadtwerke_Rechnung.pdf"
+
+
+def test_rename_after_upload_records_the_name_instead_of_forwarding(item, mocker):
+    item.rename_after_upload = True
+    mocker.patch.object(fn_main.settings.file_naming, "method", FileNamingMethod.OPENAI)
+    mocker.patch.object(fn_main, "generate_filename_openai", return_value="renamed")
+    mocker.patch.object(fn_main, "execute_query", return_value=item.file_naming_db_id)
+    mocker.patch.object(fn_main, "get_latest_file_naming_status", return_value=FileNamingStatus.COMPLETED)
+    update = mocker.patch.object(fn_main, "update_scanneddata_database")
+    forward = mocker.patch.object(fn_main, "forward_to_rabbitmq")
+    record = mocker.patch.object(fn_main.remote_rename, "record_filename")
+
+    ch = mocker.Mock()
+    method = mocker.Mock()
+    method.delivery_tag = 654
+
+    fn_main.callback(ch, method, None, pickle.dumps(item))
+
+    ch.basic_ack.assert_called_once_with(delivery_tag=654)
+    record.assert_called_once()
+    assert record.call_args.args[1] == "renamed"
+    # The upload service owns the status of the document.
     update.assert_not_called()
     forward.assert_not_called()
+
+
+def test_batch_names_are_used_without_single_requests(item, mocker):
+    mocker.patch.object(fn_main.settings.file_naming, "method", FileNamingMethod.OPENAI)
+    batch = fn_main.batch_naming.Batch(3, "gpt", {item.db_id: "Rechnung_Stadtwerke"})
+    join = mocker.patch.object(batch, "join")
+    llm = mocker.patch.object(fn_main, "generate_filename_openai")
+    mocker.patch.object(fn_main, "execute_query", return_value=item.file_naming_db_id)
+    mocker.patch.object(fn_main, "get_latest_file_naming_status", return_value=FileNamingStatus.COMPLETED)
+    mocker.patch.object(fn_main, "update_scanneddata_database")
+    forward = mocker.patch.object(fn_main, "forward_to_rabbitmq")
+
+    ch = mocker.Mock()
+    method = mocker.Mock()
+    method.delivery_tag = 111
+
+    fn_main.callback(ch, method, None, pickle.dumps(item), batch)
+
+    join.assert_called_once()
+    llm.assert_not_called()
+    assert forward.call_args.args[1].filename == "Rechnung_Stadtwerke.pdf"
+
+
+def test_documents_named_by_rules_are_not_batched(item, mocker):
+    mocker.patch.object(fn_main.settings.file_naming, "rules_enabled", True)
+    mocker.patch.object(fn_main.settings.file_naming, "excerpt_budget", lambda model: 1000, create=True)
+    mocker.patch.object(fn_main, "named_by_rules", side_effect=lambda document: document.db_id == 7)
+    name_batch = mocker.patch.object(fn_main.batch_naming, "name_batch")
+    process = mocker.patch.object(fn_main, "process")
+    other = pickle.loads(pickle.dumps(item))
+    other.db_id = 8
+
+    fn_main.process_batch(mocker.Mock(), [(mocker.Mock(), None, pickle.dumps(document), None) for document in (item, other)])
+
+    assert [document.db_id for document in name_batch.call_args.args[0]] == [8]
+    assert process.call_count == 2
+
+
+def test_deliveries_are_collected_while_the_queue_is_deep(item, mocker):
+    mocker.patch.object(fn_main.settings.file_naming, "method", FileNamingMethod.OPENAI)
+    mocker.patch.object(fn_main.settings.file_naming, "batch_size", 2, create=True)
+    mocker.patch.object(fn_main.settings.file_naming, "batch_queue_threshold", 50, create=True)
+    mocker.patch.object(fn_main.batch_naming, "queue_is_deep", return_value=True)
+    mocker.patch.object(fn_main.tracing, "detach_span", return_value=None)
+    executor = mocker.patch.object(fn_main, "executor")
+
+    ch = mocker.Mock()
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+    executor.submit.assert_not_called()
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+
+    executor.submit.assert_called_once()
+    assert executor.submit.call_args.args[0] is fn_main.process_batch
+    assert len(executor.submit.call_args.args[2]) == 2
+    assert fn_main.pending == [] and fn_main.pending_timer is None
+
+
+def test_prefetch_is_raised_only_while_batching(item, mocker):
+    mocker.patch.object(fn_main.settings.file_naming, "method", FileNamingMethod.OPENAI)
+    mocker.patch.object(fn_main.settings.file_naming, "batch_size", 10, create=True)
+    mocker.patch.object(fn_main.settings.file_naming, "batch_queue_threshold", 50, create=True)
+    mocker.patch.object(fn_main, "workers", 2)
+    mocker.patch.object(fn_main, "prefetch", {"channel": None, "count": None})
+    mocker.patch.object(fn_main, "collect")
+    mocker.patch.object(fn_main, "executor")
+    mocker.patch.object(fn_main.tracing, "detach_span", return_value=None)
+    deep = mocker.patch.object(fn_main.batch_naming, "queue_is_deep", return_value=False)
+    ch = mocker.Mock()
+
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+    ch.basic_qos.assert_not_called()
+
+    deep.return_value = True
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+    ch.basic_qos.assert_called_once_with(prefetch_count=10)
+
+    deep.return_value = False
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+    ch.basic_qos.assert_called_with(prefetch_count=2)
+
+
+def test_prefetch_stays_at_one_per_worker_with_ollama(item, mocker):
+    mocker.patch.object(fn_main.settings.file_naming, "method", FileNamingMethod.OLLAMA)
+    mocker.patch.object(fn_main.settings.file_naming, "batch_size", 10, create=True)
+    mocker.patch.object(fn_main, "workers", 2)
+    mocker.patch.object(fn_main, "prefetch", {"channel": None, "count": None})
+    mocker.patch.object(fn_main, "executor")
+    mocker.patch.object(fn_main.tracing, "detach_span", return_value=None)
+    ch = mocker.Mock()
+
+    fn_main.dispatch(ch, mocker.Mock(), None, pickle.dumps(item))
+
+    ch.basic_qos.assert_not_called()
@@ -0,0 +1,87 @@
+import sys
+import types
+
+import fakeredis
+import pytest
+
+from scansynclib import filename_cache
+from scansynclib.settings_schema import FileNamingSettings
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    file_naming = FileNamingSettings(cache_max_entries=2)
+    monkeypatch.setattr(filename_cache, "_redis", lambda: client)
+    monkeypatch.setattr(filename_cache, "_settings", lambda: file_naming)
+    return types.SimpleNamespace(client=client, settings=file_naming)
+
+
+def test_key_ignores_whitespace_differences():
+    first = filename_cache.cache_key("openai", "gpt", "prompt", "Invoice  42\n\fTotal 10 EUR ")
+    second = filename_cache.cache_key("openai", "gpt", "prompt", "Invoice 42 Total 10 EUR")
+    assert first == second
+
+
+@pytest.mark.parametrize("other", [
+    ("ollama", "gpt", "prompt", "Invoice 42"),
+    ("openai", "gpt-4", "prompt", "Invoice 42"),
+    ("openai", "gpt", "other prompt", "Invoice 42"),
+    ("openai", "gpt", "prompt", "Invoice 43"),
+])
+def test_key_depends_on_provider_model_prompt_and_text(other):
+    assert filename_cache.cache_key("openai", "gpt", "prompt", "Invoice 42") != filename_cache.cache_key(*other)
+
+
+def test_key_depends_on_prompt_version(monkeypatch):
+    key = filename_cache.cache_key("openai", "gpt", "prompt", "Invoice 42")
+    monkeypatch.setattr(filename_cache, "PROMPT_VERSION", filename_cache.PROMPT_VERSION + 1)
+    assert filename_cache.cache_key("openai", "gpt", "prompt", "Invoice 42") != key
+
+
+def test_put_and_get(cache):
+    filename_cache.put("filename_cache:a", "Invoice_42")
+    assert filename_cache.get("filename_cache:a") == "Invoice_42"
+    assert filename_cache.get("filename_cache:b") is None
+    assert 0 < cache.client.ttl("filename_cache:a") <= 30 * 24 * 60 * 60
+
+
+def test_least_recently_used_entry_is_evicted(cache, monkeypatch):
+    now = iter(range(100))
+    monkeypatch.setattr(filename_cache.time, "time", lambda: next(now))
+    filename_cache.put("filename_cache:a", "A")
+    filename_cache.put("filename_cache:b", "B")
+    filename_cache.get("filename_cache:a")
+    filename_cache.put("filename_cache:c", "C")
+
+    assert filename_cache.get("filename_cache:b") is None
+    assert filename_cache.get("filename_cache:a") == "A"
+    assert filename_cache.get("filename_cache:c") == "C"
+
+
+def test_disabled_cache_is_bypassed(cache):
+    cache.settings.cache_enabled = False
+    filename_cache.put("filename_cache:a", "A")
+    assert filename_cache.get("filename_cache:a") is None
+    assert cache.client.get("filename_cache:a") is None
+
+
+def test_lookup_records_hit_and_miss(cache, monkeypatch):
+    calls = []
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = lambda query, params=(), **kwargs: calls.append(params)
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+
+    assert filename_cache.lookup(7, "filename_cache:a") is None
+    filename_cache.put("filename_cache:a", "A")
+    assert filename_cache.lookup(8, "filename_cache:a") == "A"
+
+    assert calls == [(False, 7), (True, 8)]
+
+
+def test_redis_errors_are_misses(cache, monkeypatch):
+    def broken():
+        raise filename_cache.redis.ConnectionError("down")
+    monkeypatch.setattr(filename_cache, "_redis", broken)
+    filename_cache.put("filename_cache:a", "A")
+    assert filename_cache.get("filename_cache:a") is None
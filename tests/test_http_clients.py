@@ -0,0 +1,61 @@
+import sys
+import types
+
+import pytest
+
+from scansynclib import http_clients
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    listeners = []
+    manager = types.SimpleNamespace(add_listener=listeners.append)
+    monkeypatch.setitem(sys.modules, "scansynclib.settings", types.SimpleNamespace(settings_manager=manager))
+    monkeypatch.setattr(http_clients, "_watching", False)
+    http_clients.reset()
+    yield listeners
+    http_clients.reset()
+
+
+def test_session_is_created_once_per_backend():
+    assert http_clients.session("ollama") is http_clients.session("ollama")
+    assert http_clients.session("ollama") is not http_clients.session("graph")
+
+
+def test_session_applies_backend_timeout(monkeypatch):
+    sent = {}
+
+    def request(self, method, url, **kwargs):
+        sent.update(kwargs)
+    monkeypatch.setattr(http_clients.requests.Session, "request", request)
+
+    http_clients.session("ollama").post("http://ollama:11434/api/generate", json={})
+    assert sent["timeout"] == http_clients.TIMEOUTS["ollama"]
+
+    http_clients.session("ollama").get("http://ollama:11434", timeout=3)
+    assert sent["timeout"] == 3
+
+
+def test_settings_change_rebuilds_clients(registry):
+    before = http_clients.session("graph")
+    assert registry == [http_clients.reset]
+
+    registry[0]()
+
+    assert http_clients.session("graph") is not before
+    assert len(registry) == 1
+
+
+def test_openai_client_per_key(monkeypatch):
+    created = []
+
+    class OpenAI:
+        def __init__(self, api_key, timeout):
+            created.append(api_key)
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=OpenAI))
+    monkeypatch.setitem(sys.modules, "httpx", types.SimpleNamespace(Timeout=lambda read, connect: (connect, read)))
+
+    first = http_clients.openai_client("sk-one")
+    assert http_clients.openai_client("sk-one") is first
+    assert http_clients.openai_client("sk-two") is not first
+    assert created == ["sk-one", "sk-two"]
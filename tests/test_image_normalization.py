@@ -0,0 +1,201 @@
+import sys
+import types
+
+import pytest
+
+from scansynclib import image_normalization
+from scansynclib.image_normalization import NormalizationResult, effective_dpi, is_grayscale, normalize_pdf, target_size
+from scansynclib.settings_schema import OcrProfile, default_ocr_profiles
+
+FAST = default_ocr_profiles()["fast"]
+
+
+def test_effective_dpi_of_a4_scan():
+    # 4960 pixels across the 595 points of an A4 page are 600 DPI
+    assert effective_dpi(4960, 595.0) == pytest.approx(600, abs=1)
+    assert effective_dpi(100, 0) == 0.0
+
+
+def test_target_size_keeps_aspect_ratio():
+    assert target_size(4960, 7016, 600, 300) == (2480, 3508)
+
+
+def test_gray_pixels_in_rgb_are_grayscale():
+    samples = bytes([10, 12, 8] * 1000 + [200, 200, 205] * 1000)
+    assert is_grayscale(samples, 3)
+
+
+def test_coloured_pixels_are_not_grayscale():
+    samples = bytes([10, 12, 8] * 900 + [220, 30, 30] * 100)
+    assert not is_grayscale(samples, 3)
+
+
+def test_few_coloured_pixels_are_tolerated():
+    samples = bytes([128, 128, 128] * 9990 + [0, 0, 255] * 10)
+    assert is_grayscale(samples, 3)
+
+
+def test_alpha_channel_is_skipped():
+    samples = bytes([50, 50, 50, 0] * 100)
+    assert is_grayscale(samples, 4)
+
+
+def test_seconds_saved_scale_with_samples():
+    result = NormalizationResult("out.pdf", 1, 1, 1000, 400, 4000, 1000, 2.0)
+    assert result.bytes_saved == 600
+    # 10 seconds for a quarter of the samples, the original would have taken 40
+    assert result.seconds_saved(10.0) == pytest.approx(28.0)
+
+
+def test_disabled_profile_skips_normalization(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pymupdf", None)
+    profile = OcrProfile(downsample_above_dpi=0, grayscale_detection=False)
+    assert normalize_pdf(str(tmp_path / "in.pdf"), str(tmp_path / "out.pdf"), profile) is None
+
+
+def test_missing_pymupdf_skips_normalization(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pymupdf", None)
+    assert normalize_pdf(str(tmp_path / "in.pdf"), str(tmp_path / "out.pdf"), FAST) is None
+
+
+def test_archival_profile_keeps_the_original_images():
+    profiles = default_ocr_profiles()
+    assert profiles["archival"].downsample_above_dpi == 0
+    assert not profiles["archival"].grayscale_detection
+    assert profiles["fast"].downsample_above_dpi and profiles["fast"].grayscale_detection
+
+
+class _Rect:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+
+class _Colorspace:
+    def __init__(self, n):
+        self.n = n
+
+
+class _Pixmap:
+    """Pixmap of uniform colour, supporting the constructors used by the normalization."""
+    def __init__(self, *args):
+        if isinstance(args[0], _Colorspace) and len(args) == 2:
+            colorspace, source = args
+            self.colorspace, self.width, self.height, self.pixel = colorspace, source.width, source.height, source.pixel[:colorspace.n]
+        elif isinstance(args[0], _Pixmap) and len(args) == 4:
+            source, self.width, self.height, _ = args
+            self.colorspace, self.pixel = source.colorspace, source.pixel
+        else:
+            self.colorspace, self.width, self.height, self.pixel = args
+        self.alpha = 0
+
+    @property
+    def n(self):
+        return self.colorspace.n
+
+    @property
+    def samples(self):
+        return bytes(self.pixel) * (self.width * self.height)
+
+    def tobytes(self, output, jpg_quality=None):
+        return b"jpeg"
+
+
+class _Page:
+    def __init__(self, images, streams=None):
+        self.images = images
+        self.streams = streams or {}
+        self.replaced = {}
+
+    def get_images(self, full=False):
+        return [(xref, 0, width, height, 8) for xref, (width, height, _, _) in self.images.items()]
+
+    def get_image_rects(self, xref):
+        return [_Rect(595, 842)]
+
+    def replace_image(self, xref, stream=None):
+        self.replaced[xref] = stream
+
+
+class _Document:
+    def __init__(self, page):
+        self.pages = [page]
+
+    def xref_stream_raw(self, xref):
+        return self.pages[0].streams.get(xref, b"x" * 1000)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def save(self, path, **kwargs):
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4 normalized")
+
+
+def _fake_pymupdf(monkeypatch, page):
+    module = types.ModuleType("pymupdf")
+    module.csGRAY, module.csRGB = _Colorspace(1), _Colorspace(3)
+    module.open = lambda path: _Document(page)
+
+    def pixmap(*args):
+        if isinstance(args[0], _Document):
+            width, height, components, pixel = page.images[args[1]]
+            return _Pixmap(_Colorspace(components), width, height, pixel)
+        return _Pixmap(*args)
+    module.Pixmap = pixmap
+    monkeypatch.setitem(sys.modules, "pymupdf", module)
+    monkeypatch.setattr(image_normalization, "THUMBNAIL_SIZE", 8)
+
+
+@pytest.fixture
+def input_pdf(tmp_path):
+    path = tmp_path / "scan.pdf"
+    path.write_bytes(b"%PDF-1.4 " + b"x" * 1000)
+    return path
+
+
+def test_oversized_gray_scan_is_downsampled_and_converted(monkeypatch, input_pdf, tmp_path):
+    # 600 DPI colour scan of a black and white page
+    page = _Page({7: (4960, 7016, 3, [120, 120, 120])})
+    _fake_pymupdf(monkeypatch, page)
+
+    result = normalize_pdf(str(input_pdf), str(tmp_path / "out.pdf"), FAST)
+
+    assert result.pages == 1 and result.images == 1
+    assert result.samples_before == 4960 * 7016 * 3
+    assert result.samples_after == 2480 * 3508
+    assert page.replaced == {7: b"jpeg"}
+    assert result.bytes_saved > 0
+
+
+def test_colour_page_at_normal_resolution_is_kept(monkeypatch, input_pdf, tmp_path):
+    page = _Page({7: (2480, 3508, 3, [200, 30, 30])})
+    _fake_pymupdf(monkeypatch, page)
+
+    assert normalize_pdf(str(input_pdf), str(tmp_path / "out.pdf"), FAST) is None
+    assert page.replaced == {}
+    assert not (tmp_path / "out.pdf").exists()
+
+
+def test_image_that_would_grow_is_kept(monkeypatch, input_pdf, tmp_path):
+    # Gray colour image at normal resolution, already smaller than its grayscale JPEG
+    page = _Page({7: (2480, 3508, 3, [120, 120, 120])}, streams={7: b"jp"})
+    _fake_pymupdf(monkeypatch, page)
+
+    assert normalize_pdf(str(input_pdf), str(tmp_path / "out.pdf"), FAST) is None
+    assert page.replaced == {}
+
+
+def test_colour_page_is_only_downsampled(monkeypatch, input_pdf, tmp_path):
+    page = _Page({7: (4960, 7016, 3, [200, 30, 30])})
+    _fake_pymupdf(monkeypatch, page)
+
+    result = normalize_pdf(str(input_pdf), str(tmp_path / "out.pdf"), OcrProfile(downsample_above_dpi=400))
+
+    assert result.samples_after == 2480 * 3508 * 3
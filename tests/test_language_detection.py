@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import types
+
+import pytest
+
+from scansynclib import language_detection
+from scansynclib.language_detection import choose_languages, history_language, pick_language
+
+GERMAN = "Sehr geehrte Damen und Herren, die Rechnung für den Monat ist nicht bezahlt. Bitte überweisen Sie den Betrag auf das Konto der Firma."
+ENGLISH = "Dear customer, the invoice for this month is attached. Please transfer the amount to the account of the company by the end of the week."
+
+
+def test_pick_language_recognizes_dominant_language():
+    assert pick_language(GERMAN, ["eng", "deu"]) == "deu"
+    assert pick_language(ENGLISH, ["eng", "deu"]) == "eng"
+
+
+def test_pick_language_is_uncertain_on_short_or_mixed_text():
+    assert pick_language("Rechnung 2024-03", ["eng", "deu"]) is None
+    assert pick_language(GERMAN + " " + ENGLISH, ["eng", "deu"]) is None
+
+
+def test_pick_language_only_considers_candidates():
+    assert pick_language(GERMAN, ["eng", "fra"]) is None
+
+
+def test_detect_language_survives_missing_tesseract(mocker):
+    mocker.patch.object(language_detection, "render_sample", return_value=b"png")
+    mocker.patch.object(language_detection.subprocess, "run", side_effect=FileNotFoundError("tesseract"))
+    assert language_detection.detect_language("scan.pdf", ["eng", "deu"]) is None
+
+
+def test_detect_language_uses_sample_text(mocker):
+    mocker.patch.object(language_detection, "render_sample", return_value=b"png")
+    run = mocker.patch.object(language_detection.subprocess, "run", return_value=subprocess.CompletedProcess([], 0, GERMAN.encode()))
+    assert language_detection.detect_language("scan.pdf", ["eng", "deu"]) == "deu"
+    assert "eng+deu" in run.call_args.args[0]
+
+
+@pytest.fixture
+def history(monkeypatch):
+    rows = []
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = lambda query, params=(), **kwargs: [{"detected_language": language} for language in rows[:params[1]]]
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return rows
+
+
+def test_history_language_requires_agreement(history):
+    history.extend(["deu"] * 9 + ["eng"])
+    assert history_language("Invoices", ["eng", "deu"], 10) == "deu"
+
+    history[:] = ["deu"] * 6 + ["eng"] * 4
+    assert history_language("Invoices", ["eng", "deu"], 10) is None
+
+
+def test_history_language_requires_enough_documents(history):
+    history.extend(["deu"] * 3)
+    assert history_language("Invoices", ["eng", "deu"], 10) is None
+    assert history_language("Invoices", ["eng", "deu"], 0) is None
+
+
+def test_choose_languages_falls_back_to_history_then_all(mocker, history):
+    mocker.patch.object(language_detection, "detect_language", return_value=None)
+    assert choose_languages("scan.pdf", "Invoices", ["eng", "deu"], 10) == (["eng", "deu"], None)
+
+    history.extend(["eng"] * 10)
+    assert choose_languages("scan.pdf", "Invoices", ["eng", "deu"], 10) == (["eng"], None)
+
+
+def test_choose_languages_skips_detection_for_single_language(mocker):
+    detect = mocker.patch.object(language_detection, "detect_language")
+    assert choose_languages("scan.pdf", "Invoices", ["eng"], 10) == (["eng"], None)
+    detect.assert_not_called()
@@ -56,6 +56,24 @@ def client(app):
     return app.test_client()
 
 
+def _database(tmp_path):
+    """Return a connection to a throwaway SQLite database with the schema."""
+    import sqlite3
+
+    connection = sqlite3.connect(tmp_path / "test.db")
+    connection.row_factory = sqlite3.Row
+    with open(os.path.join(os.path.dirname(__file__), '../scansynclib/scansynclib/db/schema.sql')) as f:
+        connection.executescript(f.read())
+    return connection
+
+
+def _querying(connection):
+    """Return an execute_query answering from ``connection``."""
+    def execute_query(query, params=(), fetchall=False, **kwargs):
+        return [dict(row) for row in connection.execute(query, params).fetchall()]
+    return execute_query
+
+
 class TestOcrLogsAPI:
     """Test cases for the /api/ocr-logs endpoint."""
 
@@ -96,7 +114,7 @@ class TestOcrLogsAPI:
             client.get('/api/ocr-logs?filter=failed')
 
         count_query = mock_query.call_args_list[0].args[0]
-        assert "NOT IN ('COMPLETED', 'PROCESSING')" in count_query
+        assert "NOT IN ('COMPLETED', 'PROCESSING', 'PENDING', 'MERGING')" in count_query
 
     def test_ocr_logs_handles_none_count(self, client):
         with patch('routes.api.execute_query') as mock_query:
@@ -165,3 +183,121 @@ class TestSyncLogsAPI:
 
         assert data['total_count'] == 12
         assert data['total_pages'] == 3
+
+
+class TestTracesAPI:
+    """Test cases for the /api/traces endpoints."""
+
+    def test_document_trace_returns_waterfall(self, client):
+        spans = [
+            {'trace_id': 't1', 'span_id': 'a', 'parent_span_id': None, 'stage': 'metadata_queue', 'status': 'ok',
+             'enqueued_at': 100.0, 'started_at': 101.0, 'finished_at': 103.0, 'queue_wait_seconds': 1.0, 'processing_seconds': 2.0},
+            {'trace_id': 't1', 'span_id': 'b', 'parent_span_id': 'a', 'stage': 'ocr_queue', 'status': 'ok',
+             'enqueued_at': 103.0, 'started_at': 163.0, 'finished_at': 223.0, 'queue_wait_seconds': 60.0, 'processing_seconds': 60.0},
+        ]
+        with patch('routes.api.execute_query', return_value=spans):
+            response = client.get('/api/traces/5')
+            data = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert data['total_seconds'] == 123.0
+        assert data['queue_wait_seconds'] == 61.0
+        assert data['spans'][1]['start_offset_seconds'] == 63.0
+
+    def test_document_trace_not_found(self, client):
+        with patch('routes.api.execute_query', return_value=[]):
+            response = client.get('/api/traces/5')
+        assert response.status_code == 404
+
+    def test_stage_percentiles(self, client, tmp_path):
+        import time
+
+        connection = _database(tmp_path)
+        for started_at, w, p in [(time.time(), 1, 10), (time.time(), 2, 20), (time.time(), 3, 30), (time.time() - 7200, 9, 90)]:
+            connection.execute(
+                "INSERT INTO pipeline_spans (trace_id, span_id, stage, status, started_at, queue_wait_seconds, processing_seconds) "
+                "VALUES ('trace', ?, 'ocr_queue', 'ok', ?, ?, ?)",
+                (f"span-{p}", started_at, w, p),
+            )
+
+        with patch('scansynclib.sqlite_wrapper.execute_query', side_effect=_querying(connection)):
+            response = client.get('/api/traces/stages?hours=1')
+            data = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert data['stages']['ocr_queue']['count'] == 3
+        assert data['stages']['ocr_queue']['processing_p50'] == 20.0
+        assert data['stages']['ocr_queue']['queue_wait_p90'] == 2.8
+
+
+class TestLatencyAnalyticsAPI:
+    """Test cases for the /api/analytics/latency endpoint."""
+
+    def test_latency_analytics_groups_by_share_and_pages(self, client, tmp_path):
+        from datetime import datetime, timedelta
+        from scansynclib import stage_latency
+
+        connection = _database(tmp_path)
+        now = datetime.now()
+        hours = [(now - timedelta(hours=ago)).strftime("%Y-%m-%d %H:00") for ago in (0, 20)]
+        for stage_hour, seconds in [(hours[0], 42), (hours[1], 2), ("2024-06-01 12:00", 3000)]:
+            histogram = stage_latency.empty_histogram()
+            stage_latency.add_to_histogram(histogram, seconds)
+            connection.execute(
+                "INSERT INTO stage_latency_hourly (hour, stage, smb_name, page_bucket, count, sum_seconds, histogram) VALUES (?, 'ocr', 'Invoices', '2-5', 1, ?, ?)",
+                (stage_hour, seconds, json.dumps(histogram)),
+            )
+
+        with patch('scansynclib.sqlite_wrapper.execute_query', side_effect=_querying(connection)):
+            response = client.get('/api/analytics/latency?hours=48')
+            data = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert data['hours'] == 48
+        assert data['stages']['ocr']['count'] == 2
+        assert data['stages']['ocr']['p50_seconds'] == 2.0
+        assert data['by_share']['Invoices']['ocr']['avg_seconds'] == 22.0
+        assert 'ocr' in data['by_pages']['2-5']
+
+
+class TestDocumentTextAPI:
+    """Test cases for the /api/documents/<id>/text endpoint."""
+
+    def test_document_text_returns_stored_text(self, client):
+        with patch('routes.api.text_store.load_text', return_value="Page one\fPage two"):
+            response = client.get('/api/documents/5/text')
+            data = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert data['pages'] == 2
+        assert data['text'] == "Page one\fPage two"
+
+    def test_document_text_not_found(self, client):
+        with patch('routes.api.text_store.load_text', return_value=None):
+            response = client.get('/api/documents/5/text')
+        assert response.status_code == 404
+
+
+class TestCancelOcrAPI:
+    """Test cases for the /api/documents/<id>/cancel-ocr endpoint."""
+
+    def test_cancel_ocr_of_running_document(self, client):
+        with patch('routes.api.execute_query', return_value={'file_status': 'OCR Processing'}), \
+             patch('routes.api.ocr_watchdog.request_cancel', return_value=True) as request_cancel:
+            response = client.post('/api/documents/5/cancel-ocr')
+
+        assert response.status_code == 202
+        request_cancel.assert_called_once_with(5)
+
+    def test_cancel_ocr_rejects_documents_past_ocr(self, client):
+        with patch('routes.api.execute_query', return_value={'file_status': 'Completed'}), \
+             patch('routes.api.ocr_watchdog.request_cancel') as request_cancel:
+            response = client.post('/api/documents/5/cancel-ocr')
+
+        assert response.status_code == 409
+        request_cancel.assert_not_called()
+
+    def test_cancel_ocr_unknown_document(self, client):
+        with patch('routes.api.execute_query', return_value=None):
+            response = client.post('/api/documents/5/cancel-ocr')
+        assert response.status_code == 404
@@ -0,0 +1,101 @@
+import pytest
+
+from scansynclib import metrics
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def buffer(redis_client, mocker):
+    buf = metrics.MetricsBuffer(redis_factory=lambda: redis_client)
+    # Flushes are triggered explicitly in the tests.
+    mocker.patch.object(buf, "_ensure_thread")
+    return buf
+
+
+def test_counters_from_several_buffers_add_up(redis_client, mocker):
+    buffers = []
+    for _ in range(2):
+        buf = metrics.MetricsBuffer(redis_factory=lambda: redis_client)
+        mocker.patch.object(buf, "_ensure_thread")
+        buf.inc("scansync_ocr_pages_total", 3, "Pages processed by OCR")
+        buf.flush()
+        buffers.append(buf)
+
+    text = metrics.render_prometheus(redis_client)
+    assert "# TYPE scansync_ocr_pages_total counter" in text
+    assert "scansync_ocr_pages_total 6" in text
+
+
+def test_histogram_renders_cumulative_buckets(buffer, redis_client):
+    buffer.observe("scansync_sqlite_query_seconds", 0.02, "SQLite latency", buckets=(0.01, 0.1), call_site="mod.func")
+    buffer.observe("scansync_sqlite_query_seconds", 0.5, "SQLite latency", buckets=(0.01, 0.1), call_site="mod.func")
+    buffer.flush()
+
+    text = metrics.render_prometheus(redis_client)
+    assert 'scansync_sqlite_query_seconds_bucket{call_site="mod.func",le="0.01"}' not in text
+    assert 'scansync_sqlite_query_seconds_bucket{call_site="mod.func",le="0.1"} 1' in text
+    assert 'scansync_sqlite_query_seconds_bucket{call_site="mod.func",le="+Inf"} 2' in text
+    assert 'scansync_sqlite_query_seconds_count{call_site="mod.func"} 2' in text
+    assert 'scansync_sqlite_query_seconds_sum{call_site="mod.func"} 0.52' in text
+
+
+def test_gauge_keeps_last_value(buffer, redis_client):
+    buffer.set_gauge("scansync_backlog", 5, "Backlog")
+    buffer.set_gauge("scansync_backlog", 2, "Backlog")
+    buffer.flush()
+    assert f'scansync_backlog{{instance="{metrics.INSTANCE}"}} 2' in metrics.render_prometheus(redis_client)
+
+
+def test_gauges_of_replicas_are_kept_apart_and_expire(redis_client, mocker):
+    for instance, value in (("ocr-1", 3), ("ocr-2", 7)):
+        buf = metrics.MetricsBuffer(redis_factory=lambda: redis_client, instance=instance)
+        mocker.patch.object(buf, "_ensure_thread")
+        buf.set_gauge("scansync_ocr_running", value, "Running OCR jobs", stage="ocr")
+        buf.flush()
+
+    text = metrics.render_prometheus(redis_client)
+    assert 'scansync_ocr_running{instance="ocr-1",stage="ocr"} 3' in text
+    assert 'scansync_ocr_running{instance="ocr-2",stage="ocr"} 7' in text
+    assert 0 < redis_client.ttl(metrics.GAUGES_KEY_PREFIX + "ocr-1") <= metrics.FLUSH_INTERVAL * metrics.GAUGE_TTL_INTERVALS
+
+    redis_client.delete(metrics.GAUGES_KEY_PREFIX + "ocr-1")
+    assert 'instance="ocr-1"' not in metrics.render_prometheus(redis_client)
+
+
+def test_failed_flush_keeps_values(mocker):
+    broken = mocker.Mock()
+    broken.pipeline.side_effect = ConnectionError("redis down")
+    buf = metrics.MetricsBuffer(redis_factory=lambda: broken)
+    mocker.patch.object(buf, "_ensure_thread")
+    buf.inc("scansync_upload_bytes_total", 100)
+
+    assert buf.flush() is False
+
+    working = fakeredis.FakeRedis(decode_responses=True)
+    buf._redis_factory = lambda: working
+    buf.inc("scansync_upload_bytes_total", 50)
+    assert buf.flush() is True
+    assert "scansync_upload_bytes_total 150" in metrics.render_prometheus(working)
+
+
+def test_labels_are_escaped_and_extra_metrics_rendered(redis_client):
+    text = metrics.render_prometheus(redis_client, extra=[
+        ("scansync_queue_depth", "gauge", "Ready messages per queue", [({"queue": 'a"b'}, 4)]),
+    ])
+    assert 'scansync_queue_depth{queue="a\\"b"} 4' in text
+
+
+def test_close_stops_the_flush_thread_and_flushes(redis_client):
+    buf = metrics.MetricsBuffer(redis_factory=lambda: redis_client, flush_interval=60)
+    buf.inc("scansync_closed_total", 1, "Closed")
+
+    buf.close()
+
+    assert not buf._thread.is_alive()
+    assert "scansync_closed_total 1" in metrics.render_prometheus(redis_client)
@@ -0,0 +1,36 @@
+"""Tests for the /metrics endpoint of the web service."""
+
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../web_service/src'))
+os.makedirs(os.path.join(os.path.dirname(__file__), '../data'), exist_ok=True)
+
+
+@pytest.fixture
+def client():
+    from flask import Flask
+    from routes.metrics import metrics_bp
+
+    app = Flask(__name__)
+    app.register_blueprint(metrics_bp)
+    app.config['TESTING'] = True
+    return app.test_client()
+
+
+def test_metrics_endpoint_renders_documents_and_queue_depths(client):
+    rows = [{'file_status': 'Completed', 'count': 3}]
+    with patch('routes.metrics.execute_query', return_value=rows), \
+            patch('routes.metrics.queue_depth', side_effect=[1, 2, None, 4]), \
+            patch('routes.metrics.metrics.flush'), \
+            patch('scansynclib.redis_client.get_redis', return_value=MagicMock(hgetall=MagicMock(return_value={}))):
+        response = client.get('/metrics')
+
+    text = response.data.decode()
+    assert response.status_code == 200
+    assert 'scansync_documents{status="Completed"} 3' in text
+    assert 'scansync_queue_depth{queue="ocr_queue"} 2' in text
+    assert 'queue="file_naming_queue"' not in text
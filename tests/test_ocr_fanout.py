@@ -0,0 +1,128 @@
+import sqlite3
+import sys
+import types
+from pathlib import Path
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+from scansynclib import ocr_fanout
+from scansynclib.ocr_fanout import OcrChunk, chunk_paths, claim_merge, failed_chunks, merge_chunks, plan_chunks, should_fan_out, split_pdf
+from scansynclib.ProcessItem import OCRStatus
+from scansynclib.settings_schema import OcrSettings
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Back the lazily imported execute_query with a throwaway SQLite database."""
+    db_file = tmp_path / "test.db"
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA.read_text())
+    conn.close()
+
+    def execute_query(query, params=(), return_last_id=False, return_scalar=False, return_rowcount=False, **kwargs):
+        with sqlite3.connect(db_file) as connection:
+            cursor = connection.execute(query, params)
+            if return_scalar:
+                row = cursor.fetchone()
+                return row[0] if row else None
+            if return_last_id:
+                return cursor.lastrowid
+            if return_rowcount:
+                return cursor.rowcount
+            return True
+
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = execute_query
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return execute_query
+
+
+def _write_pdf(path, pages):
+    writer = PdfWriter()
+    for index in range(pages):
+        # Page widths encode the page number, so the order can be checked after merging.
+        writer.add_blank_page(width=100 + index, height=100)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def _widths(path):
+    return [int(page.mediabox.width) for page in PdfReader(path).pages]
+
+
+def test_plan_chunks_covers_all_pages():
+    assert plan_chunks(60, 20) == [(1, 20), (21, 40), (41, 60)]
+    assert plan_chunks(0, 20) == []
+    assert plan_chunks(5, 20) == [(1, 5)]
+
+
+def test_plan_chunks_merges_short_remainder_into_last_chunk():
+    assert plan_chunks(45, 20) == [(1, 20), (21, 45)]
+    assert plan_chunks(52, 20) == [(1, 20), (21, 40), (41, 52)]
+
+
+def test_should_fan_out():
+    settings = OcrSettings(fan_out_pages=60, chunk_pages=20)
+    assert not should_fan_out(60, settings)
+    assert should_fan_out(61, settings)
+    assert not should_fan_out(500, OcrSettings(fan_out_pages=0))
+
+
+def test_split_and_merge_keep_page_order(tmp_path):
+    source = tmp_path / "scan.pdf"
+    _write_pdf(source, 7)
+    directory = tmp_path / "chunks"
+    ranges = plan_chunks(7, 3)
+
+    split_pdf(str(source), str(directory), ranges)
+    for index, (start, end) in enumerate(ranges):
+        chunk_input, chunk_output = chunk_paths(str(directory), index)
+        assert _widths(chunk_input) == [100 + page - 1 for page in range(start, end + 1)]
+        # Stand in for ocrmypdf: the OCR output of a chunk is a copy of its input.
+        Path(chunk_output).write_bytes(Path(chunk_input).read_bytes())
+
+    merged = tmp_path / "merged.pdf"
+    merge_chunks(str(directory), len(ranges), str(merged))
+    assert _widths(merged) == _widths(source)
+
+
+def test_fan_out_registers_parent_and_chunk_jobs(tmp_path, database, monkeypatch):
+    monkeypatch.setattr(ocr_fanout, "CHUNK_DIR", str(tmp_path / "chunks"))
+    source = tmp_path / "scan.pdf"
+    _write_pdf(source, 50)
+    item = types.SimpleNamespace(db_id=7, filename="scan.pdf", local_file_path=str(source), pdf_pages=50, chunk=None, ocr_db_id=None)
+
+    chunk_items = ocr_fanout.fan_out(item, OcrSettings(chunk_pages=20))
+
+    assert [(c.chunk.page_start, c.chunk.page_end) for c in chunk_items] == [(1, 20), (21, 40), (41, 50)]
+    assert {c.chunk.parent_job_id for c in chunk_items} == {item.ocr_db_id}
+    assert item.chunk is None
+    assert database("SELECT COUNT(*) FROM ocr_jobs WHERE parent_id = ?", (item.ocr_db_id,), return_scalar=True) == 3
+    assert all(Path(c.chunk.input_path).exists() for c in chunk_items)
+
+
+def test_merge_is_claimed_once_after_the_last_chunk(database):
+    parent = database("INSERT INTO ocr_jobs (scanneddata_id, ocr_status, chunk_count) VALUES (1, 'PENDING', 2)", return_last_id=True)
+    first = database("INSERT INTO ocr_jobs (scanneddata_id, ocr_status, parent_id, chunk_index) VALUES (1, 'COMPLETED', ?, 0)", (parent,), return_last_id=True)
+    second = database("INSERT INTO ocr_jobs (scanneddata_id, ocr_status, parent_id, chunk_index) VALUES (1, 'PROCESSING', ?, 1)", (parent,), return_last_id=True)
+
+    assert claim_merge(parent) is False
+
+    database("UPDATE ocr_jobs SET ocr_status = 'COMPLETED' WHERE id = ?", (second,))
+    assert claim_merge(parent) is True
+    assert claim_merge(parent) is False
+    assert database("SELECT ocr_status FROM ocr_jobs WHERE id = ?", (parent,), return_scalar=True) == OCRStatus.MERGING.name
+    assert failed_chunks(parent) == 0
+
+    database("UPDATE ocr_jobs SET ocr_status = 'FAILED' WHERE id = ?", (first,))
+    assert failed_chunks(parent) == 1
+
+
+def test_chunk_paths_are_ordered(tmp_path):
+    chunk = OcrChunk(job_id=2, parent_job_id=1, index=3, count=5, page_start=61, page_end=80, directory=str(tmp_path))
+    assert chunk.pages == 20
+    assert chunk.input_path.endswith("chunk_0003.pdf")
+    assert chunk.output_path.endswith("chunk_0003_OCR.pdf")
@@ -63,6 +63,7 @@ def teardown_module(module):
 
 import ocr_service.main as ocr_main  # noqa: E402
 from scansynclib.ProcessItem import ProcessItem, ItemType, OCRStatus, ProcessStatus  # noqa: E402
+from scansynclib.settings_schema import OcrSettings  # noqa: E402
 
 
 @pytest.fixture
@@ -70,10 +71,20 @@ def item(tmp_path):
     file_path = tmp_path / "scan.pdf"
     file_path.write_bytes(b"%PDF-1.4 test")
     process_item = ProcessItem(str(file_path), ItemType.PDF)
+    process_item.ocr_file = str(tmp_path / "output" / "scan_OCR.pdf")
     process_item.db_id = 42
     return process_item
 
 
+def _writing_ocr(exit_code=0):
+    """Stand in for ocrmypdf: write the output file like a real run would."""
+    def ocr(input_file, output_file, **kwargs):
+        with open(output_file, "wb") as f:
+            f.write(b"%PDF-1.4 ocr")
+        return exit_code
+    return ocr
+
+
 @pytest.fixture
 def patched(mocker):
     """Mock external collaborators of the OCR service.
@@ -85,19 +96,23 @@ def patched(mocker):
     execute_query = mocker.patch.object(ocr_main, "execute_query", return_value=99)
     update_db = mocker.patch.object(ocr_main, "update_scanneddata_database")
     forward = mocker.patch.object(ocr_main, "forward_to_rabbitmq")
+    move_to_failed = mocker.patch.object(ocr_main, "move_to_failed")
     fake_settings = types.SimpleNamespace(
         file_naming=types.SimpleNamespace(
             ollama_server_url="",
             ollama_server_port="",
             ollama_model="",
             openai_api_key="",
-        )
+            rename_after_upload=False,
+        ),
+        ocr=OcrSettings(watchdog_enabled=False),
     )
     mocker.patch.object(ocr_main, "settings", fake_settings)
     return {
         "execute_query": execute_query,
         "update_db": update_db,
         "forward": forward,
+        "move_to_failed": move_to_failed,
         "settings": fake_settings,
     }
 
@@ -111,7 +126,7 @@ def _ocr_job_update_args(execute_query):
 @pytest.mark.parametrize(
     "ocr_behavior, expected_status, expected_error",
     [
-        ({"return_value": 0}, OCRStatus.COMPLETED, None),
+        ({"side_effect": _writing_ocr(0)}, OCRStatus.COMPLETED, None),
         ({"return_value": 5}, OCRStatus.FAILED, "OCR exited with code 5"),
         (
             {"side_effect": ocr_main.ocrmypdf.UnsupportedImageFormatError()},
@@ -143,11 +158,6 @@ def _ocr_job_update_args(execute_query):
 )
 def test_start_processing_persists_ocr_job_status(item, patched, mocker, ocr_behavior, expected_status, expected_error):
     mocker.patch.object(ocr_main.ocrmypdf, "ocr", **ocr_behavior)
-    # On the success path the service verifies that ocrmypdf produced an output
-    # file containing text. ocrmypdf is stubbed here, so provide the artifacts it
-    # would normally create for the "completed" case.
-    with open(item.ocr_file, "wb") as ocr_file:
-        ocr_file.write(b"%PDF-1.4 ocr")
     mocker.patch.object(ocr_main, "extract_text", return_value="sample text")
 
     ocr_main.start_processing(item)
@@ -184,3 +194,199 @@ def test_start_processing_forwards_to_file_naming_when_enabled(item, patched, mo
     patched["forward"].assert_called_once()
     assert patched["forward"].call_args.args[0] == "file_naming_queue"
     assert item.status == ProcessStatus.FILENAME_PENDING
+
+
+def test_start_processing_uploads_while_naming_when_renaming_after_upload(item, patched, mocker):
+    patched["settings"].file_naming.openai_api_key = "secret"
+    patched["settings"].file_naming.rename_after_upload = True
+    mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+
+    ocr_main.start_processing(item)
+
+    assert [call.args[0] for call in patched["forward"].call_args_list] == ["upload_queue", "file_naming_queue"]
+    assert item.rename_after_upload
+    assert item.status == ProcessStatus.SYNC_PENDING
+
+
+def _chunk_item(item, tmp_path, index=0, count=2):
+    from scansynclib.ocr_fanout import OcrChunk
+    item.chunk = OcrChunk(job_id=10 + index, parent_job_id=5, index=index, count=count, page_start=1, page_end=20, directory=str(tmp_path))
+    return item
+
+
+def test_chunk_waits_for_remaining_chunks(item, patched, mocker, tmp_path):
+    mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+    mocker.patch.object(ocr_main.ocr_fanout, "mark_parent_processing")
+    mocker.patch.object(ocr_main.ocr_fanout, "claim_merge", return_value=False)
+    open(_chunk_item(item, tmp_path).chunk.output_path, "wb").close()
+
+    ocr_main.start_processing(item)
+
+    chunk_update = [c for c in patched["execute_query"].call_args_list if "ocr_error" in c.args[0]]
+    assert chunk_update[-1].args[1] == (OCRStatus.COMPLETED.name, None, 10)
+    patched["forward"].assert_not_called()
+
+
+def test_last_chunk_merges_and_forwards_document(item, patched, mocker, tmp_path):
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", side_effect=_writing_ocr(0))
+    mocker.patch.object(ocr_main.ocr_fanout, "mark_parent_processing")
+    mocker.patch.object(ocr_main.ocr_fanout, "claim_merge", return_value=True)
+    mocker.patch.object(ocr_main.ocr_fanout, "failed_chunks", return_value=0)
+    merge = mocker.patch.object(ocr_main.ocr_fanout, "merge_chunks")
+    mocker.patch.object(ocr_main.ocr_fanout, "remove_chunks")
+    mocker.patch.object(ocr_main, "extract_text", return_value="merged text")
+    _chunk_item(item, tmp_path, index=1)
+
+    ocr_main.start_processing(item)
+
+    merge.assert_called_once_with(str(tmp_path), 2, str(tmp_path / "merged.pdf"))
+    assert ocr.call_args.kwargs["output_type"] == "pdfa"
+    assert item.chunk is None
+    assert item.ocr_status == OCRStatus.COMPLETED
+    status_name, error, db_id = _ocr_job_update_args_for(patched["execute_query"], 5)
+    assert (status_name, error) == (OCRStatus.COMPLETED.name, None)
+    patched["forward"].assert_called_once()
+    assert patched["forward"].call_args.args[0] == "upload_queue"
+
+
+def _ocr_job_update_args_for(execute_query, job_id):
+    calls = [c for c in execute_query.call_args_list if "ocr_error" in c.args[0] and c.args[1][-1] == job_id]
+    assert len(calls) == 1
+    return calls[0].args[1]
+
+
+def test_sidecar_text_is_used_instead_of_parsing_the_pdf(item, patched, mocker):
+    def fake_ocr(input_file, output_file, sidecar=None, **kwargs):
+        with open(output_file, "wb") as f:
+            f.write(b"%PDF-1.4 ocr")
+        with open(sidecar, "w") as f:
+            f.write("Invoice 42\f")
+        return 0
+
+    mocker.patch.object(ocr_main.ocrmypdf, "ocr", side_effect=fake_ocr)
+    extract = mocker.patch.object(ocr_main, "extract_text", return_value="parsed")
+    save = mocker.patch.object(ocr_main.text_store, "save_text", return_value=True)
+    throughput = mocker.patch.object(ocr_main, "record_ocr_throughput")
+
+    ocr_main.start_processing(item)
+
+    assert item.ocr_status == OCRStatus.COMPLETED
+    extract.assert_not_called()
+    save.assert_called_once_with(42, "Invoice 42\f", "sidecar")
+    throughput.assert_called_once()
+
+
+def test_document_with_text_layer_skips_ocr(item, patched, mocker):
+    item.text_layer_mode = "passthrough"
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+    mocker.patch.object(ocr_main.text_layer, "read_text_layer", return_value="Printed invoice text")
+    save = mocker.patch.object(ocr_main.text_store, "save_text", return_value=True)
+    throughput = mocker.patch.object(ocr_main, "record_ocr_throughput")
+
+    ocr_main.start_processing(item)
+
+    ocr.assert_not_called()
+    # Passed through pages would inflate the OCR pages/sec
+    throughput.assert_not_called()
+    assert item.ocr_status == OCRStatus.COMPLETED
+    with open(item.ocr_file, "rb") as f:
+        assert f.read() == b"%PDF-1.4 test"
+    save.assert_called_once_with(42, "Printed invoice text", "text_layer")
+
+
+def test_text_layer_detection_is_skipped_when_share_forces_ocr(item, patched, mocker):
+    item.text_layer_mode = "ocr"
+    mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+    read = mocker.patch.object(ocr_main.text_layer, "read_text_layer")
+
+    ocr_main.start_processing(item)
+
+    read.assert_not_called()
+
+
+def test_share_ocr_profile_selects_ocrmypdf_options(item, patched, mocker):
+    item.ocr_profile = "fast"
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+
+    ocr_main.start_processing(item)
+
+    options = ocr.call_args.kwargs
+    assert options["output_type"] == "pdf"
+    assert options["optimize"] == 0
+    assert options["language"] == ["eng"]
+
+
+def test_detected_language_narrows_ocr_languages(item, patched, mocker):
+    mocker.patch.object(ocr_main.language_detection, "detect_language", return_value="deu")
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+
+    ocr_main.start_processing(item)
+
+    assert ocr.call_args.kwargs["language"] == ["deu"]
+    assert item.detected_language == "deu"
+    patched["update_db"].assert_any_call(item, {"detected_language": "deu"})
+
+
+def test_inconclusive_language_detection_keeps_all_languages(item, patched, mocker):
+    mocker.patch.object(ocr_main.language_detection, "detect_language", return_value=None)
+    mocker.patch.object(ocr_main.language_detection, "history_language", return_value=None)
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+
+    ocr_main.start_processing(item)
+
+    assert ocr.call_args.kwargs["language"] == ["eng", "deu"]
+    assert item.detected_language is None
+
+
+def test_ocr_run_reports_progress_through_the_plugin(item, patched, mocker):
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+
+    ocr_main.start_processing(item)
+
+    assert ocr.call_args.kwargs["plugins"] == [ocr_main.PROGRESS_PLUGIN]
+    assert ocr.call_args.kwargs["progress_bar"] is True
+
+
+def test_cancelled_document_is_not_ocrd(item, patched, mocker):
+    mocker.patch.object(ocr_main.ocr_watchdog, "cancel_requested", return_value=True)
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", return_value=0)
+
+    ocr_main.start_processing(item)
+
+    ocr.assert_not_called()
+    assert item.ocr_status == OCRStatus.CANCELLED
+    assert _ocr_job_update_args(patched["execute_query"])[0] == OCRStatus.CANCELLED.name
+    patched["forward"].assert_not_called()
+    assert item.status == ProcessStatus.SKIPPED
+    patched["move_to_failed"].assert_called_once_with(item)
+
+
+def test_watchdog_timeout_is_recorded(item, patched, mocker):
+    patched["settings"].ocr = OcrSettings()
+    mocker.patch.object(ocr_main.ocr_watchdog, "run_supervised", side_effect=ocr_main.ocr_watchdog.OcrAborted(OCRStatus.TIMEOUT, "OCR exceeded its deadline of 330 seconds"))
+
+    ocr_main.start_processing(item)
+
+    assert item.ocr_status == OCRStatus.TIMEOUT
+    assert _ocr_job_update_args(patched["execute_query"]) == (OCRStatus.TIMEOUT.name, "OCR exceeded its deadline of 330 seconds", 99)
+    patched["forward"].assert_not_called()
+    assert item.status == ProcessStatus.FAILED
+    patched["move_to_failed"].assert_called_once_with(item)
+
+
+def test_normalized_images_are_ocrd_and_savings_recorded(item, patched, mocker, tmp_path):
+    def normalize(input_path, output_path, profile):
+        with open(output_path, "wb") as f:
+            f.write(b"%PDF-1.4 normalized")
+        return ocr_main.image_normalization.NormalizationResult(output_path, 2, 2, 5000, 2000, 4000, 1000, 0.5)
+    mocker.patch.object(ocr_main.image_normalization, "normalize_pdf", side_effect=normalize)
+    ocr = mocker.patch.object(ocr_main.ocrmypdf, "ocr", side_effect=_writing_ocr(0))
+
+    ocr_main.start_processing(item)
+
+    assert ocr.call_args.args[0].endswith("normalized.pdf")
+    savings = [c.args[1] for c in patched["execute_query"].call_args_list if "bytes_saved" in c.args[0]]
+    assert len(savings) == 1
+    pages, bytes_saved, seconds_saved, job_id = savings[0]
+    assert (pages, bytes_saved, job_id) == (2, 3000, 99)
+    assert seconds_saved >= -0.5
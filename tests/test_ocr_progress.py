@@ -0,0 +1,97 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+from scansynclib import ocr_progress
+from scansynclib.ocr_fanout import OcrChunk
+from scansynclib.ocr_progress import OcrProgress
+
+PLUGIN = Path(__file__).resolve().parents[1] / "ocr_service" / "ocr_progress_plugin.py"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _progress(pages=10, chunk=None):
+    events = []
+    clock = FakeClock()
+    progress = OcrProgress(42, pages, chunk=chunk, publish=events.append, clock=clock, min_interval=2.0)
+    return progress, events, clock
+
+
+def test_updates_are_throttled_but_completion_is_always_published():
+    progress, events, clock = _progress()
+    progress.start_phase("OCR", 10, "page")
+    progress.update()
+    clock.now += 1
+    progress.update()
+    assert len(events) == 1
+
+    clock.now += 1.5
+    progress.update()
+    assert events[-1]["pages_done"] == 3
+
+    progress.update(completed=10)
+    assert events[-1]["pages_done"] == 10
+    assert events[-1]["eta_seconds"] == 0
+    assert len(events) == 3
+
+
+def test_eta_is_estimated_from_the_phase_rate():
+    progress, events, clock = _progress(pages=150)
+    progress.start_phase("OCR", 150, "page")
+    clock.now += 30
+    progress.update(50)
+
+    event = events[-1]
+    assert event["type"] == "ocr_progress"
+    assert event["id"] == 42
+    assert event["pages_done"] == 50
+    assert event["pages_total"] == 150
+    assert event["eta_seconds"] == 60
+
+
+def test_chunk_events_identify_the_chunk(tmp_path):
+    chunk = OcrChunk(job_id=2, parent_job_id=1, index=1, count=3, page_start=21, page_end=40, directory=str(tmp_path))
+    progress, events, _ = _progress(pages=chunk.pages, chunk=chunk)
+    progress.start_phase("OCR", 20, "page")
+    assert events[-1]["chunk_index"] == 1
+    assert events[-1]["chunk_count"] == 3
+
+
+def test_publish_errors_do_not_break_ocr():
+    def fail(event):
+        raise ConnectionError("broker down")
+
+    progress = OcrProgress(42, 10, publish=fail)
+    progress.start_phase("OCR", 10, "page")
+    progress.update()
+
+
+def test_plugin_forwards_to_the_tracked_progress(monkeypatch):
+    ocrmypdf_stub = types.ModuleType("ocrmypdf")
+    ocrmypdf_stub.hookimpl = lambda function: function
+    monkeypatch.setitem(sys.modules, "ocrmypdf", ocrmypdf_stub)
+    spec = importlib.util.spec_from_file_location("ocr_progress_plugin", PLUGIN)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    progress_bar = plugin.get_progressbar_class()
+
+    progress, events, _ = _progress()
+    with ocr_progress.tracking(progress):
+        with progress_bar(total=10, desc="OCR", unit="page", disable=True) as bar:
+            bar.update(completed=10)
+    assert ocr_progress.active() is None
+    assert events[-1]["phase"] == "OCR"
+    assert events[-1]["pages_done"] == 10
+
+    # Runs without a tracked document, e.g. the PDF/A pass of a merge, report nothing.
+    with progress_bar(total=10, desc="OCR", unit="page") as bar:
+        bar.update()
+    assert len(events) == 2
@@ -0,0 +1,73 @@
+import errno
+import os
+
+from scansynclib import ocr_storage
+from scansynclib.ocr_storage import ScratchDirectory, output_path, publish
+
+
+def test_output_path_is_outside_the_share(mocker):
+    mocker.patch.object(ocr_storage, "OUTPUT_DIR", "/app/data/ocr-output")
+    assert output_path("Invoices", "scan") == "/app/data/ocr-output/Invoices/scan_OCR.pdf"
+
+
+def test_scans_of_the_same_name_get_their_own_output(mocker):
+    mocker.patch.object(ocr_storage, "OUTPUT_DIR", "/app/data/ocr-output")
+    assert output_path("Invoices", "scan", 7) == "/app/data/ocr-output/Invoices/7_scan_OCR.pdf"
+    assert output_path("Invoices", "scan", 7) != output_path("Invoices", "scan", 8)
+
+
+def test_publish_moves_the_file_into_the_output_area(tmp_path):
+    source = tmp_path / "scratch" / "output.pdf"
+    source.parent.mkdir()
+    source.write_bytes(b"%PDF-1.4 ocr")
+    destination = tmp_path / "out" / "Invoices" / "scan_OCR.pdf"
+
+    assert publish(str(source), str(destination))
+    assert destination.read_bytes() == b"%PDF-1.4 ocr"
+    assert not source.exists()
+
+
+def test_publish_copies_across_file_systems(tmp_path, mocker):
+    source = tmp_path / "output.pdf"
+    source.write_bytes(b"%PDF-1.4 ocr")
+    destination = tmp_path / "out" / "scan_OCR.pdf"
+    real_replace = os.replace
+
+    def replace(src, dst):
+        if src == str(source):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return real_replace(src, dst)
+
+    mocker.patch.object(ocr_storage.os, "replace", side_effect=replace)
+
+    assert publish(str(source), str(destination))
+    assert destination.read_bytes() == b"%PDF-1.4 ocr"
+    assert not source.exists()
+    assert not (tmp_path / "out" / "scan_OCR.pdf.partial").exists()
+
+
+def test_publish_without_output_removes_stale_file(tmp_path):
+    destination = tmp_path / "scan_OCR.pdf"
+    destination.write_bytes(b"%PDF-1.4 old")
+
+    assert not publish(str(tmp_path / "missing.pdf"), str(destination))
+    assert not destination.exists()
+
+
+def test_scratch_uses_configured_directory(tmp_path, mocker):
+    mocker.patch.object(ocr_storage, "SCRATCH_DIR", str(tmp_path / "scratch"))
+    with ScratchDirectory() as scratch:
+        assert os.path.dirname(scratch.path) == str(tmp_path / "scratch")
+        path = scratch.path
+    assert not os.path.exists(path)
+
+
+def test_scratch_falls_back_when_tmpfs_is_too_small(tmp_path, mocker):
+    mocker.patch.object(ocr_storage, "SCRATCH_DIR", "")
+    mocker.patch.object(ocr_storage, "TMPFS_DIR", str(tmp_path))
+    mocker.patch.object(ocr_storage, "_free_bytes", return_value=2**20)
+    mocker.patch.object(ocr_storage.tempfile, "gettempdir", return_value="/var/tmp")
+    assert ocr_storage.scratch_root(10 * 2**20) == "/var/tmp"
+
+    ocr_storage._free_bytes.return_value = 2**40
+    assert ocr_storage.scratch_root(10 * 2**20) == str(tmp_path)
@@ -3,6 +3,7 @@ import sys
 import tempfile
 from unittest.mock import Mock, patch, MagicMock
 from scansynclib.ProcessItem import ProcessItem, ItemType, OCRStatus, ProcessStatus
+from scansynclib.settings_schema import OcrSettings
 
 
 class TestOCRTextVerification:
@@ -117,6 +118,7 @@ def _load_ocr_main():
     mock_settings_mod.settings.file_naming.ollama_server_port = None
     mock_settings_mod.settings.file_naming.ollama_model = None
     mock_settings_mod.settings.file_naming.openai_api_key = None
+    mock_settings_mod.settings.ocr = OcrSettings(watchdog_enabled=False)
 
     module_patches = {
         'ocrmypdf': mock_ocrmypdf,
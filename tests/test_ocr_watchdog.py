@@ -0,0 +1,61 @@
+import os
+import time
+
+import fakeredis
+import pytest
+
+from scansynclib import ocr_watchdog
+from scansynclib.ocr_watchdog import OcrAborted, deadline_for, process_group_rss, run_supervised
+from scansynclib.ProcessItem import OCRStatus
+from scansynclib.settings_schema import OcrSettings
+
+
+def test_deadline_scales_with_pages():
+    settings = OcrSettings(timeout_base=300, timeout_per_page=30)
+    assert deadline_for(10, settings) == 600
+    assert deadline_for(0, settings) == 330
+
+
+def test_result_of_the_child_is_returned():
+    assert run_supervised(divmod, (7, 2), deadline=30, poll_interval=0.05) == (3, 1)
+
+
+def test_exceptions_of_the_child_are_raised():
+    with pytest.raises(ZeroDivisionError):
+        run_supervised(divmod, (1, 0), deadline=30, poll_interval=0.05)
+
+
+def test_child_exceeding_the_deadline_is_killed():
+    started = time.monotonic()
+    with pytest.raises(OcrAborted) as aborted:
+        run_supervised(time.sleep, (30,), deadline=0.5, poll_interval=0.05)
+    assert aborted.value.status == OCRStatus.TIMEOUT
+    assert time.monotonic() - started < 15
+
+
+def test_child_exceeding_the_memory_limit_is_killed():
+    with pytest.raises(OcrAborted) as aborted:
+        run_supervised(time.sleep, (30,), deadline=30, rss_limit=2**20, rss=lambda pid: 2**30, poll_interval=0.05)
+    assert aborted.value.status == OCRStatus.MEMORY_LIMIT
+
+
+def test_cancelled_child_is_killed():
+    with pytest.raises(OcrAborted) as aborted:
+        run_supervised(time.sleep, (30,), deadline=30, cancelled=lambda: True, poll_interval=0.05)
+    assert aborted.value.status == OCRStatus.CANCELLED
+
+
+def test_process_group_rss_counts_own_group():
+    assert process_group_rss(os.getpgrp()) > 0
+
+
+def test_cancel_requests_are_shared_through_redis(mocker):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    mocker.patch.object(ocr_watchdog, "_redis", return_value=client)
+
+    assert not ocr_watchdog.cancel_requested(5)
+    assert ocr_watchdog.request_cancel(5)
+    assert ocr_watchdog.cancel_requested(5)
+    assert not ocr_watchdog.cancel_requested(6)
+    ocr_watchdog.clear_cancel(5)
+    assert not ocr_watchdog.cancel_requested(5)
@@ -0,0 +1,127 @@
+import sys
+import types
+
+import pytest
+
+
+@pytest.fixture
+def ollama_helper(monkeypatch):
+    """Import the helper with the database replaced, sqlite_wrapper initializes it on import."""
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = lambda *args, **kwargs: None
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    monkeypatch.delitem(sys.modules, "scansynclib.ollama_helper", raising=False)
+    import scansynclib.ollama_helper as module
+    monkeypatch.setattr(module, "_keep_alive", {"seconds": None, "measured": 0.0})
+    yield module
+    sys.modules.pop("scansynclib.ollama_helper", None)
+
+
+def test_keep_alive_has_a_minimum(ollama_helper):
+    assert ollama_helper.keep_alive_for([], 7200) == ollama_helper.MIN_KEEP_ALIVE
+    assert ollama_helper.keep_alive_for([30, 60], 7200) == ollama_helper.MIN_KEEP_ALIVE
+
+
+def test_keep_alive_follows_the_scan_cadence(ollama_helper):
+    # Documents arrive about every 20 minutes
+    assert ollama_helper.keep_alive_for([1200] * 10, 7200) == 1800
+
+
+def test_keep_alive_is_capped(ollama_helper):
+    assert ollama_helper.keep_alive_for([86400] * 10, 7200) == 7200
+
+
+def test_scan_gaps_from_file_naming_jobs(ollama_helper, monkeypatch):
+    rows = [{"started": "2024-03-12 10:20:00"}, {"started": "2024-03-12 10:05:00"}, {"started": "2024-03-12 10:00:00"}]
+    monkeypatch.setattr(ollama_helper, "execute_query", lambda *args, **kwargs: rows)
+    assert ollama_helper.scan_gaps() == [300.0, 900.0]
+
+
+def test_warm_up_loads_the_model_with_keep_alive(ollama_helper, mocker):
+    file_naming = types.SimpleNamespace(ollama_server_url="http://ollama", ollama_server_port=11434, ollama_model="llama3.2", ollama_keep_alive_max=60)
+    mocker.patch.object(ollama_helper, "settings", types.SimpleNamespace(file_naming=file_naming))
+    mocker.patch.object(ollama_helper, "scan_gaps", return_value=[])
+    session = mocker.Mock()
+    session.post.return_value = mocker.Mock(status_code=200, json=lambda: {"model": "llama3.2", "load_duration": 4_200_000_000})
+    mocker.patch.object(ollama_helper.http_clients, "session", return_value=session)
+    observe = mocker.patch.object(ollama_helper.metrics, "observe")
+
+    assert ollama_helper.warm_up_model()
+
+    url, = session.post.call_args.args
+    assert url == "http://ollama:11434/api/generate"
+    assert session.post.call_args.kwargs["json"] == {"model": "llama3.2", "stream": False, "keep_alive": ollama_helper.MIN_KEEP_ALIVE}
+    assert observe.call_args.args[:2] == ("scansync_ollama_model_load_seconds", 4.2)
+
+
+def test_warm_up_without_ollama_configured(ollama_helper, mocker):
+    file_naming = types.SimpleNamespace(ollama_server_url="", ollama_server_port=11434, ollama_model="", ollama_keep_alive_max=60)
+    mocker.patch.object(ollama_helper, "settings", types.SimpleNamespace(file_naming=file_naming))
+    session = mocker.patch.object(ollama_helper.http_clients, "session")
+
+    assert not ollama_helper.warm_up_model()
+    session.assert_not_called()
+
+
+def _chunks(*parts, done=False):
+    lines = [f'{{"response": {part!r}}}'.replace("'", '"') for part in parts]
+    if done:
+        lines.append('{"response": "", "done": true, "load_duration": 1000}')
+    return lines
+
+
+def test_stream_stops_at_the_first_line_break(ollama_helper):
+    consumed = []
+
+    def lines():
+        for line in _chunks("Invoice", "_ACME", "\n", "This filename was chosen because", " the document is an invoice"):
+            consumed.append(line)
+            yield line
+
+    filename, last = ollama_helper.read_filename_stream(lines())
+    assert filename == "Invoice_ACME"
+    assert len(consumed) == 3
+
+
+def test_stream_skips_leading_line_breaks(ollama_helper):
+    filename, _ = ollama_helper.read_filename_stream(_chunks("\n", "Tax_Return_2024", done=True))
+    assert filename == "Tax_Return_2024"
+
+
+def test_stream_stops_at_the_character_budget(ollama_helper):
+    filename, last = ollama_helper.read_filename_stream(_chunks("A" * 20, "B" * 20, "C" * 20))
+    assert filename == "A" * 20 + "B" * 10
+    assert not last.get("done")
+
+
+def test_stream_read_to_the_end_returns_statistics(ollama_helper):
+    filename, last = ollama_helper.read_filename_stream(_chunks("Invoice", done=True))
+    assert filename == "Invoice"
+    assert last["load_duration"] == 1000
+
+
+def test_stream_reports_the_first_chunk(ollama_helper):
+    first = []
+    ollama_helper.read_filename_stream(_chunks("Invoice", "_ACME", "\n"), on_first_chunk=first.append)
+    assert first == [{"response": "Invoice"}]
+
+
+def test_request_is_timed_until_the_stream_was_read(ollama_helper, mocker):
+    file_naming = types.SimpleNamespace(ollama_model="llama3.2", ollama_streaming=True, excerpt_budget=lambda model: 1000)
+    mocker.patch.object(ollama_helper, "settings", types.SimpleNamespace(file_naming=file_naming))
+    mocker.patch.object(ollama_helper.text_store, "get_text", return_value="Rechnung")
+    mocker.patch.object(ollama_helper.filename_cache, "lookup", return_value=None)
+    mocker.patch.object(ollama_helper.filename_cache, "put")
+    mocker.patch.object(ollama_helper.circuit_breaker, "allow", return_value=True)
+    mocker.patch.object(ollama_helper, "keep_alive_seconds", return_value=None)
+    observed = []
+    mocker.patch.object(ollama_helper.metrics, "observe", side_effect=lambda name, *args, **kwargs: observed.append(name))
+
+    def lines():
+        observed.append("read")
+        yield from _chunks("Invoice", "\n")
+    mocker.patch.object(ollama_helper, "post_to_ollama", return_value=mocker.Mock(status_code=200, iter_lines=lines))
+    item = types.SimpleNamespace(filename="doc.pdf", filename_without_extension="doc", ocr_file="doc_OCR.pdf", file_naming_db_id=1)
+
+    assert ollama_helper.generate_filename_ollama(item) == "Invoice"
+    assert observed == ["read", "scansync_ollama_first_chunk_seconds", "scansync_llm_request_seconds"]
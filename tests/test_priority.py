@@ -0,0 +1,38 @@
+from scansynclib.priority import compute_priority, clamp_share_priority, PRIORITY_SMALL, PRIORITY_MEDIUM, PRIORITY_LARGE
+from scansynclib.rabbitmq import MAX_PRIORITY
+from scansynclib.settings_schema import PrioritySettings
+
+
+def test_small_documents_get_highest_base_priority():
+    assert compute_priority(1) == PRIORITY_SMALL
+    assert compute_priority(5) == PRIORITY_SMALL
+
+
+def test_large_documents_get_lowest_base_priority():
+    assert compute_priority(20) == PRIORITY_MEDIUM
+    assert compute_priority(300) == PRIORITY_LARGE
+
+
+def test_unknown_page_count_is_treated_as_single_page():
+    assert compute_priority(0) == PRIORITY_SMALL
+    assert compute_priority(None) == PRIORITY_SMALL
+
+
+def test_share_priority_is_added_and_result_clamped():
+    assert compute_priority(300, share_priority=3) == PRIORITY_LARGE + 3
+    assert compute_priority(1, share_priority=3) <= MAX_PRIORITY
+    assert compute_priority(300, share_priority=-3) >= 0
+
+
+def test_thresholds_come_from_settings():
+    settings = PrioritySettings(small_document_pages=1, large_document_pages=2)
+    assert compute_priority(2, priority_settings=settings) == PRIORITY_MEDIUM
+    assert compute_priority(3, priority_settings=settings) == PRIORITY_LARGE
+
+
+def test_clamp_share_priority_handles_invalid_values():
+    assert clamp_share_priority("2") == 2
+    assert clamp_share_priority("high") == 0
+    assert clamp_share_priority(None) == 0
+    assert clamp_share_priority(10) == 3
+    assert clamp_share_priority(-10) == -3
@@ -0,0 +1,61 @@
+from scansynclib.prompt_excerpt import build_excerpt, estimate_tokens, is_heading, is_relevant
+from scansynclib.settings_schema import FileNamingSettings
+
+LETTER = "\n".join([
+    "Stadtwerke Musterstadt GmbH",
+    "Hauptstraße 1, 12345 Musterstadt",
+    "RECHNUNG",
+    "Rechnungsdatum: 12.03.2024",
+] + [f"Position {i} Grundgebühr Strom laut Tarif" for i in range(40)])
+
+SECOND_PAGE = "\n".join(
+    [f"Erläuterung {i} zu Ihrem Tarif und den gesetzlichen Bestimmungen" for i in range(200)]
+    + ["Gesamtbetrag 123,45 €", "Zahlbar bis 01.04.2024"]
+)
+
+
+def test_short_text_is_unchanged():
+    assert build_excerpt("Invoice 42\nTotal 10 EUR", 100) == "Invoice 42\nTotal 10 EUR"
+    assert build_excerpt("", 100) == ""
+
+
+def test_excerpt_stays_within_budget():
+    excerpt = build_excerpt(LETTER + "\f" + SECOND_PAGE, 200)
+    assert estimate_tokens(excerpt) <= 200
+
+
+def test_excerpt_keeps_first_page_and_relevant_lines_of_later_pages():
+    excerpt = build_excerpt(LETTER + "\f" + SECOND_PAGE, 200)
+    lines = excerpt.splitlines()
+    assert lines[:4] == ["Stadtwerke Musterstadt GmbH", "Hauptstraße 1, 12345 Musterstadt", "RECHNUNG", "Rechnungsdatum: 12.03.2024"]
+    assert "Gesamtbetrag 123,45 €" in lines
+    assert "Zahlbar bis 01.04.2024" in lines
+    assert not any(line.startswith("Erläuterung") for line in lines)
+
+
+def test_excerpt_truncates_an_overlong_line():
+    excerpt = build_excerpt("Lorem ipsum dolor sit amet. " * 400, 1500)
+    assert excerpt.startswith("Lorem ipsum dolor sit amet.")
+    assert 0 < estimate_tokens(excerpt) <= 1500
+
+
+def test_excerpt_of_text_without_relevant_lines_is_never_empty():
+    excerpt = build_excerpt("\f" + "lorem ipsum dolor sit amet\n" * 500, 100)
+    assert excerpt
+    assert estimate_tokens(excerpt) <= 100
+
+
+def test_relevant_lines():
+    assert is_heading("RECHNUNG")
+    assert is_heading("Betreff: Ihre Kündigung")
+    assert not is_heading("Wir bedanken uns für Ihren Auftrag und freuen uns auf die weitere Zusammenarbeit.")
+    assert is_relevant("Invoice date 2024-03-12")
+    assert is_relevant("Total $ 19.99")
+    assert is_relevant("Example Ltd, contact@example.com")
+    assert not is_relevant("thank you for your business")
+
+
+def test_excerpt_budget_per_model():
+    file_naming = FileNamingSettings(excerpt_tokens=1000, excerpt_tokens_per_model={"llama3.2:1b": 400})
+    assert file_naming.excerpt_budget("llama3.2:1b") == 400
+    assert file_naming.excerpt_budget("gpt-4.1-nano") == 1000
@@ -1,4 +1,5 @@
 import pickle
+import threading
 
 import pika.exceptions
 import pytest
@@ -18,6 +19,8 @@ class FakeChannel:
         self.is_open = True
         self.channel_number = 1
         self.queue_declare_calls = []
+        self.queue_declare_arguments = {}
+        self.queue_declare_side_effect = None
         self.exchange_declare_calls = []
         self.basic_publish_calls = []
         self.basic_qos_calls = []
@@ -28,8 +31,13 @@ class FakeChannel:
     def basic_qos(self, prefetch_count=1):
         self.basic_qos_calls.append(prefetch_count)
 
-    def queue_declare(self, queue, durable=True):
+    def queue_declare(self, queue, durable=True, arguments=None, passive=False):
+        if self.queue_declare_side_effect is not None and not passive:
+            effect = self.queue_declare_side_effect
+            self.queue_declare_side_effect = None
+            raise effect
         self.queue_declare_calls.append(queue)
+        self.queue_declare_arguments[queue] = arguments
 
     def exchange_declare(self, exchange, exchange_type="fanout"):
         self.exchange_declare_calls.append((exchange, exchange_type))
@@ -54,6 +62,7 @@ class FakeConnection:
     def __init__(self, channel):
         self.is_open = True
         self._channel = channel
+        channel.connection = self
         self.process_data_events_calls = []
 
     def channel(self):
@@ -154,6 +163,45 @@ def test_forward_to_rabbitmq_pickles_item(mocker):
     assert kwargs["queue_name"] == "upload_queue"
 
 
+def test_forward_to_rabbitmq_passes_item_priority(mocker):
+    publish = mocker.patch.object(rabbitmq._publisher, "publish", return_value=True)
+
+    item = _ForwardItem()
+    item.priority = 8
+    rabbitmq.forward_to_rabbitmq("upload_queue", item)
+    assert publish.call_args.kwargs["priority"] == 8
+
+
+def test_stage_queues_are_declared_with_max_priority(fake_broker):
+    client = RabbitMQClient(name="test")
+    client.publish(b"payload", queue_name="ocr_queue")
+    client.publish(b"payload", queue_name="metadata_queue")
+
+    channel = fake_broker["channels"][0]
+    assert channel.queue_declare_arguments["ocr_queue"] == {"x-max-priority": rabbitmq.MAX_PRIORITY}
+    assert channel.queue_declare_arguments["metadata_queue"] is None
+
+
+def test_publish_sets_clamped_message_priority(fake_broker):
+    client = RabbitMQClient(name="test")
+    client.publish(b"payload", queue_name="ocr_queue", priority=42)
+
+    _, _, _, properties = fake_broker["channels"][0].basic_publish_calls[0]
+    assert properties.priority == rabbitmq.MAX_PRIORITY
+    assert properties.delivery_mode == 2
+
+
+def test_existing_queue_without_priority_falls_back_to_passive_declare(fake_broker):
+    client = RabbitMQClient(name="test")
+    assert client.ensure_connection() is True
+    channel = fake_broker["channels"][0]
+    channel.queue_declare_side_effect = pika.exceptions.ChannelClosedByBroker(406, "PRECONDITION_FAILED")
+
+    assert client.publish(b"payload", queue_name="ocr_queue", priority=5) is True
+    assert channel.queue_declare_calls == ["ocr_queue"]
+    assert len(channel.basic_publish_calls) == 1
+
+
 def test_consume_reconnects_on_connection_error(fake_broker):
     client = RabbitMQClient(name="test")
 
@@ -181,6 +229,30 @@ def test_consume_reconnects_on_connection_error(fake_broker):
     assert fake_broker["blocking"].call_count == 2
 
 
+def test_reopened_channel_keeps_the_consumer_prefetch(fake_broker):
+    client = RabbitMQClient(name="test")
+
+    def on_message(ch, method, properties, body):
+        pass
+
+    def prime_channel(*args, **kwargs):
+        channel = FakeChannel()
+        channel.start_consuming_side_effect = [KeyboardInterrupt()]
+        fake_broker["channels"].append(channel)
+        return FakeConnection(channel)
+
+    fake_broker["blocking"].side_effect = prime_channel
+    with pytest.raises(KeyboardInterrupt):
+        client.consume("q", on_message, prefetch_count=8)
+
+    # e.g. after a passive declare of a missing queue closed the channel
+    client._reopen_channel()
+    assert fake_broker["channels"][0].basic_qos_calls[-1] == 8
+    client.close()
+    client.ensure_connection()
+    assert fake_broker["channels"][1].basic_qos_calls == [8]
+
+
 def test_connect_rabbitmq_returns_connection_and_channel(fake_broker):
     result = rabbitmq.connect_rabbitmq(["a", "b"])
     assert result is not None
@@ -188,6 +260,22 @@ def test_connect_rabbitmq_returns_connection_and_channel(fake_broker):
     assert channel.queue_declare_calls == ["a", "b"]
 
 
+def test_connect_rabbitmq_keeps_existing_queues_without_priority(fake_broker):
+    def reject_priorities(*args, **kwargs):
+        channel = FakeChannel()
+        channel.queue_declare_side_effect = pika.exceptions.ChannelClosedByBroker(406, "PRECONDITION_FAILED")
+        fake_broker["channels"].append(channel)
+        return FakeConnection(channel)
+
+    fake_broker["blocking"].side_effect = reject_priorities
+    result = rabbitmq.connect_rabbitmq(["ocr_queue", "a"])
+
+    assert result is not None
+    connection, channel = result
+    assert channel.queue_declare_calls == ["ocr_queue", "a"]
+    assert channel.basic_qos_calls == [1]
+
+
 def test_connect_rabbitmq_returns_none_on_failure(mocker):
     mocker.patch("scansynclib.rabbitmq.time.sleep")
     mocker.patch(
@@ -202,3 +290,74 @@ def test_process_events_services_heartbeats(fake_broker):
     client.ensure_connection()
     client.process_events(1)
     assert fake_broker["connections"][0].process_data_events_calls == [1]
+
+
+def test_queue_depth_uses_passive_declare(fake_broker, mocker):
+    client = RabbitMQClient(name="test")
+    assert client.ensure_connection() is True
+    channel = fake_broker["channels"][0]
+    result = mocker.Mock()
+    result.method.message_count = 17
+    channel.queue_declare = mocker.Mock(return_value=result)
+
+    assert client.queue_depth("ocr_queue") == 17
+    channel.queue_declare.assert_called_once_with(queue="ocr_queue", passive=True)
+
+
+def test_queue_depth_of_missing_queue_is_zero(fake_broker, mocker):
+    client = RabbitMQClient(name="test")
+    assert client.ensure_connection() is True
+    channel = fake_broker["channels"][0]
+    channel.queue_declare = mocker.Mock(side_effect=pika.exceptions.ChannelClosedByBroker(404, "NOT_FOUND"))
+
+    assert client.queue_depth("missing_queue") == 0
+
+
+def test_queue_depth_with_timeout_tries_once(mocker):
+    sleep = mocker.patch("scansynclib.rabbitmq.time.sleep")
+    blocking = mocker.patch(
+        "scansynclib.rabbitmq.pika.BlockingConnection",
+        side_effect=pika.exceptions.AMQPConnectionError("down"),
+    )
+    client = RabbitMQClient(name="test")
+
+    assert client.queue_depth("ocr_queue", timeout=2) is None
+    assert blocking.call_count == 1
+    assert blocking.call_args.args[0].socket_timeout == 2
+    sleep.assert_not_called()
+
+
+def test_queue_depth_with_timeout_skips_a_busy_client(fake_broker):
+    client = RabbitMQClient(name="test")
+    holder = threading.Thread(target=client._lock.acquire)
+    holder.start()
+    holder.join()
+
+    assert client.queue_depth("ocr_queue", timeout=0.01) is None
+    assert fake_broker["blocking"].call_count == 0
+
+
+def test_ack_threadsafe_acks_on_the_connection_thread(mocker):
+    channel = mocker.Mock()
+    channel.connection.add_callback_threadsafe.side_effect = lambda callback: threading.Thread(target=callback).start()
+
+    rabbitmq.ack_threadsafe(channel, 42)
+
+    channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_ack_threadsafe_raises_when_the_ack_fails(mocker):
+    channel = mocker.Mock()
+    channel.basic_ack.side_effect = pika.exceptions.ChannelClosed(406, "closed")
+    channel.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+
+    with pytest.raises(pika.exceptions.AMQPError):
+        rabbitmq.ack_threadsafe(channel, 42)
+
+
+def test_ack_threadsafe_times_out_without_connection_thread(mocker):
+    channel = mocker.Mock()
+
+    with pytest.raises(pika.exceptions.AMQPError):
+        rabbitmq.ack_threadsafe(channel, 42, timeout=0.01)
+    channel.basic_ack.assert_not_called()
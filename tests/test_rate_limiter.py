@@ -0,0 +1,91 @@
+import pytest
+import redis
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from scansynclib.rate_limiter import RateLimiter  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def _limiter(client, clock, rpm, tpm):
+    return RateLimiter("openai", lambda: (rpm, tpm), redis_factory=lambda: client, clock=clock, sleep=clock.sleep)
+
+
+def test_requests_per_minute(client):
+    clock = FakeClock()
+    limiter = _limiter(client, clock, 2, 0)
+
+    assert limiter.try_acquire(0) == 0
+    assert limiter.try_acquire(0) == 0
+    # The bucket refills with one request every 30 seconds.
+    assert limiter.try_acquire(0) == pytest.approx(30)
+
+    clock.now += 30
+    assert limiter.try_acquire(0) == 0
+
+
+def test_tokens_per_minute(client):
+    clock = FakeClock()
+    limiter = _limiter(client, clock, 0, 1000)
+
+    assert limiter.try_acquire(800) == 0
+    assert limiter.try_acquire(500) == pytest.approx(18)
+
+
+def test_buckets_are_shared_between_replicas(client):
+    clock = FakeClock()
+    first, second = _limiter(client, clock, 1, 0), _limiter(client, clock, 1, 0)
+
+    assert first.try_acquire(0) == 0
+    assert second.try_acquire(0) > 0
+
+
+def test_acquire_waits_for_refill(client):
+    clock = FakeClock()
+    limiter = _limiter(client, clock, 60, 0)
+    for _ in range(60):
+        assert limiter.acquire() == 0
+
+    assert limiter.acquire() == pytest.approx(1)
+
+
+def test_oversized_request_waits_for_a_full_bucket(client):
+    clock = FakeClock()
+    limiter = _limiter(client, clock, 0, 100)
+
+    assert limiter.acquire(500) == 0
+    assert limiter.acquire(500) == pytest.approx(60)
+
+
+def test_disabled_limits_never_touch_redis(client):
+    limiter = RateLimiter("openai", lambda: (0, 0), redis_factory=lambda: pytest.fail("Redis used"))
+    assert limiter.acquire(100) == 0
+
+
+def test_drain_makes_all_replicas_wait(client):
+    clock = FakeClock()
+    limiter = _limiter(client, clock, 60, 0)
+    limiter.drain()
+    assert limiter.try_acquire(0) == pytest.approx(1)
+
+
+def test_unreachable_redis_does_not_block():
+    def broken():
+        raise redis.ConnectionError("down")
+    limiter = RateLimiter("openai", lambda: (1, 0), redis_factory=broken)
+    assert limiter.acquire() >= 0
@@ -0,0 +1,176 @@
+import sqlite3
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+from scansynclib import remote_rename
+from scansynclib.ProcessItem import OneDriveDestination, ProcessStatus
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Back the lazily imported execute_query with a throwaway SQLite database."""
+    db_file = tmp_path / "test.db"
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA.read_text())
+    conn.execute("INSERT INTO scanneddata (id, file_name, local_filepath, file_status) VALUES (1, 'scan_001.pdf', 'Rechnungen', 'Completed')")
+    conn.commit()
+    conn.close()
+
+    def execute_query(query, params=(), fetchone=False, return_rowcount=False, **kwargs):
+        with sqlite3.connect(db_file) as connection:
+            connection.row_factory = sqlite3.Row
+            cursor = connection.execute(query, params)
+            if fetchone:
+                return cursor.fetchone()
+            if return_rowcount:
+                return cursor.rowcount
+            return True
+
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = execute_query
+    stub.notify_sse_clients = lambda item: None
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return execute_query
+
+
+@pytest.fixture
+def notified(database, monkeypatch):
+    """Items published to the dashboard."""
+    items = []
+    monkeypatch.setattr(sys.modules["scansynclib.sqlite_wrapper"], "notify_sse_clients", items.append)
+    return items
+
+
+@pytest.fixture
+def renames(monkeypatch):
+    """Replace the Graph PATCH, onedrive_api needs a token on import."""
+    calls = []
+
+    def rename_item(drive_id, item_id, name):
+        calls.append((drive_id, item_id, name))
+        return {"name": name, "webUrl": f"https://onedrive/{item_id}/{name}"}
+
+    stub = types.ModuleType("scansynclib.onedrive_api")
+    stub.rename_item = rename_item
+    monkeypatch.setitem(sys.modules, "scansynclib.onedrive_api", stub)
+    return calls
+
+
+@pytest.fixture
+def item():
+    destination = OneDriveDestination("/Rechnungen", "folder", "drive")
+    destination.item_id = "item-1"
+    destination.web_url = "https://onedrive/item-1/scan_001.pdf"
+    return types.SimpleNamespace(db_id=1, filename="scan_001.pdf", filename_without_extension="scan_001", OneDriveDestinations=[destination],
+                                 status=ProcessStatus.SYNC_PENDING)
+
+
+def test_named_before_upload(database, renames, item):
+    remote_rename.record_filename(item, "2024-03-12_Stadtwerke_Rechnung")
+    assert renames == []
+
+    remote_rename.record_uploaded(item)
+
+    assert renames == [("drive", "item-1", "2024-03-12_Stadtwerke_Rechnung.pdf")]
+    row = database("SELECT file_name, web_url FROM scanneddata WHERE id = 1", fetchone=True)
+    assert row["file_name"] == "2024-03-12_Stadtwerke_Rechnung.pdf"
+    assert row["web_url"] == "https://onedrive/item-1/2024-03-12_Stadtwerke_Rechnung.pdf"
+
+
+def test_uploaded_before_naming(database, renames, item):
+    remote_rename.record_uploaded(item)
+    assert renames == []
+
+    remote_rename.record_filename(item, "Stadtwerke_Rechnung")
+
+    assert renames == [("drive", "item-1", "Stadtwerke_Rechnung.pdf")]
+    assert item.filename == "Stadtwerke_Rechnung.pdf"
+
+
+def test_rename_is_claimed_once(database, renames, item):
+    remote_rename.record_uploaded(item)
+    remote_rename.record_filename(item, "Stadtwerke_Rechnung")
+
+    assert not remote_rename.claim(item.db_id)
+    assert not remote_rename.try_rename(item)
+    assert len(renames) == 1
+
+
+def test_failed_rename_keeps_the_upload(database, item, monkeypatch):
+    stub = types.ModuleType("scansynclib.onedrive_api")
+    stub.rename_item = lambda *args: None
+    monkeypatch.setitem(sys.modules, "scansynclib.onedrive_api", stub)
+
+    remote_rename.record_uploaded(item)
+    remote_rename.record_filename(item, "Stadtwerke_Rechnung")
+
+    assert database("SELECT file_name FROM scanneddata WHERE id = 1", fetchone=True)["file_name"] == "scan_001.pdf"
+    row = database("SELECT error_description, claimed FROM remote_renames WHERE scanneddata_id = 1", fetchone=True)
+    assert row["error_description"] == "Failed to rename 1 of 1 uploaded files"
+    assert row["claimed"] == 0
+
+
+def test_failed_rename_is_tried_again(database, item, monkeypatch):
+    answers = [OSError("Graph is unreachable"), {"name": "Stadtwerke_Rechnung.pdf"}]
+
+    def rename_item(*args):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    stub = types.ModuleType("scansynclib.onedrive_api")
+    stub.rename_item = rename_item
+    monkeypatch.setitem(sys.modules, "scansynclib.onedrive_api", stub)
+
+    remote_rename.record_uploaded(item)
+    remote_rename.record_filename(item, "Stadtwerke_Rechnung")
+    assert database("SELECT file_name FROM scanneddata WHERE id = 1", fetchone=True)["file_name"] == "scan_001.pdf"
+
+    remote_rename.record_filename(item, "Stadtwerke_Rechnung")
+    assert database("SELECT file_name FROM scanneddata WHERE id = 1", fetchone=True)["file_name"] == "Stadtwerke_Rechnung.pdf"
+
+
+def test_dashboard_shows_the_new_name_with_the_current_status(database, notified, renames, item):
+    remote_rename.record_uploaded(item)
+    remote_rename.record_filename(item, "Stadtwerke_Rechnung")
+
+    assert notified == [item]
+    assert item.status == ProcessStatus.COMPLETED
+    assert item.OneDriveDestinations[0].web_url == "https://onedrive/item-1/Stadtwerke_Rechnung.pdf"
+    # The status of the document is left alone
+    assert database("SELECT file_status FROM scanneddata WHERE id = 1", fetchone=True)["file_status"] == "Completed"
+
+
+def test_throttled_renames_are_retried(mocker):
+    from tenacity import wait_none
+    from scansynclib import onedrive_api
+
+    throttled = mocker.Mock(status_code=429, text="Too Many Requests")
+    throttled.raise_for_status.side_effect = onedrive_api.requests.exceptions.HTTPError("429")
+    renamed = mocker.Mock(status_code=200)
+    renamed.json.return_value = {"name": "Stadtwerke_Rechnung.pdf"}
+    mocker.patch.object(onedrive_api, "get_access_token", return_value="token")
+    session = mocker.patch.object(onedrive_api.http_clients, "session")
+    session.return_value.patch.side_effect = [throttled, renamed]
+
+    rename_item = onedrive_api.rename_item.retry_with(wait=wait_none())
+    assert rename_item("drive", "item-1", "Stadtwerke_Rechnung.pdf") == {"name": "Stadtwerke_Rechnung.pdf"}
+    assert session.return_value.patch.call_count == 2
+
+
+def test_refused_renames_are_not_retried(mocker):
+    from tenacity import wait_none
+    from scansynclib import onedrive_api
+
+    mocker.patch.object(onedrive_api, "get_access_token", return_value="token")
+    session = mocker.patch.object(onedrive_api.http_clients, "session")
+    session.return_value.patch.return_value = mocker.Mock(status_code=403, text="Forbidden")
+
+    assert onedrive_api.rename_item.retry_with(wait=wait_none())("drive", "item-1", "Stadtwerke_Rechnung.pdf") is None
+    assert session.return_value.patch.call_count == 1
@@ -0,0 +1,146 @@
+import sqlite3
+import sys
+import types
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from scansynclib import rule_namer
+from scansynclib.settings_schema import FileNamingSettings, NamingRule
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+LETTER = "\n".join([
+    "Stadtwerke Musterstadt GmbH, Hauptstraße 1, 12345 Musterstadt",
+    "Herrn Max Mustermann",
+    "Rechnungsdatum: 12.03.2024",
+    "Rechnung Nr. 4711",
+    "Kundennummer: 100234",
+    "Zahlbar bis 01.04.2024",
+]) + "\fSeite 2 mit Erläuterungen vom 01.01.2023"
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Replace the database, sqlite_wrapper initializes the real one on import."""
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA.read_text())
+
+    def execute_query(query, params=(), fetchall=False, return_scalar=False, **kwargs):
+        rows = conn.execute(query, params).fetchall()
+        conn.commit()
+        if return_scalar:
+            return rows[0][0] if rows else None
+        return rows if fetchall else None
+
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = execute_query
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return conn
+
+
+@pytest.fixture
+def file_naming(monkeypatch):
+    settings = FileNamingSettings()
+    monkeypatch.setattr(rule_namer, "_settings", lambda: settings)
+    return settings
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Datum: 12.03.2024", date(2024, 3, 12)),
+    ("Invoice date 2024-03-12", date(2024, 3, 12)),
+    ("Berlin, 5. März 2024", date(2024, 3, 5)),
+    ("March 5, 2024", date(2024, 3, 5)),
+    ("vom 12.03.24", date(2024, 3, 12)),
+    ("Version 31.02.2024", None),
+    ("Telefon 0123/45/6789", None),
+])
+def test_parse_date(line, expected):
+    assert rule_namer.parse_date(line) == expected
+
+
+def test_document_date_prefers_labeled_dates_and_skips_due_dates():
+    lines = ["Zahlbar bis 01.04.2024", "Leistungszeitraum 01.02.2024", "Datum: 12.03.2024"]
+    assert rule_namer.extract_date(lines) == date(2024, 3, 12)
+    assert rule_namer.extract_date(lines[:2]) == date(2024, 2, 1)
+
+
+def test_sender_candidates_without_legal_form_and_address():
+    lines = ["Stadtwerke Musterstadt GmbH, Hauptstraße 1", "Von: Hausverwaltung Meier", "Musterbank AG", "Herrn Max Mustermann"]
+    assert rule_namer.sender_candidates(lines) == ["Stadtwerke Musterstadt", "Hausverwaltung Meier", "Musterbank"]
+
+
+def test_document_type_keeps_the_language():
+    assert rule_namer.document_type(["RECHNUNG Nr. 4711"]) == "Rechnung"
+    assert rule_namer.document_type(["Your invoice"]) == "Invoice"
+    assert rule_namer.document_type(["Mahnung zur Rechnung 4711"]) == "Mahnung"
+    assert rule_namer.document_type(["Sehr geehrter Herr Mustermann"]) is None
+
+
+def test_unknown_sender_is_not_confident(database, file_naming):
+    suggestion = rule_namer.suggest(LETTER, "Rechnungen")
+    assert suggestion.filename == "2024-03-12_Stadtwerke_Musterstadt_Rechnung"
+    assert suggestion.confidence < file_naming.rules_min_confidence
+
+
+def test_learned_sender_is_confident(database, file_naming):
+    for _ in range(rule_namer.MIN_SENDER_HITS):
+        rule_namer.learn("Rechnungen", LETTER, "Stadtwerke_Rechnung_Maerz")
+    suggestion = rule_namer.suggest(LETTER, "Rechnungen")
+    assert suggestion.filename == "2024-03-12_Stadtwerke_Musterstadt_Rechnung"
+    assert suggestion.confidence >= file_naming.rules_min_confidence
+    # The vocabulary is per share
+    assert rule_namer.suggest(LETTER, "Privat").confidence < file_naming.rules_min_confidence
+
+
+def test_recipient_is_not_learned_as_sender(database, file_naming):
+    for _ in range(rule_namer.MIN_SENDER_HITS):
+        rule_namer.learn("S", LETTER, "Mustermann_Stadtwerke_Rechnung")
+    assert rule_namer.known_senders("S") == {"Stadtwerke Musterstadt": 2}
+
+    other = "\n".join(["Finanzamt Musterstadt", "Herrn Max Mustermann", "Musterweg 2", "12345 Musterstadt", "Datum: 05.10.2024", "Bescheid"])
+    suggestion = rule_namer.suggest(other, "S")
+    assert "Mustermann" not in suggestion.filename
+    assert suggestion.confidence < file_naming.rules_min_confidence
+
+
+def test_sender_the_llm_did_not_name_is_not_learned(database, file_naming):
+    rule_namer.learn("S", LETTER, "Stromrechnung_Maerz")
+    assert rule_namer.known_senders("S") == {}
+
+
+def test_senders_of_most_documents_are_ignored(database, file_naming):
+    for _ in range(rule_namer.MIN_SHARE_DOCUMENTS):
+        rule_namer.learn("S", LETTER, "Stadtwerke_Rechnung")
+    assert rule_namer.known_senders("S") == {}
+    for _ in range(rule_namer.MIN_SHARE_DOCUMENTS):
+        rule_namer.learn("S", "Musterbank AG\nKontoauszug", "Musterbank_Kontoauszug")
+    assert rule_namer.known_senders("S") == {"Stadtwerke Musterstadt": 5, "Musterbank": 5}
+
+
+def test_sender_lines_skip_the_address_block():
+    lines = ["Stadtwerke Musterstadt GmbH", "Herrn Max Mustermann", "Musterweg 2", "12345 Musterstadt", "Rechnung"]
+    assert rule_namer.sender_lines(lines) == ["Stadtwerke Musterstadt GmbH", "Rechnung"]
+
+
+def test_template_of_the_share_wins(database, file_naming):
+    file_naming.naming_rules = {
+        "Rechnungen": [NamingRule(pattern=r"Kundennummer:\s*(?P<customer>\d+)", template="{date}_Stadtwerke_{customer}")],
+        "*": [NamingRule(pattern=r"Rechnung", template="{date}_{unknown_field}")],
+    }
+    suggestion = rule_namer.suggest(LETTER, "Rechnungen")
+    assert (suggestion.filename, suggestion.confidence, suggestion.rule) == ("2024-03-12_Stadtwerke_100234", 1.0, "template")
+    # The template for all shares can't be filled, the composed name is suggested
+    assert rule_namer.suggest(LETTER, "Privat").rule == "composed"
+
+
+def test_invalid_template_pattern_is_skipped(database, file_naming):
+    file_naming.naming_rules = {"*": [NamingRule(pattern="(unclosed", template="{date}")]}
+    assert rule_namer.suggest(LETTER, "Rechnungen").rule == "composed"
+
+
+def test_nothing_to_suggest(database, file_naming):
+    assert rule_namer.suggest("", "Rechnungen") is None
+    assert rule_namer.suggest("Sehr geehrte Damen und Herren,\nvielen Dank.", "Rechnungen") is None
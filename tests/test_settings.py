@@ -223,3 +223,31 @@ def test_ollama_server_port_strict_int_validation():
             ollama_server_port=70000,
             ollama_model="llama3"
         )
+
+
+def test_ocr_profiles_defaults():
+    from scansynclib.settings_schema import OcrSettings
+    ocr = OcrSettings()
+    archival = ocr.profile().ocrmypdf_options()
+    assert archival["output_type"] == "pdfa"
+    assert archival["optimize"] == 2
+    assert archival["language"] == ["eng", "deu"]
+
+    fast = ocr.profile("fast").ocrmypdf_options()
+    assert fast["output_type"] == "pdf"
+    assert fast["optimize"] == 0
+    assert "jpg_quality" not in fast
+
+
+def test_unknown_ocr_profile_falls_back_to_default():
+    from scansynclib.settings_schema import OcrProfile, OcrSettings
+    ocr = OcrSettings(profiles={"inbox": OcrProfile(languages=["deu"])}, default_profile="inbox")
+    assert ocr.profile("missing").languages == ["deu"]
+    assert OcrSettings(profiles={}).profile().output_type == "pdfa"
+
+
+def test_ocr_profiles_json_roundtrip():
+    s = SettingsSchema()
+    s.ocr.profiles["custom"] = s.ocr.profiles["fast"].model_copy(update={"languages": ["fra"]})
+    restored = SettingsSchema.model_validate_json(s.model_dump_json())
+    assert restored.ocr.profile("custom").languages == ["fra"]
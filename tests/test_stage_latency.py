@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+from scansynclib import stage_latency
+from scansynclib.ProcessItem import ProcessStatus
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA.read_text())
+    conn.execute("INSERT INTO scanneddata (id, file_name, local_filepath, pdf_pages) VALUES (1, 'doc.pdf', 'Invoices', 3)")
+    yield conn.cursor()
+    conn.close()
+
+
+def test_page_bucket():
+    assert stage_latency.page_bucket(0) == "1"
+    assert stage_latency.page_bucket(3) == "2-5"
+    assert stage_latency.page_bucket(300) == "100+"
+
+
+def test_status_durations():
+    transitions = [
+        (ProcessStatus.OCR_PENDING.value, 0.0),
+        (ProcessStatus.OCR.value, 10.0),
+        (ProcessStatus.SYNC_PENDING.value, 40.0),
+        (ProcessStatus.COMPLETED.value, 45.0),
+    ]
+    durations = stage_latency.status_durations(transitions)
+    assert durations == {"ocr_pending": 10.0, "ocr": 30.0, "sync_pending": 5.0, "total": 45.0}
+
+
+def test_record_transition_skips_repeated_status(cursor):
+    stage_latency.record_transition(cursor, 1, ProcessStatus.SYNC, at=1.0)
+    stage_latency.record_transition(cursor, 1, ProcessStatus.SYNC, at=2.0)
+    stage_latency.record_transition(cursor, 1, ProcessStatus.COMPLETED, at=3.0)
+    cursor.execute("SELECT status, status_code, at FROM status_transitions ORDER BY id")
+    assert cursor.fetchall() == [("Syncing", 4, 1.0), ("Completed", 5, 3.0)]
+
+
+def test_rollup_document_is_incremental_and_only_once(cursor):
+    for status, at in ((ProcessStatus.OCR_PENDING, 0.0), (ProcessStatus.OCR, 4.0), (ProcessStatus.COMPLETED, 100.0)):
+        stage_latency.record_transition(cursor, 1, status, at=at)
+
+    assert stage_latency.rollup_document(cursor, 1) is True
+    assert stage_latency.rollup_document(cursor, 1) is False
+
+    cursor.execute("SELECT stage, smb_name, page_bucket, count, sum_seconds, histogram FROM stage_latency_hourly WHERE stage = 'ocr'")
+    stage, share, bucket, count, total, histogram = cursor.fetchone()
+    assert (share, bucket, count, total) == ("Invoices", "2-5", 1, 96.0)
+    assert sum(json.loads(histogram)) == 1
+
+
+def test_histogram_percentile_interpolates_inside_bucket():
+    counts = stage_latency.empty_histogram()
+    for seconds in (0.5, 0.5, 8, 8):
+        stage_latency.add_to_histogram(counts, seconds)
+    assert stage_latency.histogram_percentile(counts, 50) == 1.0
+    assert 5 < stage_latency.histogram_percentile(counts, 99) <= 10
+    assert stage_latency.histogram_percentile(stage_latency.empty_histogram(), 50) is None
+
+
+def test_summarize_groups_rows():
+    histogram = stage_latency.empty_histogram()
+    stage_latency.add_to_histogram(histogram, 3)
+    rows = [
+        {"stage": "ocr", "smb_name": "A", "page_bucket": "1", "count": 1, "sum_seconds": 3.0, "histogram": json.dumps(histogram)},
+        {"stage": "ocr", "smb_name": "B", "page_bucket": "1", "count": 1, "sum_seconds": 3.0, "histogram": json.dumps(histogram)},
+    ]
+    assert stage_latency.summarize(rows)["ocr"]["count"] == 2
+    assert stage_latency.summarize(rows)["ocr"]["avg_seconds"] == 3.0
+    assert set(stage_latency.summarize(rows, "smb_name")) == {"A", "B"}
+    assert stage_latency.summarize(rows, "page_bucket")["1"]["ocr"]["count"] == 2
+
+
+def test_transitions_are_deleted_with_their_document_and_pruned(cursor, monkeypatch):
+    def execute_query(query, params=(), return_rowcount=False, **kwargs):
+        cursor.execute(query, params)
+        return cursor.rowcount if return_rowcount else True
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", types.SimpleNamespace(execute_query=execute_query))
+    stage_latency.record_transition(cursor, 1, ProcessStatus.OCR, at=100.0)
+    stage_latency.record_transition(cursor, 1, ProcessStatus.COMPLETED, at=300.0)
+    stage_latency.record_transition(cursor, 2, ProcessStatus.OCR, at=100.0)
+
+    assert stage_latency.delete_transitions(2)
+    assert stage_latency.prune_transitions(before=200.0) == 1
+    cursor.execute("SELECT scanneddata_id, status FROM status_transitions")
+    assert cursor.fetchall() == [(1, ProcessStatus.COMPLETED.value)]
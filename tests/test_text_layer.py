@@ -0,0 +1,103 @@
+import sys
+import types
+
+from scansynclib import text_layer
+from scansynclib.text_layer import TextLayerMode, page_has_text, parse_mode, read_text_layer, strictest_mode, text_coverage
+
+A4 = (0, 0, 595, 842)
+LOGO = (40, 40, 140, 90)
+
+
+class FakePage:
+    """Page with ``images`` images at ``image_rect`` and its text in one line of words at the top."""
+    def __init__(self, number, text, images, image_rect=LOGO, words=None):
+        self.number = number
+        self.rect = A4
+        self._text = text
+        self._images = images
+        self._image_rect = image_rect
+        self._words = words if words is not None else [(40, 100 + 12 * i, 200, 110 + 12 * i, word) for i, word in enumerate(text.split())]
+
+    def get_text(self, option="text"):
+        return self._words if option == "words" else self._text
+
+    def get_images(self, full=False):
+        return [(xref,) for xref in range(self._images)]
+
+    def get_image_rects(self, xref):
+        return [self._image_rect]
+
+
+class FakeDocument(list):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def _fake_pymupdf(monkeypatch, pages):
+    module = types.ModuleType("pymupdf")
+    module.open = lambda path: FakeDocument(FakePage(i, *page) for i, page in enumerate(pages))
+    monkeypatch.setitem(sys.modules, "pymupdf", module)
+
+
+def test_parse_mode_defaults_to_pdfa():
+    assert parse_mode("passthrough") == TextLayerMode.PASSTHROUGH
+    assert parse_mode(None) == TextLayerMode.PDFA
+    assert parse_mode("bogus") == TextLayerMode.PDFA
+
+
+def test_strictest_mode_prefers_more_processing():
+    assert strictest_mode(["passthrough", "ocr"]) == TextLayerMode.OCR
+    assert strictest_mode(["passthrough", "pdfa"]) == TextLayerMode.PDFA
+    assert strictest_mode(["passthrough"]) == TextLayerMode.PASSTHROUGH
+    assert strictest_mode([]) == TextLayerMode.PDFA
+
+
+def test_page_has_text():
+    assert page_has_text(text_layer.MIN_PAGE_CHARS, 1)
+    assert not page_has_text(3, 1)
+    # Blank pages have nothing to OCR
+    assert page_has_text(0, 0)
+
+
+def test_read_text_layer_returns_text_of_fully_texted_document(monkeypatch):
+    _fake_pymupdf(monkeypatch, [("Invoice number 12345 dated 2024", 1), ("", 0), ("Total amount due: 100 EUR", 0)])
+    assert read_text_layer("doc.pdf") == "Invoice number 12345 dated 2024\f\fTotal amount due: 100 EUR"
+
+
+def test_read_text_layer_rejects_scanned_pages(monkeypatch):
+    _fake_pymupdf(monkeypatch, [("Invoice number 12345 dated 2024", 0), ("", 1)])
+    assert read_text_layer("doc.pdf") is None
+
+
+def test_text_coverage_of_the_scans():
+    assert text_coverage([], []) == 1.0
+    assert text_coverage([(0, 0, 10, 10, "word")], [(0, 0, 100, 100)]) == 0.01
+    # Words outside the scan don't count
+    assert text_coverage([(200, 200, 210, 210, "word")], [(0, 0, 100, 100)]) == 0.0
+
+
+def test_read_text_layer_rejects_scans_with_a_stamp(monkeypatch):
+    # A full page scan, the scanner only added the scan date as text
+    _fake_pymupdf(monkeypatch, [("Scanned 2024-03-12 10:42 by MFP-3", 1, A4, [(450, 820, 590, 834, "Scanned")])])
+    assert read_text_layer("doc.pdf") is None
+
+
+def test_read_text_layer_accepts_scans_with_ocr_text(monkeypatch):
+    text = "Invoice number 12345 dated 2024 total amount due 100 EUR"
+    words = [(40, 100 + 14 * line, 555, 112 + 14 * line, "word") for line in range(10)]
+    _fake_pymupdf(monkeypatch, [(text, 1, A4, words)])
+    assert read_text_layer("doc.pdf") == text
+
+
+def test_read_text_layer_handles_unreadable_files(monkeypatch):
+    module = types.ModuleType("pymupdf")
+
+    def broken_open(path):
+        raise RuntimeError("cannot open broken document")
+
+    module.open = broken_open
+    monkeypatch.setitem(sys.modules, "pymupdf", module)
+    assert read_text_layer("doc.pdf") is None
@@ -0,0 +1,91 @@
+import sqlite3
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+from scansynclib import text_store
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Back the lazily imported execute_query with a throwaway SQLite database."""
+    db_file = tmp_path / "test.db"
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA.read_text())
+    conn.close()
+
+    def execute_query(query, params=(), return_scalar=False, **kwargs):
+        with sqlite3.connect(db_file) as connection:
+            cursor = connection.execute(query, params)
+            if return_scalar:
+                row = cursor.fetchone()
+                return row[0] if row else None
+            return True
+
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = execute_query
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return execute_query
+
+
+def test_read_sidecar(tmp_path):
+    sidecar = tmp_path / "scan.txt"
+    sidecar.write_text("Invoice 42\fTotal 10 EUR\f")
+    assert text_store.read_sidecar(str(sidecar)) == "Invoice 42\fTotal 10 EUR\f"
+    assert text_store.read_sidecar(str(tmp_path / "missing.txt")) is None
+
+
+def test_read_sidecar_rejects_incomplete_text(tmp_path):
+    sidecar = tmp_path / "scan.txt"
+    sidecar.write_text("[OCR skipped on page(s) 1-2]\fTotal 10 EUR")
+    assert text_store.read_sidecar(str(sidecar)) is None
+
+    sidecar.write_text("  \n\f ")
+    assert text_store.read_sidecar(str(sidecar)) is None
+
+
+def test_limit_text_matches_extract_text_limits():
+    text = "\f".join(f"Page {i}" for i in range(20))
+    assert text_store.limit_text(text, max_pages=2) == "Page 0\nPage 1"
+    assert text_store.limit_text(text, max_chars=10) == "Page 0\nPag"
+
+
+def test_limit_text_keeps_page_breaks():
+    text = "\f".join(f"Page {i}" for i in range(3))
+    assert text_store.limit_text(text, max_pages=2, keep_pages=True) == "Page 0\fPage 1"
+
+
+def test_save_and_load_round_trip(database):
+    assert text_store.save_text(3, "Grüße\fSeite zwei")
+    assert text_store.load_text(3) == "Grüße\fSeite zwei"
+    assert database("SELECT pages FROM document_text WHERE scanneddata_id = 3", return_scalar=True) == 2
+    assert text_store.load_text(4) is None
+
+
+def test_trailing_and_blank_pages_are_not_counted(database):
+    assert text_store.save_text(3, "Seite eins\f\fSeite drei\f")
+    assert database("SELECT pages FROM document_text WHERE scanneddata_id = 3", return_scalar=True) == 2
+
+
+def test_delete_text(database):
+    text_store.save_text(3, "Seite eins\f")
+    assert text_store.delete_text(3)
+    assert text_store.load_text(3) is None
+
+
+def test_get_text_prefers_stored_text(database, monkeypatch):
+    extract = []
+    monkeypatch.setattr(text_store, "extract_text", lambda *args, **kwargs: extract.append(args) or "parsed")
+    item = types.SimpleNamespace(db_id=3, filename="scan.pdf", ocr_file="scan_OCR.pdf")
+
+    text_store.save_text(3, "stored\ftext")
+    assert text_store.get_text(item) == "stored\ntext"
+    assert extract == []
+
+    item.db_id = 4
+    assert text_store.get_text(item) == "parsed"
+    assert extract == [("scan_OCR.pdf",)]
@@ -0,0 +1,165 @@
+import random
+import sqlite3
+import sys
+import types
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from scansynclib import tracing
+from scansynclib.helpers import percentile
+
+SCHEMA = Path(__file__).resolve().parents[1] / "scansynclib" / "scansynclib" / "db" / "schema.sql"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Back the lazily imported execute_query with a throwaway SQLite database."""
+    db_file = tmp_path / "test.db"
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA.read_text())
+    conn.close()
+
+    def execute_query(query, params=(), fetchall=False, return_rowcount=False, **kwargs):
+        with sqlite3.connect(db_file) as connection:
+            connection.row_factory = sqlite3.Row
+            cursor = connection.execute(query, params)
+            if fetchall:
+                return [dict(row) for row in cursor.fetchall()]
+            if return_rowcount:
+                return cursor.rowcount
+            return True
+
+    stub = types.ModuleType("scansynclib.sqlite_wrapper")
+    stub.execute_query = execute_query
+    monkeypatch.setitem(sys.modules, "scansynclib.sqlite_wrapper", stub)
+    return execute_query
+
+
+def _insert_span(database, stage, started_at, queue_wait, processing, document_id=1):
+    database(
+        "INSERT INTO pipeline_spans (trace_id, span_id, document_id, stage, status, started_at, queue_wait_seconds, processing_seconds) "
+        "VALUES ('trace', ?, ?, ?, 'ok', ?, ?, ?)",
+        (f"{stage}-{started_at}", document_id, stage, started_at, queue_wait, processing),
+    )
+
+
+@pytest.fixture
+def recorded(mocker):
+    spans = []
+    mocker.patch.object(tracing, "record_span", side_effect=spans.append)
+    return spans
+
+
+def test_inject_headers_starts_new_trace_outside_of_span():
+    headers = tracing.inject_headers()
+    assert headers[tracing.TRACE_ID_HEADER]
+    assert tracing.PARENT_SPAN_HEADER not in headers
+    assert headers[tracing.ENQUEUED_AT_HEADER] > 0
+
+
+def test_traced_callback_records_queue_wait_and_continues_trace(recorded, mocker):
+    mocker.patch.object(tracing.time, "time", side_effect=[100.0, 104.0, 110.0])
+    incoming = {
+        tracing.TRACE_ID_HEADER: "trace-1",
+        tracing.PARENT_SPAN_HEADER: "parent",
+        tracing.ENQUEUED_AT_HEADER: 90.0,
+        tracing.DOCUMENT_ID_HEADER: 7,
+    }
+    published = {}
+
+    def callback(ch, method, properties, body):
+        published.update(tracing.inject_headers())
+
+    wrapped = tracing.traced_callback("ocr_queue", callback)
+    wrapped(None, None, SimpleNamespace(headers=incoming), b"")
+
+    span = recorded[0]
+    assert span.stage == "ocr_queue"
+    assert span.trace_id == "trace-1"
+    assert span.parent_span_id == "parent"
+    assert span.document_id == 7
+    assert span.queue_wait == 10.0
+    assert span.duration == 10.0
+    # Messages published from within the callback continue the trace.
+    assert published[tracing.TRACE_ID_HEADER] == "trace-1"
+    assert published[tracing.PARENT_SPAN_HEADER] == span.span_id
+    assert published[tracing.DOCUMENT_ID_HEADER] == 7
+    assert tracing.current_span() is None
+
+
+def test_traced_callback_marks_failed_span(recorded):
+    def callback(ch, method, properties, body):
+        raise RuntimeError("boom")
+
+    wrapped = tracing.traced_callback("upload_queue", callback)
+    with pytest.raises(RuntimeError):
+        wrapped(None, None, SimpleNamespace(headers=None), b"")
+
+    assert recorded[0].status == "error"
+    assert recorded[0].queue_wait is None
+
+
+def test_set_document_id_updates_current_span(recorded):
+    def callback(ch, method, properties, body):
+        tracing.set_document_id(42)
+
+    tracing.traced_callback("metadata_queue", callback)(None, None, SimpleNamespace(headers={}), b"")
+    assert recorded[0].document_id == 42
+
+
+def test_explicit_document_id_header_is_kept():
+    headers = tracing.inject_headers({tracing.DOCUMENT_ID_HEADER: 3})
+    assert headers[tracing.DOCUMENT_ID_HEADER] == 3
+
+
+def test_percentile_interpolates():
+    assert percentile([], 50) is None
+    assert percentile([5], 99) == 5.0
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([10, None, 0], 100) == 10.0
+
+
+def test_detached_span_is_finished_by_the_worker(recorded):
+    detached = []
+
+    def callback(ch, method, properties, body):
+        detached.append(tracing.detach_span())
+
+    tracing.traced_callback("file_naming_queue", callback)(None, None, SimpleNamespace(headers={}), b"")
+    assert recorded == []
+    assert tracing.current_span() is None
+
+    with tracing.resume_span(detached[0]):
+        assert tracing.current_span() is detached[0]
+    assert recorded == detached
+    assert recorded[0].status == "ok"
+
+
+def test_stage_percentiles_match_the_interpolated_percentiles(database):
+    generator = random.Random(7)
+    samples = {"ocr": [generator.uniform(0, 100) for _ in range(37)], "upload": [3.0]}
+    for stage, values in samples.items():
+        for index, value in enumerate(values):
+            _insert_span(database, stage, 1000 + index, None if index == 0 else value / 2, value)
+    _insert_span(database, "ocr", 10, 1.0, 500.0)
+
+    stages = tracing.stage_percentiles(since=1000)
+
+    assert stages["ocr"]["count"] == 37
+    for pct in (50, 90, 99):
+        assert stages["ocr"][f"processing_p{pct}"] == round(percentile(samples["ocr"], pct), 3)
+        assert stages["ocr"][f"queue_wait_p{pct}"] == round(percentile([value / 2 for value in samples["ocr"][1:]], pct), 3)
+    assert stages["upload"] == {"count": 1, "queue_wait_p50": None, "queue_wait_p90": None, "queue_wait_p99": None,
+                                "processing_p50": 3.0, "processing_p90": 3.0, "processing_p99": 3.0}
+
+
+def test_spans_are_deleted_with_their_document_and_pruned(database):
+    _insert_span(database, "ocr", 100, 1.0, 2.0, document_id=1)
+    _insert_span(database, "ocr", 200, 1.0, 2.0, document_id=2)
+    _insert_span(database, "ocr", 300, 1.0, 2.0, document_id=3)
+
+    assert tracing.delete_spans(1)
+    assert tracing.prune_spans(before=250) == 1
+    assert [row["document_id"] for row in database("SELECT document_id FROM pipeline_spans", fetchall=True)] == [3]
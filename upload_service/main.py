@@ -5,6 +5,7 @@ from scansynclib.logging import logger
 from scansynclib.helpers import consume, move_to_failed
 from scansynclib.sqlite_wrapper import update_scanneddata_database, execute_query
 from scansynclib.onedrive_api import upload_small
+from scansynclib import remote_rename
 from scansynclib.config import config
 import os
 
@@ -89,6 +90,10 @@ def start_processing(item: ProcessItem):
     else:
         logger.info(f"Upload completed: {item.filename}")
 
+        if getattr(item, "rename_after_upload", False):
+            # Renamed now if file naming finished first, otherwise by the file naming service.
+            remote_rename.record_uploaded(item)
+
         # Delete ocr file
         try:
             os.remove(item.ocr_file)
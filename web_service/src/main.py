@@ -16,6 +16,7 @@ from routes.sync import sync_bp
 from routes.settings import settings_bp
 from routes.api import api_bp
 from routes.onedrive import onedrive_bp
+from routes.metrics import metrics_bp
 from scansynclib.sqlite_wrapper import execute_query
 from scansynclib.onedrive_api import is_token_expired
 
@@ -29,6 +30,7 @@ app.register_blueprint(sync_bp)
 app.register_blueprint(settings_bp)
 app.register_blueprint(api_bp)
 app.register_blueprint(onedrive_bp)
+app.register_blueprint(metrics_bp)
 
 sse_queue = queue.Queue()
 connected_clients = 0
@@ -48,6 +50,10 @@ def rabbitmq_listener():
     def callback(ch, method, properties, body):
         if connected_clients > 0:
             item: ProcessItem = pickle.loads(body)
+            if isinstance(item, dict):
+                # Lightweight events like the OCR progress are forwarded as they are.
+                sse_queue.put(json.dumps(item, default=str))
+                return
 
             # Import unified badge generator
             from badge_generator import generate_badges
@@ -1,3 +1,4 @@
+from datetime import datetime
 from flask import Blueprint, Response, json, request, jsonify
 from scansynclib.logging import logger
 from scansynclib.openai_helper import test_key
@@ -5,7 +6,8 @@ from scansynclib.sqlite_wrapper import execute_query
 from scansynclib.ollama_helper import test_ollama_server
 from scansynclib.settings import settings
 from scansynclib.settings_schema import FileNamingMethod, FileNamingSettings
-from scansynclib.ProcessItem import OCRStatus
+from scansynclib.ProcessItem import OCRStatus, ProcessStatus
+from scansynclib import ocr_watchdog, stage_latency, text_store, tracing
 
 api_bp = Blueprint('api', __name__)
 
@@ -329,7 +331,7 @@ def ocr_logs():
         response_data = _fetch_job_logs(
             "ocr_jobs",
             "ocr_jobs.ocr_status = 'COMPLETED'",
-            "ocr_jobs.ocr_status NOT IN ('COMPLETED', 'PROCESSING')"
+            "ocr_jobs.ocr_status NOT IN ('COMPLETED', 'PROCESSING', 'PENDING', 'MERGING')"
         )
         for log in (response_data.get("logs") or []):
             try:
@@ -374,9 +376,146 @@ def delete_id_from_db(job_id: int):
         if res is None:
             logger.error(f"Failed to delete job ID {job_id} from the database")
             return jsonify({'error': f'Failed to delete job ID {job_id}'}), 500
+        text_store.delete_text(job_id)
+        tracing.delete_spans(job_id)
+        stage_latency.delete_transitions(job_id)
         logger.info(f"Successfully deleted job ID {job_id} from the database")
         return jsonify({'message': f'Job ID {job_id} deleted successfully!'}), 200
     except Exception as e:
         err = f"Error deleting job ID {job_id}: {e}"
         logger.exception(err)
         return jsonify({'error': err}), 500
+
+
+@api_bp.get('/api/documents/<int:document_id>/text')
+def document_text(document_id: int):
+    """
+    Route returning the OCR text of a document as stored by the OCR service.
+    Pages are separated by form feeds.
+    """
+    try:
+        logger.info(f"Requested text of document {document_id}")
+        text = text_store.load_text(document_id)
+        if text is None:
+            return jsonify({'error': f'No text stored for document {document_id}'}), 404
+        return jsonify({'document_id': document_id, 'pages': text.count(text_store.PAGE_SEPARATOR) + 1, 'text': text}), 200
+    except Exception as e:
+        logger.exception(f"Error retrieving text of document {document_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@api_bp.post('/api/documents/<int:document_id>/cancel-ocr')
+def cancel_ocr(document_id: int):
+    """
+    Route asking the OCR service to stop processing a document.
+    The replica running the OCR kills it and records it as cancelled.
+    """
+    try:
+        logger.info(f"Requested to cancel the OCR of document {document_id}")
+        row = execute_query("SELECT file_status FROM scanneddata WHERE id = ?", (document_id,), fetchone=True)
+        if not row:
+            return jsonify({'error': f'Document {document_id} not found'}), 404
+        if row['file_status'] not in (ProcessStatus.OCR_PENDING.value, ProcessStatus.OCR.value):
+            return jsonify({'error': f'Document {document_id} is not waiting for or running OCR'}), 409
+        if not ocr_watchdog.request_cancel(document_id):
+            return jsonify({'error': 'Failed to request the cancellation'}), 500
+        return jsonify({'message': f'Cancelling the OCR of document {document_id}'}), 202
+    except Exception as e:
+        logger.exception(f"Error cancelling the OCR of document {document_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@api_bp.get('/api/traces/<int:document_id>')
+def document_trace(document_id: int):
+    """
+    Route returning the waterfall of a single document.
+    Each span contains its offset from the moment the document entered the
+    pipeline, the time it waited in the queue and the processing time.
+    """
+    try:
+        logger.info(f"Requested trace of document {document_id}")
+        query = """
+            SELECT * FROM pipeline_spans
+            WHERE trace_id IN (SELECT DISTINCT trace_id FROM pipeline_spans WHERE document_id = ?)
+            ORDER BY COALESCE(enqueued_at, started_at), started_at
+        """
+        spans = execute_query(query, (document_id,), fetchall=True) or []
+        if not spans:
+            return jsonify({'error': f'No trace found for document {document_id}'}), 404
+
+        origin = min(span.get("enqueued_at") or span["started_at"] for span in spans)
+        end = max(span.get("finished_at") or span["started_at"] for span in spans)
+        waterfall = []
+        for span in spans:
+            waterfall.append({
+                "stage": span["stage"],
+                "span_id": span["span_id"],
+                "parent_span_id": span["parent_span_id"],
+                "status": span["status"],
+                "enqueued_offset_seconds": round(span["enqueued_at"] - origin, 3) if span.get("enqueued_at") is not None else None,
+                "start_offset_seconds": round(span["started_at"] - origin, 3),
+                "queue_wait_seconds": span["queue_wait_seconds"],
+                "processing_seconds": span["processing_seconds"],
+            })
+
+        response_data = {
+            "document_id": document_id,
+            "trace_ids": sorted({span["trace_id"] for span in spans}),
+            "total_seconds": round(end - origin, 3),
+            "queue_wait_seconds": round(sum(span["queue_wait_seconds"] or 0 for span in spans), 3),
+            "processing_seconds": round(sum(span["processing_seconds"] or 0 for span in spans), 3),
+            "spans": waterfall,
+        }
+        return Response(json.dumps(response_data, default=str), mimetype='application/json', status=200)
+    except Exception as e:
+        logger.exception(f"Error retrieving trace of document {document_id}: {e}")
+        return Response(json.dumps({}), mimetype='application/json', status=500)
+
+
+@api_bp.get('/api/traces/stages')
+def stage_percentiles():
+    """
+    Route returning p50/p90/p99 of queue wait and processing time per stage.
+    Accepts 'hours' (default 24) as URL query parameter to limit the window.
+    """
+    try:
+        try:
+            hours = max(1, min(24 * 90, int(request.args.get('hours', 24))))
+        except (ValueError, TypeError):
+            hours = 24
+        logger.info(f"Requested stage percentiles of the last {hours} hours")
+        stages = tracing.stage_percentiles(datetime.now().timestamp() - hours * 3600)
+        return Response(json.dumps({"hours": hours, "stages": stages}, default=str), mimetype='application/json', status=200)
+    except Exception as e:
+        logger.exception(f"Error retrieving stage percentiles: {e}")
+        return Response(json.dumps({}), mimetype='application/json', status=500)
+
+
+@api_bp.get('/api/analytics/latency')
+def latency_analytics():
+    """
+    Route returning p50/p90/p99 of the time documents spend in each stage,
+    overall, per share and per page-count bucket.
+    Accepts 'hours' (default 24) as URL query parameter to limit the window.
+    Percentiles are approximated from the hourly rollup histograms, merged by the database.
+    """
+    try:
+        try:
+            hours = max(1, min(24 * 365, int(request.args.get('hours', 24))))
+        except (ValueError, TypeError):
+            hours = 24
+        logger.info(f"Requested latency analytics of the last {hours} hours")
+        since = datetime.fromtimestamp(datetime.now().timestamp() - hours * 3600).strftime("%Y-%m-%d %H:00")
+        rows = stage_latency.rollup_totals(since) or []
+
+        response_data = {
+            "hours": hours,
+            "histogram_bounds": [b for b in stage_latency.HISTOGRAM_BOUNDS if b != float("inf")],
+            "stages": stage_latency.summarize(rows),
+            "by_share": stage_latency.summarize(rows, "smb_name"),
+            "by_pages": stage_latency.summarize(rows, "page_bucket"),
+        }
+        return Response(json.dumps(response_data, default=str), mimetype='application/json', status=200)
+    except Exception as e:
+        logger.exception(f"Error retrieving latency analytics: {e}")
+        return Response(json.dumps({}), mimetype='application/json', status=500)
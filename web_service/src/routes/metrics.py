@@ -0,0 +1,47 @@
+from flask import Blueprint, Response
+from scansynclib import metrics
+from scansynclib.logging import logger
+from scansynclib.rabbitmq import queue_depth
+from scansynclib.sqlite_wrapper import execute_query
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Queues whose depth is reported on every scrape.
+MONITORED_QUEUES = ["metadata_queue", "ocr_queue", "file_naming_queue", "upload_queue"]
+
+# Seconds a scrape waits for RabbitMQ, a scrape must not hang on a broker that is down.
+QUEUE_DEPTH_TIMEOUT = 2
+
+
+def _scrape_time_metrics() -> list:
+    """Collect the metrics that are read directly at scrape time."""
+    extra = []
+
+    rows = execute_query("SELECT file_status, COUNT(*) AS count FROM scanneddata GROUP BY file_status", fetchall=True) or []
+    extra.append((
+        "scansync_documents",
+        "gauge",
+        "Documents per status",
+        [({"status": row["file_status"]}, row["count"]) for row in rows],
+    ))
+
+    depths = []
+    for queue_name in MONITORED_QUEUES:
+        depth = queue_depth(queue_name, timeout=QUEUE_DEPTH_TIMEOUT)
+        if depth is not None:
+            depths.append(({"queue": queue_name}, depth))
+    extra.append(("scansync_queue_depth", "gauge", "Ready messages per queue", depths))
+    return extra
+
+
+@metrics_bp.get('/metrics')
+def prometheus_metrics():
+    """Expose all ScanSync metrics in the Prometheus text format."""
+    try:
+        # Make the web service's own measurements visible right away.
+        metrics.flush()
+        body = metrics.render_prometheus(extra=_scrape_time_metrics())
+        return Response(body, mimetype='text/plain; version=0.0.4', status=200)
+    except Exception as e:
+        logger.exception(f"Error rendering metrics: {e}")
+        return Response("# failed to collect metrics\n", mimetype='text/plain', status=500)
@@ -2,6 +2,8 @@ from enum import Enum
 import json
 from flask import Blueprint, Response, redirect, render_template, request, url_for
 import requests
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from scansynclib.helpers import to_bool
 from scansynclib.logging import logger
 from scansynclib.onedrive_api import get_user_info, get_user_photo
 from scansynclib.settings import settings
@@ -96,6 +98,9 @@ def flatten_settings(model, prefix=""):
         # Ist Wert selbst ein BaseModel Proxy? Dann rekursiv tiefer
         if hasattr(attr, "_model"):  # Proxy-Erkennung
             result.update(flatten_settings(attr, full_key))
+        elif isinstance(attr, dict):
+            # Dicts of models (e.g. OCR profiles) are edited as JSON
+            result[full_key] = {k: v.model_dump(mode="json") if isinstance(v, BaseModel) else v for k, v in attr.items()}
         else:
             result[full_key] = attr
     return result
@@ -116,10 +121,22 @@ def settings_view():
 
             # Typ ermitteln für passende Umwandlung
             current_value = getattr(target, attr_name)
-            if isinstance(current_value, int):
+            # bool zuerst prüfen, da bool eine Unterklasse von int ist
+            if isinstance(current_value, bool):
+                value = to_bool(value)
+            elif isinstance(current_value, int):
                 value = int(value)
+            elif isinstance(current_value, float):
+                value = float(value)
             elif isinstance(current_value, list):
                 value = [v.strip() for v in value.split(",")]
+            elif isinstance(current_value, dict):
+                try:
+                    annotation = type(target._model).model_fields[attr_name].annotation
+                    value = TypeAdapter(annotation).validate_python(json.loads(value))
+                except (ValueError, ValidationError) as e:
+                    logger.error(f"Invalid value for {key}, keeping the current one: {e}")
+                    continue
             elif isinstance(current_value, Enum):
                 enum_cls = type(current_value)
                 value = enum_cls(value)
@@ -6,7 +6,11 @@ from scansynclib.logging import logger
 import math
 from scansynclib.sqlite_wrapper import execute_query
 from scansynclib.config import config
+from scansynclib.settings import settings
 from scansynclib.helpers import validate_smb_filename, SMB_TAG_COLORS
+from scansynclib.priority import clamp_share_priority
+from scansynclib.text_layer import TextLayerMode, parse_mode
+from scansynclib import stage_latency, text_store, tracing
 import io
 import csv
 
@@ -52,7 +56,9 @@ def sync():
                            failed_pdfs=failed_pdfs,
                            total_pages_failed_pdfs=total_pages_failed_pdfs,
                            page_failed_pdfs=page_failed_pdfs,
-                           smb_tag_colors=SMB_TAG_COLORS,)
+                           smb_tag_colors=SMB_TAG_COLORS,
+                           ocr_profiles=sorted(settings.ocr.profiles),
+                           default_ocr_profile=settings.ocr.default_profile,)
 
 
 @sync_bp.post('/add-path-mapping')
@@ -69,6 +75,9 @@ def add_path_mapping():
     drive_id = request.form.get('drive_id')
     folder_id = request.form.get('folder_id')
     web_url = request.form.get('web_url')
+    priority = clamp_share_priority(request.form.get('priority', 0))
+    text_layer_mode = parse_mode(request.form.get('text_layer_mode')).value
+    ocr_profile = request.form.get('ocr_profile') or None
     old_smb_id = request.form.get('old_smb_id', -1)
     if old_smb_id == '' or old_smb_id is None:
         old_smb_id = -1
@@ -84,7 +93,7 @@ def add_path_mapping():
 
     if old_smb_id != -1:
         logger.debug(f"Editing existing SMB share with ID {old_smb_id}")
-        success = onedrive_smb_manager.edit(old_smb_id, smb_name, drive_id, folder_id, onedrive_path, web_url)
+        success = onedrive_smb_manager.edit(old_smb_id, smb_name, drive_id, folder_id, onedrive_path, web_url, priority, text_layer_mode, ocr_profile)
         if not success:
             logger.error("Failed to edit SMB share in database")
             return jsonify({'error': 'Failed to edit SMB share in database'}), 500
@@ -92,7 +101,7 @@ def add_path_mapping():
         return jsonify({'success': True}), 200
     else:
         logger.debug("Adding new SMB share")
-        db_id = onedrive_smb_manager.add(smb_name, drive_id, folder_id, onedrive_path, web_url)
+        db_id = onedrive_smb_manager.add(smb_name, drive_id, folder_id, onedrive_path, web_url, priority, text_layer_mode, ocr_profile)
         if db_id == -1:
             logger.error("Failed to add SMB share to database")
             return jsonify({'error': 'Failed to add SMB share to database'}), 500
@@ -195,6 +204,9 @@ def deleteFailedPDF():
             if db is None:
                 logger.error("Failed to update database")
                 return "Failed to update database", 500
+            text_store.delete_text(json_data['id'])
+            tracing.delete_spans(json_data['id'])
+            stage_latency.delete_transitions(json_data['id'])
             logger.info(f"Updated database for {item_name}")
             return f"Success deleting {item_name}", 200
     except Exception as ex:
@@ -265,7 +277,10 @@ def get_path_mapping_details(smb_id):
             'onedrive_path': smb_share.get('onedrive_path'),
             'folder_id': smb_share.get('folder_id'),
             'drive_id': smb_share.get('drive_id'),
-            'web_url': smb_share.get('web_url')
+            'web_url': smb_share.get('web_url'),
+            'priority': smb_share.get('priority', 0),
+            'text_layer_mode': smb_share.get('text_layer_mode') or TextLayerMode.PDFA.value,
+            'ocr_profile': smb_share.get('ocr_profile') or ''
         }
 
         logger.debug(f"Returning path mapping details: {response_data}")
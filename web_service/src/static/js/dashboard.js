@@ -36,13 +36,17 @@ document.addEventListener('DOMContentLoaded', function() {
         eventSource.onmessage = function(event) {
             const data = JSON.parse(event.data);
             console.log("Received data:", data);
-            // Check if the data has card id
-            if (data.id) {
+            if (data.type === "ocr_progress") {
+                updateOcrProgress(data);
+            } else if (data.id) {
+                // Check if the data has card id
                 console.log("Updating card with ID:", data.id);
                 updateCard(data);
             }
         };
 
+        setInterval(markStalledOcrProgress, OCR_PROGRESS_CHECK_INTERVAL_MS);
+
         eventSource.onerror = function(err) {
             console.error("SSE error", err);
         };
@@ -63,6 +67,116 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
 
+// Live OCR progress per document id, fed by "ocr_progress" SSE events.
+// Split documents report one entry per chunk, which are summed up.
+const ocrProgress = new Map();
+const OCR_PROGRESS_STALLED_MS = 60 * 1000;
+const OCR_PROGRESS_CHECK_INTERVAL_MS = 15 * 1000;
+
+function formatDuration(seconds) {
+    if (seconds < 60) return `${Math.max(1, Math.round(seconds))} s`;
+    if (seconds < 3600) return `${Math.round(seconds / 60)} min`;
+    return `${Math.floor(seconds / 3600)} h ${Math.round((seconds % 3600) / 60)} min`;
+}
+
+function updateOcrProgress(event) {
+    let entry = ocrProgress.get(event.id);
+    if (!entry) {
+        entry = { chunks: new Map() };
+        ocrProgress.set(event.id, entry);
+    }
+    entry.chunks.set(event.chunk_index ?? 0, event);
+    entry.chunkCount = event.chunk_count || 1;
+    entry.updatedAt = Date.now();
+    renderOcrProgress(event.id);
+}
+
+function renderOcrProgress(pdfId) {
+    const entry = ocrProgress.get(pdfId);
+    const element = document.getElementById(pdfId + "_pdf_status");
+    if (!entry || !element) return;
+
+    const chunks = Array.from(entry.chunks.values());
+    const pagesDone = chunks.reduce((sum, chunk) => sum + (chunk.pages_done || 0), 0);
+    const badge = document.getElementById(pdfId + "_pdf_pages_badge");
+    const pagesTotal = Number(badge?.textContent) || chunks.reduce((sum, chunk) => sum + (chunk.pages_total || 0), 0);
+    const etas = chunks.map(chunk => chunk.eta_seconds).filter(eta => eta !== null && eta !== undefined);
+    const latest = chunks[chunks.length - 1];
+
+    let text = "OCR Processing";
+    if (latest.unit === "page" && pagesTotal) {
+        text += ` – ${pagesDone}/${pagesTotal} pages`;
+        if (etas.length) text += `, ~${formatDuration(Math.max(...etas))} left`;
+    } else if (latest.phase) {
+        text += ` – ${latest.phase}`;
+    }
+    if (entry.chunkCount > 1) {
+        text += ` (${entry.chunks.size}/${entry.chunkCount} parts started)`;
+    }
+
+    const stalledFor = Date.now() - entry.updatedAt;
+    element.classList.toggle("text-warning", stalledFor >= OCR_PROGRESS_STALLED_MS);
+    if (stalledFor >= OCR_PROGRESS_STALLED_MS) {
+        text += ` – no progress for ${formatDuration(stalledFor / 1000)}`;
+    }
+    element.textContent = text;
+    element.appendChild(document.createElement('br'));
+}
+
+// A job whose progress stopped is flagged long before the Tesseract timeout ends it.
+function markStalledOcrProgress() {
+    ocrProgress.forEach((entry, pdfId) => {
+        if (!document.getElementById(pdfId + "_pdf_status")) {
+            ocrProgress.delete(pdfId);
+            return;
+        }
+        if (Date.now() - entry.updatedAt >= OCR_PROGRESS_STALLED_MS) {
+            renderOcrProgress(pdfId);
+        }
+    });
+}
+
+
+function isInOcr(fileStatus) {
+    const status = (fileStatus || "").toLowerCase();
+    return status === "ocr pending" || status === "ocr processing";
+}
+
+// Button asking the OCR service to stop a document, shown while it waits for or runs OCR.
+function createOcrCancelButton(pdfData) {
+    const button = document.createElement('button');
+    button.id = pdfData.id + '_ocr_cancel';
+    button.type = 'button';
+    button.classList.add('btn', 'btn-sm', 'btn-outline-danger', 'py-0', 'mb-1');
+    button.innerHTML = '<i class="bi bi-x-circle"></i> Cancel OCR';
+    button.style.display = isInOcr(pdfData.file_status) ? '' : 'none';
+    button.addEventListener('click', () => cancelOcr(pdfData.id, button));
+    return button;
+}
+
+function toggleOcrCancelButton(pdfId, fileStatus) {
+    const button = document.getElementById(pdfId + '_ocr_cancel');
+    if (!button) return;
+    button.style.display = isInOcr(fileStatus) ? '' : 'none';
+    button.disabled = false;
+}
+
+async function cancelOcr(pdfId, button) {
+    button.disabled = true;
+    try {
+        const response = await fetch(`/api/documents/${pdfId}/cancel-ocr`, { method: 'POST' });
+        const data = await response.json();
+        if (!response.ok) {
+            console.error(`Failed to cancel OCR of ${pdfId}: ${data.error}`);
+            button.disabled = false;
+        }
+    } catch (error) {
+        console.error(`Failed to cancel OCR of ${pdfId}: ${error.message}`);
+        button.disabled = false;
+    }
+}
+
+
 function updateDashboard(data) {
     console.log("Updating dashboard");
     // Find the dashboard
@@ -179,6 +293,10 @@ function updateCard(updateData) {
             } else {
                 console.warn("Parent element is not a <span> or does not exist for status icon update.");
             }
+            if (!updateData.file_status.toLowerCase().includes("ocr processing")) {
+                ocrProgress.delete(updateData.id);
+                element.classList.remove("text-warning");
+            }
             if (updateData.file_status.toLowerCase() === "syncing") {
                 element.textContent = `Uploading ${updateData.currently_uploading}/${updateData.smb_target_ids.length} to ${updateData.current_upload_target}`;
             } else {
@@ -187,6 +305,7 @@ function updateCard(updateData) {
             // Re-append trailing <br> that gets wiped out by setting textContent,
             // so the OCR status span renders on a new line (see createCard).
             element.appendChild(document.createElement('br'));
+            toggleOcrCancelButton(updateData.id, updateData.file_status);
         }
     } catch (error) {
         console.error(`Error updating file status: ${error.message}`);
@@ -546,6 +665,7 @@ function addPdfCard(pdfData) {
     infoParagraph.appendChild(smbContainer);
     infoParagraph.appendChild(statusText);
     infoParagraph.appendChild(statusSpan);
+    infoParagraph.appendChild(createOcrCancelButton(pdfData));
     infoParagraph.appendChild(ocrStatusSpan);
 
     bodyDiv.appendChild(titleElement);
@@ -615,12 +735,15 @@ function getOcrStatusText(ocr_status) {
         'DPI_ERROR': 'OCR: Image DPI too low',
         'INPUT_ERROR': 'OCR: Input file error',
         'OUTPUT_ERROR': 'OCR: Output file error',
+        'TIMEOUT': 'OCR: Timed out',
+        'MEMORY_LIMIT': 'OCR: Memory limit exceeded',
+        'CANCELLED': 'OCR: Cancelled',
     };
     return ocrFailureMessages[ocr_status] || null;
 }
 
 // OCR statuses that indicate failure
-const ocrFailureStatuses = ["FAILED", "NO_TEXT", "UNSUPPORTED", "DPI_ERROR", "INPUT_ERROR", "OUTPUT_ERROR"];
+const ocrFailureStatuses = ["FAILED", "NO_TEXT", "UNSUPPORTED", "DPI_ERROR", "INPUT_ERROR", "OUTPUT_ERROR", "TIMEOUT", "MEMORY_LIMIT", "CANCELLED"];
 
 // File naming statuses that indicate failure
 const fileNamingFailureStatuses = ["FAILED", "NO_OCR_FILE", "NO_PDF_TEXT", "NO_SERVER_CONNECTION",
@@ -458,6 +458,9 @@ function fetchPathMappingDetails(id) {
                 if (data.web_url) {
                     document.getElementById("web_url_input").value = data.web_url;
                 }
+                document.getElementById("priority_select").value = String(data.priority || 0);
+                document.getElementById("text_layer_mode_select").value = data.text_layer_mode || "pdfa";
+                document.getElementById("ocr_profile_select").value = data.ocr_profile || "";
                 
                 // If the OneDrive browser is currently visible, update the selection
                 if (currentOneDriveSelectedID) {